@@ -43,22 +43,176 @@ class DriveSmartEntryAttr(object):
             self.attr_id = int(attr[0])
             self.attr_name = attr[1]
 
-def get_drivedb_entry_by_mn(model, vs_smart_drivedb_path=None):
-    import re
+## The drivedb has about 800 model regexps, more than the cache of re module,
+#  so matching a model against all of them compiles all of them again. The
+#  compiled drivedb keeps the literal prefixes of every regexp(every top level
+#  alternative), a model is only matched against the regexps that one of
+#  their prefixes is a prefix of the model, or that have no literal prefix.
+#  The regexps are compiled on first use and kept. It is loaded once per
+#  process, and reloaded if any drivedb file changed(mtime or size).
+_RegexpSpecialChars = ".^$*+?{}[]|()\\"
+_MaxModelCache = 1024
+
+
+def _split_top_alternatives(pattern):
+    """
+    :param pattern: a regexp
+    :return: a list of the top level alternatives
+    """
+    result = []
+    depth = 0
+    in_class = False
+    start = 0
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            if c == "]":
+                in_class = False
+        elif c == "[":
+            in_class = True
+            ## a "]" just after "[" or "[^" is a literal
+            if pattern[i+1:i+2] == "^":
+                i += 1
+            if pattern[i+1:i+2] == "]":
+                i += 1
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            result.append(pattern[start:i])
+            start = i + 1
+        i += 1
+    result.append(pattern[start:])
+    return result
+
+
+def _get_literal_prefix(pattern):
+    """
+    :param pattern: a regexp without top level alternative
+    :return: the literal string every match starts with, maybe empty
+    """
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            n = pattern[i+1:i+2]
+            if not n or n.isalnum():
+                break
+            c,step = n,2
+        elif c in _RegexpSpecialChars:
+            break
+        else:
+            step = 1
+        quantifier = pattern[i+step:i+step+1]
+        if quantifier and quantifier in "*?{":
+            break
+        prefix.append(c)
+        if quantifier == "+":
+            break
+        i += step
+    return "".join(prefix)
+
+
+class CompiledDriveDB(object):
+    """
+    The drivedb entries, indexed for model matching
+    """
+    def __init__(self, entries):
+        """
+        :param entries: the drivedb entries, see load_drivedb_file
+        """
+        self.entries = entries
+        ## {first char of prefix: [(index, prefixes),]}
+        self.buckets = {}
+        ## [(index, None)], the regexps without literal prefix
+        self.unindexed = []
+        self.__regexps = {}
+        self.__models = {}
+        for index,entry in enumerate(entries):
+            prefixes = tuple(_get_literal_prefix(i) for i in _split_top_alternatives(entry["modelregexp"]))
+            if not all(prefixes):
+                self.unindexed.append((index, None))
+            else:
+                for first in set(p[0] for p in prefixes):
+                    self.buckets.setdefault(first, []).append((index, prefixes))
+
+    def get_regexp(self, index):
+        regexp = self.__regexps.get(index)
+        if regexp is None:
+            import re
+            regexp = self.__regexps[index] = re.compile(self.entries[index]["modelregexp"])
+        return regexp
+
+    def match_indexes(self, model):
+        """
+        :param model: the model number
+        :return: a tuple of the index of the entries matched, in order
+        """
+        result = self.__models.get(model)
+        if result is None:
+            candidates = [index for index,prefixes in self.buckets.get(model[:1], [])
+                          if any(model.startswith(p) for p in prefixes)]
+            candidates.extend(index for index,_ in self.unindexed)
+            result = tuple(index for index in sorted(candidates) if self.get_regexp(index).match(model))
+            if len(self.__models) >= _MaxModelCache:
+                self.__models.clear()
+            self.__models[model] = result
+        return result
+
+    def get_entry(self, model):
+        """
+        :param model: the model number
+        :return: the DEFAULT entry updated by all the entries matched in order, the vs_attribute is merged
+        """
+        result = dict(self.entries[1])
+        vs_attribute = dict(result["presets"]["vs_attribute"])
+        for index in self.match_indexes(model):
+            entry = self.entries[index]
+            result.update(entry)
+            vs_attribute.update(entry["presets"]["vs_attribute"])
+        result["presets"] = dict(result["presets"])
+        result["presets"]["vs_attribute"] = vs_attribute
+        return result
+
+
+## {vs_smart_drivedb_path: ((file, mtime, size), ...), CompiledDriveDB)}
+_compiled_drivedb = {}
+
+def _get_file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_mtime, st.st_size)
+
+def get_compiled_drivedb(vs_smart_drivedb_path=None):
+    """
+    :param vs_smart_drivedb_path: the vendor drivedb file, its entries are after the drivedb
+    :return: the CompiledDriveDB
+    """
     for f in possible_smart_drivedb_path:
         if os.path.exists(f):
-            vs_smart_all = load_drivedb_file(json_file=f)
             break
     else:
         raise FileNotFoundError("Can not find any drivedb file")
+    stamp = (_get_file_stamp(f),)
+    if vs_smart_drivedb_path:
+        stamp += (_get_file_stamp(vs_smart_drivedb_path),)
+    cached = _compiled_drivedb.get(vs_smart_drivedb_path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    vs_smart_all = load_drivedb_file(json_file=f)
     if vs_smart_drivedb_path:
         vs_smart_all.extend(load_drivedb_file(json_file=vs_smart_drivedb_path))
-    vs_smart = vs_smart_all[1].copy()
-    vs_smart_modelregexp = (i["modelregexp"] for i in vs_smart_all)
-    for index,pattern in enumerate(vs_smart_modelregexp):
-        if re.match(pattern, model):
-            vs_attribute = vs_smart["presets"].pop("vs_attribute") # default attribute
-            vs_smart.update(vs_smart_all[index])
-            vs_attribute.update(vs_smart["presets"]["vs_attribute"])
-            vs_smart["presets"]["vs_attribute"] = vs_attribute
-    return vs_smart
+    db = CompiledDriveDB(vs_smart_all)
+    _compiled_drivedb[vs_smart_drivedb_path] = (stamp, db)
+    return db
+
+def get_drivedb_entry_by_mn(model, vs_smart_drivedb_path=None):
+    return get_compiled_drivedb(vs_smart_drivedb_path).get_entry(model)
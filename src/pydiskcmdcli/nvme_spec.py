@@ -447,30 +447,39 @@ def persistent_event_log_header_decode(data):
         result["SEB"] = result_temp
     return result
 
+def persistent_event_log_event_decode(raw_event):
+    """
+    decode one event of persistent event log
+
+    :param raw_event: the event data, event header included
+    :return: a dict of event_log_event_header, vendor_spec_info and event_log_event_data
+    """
+    event_log_event_format = {}
+    event_log_event_header = {}
+    decode_bits(raw_event[0:24], Persistent_Event_Log_Event_Header_bit_mask, event_log_event_header)
+    event_log_event_format["event_log_event_header"] = event_log_event_header
+    ##
+    ehl_int = scsi_ba_to_int(event_log_event_header.get("EHL"), 'little')
+    vsil_int = scsi_ba_to_int(event_log_event_header.get("VSIL"), 'little')
+    el_int = scsi_ba_to_int(event_log_event_header.get("EL"), 'little')
+    #
+    event_log_event_format["vendor_spec_info"] = raw_event[ehl_int+3:ehl_int+2+vsil_int+1]
+    event_log_event_format["event_log_event_data"] = raw_event[ehl_int+3+vsil_int:ehl_int+el_int+2+1]
+    return event_log_event_format
+
 def persistent_event_log_events_decode(raw_data, total_event_number):
     offset = 0
     event_log_events = {}
     if raw_data:
         for i in range(total_event_number):
-            event_log_event_format = {}
-            event_log_event_header = {}
             # fix a bug: break loop when there is no avaliable data
             # By Eric, 2024-04-15
-            if not raw_data[offset:offset+24]:
+            event_header = raw_data[offset:offset+24]
+            if not event_header:
                 break
-            decode_bits(raw_data[offset:offset+24], Persistent_Event_Log_Event_Header_bit_mask, event_log_event_header)
-            event_log_event_format["event_log_event_header"] = event_log_event_header
-            ##
-            ehl_int = scsi_ba_to_int(event_log_event_header.get("EHL"), 'little')
-            vsil_int = scsi_ba_to_int(event_log_event_header.get("VSIL"), 'little')
-            el_int = scsi_ba_to_int(event_log_event_header.get("EL"), 'little')
-            #
-            vendor_spec_info = raw_data[offset+ehl_int+3:offset+ehl_int+2+vsil_int+1]
-            event_log_event_data = raw_data[offset+ehl_int+3+vsil_int:offset+ehl_int+el_int+2+1]
-            event_log_event_format["vendor_spec_info"] = vendor_spec_info
-            event_log_event_format["event_log_event_data"] = event_log_event_data
-            event_log_events[i] = event_log_event_format
-            offset += (ehl_int+el_int+2+1)
+            event_len = (event_header[2]+event_header[22]+(event_header[23] << 8)+2+1) if len(event_header) == 24 else 24
+            event_log_events[i] = persistent_event_log_event_decode(raw_data[offset:offset+event_len])
+            offset += event_len
     return event_log_events
 
 def self_test_log_decode(raw_data):
@@ -523,9 +532,10 @@ def decode_LBA_Status_Descriptor_List(data):
     result = {"header": {}, "entry_list": []}
     ##
     decode_bits(data[0:8], LBAStatusDescriptorListHeader_bit_mask, result["header"])
-    #
+    ## only the NLSD descriptors are valid
+    nlsd = int.from_bytes(bytes(data[0:4]), 'little')
     index = 8
-    while True:
+    while len(result["entry_list"]) < nlsd:
         temp_data = data[index:(index+16)]
         if temp_data:
             temp_res = {}
@@ -1,18 +1,35 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
-from .ocp import ocp
-from .parse_cmd import parse_cmd
-from .vroc import win_nvme_vroc
-from .csmi import win_csmi
-from .broadcom import meraraid_sata
-from .broadcom import meraraid_scsi
-from .pcie import pci
-from .rst import win_sata_rst
-from .nvme_mi import nvme_mi
-try:
-    from .lenovo import lenovo
-except:
+import importlib
+import importlib.util
+
+def _lazy_plugin(module_name, func_name):
+    """
+    Get a plugin function, the plugin module is imported when the function is called,
+    so the script does not load all the plugins to run one command.
+
+    :param module_name: the plugin module, relative to this package
+    :param func_name: the function name in the module
+    :return: a function
+    """
+    def plugin():
+        return getattr(importlib.import_module(module_name, __name__), func_name)()
+    plugin.__name__ = func_name
+    return plugin
+
+ocp = _lazy_plugin(".ocp", "ocp")
+parse_cmd = _lazy_plugin(".parse_cmd", "parse_cmd")
+win_nvme_vroc = _lazy_plugin(".vroc", "win_nvme_vroc")
+win_csmi = _lazy_plugin(".csmi", "win_csmi")
+meraraid_sata = _lazy_plugin(".broadcom", "meraraid_sata")
+meraraid_scsi = _lazy_plugin(".broadcom", "meraraid_scsi")
+pci = _lazy_plugin(".pcie", "pci")
+win_sata_rst = _lazy_plugin(".rst", "win_sata_rst")
+nvme_mi = _lazy_plugin(".nvme_mi", "nvme_mi")
+if importlib.util.find_spec(".lenovo", __name__) is not None:
+    lenovo = _lazy_plugin(".lenovo", "lenovo")
+else:
     def lenovo():
         raise RuntimeError("Function Not in Public release!")
 
@@ -3,7 +3,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 from typing import List,Dict
 from pyscsi.pyscsi.scsi import *
-from pyscsi.utils.converter import decode_bits
+from pydiskcmdlib.utils.converter import decode_bits
 from pydiskcmdlib.pyscsi.scsi import *
 from pyscsi.pyscsi.scsi_enum_command import (
     spc_opcodes,
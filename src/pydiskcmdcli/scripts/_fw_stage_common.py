@@ -0,0 +1,15 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+def print_fw_stage_result(result):
+    """
+    :param result: the result of pydiskcmdlib.fw_staging.stage_image
+    """
+    print ("%d bytes in %d chunks of %d bytes, %.3fs, chunk latency min/avg/max %.1f/%.1f/%.1f ms" % (result["bytes"],
+                                                                                                      result["chunks"],
+                                                                                                      result["chunk_size"],
+                                                                                                      result["seconds"],
+                                                                                                      result["min_latency_ns"] / 1000000,
+                                                                                                      result["avg_latency_ns"] / 1000000,
+                                                                                                      result["max_latency_ns"] / 1000000))
@@ -0,0 +1,24 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from pydiskcmdcli.utils.format_print import format_dump_bytes,json_print
+
+def print_lba_status_map(m, output_format, map_file=''):
+    """
+    :param m: a pydiskcmdlib.lba_status_map.LBAStatusMap
+    :param output_format: normal|hex|raw|json
+    :param map_file: save the map to this file if set
+    """
+    from pydiskcmdlib.lba_status_map import format_lba_status_map
+    if map_file:
+        with open(map_file, 'wb') as f:
+            f.write(m.to_bytes())
+    if output_format == "normal":
+        for line in format_lba_status_map(m):
+            print (line)
+    elif output_format == "hex":
+        format_dump_bytes(m.to_bytes())
+    elif output_format == "json":
+        json_print(m.to_dict())
+    else:
+        print (m.to_bytes())
@@ -0,0 +1,54 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+from pydiskcmdcli.utils.format_print import human_read_capacity
+
+def add_surface_scan_options(parser):
+    parser.add_option("-s", "--start-block", type="int", dest="start_block", action="store", default=0,
+        help="The first LBA to scan, default 0")
+    parser.add_option("-c", "--block-count", type="int", dest="block_count", action="store", default=0,
+        help="The number of blocks to scan, default 0 means to the last LBA")
+    parser.add_option("-b", "--chunk", type="int", dest="chunk", action="store", default=0,
+        help="The blocks per command, default 0 means 1MiB")
+    parser.add_option("-q", "--queue-depth", type="int", dest="queue_depth", action="store", default=32,
+        help="The max commands in flight, default 32(limited by the backend)")
+    parser.add_option("-r", "--regions", type="int", dest="regions", action="store", default=256,
+        help="The regions of the latency heatmap, default 256")
+    parser.add_option("-w", "--width", type="int", dest="width", action="store", default=64,
+        help="The regions per line of the latency heatmap, default 64")
+    parser.add_option("-t", "--slow-ms", type="float", dest="slow_ms", action="store", default=200,
+        help="Report the commands slower than it(milliseconds), default 200")
+
+def get_progress_printer(title):
+    """
+    :param title: the title of the progress, like Scanning
+    :return: a callable progress(done, total), it prints the progress every 0.1% if stdout is a tty
+    """
+    last = [-1]
+    def progress(done, total):
+        permille = done * 1000 // total
+        if permille != last[0] and sys.stdout.isatty():
+            last[0] = permille
+            sys.stdout.write("\r%s: %.1f%%" % (title, permille / 10))
+            sys.stdout.flush()
+    return progress
+
+def run_surface_scan(target, options):
+    from pydiskcmdlib.surface_scan import SurfaceScan,format_scan_report
+    scan = SurfaceScan(target,
+                       start=options.start_block,
+                       count=options.block_count,
+                       chunk=options.chunk,
+                       regions=options.regions,
+                       slow_ms=options.slow_ms,
+                       queue_depth=options.queue_depth)
+    result = scan.run(progress=get_progress_printer("Scanning"))
+    if sys.stdout.isatty():
+        print ("")
+    for line in format_scan_report(result, width=options.width):
+        print (line)
+    print ("Throughput: %s/s, queue depth %d, %d blocks per command" % (human_read_capacity(int(result["throughput"])),
+                                                                        scan.queue_depth,
+                                                                        scan.chunk))
+    return 1 if result["errors"] else 0
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+import optparse
+from pydiskcmdcli import version as Version
+from . import parser_update,script_check
+from pydiskcmdcli.exceptions import NonpydiskcmdError
+from pydiskcmdcli import log
+
+
+def pydiskexporter():
+    '''
+    Serve the SMART of the drives in OpenMetrics text.
+
+    :return: None
+    :exit: exit code of command, see pynvme
+    '''
+    usage="usage: %prog [OPTIONS]"
+    parser = optparse.OptionParser(usage, version="pydiskexporter %s" % Version)
+    parser.add_option("-l", "--listen", type="str", dest="listen", action="store", default="127.0.0.1:9586",
+        help="The HTTP address to listen, default 127.0.0.1:9586")
+    parser.add_option("-u", "--unix-socket", type="str", dest="unix_socket", action="store", default="",
+        help="Listen on this Unix socket instead of HTTP address")
+    parser.add_option("-N", "--nvme", type="str", dest="nvme", action="store", default=None,
+        help="The NVMe controllers to export, split by comma, default all")
+    parser.add_option("-D", "--disk", type="str", dest="disk", action="store", default=None,
+        help="The SATA/SAS disks to export, split by comma, default all")
+    parser.add_option("-w", "--workers", type="int", dest="workers", action="store", default=4,
+        help="The max drives refreshed at the same time, default 4")
+    parser.add_option("-t", "--ttl", type="str", dest="ttl", action="append", default=[],
+        help="The TTL of a page, <page>=<seconds>, the pages are nvme_smart(60), nvme_ocp_smart(300), ata_smart(60) and scsi_smart(300)")
+    parser_update(parser)
+
+    (options, args) = parser.parse_args(sys.argv[1:])
+    ##
+    script_check(options, admin_check=True)
+    ##
+    from pydiskcmdcli.system.metrics_exporter import DefaultPages,MetricsExporter,open_devices
+    ttl = {}
+    for item in options.ttl:
+        page,_,seconds = item.partition("=")
+        if page not in DefaultPages or not seconds.isdigit():
+            parser.error("Invalid TTL %s" % item)
+        ttl[page] = int(seconds)
+    if options.unix_socket:
+        address = options.unix_socket
+    else:
+        host,_,port = options.listen.rpartition(":")
+        if not port.isdigit():
+            parser.error("Invalid listen address %s" % options.listen)
+        address = (host, int(port))
+    try:
+        exporter = MetricsExporter(open_devices(nvme_paths=options.nvme.split(",") if options.nvme is not None else None,
+                                                disk_paths=options.disk.split(",") if options.disk is not None else None),
+                                   max_workers=options.workers,
+                                   ttl=ttl)
+        print ("Exporting %d drives on %s" % (len(exporter.devices), options.unix_socket if options.unix_socket else options.listen))
+        sys.stdout.flush()
+        exporter.start()
+        try:
+            exporter.serve(address)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            exporter.close()
+    except Exception as e:
+        from pydiskcmdlib.exceptions import BaseError as lib_BaseError
+        from pydiskcmdcli.exceptions import BaseError as cli_BaseError
+        if not isinstance(e, (lib_BaseError, cli_BaseError)):
+            e = NonpydiskcmdError(("%s: %s" % (e.__class__.__name__, str(e))))
+        print (str(e))
+        import traceback
+        log.debug(traceback.format_exc())
+        sys.exit(e.exit_code)
+    sys.exit(0)
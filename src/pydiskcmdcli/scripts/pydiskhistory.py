@@ -0,0 +1,219 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+import time
+import optparse
+from pydiskcmdcli.utils.format_print import json_print
+from pydiskcmdcli import version as Version
+from . import parser_update,script_check
+from pydiskcmdcli.exceptions import (
+    NonpydiskcmdError,
+    UserDefinedError,
+    FunctionNotImplementError,
+)
+from pydiskcmdcli import log
+
+DefaultDB = "pydiskhistory.db"
+
+
+def version():
+    print ("pydiskhistory version %s" % Version)
+
+def print_help():
+    if len(sys.argv) > 2 and sys.argv[2] in commands_dict:
+        func_name,sys.argv[2] = sys.argv[2],"--help"
+        commands_dict[func_name]()
+    else:
+        print ("pydiskhistory-%s" % Version)
+        print ("usage: pydiskhistory <command> [<args>]")
+        print ("")
+        print ("Track the SMART of all the NVMe, SATA and SAS drives in a sqlite database.")
+        print ("")
+        print ("The following are all implemented sub-commands:")
+        print ("  collect               Sample the SMART of the drives periodically")
+        print ("  drives                List the drives in the database")
+        print ("  query                 Show the history of a SMART attribute of a drive")
+        print ("  maintain              Downsample and expire the history")
+        print ("  version               Shows the program version")
+        print ("  help                  Display this help")
+        print ("")
+        print ("See 'pydiskhistory help <command>' or 'pydiskhistory <command> --help' for more information on a sub-command")
+
+def _add_db_option(parser):
+    parser.add_option("-d", "--database", type="str", dest="database", action="store", default=DefaultDB,
+        help="The history database file, default %s" % DefaultDB)
+
+def _add_maintain_options(parser):
+    from pydiskcmdcli.system.smart_history import DefaultRawDays,DefaultDownsamplePeriod,DefaultRetentionDays
+    parser.add_option("-r", "--raw-days", type="int", dest="raw_days", action="store", default=DefaultRawDays,
+        help="Keep every change of the days, default %d" % DefaultRawDays)
+    parser.add_option("-p", "--period", type="int", dest="period", action="store", default=DefaultDownsamplePeriod,
+        help="Keep one point per period(seconds) for the older history, default %d" % DefaultDownsamplePeriod)
+    parser.add_option("-k", "--keep-days", type="int", dest="keep_days", action="store", default=DefaultRetentionDays,
+        help="Keep the history of the days, default %d" % DefaultRetentionDays)
+
+def collect():
+    usage="usage: %prog collect [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    _add_db_option(parser)
+    parser.add_option("-i", "--interval", type="int", dest="interval", action="store", default=3600,
+        help="The sample interval in seconds, default 3600")
+    parser.add_option("-n", "--rounds", type="int", dest="rounds", action="store", default=0,
+        help="The rounds to sample, default 0 means forever")
+    parser.add_option("-N", "--nvme", type="str", dest="nvme", action="store", default=None,
+        help="The NVMe controllers to sample, split by comma, default all")
+    parser.add_option("-D", "--disk", type="str", dest="disk", action="store", default=None,
+        help="The SATA/SAS disks to sample, split by comma, default all")
+    parser.add_option("-w", "--workers", type="int", dest="workers", action="store", default=16,
+        help="The max drives sampled at the same time, default 16")
+    parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=10000,
+        help="The max time(milliseconds) to wait for a drive, default 10000")
+    _add_maintain_options(parser)
+    parser_update(parser)
+
+    (options, args) = parser.parse_args(sys.argv[2:])
+    ##
+    script_check(options, admin_check=True)
+    ##
+    from pydiskcmdcli.system.smart_history import SMARTHistory,SMARTCollector
+    def callback(result):
+        print ("%s: %d drives, %d points, %d failed %s" % (time.strftime("%Y-%m-%d %H:%M:%S"),
+                                                           result["drives"],
+                                                           result["points"],
+                                                           len(result["failed"]),
+                                                           ",".join(result["failed"])))
+        sys.stdout.flush()
+    with SMARTHistory(options.database) as h:
+        collector = SMARTCollector(h,
+                                   nvme_paths=options.nvme.split(",") if options.nvme is not None else None,
+                                   disk_paths=options.disk.split(",") if options.disk is not None else None,
+                                   max_workers=options.workers,
+                                   timeout=options.timeout/1000)
+        try:
+            collector.run(interval=options.interval,
+                          rounds=options.rounds,
+                          callback=callback,
+                          raw_days=options.raw_days,
+                          period=options.period,
+                          retention_days=options.keep_days)
+        except KeyboardInterrupt:
+            pass
+
+def drives():
+    usage="usage: %prog drives [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    _add_db_option(parser)
+    parser_update(parser, add_output=["normal", "json"])
+
+    (options, args) = parser.parse_args(sys.argv[2:])
+    ##
+    from pydiskcmdcli.system.smart_history import SMARTHistory
+    with SMARTHistory(options.database) as h:
+        result = h.drives()
+    if options.output_format == "json":
+        json_print(result)
+    else:
+        print_format = "%-4s %-5s %-20s %-40s %-14s %-19s %-19s"
+        print (print_format % ("ID", "Kind", "SN", "Model", "Node", "First", "Last"))
+        print (print_format % ("-"*4, "-"*5, "-"*20, "-"*40, "-"*14, "-"*19, "-"*19))
+        for drive in result:
+            print (print_format % (drive["id"], drive["kind"], drive["sn"], drive["mn"], drive["node"],
+                                   _format_time(drive["first"]), _format_time(drive["last"])))
+
+def _format_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts)) if ts is not None else '-'
+
+def query():
+    usage="usage: %prog query <drive> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    _add_db_option(parser)
+    parser.add_option("-a", "--attribute", type="str", dest="attribute", action="store", default="",
+        help="The attribute name, default to list the attributes of the drive")
+    parser.add_option("-s", "--since-days", type="float", dest="since_days", action="store", default=0,
+        help="Show the history of the last days, default 0 means all")
+    parser_update(parser, add_output=["normal", "json"])
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ##
+        from pydiskcmdcli.system.smart_history import SMARTHistory
+        with SMARTHistory(options.database) as h:
+            drive_id = h.find_drive(sys.argv[2])
+            if drive_id is None:
+                parser.error("No drive %s in %s" % (sys.argv[2], options.database))
+            if not options.attribute:
+                result = h.attributes(drive_id)
+            else:
+                start = int(time.time() - options.since_days * 86400) if options.since_days > 0 else None
+                result = h.series(drive_id, options.attribute, start=start)
+        if options.output_format == "json":
+            json_print(result)
+        elif not options.attribute:
+            for name in result:
+                print (name)
+        else:
+            for ts,value in result:
+                print ("%s %d" % (_format_time(ts), value))
+    else:
+        parser.print_help()
+
+def maintain():
+    usage="usage: %prog maintain [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    _add_db_option(parser)
+    _add_maintain_options(parser)
+    parser_update(parser)
+
+    (options, args) = parser.parse_args(sys.argv[2:])
+    ##
+    from pydiskcmdcli.system.smart_history import SMARTHistory
+    with SMARTHistory(options.database) as h:
+        deleted = h.maintain(raw_days=options.raw_days, period=options.period, retention_days=options.keep_days)
+    print ("%d points deleted" % deleted)
+
+###########################
+###########################
+commands_dict = {"collect": collect,
+                 "drives": drives,
+                 "query": query,
+                 "maintain": maintain,
+                 "version": version,
+                 "help": print_help,
+                 }
+
+def pydiskhistory():
+    '''
+    Execute command cli inetrface.
+
+    :return: None
+    :exit: exit code of command, see pynvme
+    '''
+    if len(sys.argv) > 1:
+        command = sys.argv[1]
+        if command in commands_dict:
+            try:
+                ret = commands_dict[command]()
+            except Exception as e:
+                from pydiskcmdlib.exceptions import BaseError as lib_BaseError
+                from pydiskcmdcli.exceptions import BaseError as cli_BaseError
+                if not isinstance(e, (lib_BaseError, cli_BaseError)):
+                    e = NonpydiskcmdError(("%s: %s" % (e.__class__.__name__, str(e))))
+                print (str(e))
+                import traceback
+                log.debug(traceback.format_exc())
+                sys.exit(e.exit_code)
+            else:
+                if (ret is not None) and ret > 0:
+                    e = UserDefinedError("pydiskhistory command of <%s> error" % command, ret)
+                    print (str(e))
+                    sys.exit(e.exit_code)
+        else:
+            print_help()
+            e = FunctionNotImplementError("pydiskhistory command of <%s> Not Implement error" % command)
+            print ('')
+            print (str(e))
+            sys.exit(e.exit_code)
+    else:
+        print_help()
+    sys.exit(0)
@@ -2,14 +2,15 @@
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import sys,os
+import json
+import time
 import optparse
 from pydiskcmdlib.utils import init_device
-from pydiskcmdlib.pynvme.nvme import NVMe,SCSI2NVMe
-from pydiskcmdcli.utils.format_print import format_dump_bytes,human_read_capacity
+from pydiskcmdlib.pynvme.nvme import NVMe
+from pydiskcmdcli.utils.format_print import format_dump_bytes,human_read_capacity,json_print
 from pydiskcmdlib.utils.converter import scsi_ba_to_int
 from pydiskcmdlib.pynvme.data_buffer import DataBuffer
 from pydiskcmdcli.nvme_spec import (
-    persistent_event_log_header_decode,
     persistent_event_log_events_decode,
 )
 ## scan_nvme_ctrls
@@ -18,8 +19,10 @@ from pydiskcmdcli import os_type
 from pydiskcmdcli import version as Version
 from pydiskcmdcli.plugins import nvme_plugins
 from . import parser_update,script_check,func_debug_info
+from ._surface_scan_common import add_surface_scan_options,run_surface_scan,get_progress_printer
+from ._fw_stage_common import print_fw_stage_result
+from ._lba_status_common import print_lba_status_map
 from pydiskcmdcli.exceptions import (
-    CommandSequenceError,
     CommandNotSupport,
     NonpydiskcmdError,
     UserDefinedError,
@@ -72,6 +75,7 @@ def print_help():
         print ("  set-feature           Set a feature and show the resulting value")
         print ("  format                Format namespace with new block format")
         print ("  sanitize              Submit a sanitize command")
+        print ("  wipe                  Wipe all the namespaces with the fastest supported method")
         print ("  device-self-test      Perform the necessary tests to observe the performance")
         print ("  pcie                  Get device PCIe status, show it(Obseleted, see plugin pci)")
         print ("  show-regs             Shows the controller registers or properties. Requires character device")
@@ -80,6 +84,8 @@ def print_help():
         print ("  flush                 Submit a flush command, return results")
         print ("  read                  Submit a read command, return results")
         print ("  verify                Submit a verify command, return results")
+        print ("  surface-scan          Scan the namespace with verify or read commands, show the latency heatmap")
+        print ("  trace-latency         Profile the latency of all the commands by the kernel nvme trace events, Linux only")
         print ("  write                 Submit a write command, return results")
         print ("  write-zeroes          Submit a write zeroes command, return results")
         print ("  write-uncor           Submit a write uncorrectable command, return results")
@@ -107,102 +113,27 @@ def print_help():
 def _list():
     usage="usage: %prog list"
     parser = optparse.OptionParser(usage)
+    parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=10000,
+        help="The max time(milliseconds) to wait for a device, default 10000")
+    parser.add_option("-w", "--workers", type="int", dest="workers", action="store", default=16,
+        help="The max devices probed at the same time, default 16")
     parser_update(parser, add_output=["normal",])
 
     (options, args) = parser.parse_args()
     ##
     script_check(options, admin_check=True)
     ##
+    if os_type not in ('Linux', 'Windows'):
+        raise RuntimeError("OS %s Not support command list" % os_type)
     print_format = "%-20s %-10s %-20s %-40s %-9s %-26s %-16s %-8s"
     print (print_format % ("Node", "Status", "SN", "Model", "Namespace", "Usage", "Format", "FW Rev"))
     print (print_format % ("-"*20, "-"*10, "-"*20, "-"*40, "-"*9, "-"*26, "-"*16, "-"*8))
-    from pydiskcmdcli.system.lin_os_tool import scan_nvme_ctrls
-    from pydiskcmdcli.utils.string_utils import decode_bytes,string_strip
-    scsi_ba_to_int = nvme_format_print.scsi_ba_to_int
-    if os_type == 'Linux':
-        for ctrl_name,ctrl_info in scan_nvme_ctrls().items():
-            log.debug("Find NVMe controller device %s" % ctrl_info.dev_path)
-            status = 'normal'
-            try:
-                with NVMe(init_device(ctrl_info.dev_path, open_t='nvme')) as d:
-                    cmd_id_ctrl = d.id_ctrl()
-                result = nvme_format_print.nvme_id_ctrl_decode(cmd_id_ctrl.data)
-            except Exception as e:
-                log.debug("Init device %s error occurs, may not a nvme device or controller down" % ctrl_info.dev_path)
-                log.debug(str(e))
-            else:
-                sn = string_strip(decode_bytes(result.get("SN")), b'\x00'.decode(), ' ')
-                mn = string_strip(decode_bytes(result.get("MN")), b'\x00'.decode(), ' ')
-                fw = string_strip(decode_bytes(result.get("FR")), b'\x00'.decode(), ' ')
-                ##
-                namespaces = ctrl_info.get_namespaces()
-                for ns_name in sorted(namespaces.keys()):
-                    ns_info = namespaces[ns_name]
-                    node = ns_info.dev_path
-                    ns_id = ns_info.ns_id
-                    ## Get information now!
-                    # send identify controller and identify namespace
-                    try:
-                        with NVMe(init_device(ctrl_info.dev_path, open_t='nvme')) as d:
-                            cmd_id_ns = d.id_ns(ns_info.ns_id)
-                    except Exception as e:
-                        log.debug("Init device %s namespace id %d error occurs, may not a nvme device or controller down" % (ctrl_info.dev_path, ns_info.ns_id))
-                        log.debug(str(e))
-                        usage = '-'
-                        _format = '-'
-                        status = 'fault'
-                    else:
-                        result = nvme_format_print.nvme_id_ns_decode(cmd_id_ns.data)
-                        #
-                        lbaf = result.get("LBAF").get(scsi_ba_to_int(result.get("FLBAS"), 'little') & 0x0F)
-                        meta_size = scsi_ba_to_int(lbaf.get("MS"), 'little')
-                        lba_data_size = scsi_ba_to_int(lbaf.get("LBADS"), 'little')
-                        _format = "%-6sB + %-3sB" % (2 ** lba_data_size, meta_size)
-                        #
-                        NUSE_B = scsi_ba_to_int(result.get("NUSE"), 'little') * (2 ** lba_data_size)
-                        NCAP_B = scsi_ba_to_int(result.get("NCAP"), 'little') * (2 ** lba_data_size)
-                        usage = "%-6s / %-6s" % (human_read_capacity(NUSE_B), human_read_capacity(NCAP_B))
-                    if options.output_format == "normal":
-                        print (print_format % (node, status, sn, mn, ns_id, usage, _format, fw))
-    elif os_type == 'Windows':
-        from  pydiskcmdcli.system.win_os_tool import scan_all_physical_drive
-        for node in sorted([i for i in scan_all_physical_drive()]):
-            log.debug("Find device %s" % node)
-            ns_id = '-'  # windows should - ,
-            status = 'normal' 
-            ## Get information now!
-            # send identify namespace, get the information
-            # if physical drive cannot execute nvme identify namespace command,
-            # then treat it as a non-nvme device.
-            try:
-                with NVMe(init_device(node, open_t='nvme')) as d:
-                    cmd_id_ctrl = d.id_ctrl()
-                    cmd_id_ns = d.id_ns()
-            except Exception as e:
-                # may a non-nvme device, or an abnormal device,
-                #
-                log.debug("Init device %s error occurs, may not a nvme deivce" % node)
-                log.debug(str(e))
-            else:
-                # para data
-                result = nvme_format_print.nvme_id_ctrl_decode(cmd_id_ctrl.data)
-                sn = string_strip(decode_bytes(result.get("SN")), b'\x00'.decode(), ' ')
-                mn = string_strip(decode_bytes(result.get("MN")), b'\x00'.decode(), ' ')
-                fw = string_strip(decode_bytes(result.get("FR")), b'\x00'.decode(), ' ')
-                #
-                result = nvme_format_print.nvme_id_ns_decode(cmd_id_ns.data)
-                lbaf = result.get("LBAF").get(scsi_ba_to_int(result.get("FLBAS"), 'little') & 0x0F)
-                meta_size = scsi_ba_to_int(lbaf.get("MS"), 'little')
-                lba_data_size = scsi_ba_to_int(lbaf.get("LBADS"), 'little')
-                _format = "%-6sB + %-3sB" % (2 ** lba_data_size, meta_size)
-                #
-                NUSE_B = scsi_ba_to_int(result.get("NUSE"), 'little') * (2 ** lba_data_size)
-                NCAP_B = scsi_ba_to_int(result.get("NCAP"), 'little') * (2 ** lba_data_size)
-                usage = "%-6s / %-6s" % (human_read_capacity(NUSE_B), human_read_capacity(NCAP_B))
-                if options.output_format == "normal":
-                    print (print_format % (node, status, sn, mn, ns_id, usage, _format, fw))
-    else:
-        raise RuntimeError("OS %s Not support command list" % os_type)
+    from pydiskcmdcli.system.discovery import discover_devices
+    ## the rows are printed as the devices respond
+    for row in discover_devices("nvme", max_workers=options.workers, timeout=options.timeout/1000):
+        if options.output_format == "normal":
+            print (print_format % (row["node"], row["status"], row["sn"], row["mn"], row["ns_id"], row["usage"], row["format"], row["fw"]))
+            sys.stdout.flush()
 
 @func_debug_info
 def _list_subsys():
@@ -391,6 +322,12 @@ def telemetry_log():
         help="Pick which telemetry data area to report. Default is 3 to fetch areas 1-3. Valid options are 1, 2, 3, 4.")
     parser.add_option("-U", "--uuid-index", type="int", dest="uuid_index", action="store", default=0,
         help="UUID index")
+    parser.add_option("-r", "--resume", dest="resume", action="store_true", default=False,
+        help="Resume a partial dump of output file, if the telemetry header is not changed")
+    parser.add_option("-z", "--compress", type="choice", dest="compress", action="store", default=None,
+        choices=["gzip", "bz2", "xz"], help="Compress the output file, gzip|bz2|xz")
+    parser.add_option("-x", "--xfer", type="int", dest="xfer", action="store", default=0,
+        help="Max transfer size of a command in bytes, default is the largest legal transfer size(max 1MiB)")
     parser_update(parser)
 
     if len(sys.argv) > 2:
@@ -399,52 +336,26 @@ def telemetry_log():
         dev = sys.argv[2]
         if not options.output_file:
             raise RuntimeError("Need an input file by -o/--output-file")
+        if options.resume and options.compress:
+            parser.error("-r/--resume can not be used with -z/--compress")
         ##
         script_check(options, admin_check=True)
-        if options.controller_init: # Gather report generated by the controller
-            with NVMe(init_device(dev, open_t='nvme')) as d:
-                ## Get first 512 bytes log
-                cmd = d.telemetry_ctrl_log(127)
-                cmd.check_return_status(raise_if_fail=True)
-                #
-                if options.data_area == 1:
-                    data_area_last = cmd.data[8] + (cmd.data[9] << 8)
-                elif options.data_area == 2:
-                    data_area_last = cmd.data[10] + (cmd.data[11] << 8)
-                elif options.data_area == 3:
-                    data_area_last = cmd.data[12] + (cmd.data[13] << 8)
-                else:
-                    data_area_last = 0
-                with open(options.output_file, 'wb') as f:
-                    ## 4k transfer
-                    for i in range(data_area_last+1):
-                        offset = int(i * 512)
-                        lpol = offset & 0xFFFFFFFF
-                        lpou = (offset >> 32) & 0xFFFFFFFF
-                        cmd = d.telemetry_ctrl_log(127, lpol=lpol, lpou=lpou, uuid=options.uuid_index)
-                        f.write(cmd.data)
-        else: # Gather report generated by the host
-            with NVMe(init_device(dev, open_t='nvme')) as d:
-                ## Get first 512 bytes log
-                cmd = d.telemetry_host_log(127)
-                cmd.check_return_status(raise_if_fail=True)
-                #
-                data_area_last = 0
-                if options.data_area == 1:
-                    data_area_last = cmd.data[8] + (cmd.data[9] << 8)
-                elif options.data_area == 2:
-                    data_area_last = cmd.data[10] + (cmd.data[11] << 8)
-                elif options.data_area == 3:
-                    data_area_last = cmd.data[12] + (cmd.data[13] << 8)
-                elif options.data_area == 4:
-                    print ("Data area 4 Not support in pynvme!")
-                with open(options.output_file, 'wb') as f:
-                    for i in range(data_area_last+1):
-                        offset = int(i * 512)
-                        lpol = offset & 0xFFFFFFFF
-                        lpou = (offset >> 32) & 0xFFFFFFFF
-                        cmd = d.telemetry_host_log(127, lpol=lpol, lpou=lpou, uuid=options.uuid_index)
-                        f.write(cmd.data)
+        from pydiskcmdlib.pynvme.telemetry import TelemetryCollector,DefaultMaxChunk
+        with NVMe(init_device(dev, open_t='nvme')) as d:
+            collector = TelemetryCollector(d,
+                                           host_initiated=not options.controller_init,
+                                           data_area=options.data_area,
+                                           create_telemetry=options.host_generate,
+                                           uuid=options.uuid_index,
+                                           max_chunk=options.xfer if options.xfer > 0 else DefaultMaxChunk)
+            result = collector.collect(options.output_file, resume=options.resume, compress=options.compress)
+            if result["resumed"]:
+                print ("Resumed from offset %d" % result["resumed"])
+            print ("Telemetry log %d bytes, %d commands of %d bytes transfer, %.3fs, %s/s" % (result["total"],
+                                                                                       result["commands"],
+                                                                                       collector.chunk_size,
+                                                                                       result["seconds"],
+                                                                                       human_read_capacity(int(result["throughput"]))))
     else:
         parser.print_help()
 
@@ -454,7 +365,7 @@ def fw_download():
     parser.add_option("-f", "--fw", type="str", dest="fw_path", action="store", default="",
         help="Firmware file path")
     parser.add_option("-x", "--xfer", type="int", dest="xfer", action="store", default=0,
-        help="transfer chunksize in byte")
+        help="transfer chunksize in byte, default is the largest by FWUG and MDTS")
     parser.add_option("-o", "--offset", type="int", dest="offset", action="store", default=0,
         help="starting dword offset, default 0")
     parser_update(parser)
@@ -480,39 +391,21 @@ def fw_download():
         #     print ('')
         #     return 0
         script_check(options, admin_check=True)
+        from pydiskcmdlib.fw_staging import stage_nvme_fw,get_nvme_fw_chunk_size
         with NVMe(init_device(dev, open_t='nvme')) as d:
-            ## Get FWUG, fwug is in dward
-            fwug = d.ctrl_identify_info[319] & 0xFF
-            # 0h indicates that no information on granularity is provided
-            # FFh indicates there is no restriction
-            # then default to 4KiB
-            if fwug == 0 or fwug == 0xFF:
-                fwug_b = 4096     # 0h indicates that no information on granularity is provided, but need alignment in dword 
-            else:
-                fwug_b = fwug * 4096  # fwug 
-            # check numd, xfer is in bytes
+            ## the largest chunk by FWUG and MDTS, xfer is in bytes
+            chunk_size,fwug_b = get_nvme_fw_chunk_size(d.ctrl_identify_info)
             xfer = options.xfer
-            if xfer == 0:
-                xfer = fwug_b
-            elif xfer and (xfer % fwug_b):
-                xfer = fwug_b
+            if xfer and (xfer % fwug_b):
+                print ("warning: xfer is not matched with FWUG in Identify, fix it to %d" % chunk_size)
+                xfer = 0
             # check offset
-            if options.offset % fwug_b != 0:
+            if (options.offset * 4) % fwug_b != 0:
                 print ("warning: offset is not matched with FWUG in Identify, it may failed with status of Invalid Field in Command.")
                 print ("")
-            with open(options.fw_path, 'rb') as f:
-                offset = options.offset
-                # seek the offset
-                f.seek(offset*4)
-                while True:
-                    fw_data = f.read(xfer)
-                    if fw_data:
-                        cmd = d.nvme_fw_download(fw_data, offset)
-                        SC,SCT = cmd.check_return_status(raise_if_fail=True)
-                    else:
-                        print ("Firmware Download Success")
-                        break # download finished
-                    offset += int(xfer/4)
+            result = stage_nvme_fw(d, options.fw_path, offset=options.offset, xfer=xfer)
+            print ("Firmware Download Success")
+            print_fw_stage_result(result)
     else:
         parser.print_help()
 
@@ -612,6 +505,8 @@ def persistent_event_log():
         help="UUID index")
     parser.add_option("-f", "--filter", type="str", dest="filter", action="store", default='',
         help="Show the event of the specified event type when --action=normal, split with comma(ex. 2,3)")
+    parser.add_option("-S", "--state-file", type="str", dest="state_file", action="store", default='',
+        help="Establish context and show only the events newer than the state file when action=0, then update the state file")
     parser_update(parser, add_output=["normal", "hex", "raw", "json"])
 
     if len(sys.argv) > 2:
@@ -623,6 +518,8 @@ def persistent_event_log():
         #
         if options.action > 2:
             parser.error("action should be 0|1|2")
+        if options.state_file and options.output_format not in ("normal", "json"):
+            parser.error("-S/--state-file needs output format normal|json")
         # check options.filter
         _filter = []
         if options.filter:
@@ -634,68 +531,58 @@ def persistent_event_log():
             ## by nvme spec 1.4a
             if not (d.ctrl_identify_info[261] & 0x10):
                 raise CommandNotSupport("Device Not support Persistent Event log.")
-            extend_cap = (d.ctrl_identify_info[261] & 0x04)
             event_log_size_max = scsi_ba_to_int(d.ctrl_identify_info[352:356], 'little')  # 64Kib unit
             if options.action == 0:
+                from pydiskcmdlib.pynvme.persistent_event_log import PersistentEventLogReader,LogHeaderSize
+                reader = PersistentEventLogReader(d, uuid=options.uuid_index)
+                if options.state_file:
+                    ## Establish Context, and read the events newer than the state of last run
+                    state = None
+                    if os.path.isfile(options.state_file):
+                        with open(options.state_file, 'r') as f:
+                            state = json.load(f)
+                    header = reader.establish()
+                    try:
+                        events = (event for offset,event in reader.read_new_events(state))
+                        nvme_format_print.format_print_event_log(header, dev=d.device.device_name, print_type=options.output_format, event_filter=_filter, events=events)
+                    finally:
+                        reader.release()
+                    if reader.state:
+                        with open(options.state_file, 'w') as f:
+                            json.dump(reader.state, f)
+                    return
                 ## check the parameters
                 lpo = options.lpo
-                # TODO: Only lpo == 0 allowed for now, when utput=normal/json.
-                if lpo > 0: 
-                    if lpo > event_log_size_max * 65536:
-                        parser.error("ERROR: lpo should less than the total number of page size %s KiB" % event_log_size_max)
-                    if options.output_format in ("normal", "json"):
-                        print ("NOTE: Only lpo = 0 allowed for now when output=normal/json, fix it to 0")
-                        lpo = 0
-                    if lpo % 4:
-                        print ("WARNING: Log Page Offset shall be Dowrd aligned")
+                if lpo > event_log_size_max * 65536:
+                    parser.error("ERROR: lpo should less than the total number of page size %s KiB" % event_log_size_max)
+                if lpo % 4:
+                    print ("WARNING: Log Page Offset shall be Dowrd aligned")
+                    lpo -= lpo % 4
                 ## step 1. Read Log Data, first 512 Bytes(Persistent Event Log Header) to be read here, 
                 ##  to determine the "Total Log Length"(TLL)
-                # build command
-                # If extended data is not supported, then bits 27:16 of the Number of Dwords Lower field 
-                # specify the Number of Dwords to transfer.
-                # 0x0FFF is enough for 512 Bytes. We Do Not Need check the Log Page Attributes field
-                cmd = d.get_persistent_event_log(0, 127, 0, uuid=options.uuid_index)
-                # if command abort, then Context is already established
-                SC,SCT = cmd.check_return_status(False, False)
-                if (SCT == 0 and SC == 0):
-                    # 
-                    persistent_event_log_header = persistent_event_log_header_decode(cmd.data)
-                    # total_number_of_events = scsi_ba_to_int(persistent_event_log_header.get("TNEV"), 'little')
-                    total_log_length = scsi_ba_to_int(persistent_event_log_header.get("TLL"), 'little')
-                    ## here to 512B aligned, althrough it should be dowrd aligned
-                    if total_log_length % 512:
-                        total_log_length = total_log_length + 512 - (total_log_length % 512)
-                    # check Log Page Attributes field page of extend capacity
-                    max_numd = (int(total_log_length / 4) - 1) if extend_cap else ((int(total_log_length / 4) - 1) & 0x0FFF)
-                    lpo_dw = int(lpo / 4)
-
-                    numd = options.numd
-                    if numd < 0:
-                        numd = max_numd
-                    elif numd > (max_numd - lpo_dw):
-                        print ("NOTE: numd is too big, fix it to a proper value")
-                        numd = max_numd - lpo_dw
-                    # Get raw data
-                    ret_data = b''
-                    chun_size= 128 * 1024  # 1MB every loop
-                    actual_numd = int(chun_size/4-1)
-                    remainder = numd % actual_numd
-                    offset = lpo
-                    for loop in range(int((numd - remainder)/actual_numd)):
-                        cmd = d.get_persistent_event_log(0, actual_numd, offset, uuid=options.uuid_index)
-                        cmd.check_return_status(True, True)
-                        ret_data += cmd.data
-                        offset += chun_size
-                    if remainder:
-                        cmd = d.get_persistent_event_log(0, remainder, offset, uuid=options.uuid_index)
-                        cmd.check_return_status(True, True)
-                        ret_data += cmd.data
-                    cmd = None  # release the located memory
-                    nvme_format_print.format_print_event_log(ret_data, dev=d.device.device_name, print_type=options.output_format, event_filter=_filter)
-                elif SCT == 0 and SC == 0x0C: # if command abort, then Context is already established
-                    raise CommandSequenceError("Command Sequence Error, may need establish the context")
+                header = reader.read_header()
+                ## here to dword aligned
+                total_log_length = reader.total_log_length
+                total_log_length += (4 - total_log_length % 4) % 4
+                max_numd = int(total_log_length / 4) - 1
+                lpo_dw = int(lpo / 4)
+                numd = options.numd
+                if numd < 0:
+                    numd = max_numd - lpo_dw
+                elif numd > (max_numd - lpo_dw):
+                    print ("NOTE: numd is too big, fix it to a proper value")
+                    numd = max_numd - lpo_dw
+                if numd < 0:
+                    parser.error("ERROR: lpo should less than the Total Log Length %s" % total_log_length)
+                if options.output_format in ("normal", "json"):
+                    ## the events are decoded as they arrive, lpo should be the offset of an event
+                    events = (event for offset,event in reader.iter_events(start=max(lpo, LogHeaderSize), end=lpo+(numd+1)*4))
+                    nvme_format_print.format_print_event_log(header, dev=d.device.device_name, print_type=options.output_format, event_filter=_filter, events=events)
                 else:
-                    cmd.check_return_status(True, True, raise_if_fail=True)
+                    ## read into one preallocated buffer
+                    ret_data = bytearray((numd + 1) * 4)
+                    reader.read_into(ret_data, lpo=lpo)
+                    nvme_format_print.format_print_event_log(bytes(ret_data), dev=d.device.device_name, print_type=options.output_format, event_filter=_filter)
             elif options.action == 1:
                 # Establish Context and Read Log Data: The controller shall:
                 #   a) determine the length of the persistent event log page data;
@@ -1272,6 +1159,7 @@ def sanitize():
                 service_action = 0x03
             else:
                 parser.error("For scsi2nvme command type, only support BLOCK_ERASE_SANITIZE (2) and CRYPTO_ERASE_SANITIZE (4)")
+            from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMe
             with SCSI2NVMe(init_device(dev, open_t='scsi')) as d:
                 cmd = d.sanitize(service_action, ause, 0, 0)
             cmd.check_nvme_return_status()
@@ -1283,6 +1171,50 @@ def sanitize():
     else:
         parser.print_help()
 
+def wipe():
+    usage="usage: %prog wipe <device> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-l", "--level", type="choice", dest="level", action="store", choices=["deallocate", "clear", "purge"], default="purge",
+        help="The wipe level, deallocate|clear|purge, default purge")
+    parser.add_option("-m", "--method", type="choice", dest="method", action="store", default="",
+        choices=["sanitize-crypto", "format-crypto", "sanitize-block", "format-erase", "sanitize-overwrite", "write-zeroes", "deallocate"],
+        help="Run this method instead of the fastest one")
+    parser.add_option("-p", "--plan", dest="plan", action="store_true", default=False,
+        help="Only show the wipe methods and their estimated time, do not wipe")
+    parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=0,
+        help="The max seconds to wait the sanitize, default 0 means no limit")
+    parser_update(parser, add_force=True)
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ## check device
+        dev = sys.argv[2]
+        ##
+        script_check(options, danger_check=not options.plan, admin_check=True)
+        ##
+        from pydiskcmdlib.pynvme.wipe_planner import WipePlanner
+        with NVMe(init_device(dev, open_t='nvme')) as d:
+            planner = WipePlanner(d)
+            candidates = planner.candidates(options.level)
+            print ("Wipe %d namespaces(%s), level %s:" % (len(planner.namespaces), human_read_capacity(planner.total_bytes), options.level))
+            for c in candidates:
+                print ("  %-20s %12.3fs(%s)" % (c["method"], c["seconds"], "reported" if c["reported"] else "guessed"))
+            if not candidates:
+                print ("No wipe method of level %s" % options.level)
+                return 1
+            if options.plan:
+                return 0
+            method = options.method if options.method else candidates[0]["method"]
+            if method not in [c["method"] for c in candidates]:
+                parser.error("Method %s is not supported or not in level %s" % (method, options.level))
+            print ("Running %s" % method)
+            seconds = planner.run(method, progress=get_progress_printer("Wiping"), timeout=options.timeout if options.timeout > 0 else None)
+            if sys.stdout.isatty():
+                print ("")
+            print ("Wipe completed in %.3fs" % seconds)
+    else:
+        parser.print_help()
+
 def read():
     usage="usage: %prog read <device> [OPTIONS]"
     parser = optparse.OptionParser(usage)
@@ -1306,6 +1238,7 @@ def read():
         script_check(options, admin_check=True)
         ##
         if os_type == 'Windows':
+            from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMe
             with SCSI2NVMe(init_device(dev, open_t='scsi')) as d:
                 if options.prinfo == 0b1000:
                     rdprotect = 0
@@ -1365,6 +1298,71 @@ def verify():
     else:
         parser.print_help()
 
+def surface_scan():
+    usage="usage: %prog surface-scan <device> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-n", "--namespace-id", type="int", dest="namespace_id", action="store", default=1,
+        help="namespace to scan(default 1)")
+    parser.add_option("-m", "--mode", type="choice", dest="mode", action="store", choices=["verify", "read"], default="verify",
+        help="The command to scan with, verify|read, default verify")
+    parser.add_option("-B", "--backend", type="choice", dest="backend", action="store", choices=["ioctl", "io_uring"], default="ioctl",
+        help="The backend, ioctl|io_uring, default ioctl(queue depth 1), io_uring needs the generic char device(like /dev/ng0n1)")
+    add_surface_scan_options(parser)
+    parser_update(parser)
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ## check device
+        dev = sys.argv[2]
+        ##
+        script_check(options, admin_check=True)
+        ##
+        from pydiskcmdlib.surface_scan import NVMeScanTarget
+        with NVMe(init_device(dev, open_t='nvme', backend=options.backend, queue_depth=options.queue_depth)) as d:
+            return run_surface_scan(NVMeScanTarget(d, options.namespace_id, mode=options.mode), options)
+    else:
+        parser.print_help()
+
+def trace_latency():
+    usage="usage: %prog trace-latency [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-c", "--controllers", type="str", dest="controllers", action="store", default=None,
+        help="The controllers to profile, split by comma, like nvme0,nvme1, default all")
+    parser.add_option("-t", "--time", type="int", dest="time", action="store", default=0,
+        help="The seconds to profile, default 0 means until CTRL+C")
+    parser.add_option("-i", "--interval", type="int", dest="interval", action="store", default=0,
+        help="Show the latency every interval seconds, and clear it, default 0 means only show at the end")
+    parser_update(parser, add_output=["normal", "json"])
+
+    (options, args) = parser.parse_args(sys.argv[2:])
+    ##
+    script_check(options, admin_check=True)
+    ##
+    if os_type != "Linux":
+        raise CommandNotSupport("trace-latency only support Linux")
+    from pydiskcmdlib.pynvme.linux_nvme_trace_latency import NVMeLatencyProfiler,format_latency_profile
+    def show(profiler):
+        if options.output_format == "json":
+            json_print(profiler.to_dict())
+        else:
+            for line in format_latency_profile(profiler.to_dict()):
+                print (line)
+            print ("")
+        sys.stdout.flush()
+        profiler.reset()
+    last = [time.monotonic()]
+    def callback(profiler):
+        if options.interval > 0 and time.monotonic() - last[0] >= options.interval:
+            last[0] = time.monotonic()
+            show(profiler)
+    with NVMeLatencyProfiler(controllers=options.controllers.split(",") if options.controllers else None) as profiler:
+        try:
+            profiler.run(timeout=options.time if options.time > 0 else None, callback=callback)
+        except KeyboardInterrupt:
+            pass
+        profiler.process()
+        show(profiler)
+
 def write():
     usage="usage: %prog write <device> [OPTIONS]"
     parser = optparse.OptionParser(usage)
@@ -1404,6 +1402,7 @@ def write():
         ##
         if os_type == 'Windows':
             temp_data = bytearray(temp_data)
+            from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMe
             with SCSI2NVMe(init_device(dev, open_t='scsi')) as d:
                 if temp_data:
                     data_l = len(temp_data)
@@ -1434,11 +1433,7 @@ def write():
             cmd.check_nvme_return_status()  
         else:
             with NVMe(init_device(dev, open_t='nvme')) as d:
-                cmd = d.id_ns(options.namespace_id)
-                result = nvme_format_print.nvme_id_ns_decode(cmd.data)
-                lbaf = result.get("LBAF").get(scsi_ba_to_int(result.get("FLBAS"), 'little') & 0x0F)
-                lba_data_size = scsi_ba_to_int(lbaf.get("LBADS"), 'little')
-                lba_size = 2 ** lba_data_size
+                lba_size = d.ns_format(options.namespace_id)["lbads"]
                 ##
                 data_l = len(temp_data)
                 remainder = data_l % lba_size
@@ -1475,6 +1470,7 @@ def flush():
         script_check(options, admin_check=True)
         ##
         if os_type == 'Windows':
+            from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMe
             with SCSI2NVMe(init_device(dev, open_t='scsi')) as d:
                 cmd = d.synchronizecache10(0, 0)
             cmd.check_nvme_return_status()  
@@ -1500,6 +1496,10 @@ def get_lba_status():
         help="the mechanism the controller uses in determining the LBA Status Descriptors to return. 0x10 Untracked LBAs, 0x11 Tracked LBAs.")
     parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=60000,
         help="timeout value, in milliseconds")
+    parser.add_option("-A", "--all", dest="all", action="store_true", default=False,
+        help="Walk the namespace from the start block to the end, and print the LBA status map")
+    parser.add_option("-f", "--map-file", type="str", dest="map_file", action="store", default='',
+        help="Save the LBA status map to this file, with --all")
     parser_update(parser, add_output=["normal", "hex", "raw", "json"])
 
     if len(sys.argv) > 2:
@@ -1510,6 +1510,18 @@ def get_lba_status():
         ##
         script_check(options, admin_check=True)
         ##
+        if options.all:
+            if options.namespace_id in (0, 0xFFFFFFFF):
+                parser.error("--all needs a namespace id")
+            from pydiskcmdlib.lba_status_map import walk_nvme_lba_status
+            with NVMe(init_device(dev, open_t='nvme')) as d:
+                m = walk_nvme_lba_status(d,
+                                         options.namespace_id,
+                                         atype=options.action_type,
+                                         slba=options.start_block,
+                                         timeout=options.timeout)
+            print_lba_status_map(m, options.output_format, map_file=options.map_file)
+            return 0
         with NVMe(init_device(dev, open_t='nvme')) as d:
             cmd = d.get_lba_status(options.namespace_id, # ns_id
                                    options.start_block,  # slba
@@ -1548,8 +1560,12 @@ def get_log():
         help="command set identifier")
     parser.add_option("-O", "--ot", type="int", dest="ot", action="store", default=0,
         help="command set identifier")
-    parser.add_option("", "--output-format", type="choice", dest="output_format", action="store", choices=["hex", "raw"],default="hex",
-        help="Output format: hex|raw, default normal")
+    parser.add_option("", "--output-format", type="choice", dest="output_format", action="store", choices=["hex", "raw", "binary"],default="hex",
+        help="Output format: hex|raw|binary, default hex. binary streams the log to stdout")
+    parser.add_option("-f", "--output-file", type="str", dest="output_file", action="store", default="",
+        help="Stream the log to a binary file")
+    parser.add_option("-x", "--xfer", type="int", dest="xfer", action="store", default=0,
+        help="Max transfer size of a command in bytes, default is the largest legal transfer size(max 1MiB)")
     parser_update(parser)
 
     if len(sys.argv) > 2:
@@ -1561,32 +1577,40 @@ def get_log():
         #
         if options.log_id < 0:
             parser.error("You need a log id")
-        log_dw = int(options.log_len / 4) - 1
-        numdl = log_dw & 0xFFFF
-        numdu = (log_dw >> 16) & 0xFFFF
-        log_dw = int(options.lpo)
-        lpol = log_dw & 0xFFFFFFFF
-        lpou = (log_dw >> 32) & 0xFFFFFFFF
+        if options.log_len % 4 or options.lpo % 4:
+            parser.error("-l/--log-len and -o/--lpo should be Dword aligned")
+        log_page_args = {"nsid": options.namespace_id,
+                         "lsp": options.lsp,
+                         "rae": options.rae,
+                         "lsi": options.lsi,
+                         "lpo": options.lpo,
+                         "uuid": options.uuid_index,
+                         "ot": options.ot,
+                         "csi": options.csi,
+                         "chunk": options.xfer if options.xfer > 0 else None,
+                        }
         ##
         with NVMe(init_device(dev, open_t='nvme')) as d:
-            cmd = d.get_log_page(options.namespace_id, # ns_id
-                                 options.log_id,       # log id
-                                 options.lsp,          # lsp
-                                 options.rae,
-                                 numdl,
-                                 numdu,
-                                 options.lsi,
-                                 lpol,
-                                 lpou,
-                                 options.uuid_index,
-                                 options.ot,
-                                 options.csi,
-                                 )
-            
+            if options.output_file or options.output_format == "binary":
+                ## stream the chunks, the log is not kept in memory
+                f = open(options.output_file, 'wb') if options.output_file else sys.stdout.buffer
+                try:
+                    for chunk in d.iter_log_page(options.log_id, options.log_len, **log_page_args):
+                        f.write(chunk)
+                finally:
+                    if options.output_file:
+                        f.close()
+                    else:
+                        f.flush()
+                return
+            ## read into one preallocated buffer
+            data = bytearray(options.log_len)
+            for chunk in d.iter_log_page(options.log_id, options.log_len, buffer=data, **log_page_args):
+                pass
         if options.output_format == "hex":
-            format_dump_bytes(cmd.data)
+            format_dump_bytes(data)
         else:
-            print(bytes(cmd.data))
+            print(bytes(data))
     else:
         parser.print_help()
 
@@ -1949,13 +1973,76 @@ def compare():
             temp_data = f.read()
         #
         with NVMe(init_device(dev, open_t='nvme')) as d:
-            cmd = d.read(options.namespace_id, options.start_block, options.block_count, temp_data)
+            cmd = d.compare(options.namespace_id, options.start_block, options.block_count, temp_data)
         cmd.check_return_status(success_hint=True, fail_hint=True, raise_if_fail=True)
     else:
         parser.print_help()
 
 def dsm():
-    raise NotImplementedError("Dataset Management is comming soon.")
+    usage="usage: %prog dsm <device> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-n", "--namespace-id", type="int", dest="namespace_id", action="store", default=1,
+        help="identifier of desired namespace(default 1)")
+    parser.add_option("-s", "--slbs", type="str", dest="slbs", action="store", default='',
+        help="comma-separated list of starting LBAs")
+    parser.add_option("-b", "--blocks", type="str", dest="blocks", action="store", default='',
+        help="comma-separated list of the number of blocks(1's based) in each range")
+    parser.add_option("-A", "--all", dest="all", action="store_true", default=False,
+        help="deallocate the whole namespace")
+    parser.add_option("-d", "--ad", dest="ad", action="store_true", default=False,
+        help="Attribute Deallocate")
+    parser.add_option("-w", "--idw", dest="idw", action="store_true", default=False,
+        help="Attribute Integral Dataset for Write")
+    parser.add_option("-r", "--idr", dest="idr", action="store_true", default=False,
+        help="Attribute Integral Dataset for Read")
+
+    parser_update(parser, add_force=True)
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ## check device
+        dev = sys.argv[2]
+        ##
+        if options.all:
+            if options.slbs or options.blocks:
+                parser.error("--all can not be used with --slbs and --blocks")
+            if not options.ad:
+                parser.error("--all needs --ad")
+            ranges = "all"
+        else:
+            try:
+                slbs = [int(i, 0) for i in options.slbs.split(",") if i.strip()]
+                blocks = [int(i, 0) for i in options.blocks.split(",") if i.strip()]
+            except ValueError:
+                parser.error("Invalid --slbs or --blocks")
+            if not slbs or len(slbs) != len(blocks):
+                parser.error("--slbs and --blocks should have the same number of values")
+            ranges = list(zip(slbs, blocks))
+        if not (options.ad or options.idw or options.idr):
+            parser.error("No attribute specified, need --ad, --idw or --idr")
+        script_check(options, danger_check=options.ad, admin_check=True)
+        ##
+        with NVMe(init_device(dev, open_t='nvme')) as d:
+            if options.ad and not (options.idw or options.idr):
+                result = d.deallocate(options.namespace_id, ranges=ranges)
+                print ("Deallocated %d blocks in %d ranges by %d commands, %.3fs, %s/s" % (result["lbas"],
+                                                                                            result["ranges"],
+                                                                                            result["commands"],
+                                                                                            result["seconds"],
+                                                                                            human_read_capacity(int(result["throughput"]))))
+            else:
+                from pydiskcmdlib.pynvme.dsm_range import DSMMaxRanges,pack_ranges
+                if ranges == "all" or len(ranges) > DSMMaxRanges:
+                    parser.error("Only %d ranges in one command with --idw or --idr" % DSMMaxRanges)
+                cmd = d.dataset_management(options.namespace_id, 
+                                           len(ranges) - 1, 
+                                           1 if options.idr else 0, 
+                                           1 if options.idw else 0, 
+                                           1 if options.ad else 0, 
+                                           pack_ranges(ranges))
+                cmd.check_return_status(success_hint=True, fail_hint=True, raise_if_fail=True)
+    else:
+        parser.print_help()
 
 def write_uncor():
     usage="usage: %prog write-uncor <device> [OPTIONS]"
@@ -2056,6 +2143,7 @@ commands_dict = {"list": _list,
                  "set-feature": set_feature,
                  "format": nvme_format,
                  "sanitize": sanitize,
+                 "wipe": wipe,
                  "persistent-event-log": persistent_event_log,
                  "device-self-test": device_self_test,
                  "self-test-log": self_test_log,
@@ -2068,6 +2156,8 @@ commands_dict = {"list": _list,
                  "flush": flush,
                  "read": read,
                  "verify": verify,
+                 "surface-scan": surface_scan,
+                 "trace-latency": trace_latency,
                  "write": write,
                  "compare": compare,
                  "dsm": dsm,
@@ -3,7 +3,6 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import sys,os
 import optparse
-import binascii
 from pydiskcmdlib.pysata.sata import SATA
 from pydiskcmdcli.utils.ata_format_print import (
     _print_return_status,
@@ -16,7 +15,7 @@ from pydiskcmdcli.utils.ata_format_print import (
     format_print_set_feature_guide,
     )
 from pydiskcmdlib.utils import init_device
-from pydiskcmdcli.utils.format_print import format_dump_bytes,human_read_capacity
+from pydiskcmdcli.utils.format_print import format_dump_bytes
 from pydiskcmdlib.exceptions import ExecuteCmdErr
 from pydiskcmdcli.exceptions import (
     CommandSequenceError,
@@ -29,6 +28,7 @@ from pydiskcmdcli import os_type
 from pydiskcmdcli import version as Version
 from pydiskcmdcli.plugins import ata_plugins
 from . import parser_update,script_check,func_debug_info
+from ._surface_scan_common import add_surface_scan_options,run_surface_scan
 from pydiskcmdlib.utils.converter import bytearray2string,translocate_bytearray
 from pydiskcmdcli import log
 VS_SMART_DRIVEDB_PATH = "/etc/pydiskcmd/vs_smart_drivedb.json" if os_type == "Linux" else None
@@ -69,6 +69,7 @@ def print_help():
         print ("  read                        Send a read command to disk")
         print ("  read-sectors                Send a read sector(s) command to disk")
         print ("  read-verify-sector          Send read verify sector(s) command")
+        print ("  surface-scan                Scan the disk with read verify sector(s) commands, show the latency heatmap")
         print ("  write                       Send a write command to disk") 
         print ("  write-uncorrectable         Send a write uncorrectable command to disk") 
         print ("  flush                       Send a flush command to disk")
@@ -91,56 +92,27 @@ def print_help():
 def _list():
     usage="usage: %prog list <device> [OPTIONS]"
     parser = optparse.OptionParser(usage)
+    parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=10000,
+        help="The max time(milliseconds) to wait for a device, default 10000")
+    parser.add_option("-w", "--workers", type="int", dest="workers", action="store", default=16,
+        help="The max devices probed at the same time, default 16")
     parser_update(parser, add_output=["normal",])
 
     (options, args) = parser.parse_args()
     ##
     script_check(options, admin_check=True)
     ##
+    if os_type not in ('Linux', 'Windows'):
+        raise RuntimeError("OS %s Not support command list" % os_type)
     print_format = "%-20s %-20s %-40s %-26s %-16s %-8s"
     print (print_format % ("Node", "SN", "Model", "Capacity", "Format(L/P)", "FW Rev"))
     print (print_format % ("-"*20, "-"*20, "-"*40, "-"*26, "-"*16, "-"*8))
-    dev_path_all = None
-    if os_type == 'Linux':
-        from pydiskcmdcli.system.lin_os_tool import get_block_devs
-        dev_path_all = [i for i in get_block_devs(exclude=("nvme",))]
-    elif os_type == 'Windows':
-        from  pydiskcmdcli.system.win_os_tool import scan_all_physical_drive
-        dev_path_all = sorted([i for i in scan_all_physical_drive()])
-    if dev_path_all is not None:
-        for dev_path in dev_path_all:
-            try:
-                with SATA(init_device(dev_path, open_t='ata'), 512) as d:
-                    id_info = d.identify_raw
-            except:
-                continue
-            # Get the information of device
-            invalid_symbol = b'\x00'.decode()
-            sn = bytearray2string(translocate_bytearray(id_info[20:40])).strip().strip(invalid_symbol)
-            fw = bytearray2string(translocate_bytearray(id_info[46:54]))
-            mn = bytearray2string(translocate_bytearray(id_info[54:94])).strip().strip(invalid_symbol)
-            logical_sector_num = int(binascii.hexlify(translocate_bytearray(id_info[200:208], 2)),16)
-            if id_info[213] & 0xC0 == 0x40: # word 106 valid
-                if id_info[213] & 0x10:
-                    logical_sector_size = int(binascii.hexlify(translocate_bytearray(id_info[234:238], 2)),16) * 2
-                else:
-                    logical_sector_size = 512
-                if id_info[213] & 0x20:
-                    relationship = 2 ** (id_info[212] & 0x0F)
-                else:
-                    relationship = 1
-                physical_sector_size = logical_sector_size * relationship
-                ##
-                disk_format = "%s / %s" % (logical_sector_size, physical_sector_size)
-                cap = human_read_capacity(logical_sector_num*logical_sector_size)
-            else:
-                disk_format = "Unknown"
-                cap = "Unknown"
-            #
-            if options.output_format == "normal":
-                print (print_format % (dev_path, sn, mn, cap, disk_format, fw))
-    else:
-        raise RuntimeError("OS %s Not support command list" % os_type)
+    from pydiskcmdcli.system.discovery import discover_devices
+    ## the rows are printed as the devices respond
+    for row in discover_devices("ata", max_workers=options.workers, timeout=options.timeout/1000):
+        if options.output_format == "normal":
+            print (print_format % (row["node"], row["sn"], row["mn"], row["capacity"], row["format"], row["fw"]))
+            sys.stdout.flush()
 
 @func_debug_info
 def check_power_mode():
@@ -282,6 +254,27 @@ def read_verify_sector():
     else:
         parser.print_help()
 
+
+@func_debug_info
+def surface_scan():
+    usage="usage: %prog surface-scan <device> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    add_surface_scan_options(parser)
+    parser_update(parser)
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ## check device
+        dev = sys.argv[2]
+        ##
+        script_check(options, admin_check=True)
+        ##
+        from pydiskcmdlib.surface_scan import ATAScanTarget
+        with SATA(init_device(dev, open_t='ata', queue_depth=options.queue_depth)) as d:
+            return run_surface_scan(ATAScanTarget(d), options)
+    else:
+        parser.print_help()
+
 def write_dma_ext():
     usage="usage: %prog write <device> [OPTIONS]"
     parser = optparse.OptionParser(usage)
@@ -758,7 +751,7 @@ def trim():
         script_check(options, danger_check=True, admin_check=True, delay_act=True)
         ## check LBA format
         LBA_list = options.block_range.split(',')
-        if 0 < len(LBA_list) < 65:
+        if 0 < len(LBA_list):
             lba_description = []
             for lba_des in LBA_list:
                 lba_des_list = lba_des.split(':')
@@ -773,9 +766,11 @@ def trim():
         print ('')
         _sending_cmd_info(dev, "data set management(known as trim)")
         with SATA(init_device(dev, open_t='ata')) as d:
-            cmd = d.trim(lba_description)
-        cmd.check_return_status()
-        if options.show_status:
+            ## the ranges are coalesced and packed into as few commands as the device allows
+            cmd = None
+            for cmd,_ in d.iter_trim(lba_description):
+                cmd.check_return_status()
+        if options.show_status and cmd is not None:
             _print_return_status(cmd.ata_status_return_descriptor)
     else:
         parser.print_help()
@@ -785,10 +780,10 @@ def download_fw():
     parser = optparse.OptionParser(usage)
     parser.add_option("-f", "--file", dest="fw_file", action="store", default='',
         help="The firmware file path.")
-    parser.add_option("-c", "--code", type="choice", dest="code", action="store", choices=[0x03, 0x07, 0x0E, 0x0F], default=3,
-        help="The subcommand code to use, default 3")
-    parser.add_option("-x", "--xfer", type=int, dest="xfer", action="store", default=0x200,
-        help="Transfer chunksize.")
+    parser.add_option("-c", "--code", type="int", dest="code", action="store", default=3,
+        help="The subcommand code to use, 3|7|14|15, default 3")
+    parser.add_option("-x", "--xfer", type=int, dest="xfer", action="store", default=0,
+        help="Transfer chunksize in 512-byte blocks, default 0 means the largest segment by IDENTIFY DEVICE(up to 1MiB)")
     parser_update(parser, add_debug=True)
 
     if len(sys.argv) > 2:
@@ -799,14 +794,28 @@ def download_fw():
         script_check(options, admin_check=True)
         if not os.path.isfile(options.fw_file):
             parser.error("Firmware file Not Exist.")
+        if options.code not in (0x03, 0x07, 0x0E, 0x0F):
+            parser.error("subcommand code should be 3|7|14|15")
         ##
         _sending_cmd_info(dev, "download microcode")
         with SATA(init_device(dev, open_t='ata')) as d:
-            rc = d.download_fw(options.fw_file, transfer_size=options.xfer, feature=options.code)
-            if rc == 0:
-                print ("Success to download firmware.")
+            if options.code in (0x03, 0x0E):
+                from pydiskcmdlib.fw_staging import stage_ata_fw
+                from ._fw_stage_common import print_fw_stage_result
+                from pydiskcmdlib.exceptions import CommandReturnStatusError,SenseDataCheckErr
+                try:
+                    result = stage_ata_fw(d, options.fw_file, feature=options.code, xfer=options.xfer * 512)
+                except (CommandReturnStatusError,SenseDataCheckErr) as e:
+                    print ("Failed to download firmware: %s" % str(e))
+                else:
+                    print ("Success to download firmware.")
+                    print_fw_stage_result(result)
             else:
-                print ("Failed to download firmware. Return Code: %s" % rc)
+                rc = d.download_fw(options.fw_file, transfer_size=options.xfer, feature=options.code)
+                if rc == 0:
+                    print ("Success to download firmware.")
+                else:
+                    print ("Failed to download firmware. Return Code: %s" % rc)
     else:
         parser.print_help()
 
@@ -1013,6 +1022,7 @@ commands_dict = {"list": _list,
                  "read": read_dma_ext,
                  "read-sectors": read_sectors,
                  "read-verify-sector": read_verify_sector,
+                 "surface-scan": surface_scan,
                  "write": write_dma_ext,
                  "write-uncorrectable": write_uncorrectable,
                  "write-log": write_log,
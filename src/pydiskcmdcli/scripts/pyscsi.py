@@ -7,13 +7,14 @@ from pydiskcmdcli import os_type
 from pydiskcmdlib.pyscsi.scsi import SCSI
 from pydiskcmdcli.scsi_spec import LogSenseAttr,get_smart_simulate
 from pydiskcmdlib.utils import init_device
-from pydiskcmdcli.utils.format_print import format_dump_bytes,human_read_capacity,json_print
+from pydiskcmdcli.utils.format_print import format_dump_bytes,json_print
 from pydiskcmdcli.plugins import scsi_plugins
 from pyscsi.pyscsi.scsi_sense import SCSICheckCondition
 from pyscsi.pyscsi import scsi_enum_inquiry as INQUIRY
 from pyscsi.pyscsi.scsi_enum_getlbastatus import P_STATUS
 from pydiskcmdcli import version as Version
 from . import parser_update,script_check,func_debug_info
+from ._surface_scan_common import add_surface_scan_options,run_surface_scan
 from pydiskcmdcli.exceptions import (
     CommandSequenceError,
     CommandNotSupport,
@@ -62,6 +63,7 @@ def print_help():
         print ("  sync                        Synchronize cache to non-volatile cache, as known as flush")
         print ("  read                        Send a read command to disk")
         print ("  write                       Send a write command to disk")
+        print ("  surface-scan                Scan the disk with verify or read commands, show the latency heatmap")
         print ("  version                     Shows the program version")
         print ("  help                        Display this help")
         print ("")
@@ -137,62 +139,27 @@ def inq():
 def _list():
     usage="usage: %prog list <device> [OPTIONS]"
     parser = optparse.OptionParser(usage)
+    parser.add_option("-t", "--timeout", type="int", dest="timeout", action="store", default=10000,
+        help="The max time(milliseconds) to wait for a device, default 10000")
+    parser.add_option("-w", "--workers", type="int", dest="workers", action="store", default=16,
+        help="The max devices probed at the same time, default 16")
     parser_update(parser, add_output=["normal",])
 
     (options, args) = parser.parse_args()
     ##
     script_check(options, admin_check=True)
     ##
+    if os_type not in ('Linux', 'Windows'):
+        raise RuntimeError("OS %s Not support command list" % os_type)
     print_format = "%-20s %-10s %-30s %-40s %-26s %-16s %-8s"
     print (print_format % ("Node", "Protocal", "SN", "Model", "Capacity", "Format(L/P)", "FW Rev"))
     print (print_format % ("-"*20, "-"*10, "-"*30, "-"*40, "-"*26, "-"*16, "-"*8))
-
-    from pydiskcmdcli.utils.string_utils import decode_bytes,string_strip
-    from pydiskcmdlib.pysata.sata import SATA
-    dev_path_all = None
-    if os_type == 'Linux':
-        from pydiskcmdcli.system.lin_os_tool import get_block_devs
-        dev_path_all = [i for i in get_block_devs(exclude=("nvme",))]
-    elif os_type == 'Windows':
-        from pydiskcmdcli.system.win_os_tool import scan_all_physical_drive
-        dev_path_all = sorted([i for i in scan_all_physical_drive()])
-    if dev_path_all is not None:
-        for dev_path in dev_path_all:
-            try:
-                with SCSI(init_device(dev_path, open_t='scsi'), 512) as d:
-                    serial_info = d.inquiry(evpd=1, page_code=INQUIRY.VPD.UNIT_SERIAL_NUMBER).result
-                    inq_info = d.inquiry().result
-                    cap = d.readcapacity16().result
-            except:
-                continue
-            # device who can be here, will be scsi device
-            # Then check if ATA device
-            device_type = 'scsi'
-            try:
-                with SATA(init_device(dev_path, open_t='ata')) as d:
-                    id_info = d.identify_raw
-            except:
-                pass
-            else:
-                device_type = 'ata'
-            # Get the information of device
-            serial = 'Unknown'
-            model = 'Unknown'
-
-            serial = string_strip(decode_bytes(serial_info.get('unit_serial_number')), b'\x00'.decode(), ' ')
-            serial = serial if serial else 'Unknown'
-            model = string_strip(decode_bytes(inq_info.get('product_identification')), b'\x00'.decode(), ' ')
-            model = model if model else 'Unknown'
-            fw = decode_bytes(inq_info.get('product_revision_level'))
-            logical_sector_num = cap["returned_lba"]
-            logical_sector_size = cap["block_length"]
-            physical_sector_size = (2 ** cap["lbppbe"]) * logical_sector_size
-            disk_format = "%s / %s" % (logical_sector_size, physical_sector_size)
-            disk_cap = human_read_capacity(logical_sector_size * logical_sector_num)
-            if options.output_format == "normal":
-                print (print_format % (dev_path, device_type, serial, model, disk_cap, disk_format, fw))
-    else:
-        raise RuntimeError("OS %s Not support command list" % os_type)
+    from pydiskcmdcli.system.discovery import discover_devices
+    ## the rows are printed as the devices respond
+    for row in discover_devices("scsi", max_workers=options.workers, timeout=options.timeout/1000):
+        if options.output_format == "normal":
+            print (print_format % (row["node"], row["protocol"], row["sn"], row["mn"], row["capacity"], row["format"], row["fw"]))
+            sys.stdout.flush()
 
 def getlbastatus():
     usage="usage: %prog getlbastatus <device> [OPTIONS]"
@@ -201,7 +168,11 @@ def getlbastatus():
         help="the lba to get status")
     parser.add_option("", "--no-check-max-lba", dest="no_check_max_lba", action="store_true", default=False,
         help="Default to check the device limit for the given lba address, disable it when set")
-    parser_update(parser, add_output=["normal", "hex", "raw"])
+    parser.add_option("-A", "--all", dest="all", action="store_true", default=False,
+        help="Walk the LUN from the lba to the end, and print the LBA status map")
+    parser.add_option("-f", "--map-file", type="str", dest="map_file", action="store", default='',
+        help="Save the LBA status map to this file, with --all")
+    parser_update(parser, add_output=["normal", "hex", "raw", "json"])
 
     if len(sys.argv) > 2:
         (options, args) = parser.parse_args(sys.argv[2:])
@@ -213,6 +184,11 @@ def getlbastatus():
         with SCSI(init_device(dev, open_t='scsi')) as d:
             if (not options.no_check_max_lba) and d.device_max_lba > 0 and options.lba > d.device_max_lba:
                 parser.error("lba %d is out of device limit %d" % (options.lba, d.device_max_lba))
+            if options.all:
+                from pydiskcmdlib.lba_status_map import walk_scsi_lba_status
+                from ._lba_status_common import print_lba_status_map
+                print_lba_status_map(walk_scsi_lba_status(d, slba=options.lba), options.output_format, map_file=options.map_file)
+                return
             print ('issuing getlbastatus command')
             print ("%s:" % d.device._file_name)
             ##
@@ -233,6 +209,8 @@ def getlbastatus():
                 ))
         elif options.output_format == "hex":
             format_dump_bytes(cmd.datain)
+        elif options.output_format == "json":
+            json_print(cmd.result)
         else:
             print (bytes(cmd.datain))
     else:
@@ -751,6 +729,27 @@ def cli_autocmd():
 #########
 ############################
 ############################
+def surface_scan():
+    usage="usage: %prog surface-scan <device> [OPTIONS]"
+    parser = optparse.OptionParser(usage)
+    parser.add_option("-m", "--mode", type="choice", dest="mode", action="store", choices=["verify", "read"], default="verify",
+        help="The command to scan with, verify(VERIFY(16))|read(READ(16)), default verify")
+    add_surface_scan_options(parser)
+    parser_update(parser)
+
+    if len(sys.argv) > 2:
+        (options, args) = parser.parse_args(sys.argv[2:])
+        ## check device
+        dev = sys.argv[2]
+        ##
+        script_check(options, admin_check=True)
+        ##
+        from pydiskcmdlib.surface_scan import SCSIScanTarget
+        with SCSI(init_device(dev, open_t='scsi', queue_depth=options.queue_depth)) as d:
+            return run_surface_scan(SCSIScanTarget(d, mode=options.mode), options)
+    else:
+        parser.print_help()
+
 commands_dict = {"list": _list, 
                  "inq": inq,
                  "cdb-passthru": cdb_passthru,
@@ -764,6 +763,7 @@ commands_dict = {"list": _list,
                  "version": version,
                  "sync": sync,
                  "read": read16,
+                 "surface-scan": surface_scan,
                  "write":write16,
                  "help": print_help,
                  "cli-info": cli_info,
@@ -8,16 +8,17 @@ def get_completion():
 _pysata_cmds="list check-PowerMode accessible-MaxAddress identify sanitize self-test set-feature \
           read-log smart-read-log smart smart-return-status standby read write flush trim \
           download-fw trusted-receive read-verify-sector write-log write-uncorrectable \
-          version help"
+          surface-scan version help"
 
 _pynvme_cmds="list list-subsys smart-log id-ctrl id-ns error-log fw-log fw-download fw-commit \
-          format sanitize persistent-event-log device-self-test self-test-log telemetry-log \
+          format sanitize wipe persistent-event-log device-self-test self-test-log telemetry-log \
           sanitize-log get-feature set-feature list-ctrl list-ns nvme-create-ns nvme-delete-ns \
           nvme-attach-ns nvme-detach-ns commands-se-log pcie flush read write get-lba-status \
-          compare dsm write-uncor write-zeroes get-log reset subsystem-reset show-regs version help"
+          compare dsm write-uncor write-zeroes get-log reset subsystem-reset show-regs surface-scan \
+          trace-latency version help"
 
 _pyscsi_cmds="list inq getlbastatus readcap luns mode-sense log-sense read write \
-          smart-simulate sync cdb-passthru se-protocol-in version help"
+          smart-simulate sync cdb-passthru se-protocol-in surface-scan version help"
 
 
 pysata_list_opts () {
@@ -39,7 +40,7 @@ pysata_list_opts () {
 
     case "$1" in
         "list")
-        opts+=" -o --output-format= -h --help"
+        opts+=" -t --timeout= -w --workers= -o --output-format= -h --help"
         ;;
         "check-PowerMode")
         opts+=" --show_status -h --help"
@@ -94,6 +95,10 @@ pysata_list_opts () {
         opts+=" -s --start-block= -c --block-count= -b --block-size= \
             --show_status -h --help"
         ;;
+        "surface-scan")
+        opts+=" -s --start-block= -c --block-count= -b --chunk= \
+            -q --queue-depth= -r --regions= -w --width= -t --slow-ms= -h --help"
+        ;;
         "write")
         opts+=" -s --start-block= -c --block-count= -d --data= \
             -f --data-file= -b --block-size= --show_status -h --help"
@@ -146,7 +151,7 @@ pyscsi_list_opts () {
 
     case "$1" in
         "list")
-        opts+=" -o --output-format= -h --help"
+        opts+=" -t --timeout= -w --workers= -o --output-format= -h --help"
         ;;
         "inq")
         opts+=" -p --page= -o --output-format= -l --alloclen= \
@@ -157,7 +162,7 @@ pyscsi_list_opts () {
             -b --block-size= -o --output-format= -h --help"
         ;;
         "getlbastatus")
-        opts+=" -l --lba= -o --output-format= -h --help"
+        opts+=" -l --lba= -A --all -f --map-file= -o --output-format= -h --help"
         ;;
         "readcap")
         opts+=" -o --output-format= -h --help"
@@ -184,6 +189,10 @@ pyscsi_list_opts () {
         opts+=" -s --start-block= -c --block-count= -i --immed= \
             -g --group-number= -h --help"
         ;;
+        "surface-scan")
+        opts+=" -m --mode= -s --start-block= -c --block-count= -b --chunk= \
+            -q --queue-depth= -r --regions= -w --width= -t --slow-ms= -h --help"
+        ;;
         "read")
         opts+=" -s --start-block= -c --block-count= -b --block-size= \
             -h --help"
@@ -227,7 +236,7 @@ pynvme_list_opts () {
 
     case "$1" in
         "list")
-        opts+=" -o --output-format= -h --help"
+        opts+=" -t --timeout= -w --workers= -o --output-format= -h --help"
         ;;
         "smart-log")
         opts+=" -o --output-format= -h --help"
@@ -241,7 +250,7 @@ pynvme_list_opts () {
         "get-log")
         opts+=" -n --namespace-id= -i --log-id= -l --log-len= -o --lpo= \
             -s --lsp= -S --lsi= -r --rae= -U --uuid-index= -y --csi= -O --ot= \
-            --output-format= -h --help"
+            --output-format= -f --output-file= -x --xfer= -h --help"
         ;;
         "error-log")
         opts+=" -o --output-format= -h --help"
@@ -275,9 +284,12 @@ pynvme_list_opts () {
         opts+=" -d --no-dealloc -i --oipbp= -n --owpass= -u --ause= \
             -a --sanact= -p --ovrpat= -h --help"
         ;;
+        "wipe")
+        opts+=" -l --level= -m --method= -p --plan -t --timeout= --force -h --help"
+        ;;
         "persistent-event-log")
-        opts+=" -a --action= -o --output-format= -f --filter= \
-            -h --help"
+        opts+=" -a --action= -l --numd= -s --lpo= -U --uuid-index= -o --output-format= \
+            -f --filter= -S --state-file= -h --help"
         ;;
         "device-self-test")
         opts+=" -n --namespace-id= -s --self-test-code= -h --help"
@@ -287,7 +299,7 @@ pynvme_list_opts () {
         ;;
         "telemetry-log")
         opts+=" -o --output-file= -g --host-generate -c --controller-init \
-            -d --data-area -h --help"
+            -d --data-area -U --uuid-index= -r --resume -z --compress= -x --xfer= -h --help"
         ;;
         "get-feature")
         opts+=" -n --namespace-id= -f --feature-id= -s --sel= -l --data-len \
@@ -337,8 +349,15 @@ pynvme_list_opts () {
             -f --data-file= -h --help"
         ;;
         "dsm")
-        opts+=" -n --namespace-id= -s --start-block= -c --block-count= \
-            -f --data-file= -h --help"
+        opts+=" -n --namespace-id= -s --slbs= -b --blocks= -A --all \
+            -d --ad -w --idw -r --idr -h --help"
+        ;;
+        "surface-scan")
+        opts+=" -n --namespace-id= -m --mode= -B --backend= -s --start-block= -c --block-count= -b --chunk= \
+            -q --queue-depth= -r --regions= -w --width= -t --slow-ms= -h --help"
+        ;;
+        "trace-latency")
+        opts+=" -c --controllers= -t --time= -i --interval= -o --output-format= -h --help"
         ;;
         "write-uncor")
         opts+=" -n --namespace-id= -s --start-block= -c --block-count= \
@@ -350,8 +369,8 @@ pynvme_list_opts () {
         ;;
         "get-lba-status")
         opts+=" -n --namespace-id= -s --start-block= -c --block-count= \
-            -e --entry-count= -a --action-type= -o --output-format= \
-            -t --timeout= -h --help"
+            -e --entry-count= -a --action-type= -A --all -f --map-file= \
+            -o --output-format= -t --timeout= -h --help"
         ;;
         "show-regs")
         opts+=" -o --output-format= -h --help"
@@ -0,0 +1,407 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import time
+import queue
+import binascii
+import threading
+from itertools import count
+from pydiskcmdlib import os_type
+from pydiskcmdlib.utils import init_device
+from pydiskcmdlib.utils.converter import translocate_bytearray,bytearray2string,scsi_ba_to_int
+from pydiskcmdcli.utils.format_print import human_read_capacity
+from pydiskcmdcli.utils.string_utils import decode_bytes,string_strip
+from pydiskcmdcli import log
+
+DefaultMaxWorkers = 16
+## seconds, a device takes longer than it is reported as timeout
+DefaultTimeout = 10
+
+
+class DiscoveryPool(object):
+    """
+    A pool of daemon worker threads to probe devices concurrently.
+
+    A device hung in ioctl can not be interrupted, so the workers are daemon
+    threads(not concurrent.futures, whose threads are joined at exit), a task
+    takes longer than timeout is reported as timeout, and its worker is replaced
+    by a new one.
+    """
+    def __init__(self, max_workers=DefaultMaxWorkers, timeout=DefaultTimeout):
+        """
+        :param max_workers: the max threads probe devices at the same time
+        :param timeout: the max seconds of one task
+        """
+        self._max_workers = max_workers
+        self._timeout = timeout
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = count()
+        ## task id -> [key, on_error, start time]
+        self._pending = {}
+        self._workers = 0
+        self._idle = 0
+        self._closed = False
+
+    def _spawn(self):
+        ## call with lock
+        if self._idle == 0 and self._workers < self._max_workers:
+            self._workers += 1
+            t = threading.Thread(target=self._worker, name="pydiskcmd-discovery")
+            t.daemon = True
+            t.start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            task = self._tasks.get()
+            with self._lock:
+                self._idle -= 1
+                if task is None:
+                    self._workers -= 1
+                    return
+                tid,func,args,on_cancel = task
+                entry = self._pending.get(tid)
+                if entry is not None:
+                    entry[2] = time.monotonic()
+            if entry is None:
+                self._cancel(on_cancel)
+                continue
+            try:
+                result = func(*args)
+            except Exception as e:
+                self._results.put((tid, None, e))
+            else:
+                self._results.put((tid, result, None))
+
+    def submit(self, key, func, *args, on_error=None, on_cancel=None):
+        """
+        submit a task, it can be called by a running task
+
+        :param key: the name of the task, like device path
+        :param func: the function of task, it returns a result or None
+        :param args: passthrough to func
+        :param on_error: a function called with the exception(or TimeoutError) if
+                         the task fails, it returns a result or None
+        :param on_cancel: a function called if the task is dropped before it runs
+                          (the pool is closed), to release the resources of the task
+        """
+        with self._lock:
+            if not self._closed:
+                tid = next(self._ids)
+                self._pending[tid] = [key, on_error, None]
+                self._tasks.put((tid, func, args, on_cancel))
+                self._spawn()
+                return
+        self._cancel(on_cancel)
+
+    def _cancel(self, on_cancel):
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception as e:
+                log.debug("Discovery cancel failed: %s" % e)
+
+    def _handle_error(self, key, on_error, error):
+        log.debug("Discovery %s failed: %s" % (key, error))
+        if on_error is not None:
+            return on_error(error)
+
+    def results(self):
+        """
+        yield the results(not None) as the tasks complete, until all the tasks
+        (and the tasks they submit) complete or time out.
+        """
+        try:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        break
+                    starts = [v[2] for v in self._pending.values() if v[2] is not None]
+                now = time.monotonic()
+                wait = max(0, min(starts) + self._timeout - now) if starts else self._timeout
+                try:
+                    tid,result,error = self._results.get(timeout=wait)
+                except queue.Empty:
+                    now = time.monotonic()
+                    with self._lock:
+                        timeout_ids = [k for k,v in self._pending.items() if v[2] is not None and now - v[2] >= self._timeout]
+                        expired = [self._pending.pop(k) for k in timeout_ids]
+                        ## the worker is hung, give the slot to a new one
+                        self._workers -= len(expired)
+                        if not self._tasks.empty():
+                            for _ in expired:
+                                self._spawn()
+                    for key,on_error,_ in expired:
+                        result = self._handle_error(key, on_error, TimeoutError("%s timeout after %ss" % (key, self._timeout)))
+                        if result is not None:
+                            yield result
+                    continue
+                with self._lock:
+                    entry = self._pending.pop(tid, None)
+                if entry is None:
+                    ## timed out
+                    continue
+                if error is not None:
+                    result = self._handle_error(entry[0], entry[1], error)
+                if result is not None:
+                    yield result
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        stop the idle workers, and drop the tasks not started
+        """
+        dropped = []
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    task = self._tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    self._pending.pop(task[0], None)
+                    dropped.append(task[3])
+            for _ in range(self._workers):
+                self._tasks.put(None)
+        for on_cancel in dropped:
+            self._cancel(on_cancel)
+
+
+class _SharedDevice(object):
+    """
+    A command object shared by several tasks, the device is closed by the last one.
+    """
+    def __init__(self, obj, users):
+        self.obj = obj
+        self._users = users
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            last = (self._users == 0)
+        if last:
+            self.obj.device.close()
+
+
+def strip_id_string(value):
+    """
+    :param value: a string field of identify or inquiry data, bytes or str
+    :return: the string without the padding spaces and NUL
+    """
+    return string_strip(decode_bytes(value), b'\x00'.decode(), ' ')
+
+
+def _nvme_ns_info(id_ns_data):
+    from pydiskcmdcli.utils import nvme_format_print
+    result = nvme_format_print.nvme_id_ns_decode(id_ns_data)
+    lbaf = result.get("LBAF").get(scsi_ba_to_int(result.get("FLBAS"), 'little') & 0x0F)
+    meta_size = scsi_ba_to_int(lbaf.get("MS"), 'little')
+    lba_data_size = scsi_ba_to_int(lbaf.get("LBADS"), 'little')
+    _format = "%-6sB + %-3sB" % (2 ** lba_data_size, meta_size)
+    NUSE_B = scsi_ba_to_int(result.get("NUSE"), 'little') * (2 ** lba_data_size)
+    NCAP_B = scsi_ba_to_int(result.get("NCAP"), 'little') * (2 ** lba_data_size)
+    usage = "%-6s / %-6s" % (human_read_capacity(NUSE_B), human_read_capacity(NCAP_B))
+    return usage,_format
+
+
+def nvme_ctrl_id_info(id_ctrl_data):
+    """
+    :param id_ctrl_data: the identify controller data
+    :return: (SN, MN, FR)
+    """
+    from pydiskcmdcli.utils import nvme_format_print
+    result = nvme_format_print.nvme_id_ctrl_decode(id_ctrl_data)
+    return strip_id_string(result.get("SN")),strip_id_string(result.get("MN")),strip_id_string(result.get("FR"))
+
+
+def _probe_nvme_ns(shared, node, ns_id, ctrl_row):
+    try:
+        cmd = shared.obj.id_ns(ns_id)
+        usage,_format = _nvme_ns_info(cmd.data)
+    finally:
+        shared.release()
+    row = dict(ctrl_row)
+    row.update({"node": node, "ns_id": ns_id, "usage": usage, "format": _format})
+    return row
+
+
+def _probe_nvme_ctrl(pool, ctrl_info):
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    dev = init_device(ctrl_info.dev_path, open_t='nvme')
+    shared = None
+    try:
+        d = NVMe(dev)
+        sn,mn,fw = nvme_ctrl_id_info(d.ctrl_identify_info)
+        namespaces = ctrl_info.get_namespaces()
+        if namespaces:
+            ## one open handle for all the namespaces of the controller
+            shared = _SharedDevice(d, len(namespaces))
+    finally:
+        if shared is None:
+            dev.close()
+    if shared is None:
+        return
+    for ns_name in sorted(namespaces.keys()):
+        ns_info = namespaces[ns_name]
+        ctrl_row = {"kind": "nvme", "ctrl": ctrl_info.dev_path, "status": "normal", "sn": sn, "mn": mn, "fw": fw}
+        fault_row = dict(ctrl_row, node=ns_info.dev_path, ns_id=ns_info.ns_id, usage='-', format='-')
+        def on_error(error, fault_row=fault_row):
+            return dict(fault_row, status="timeout" if isinstance(error, TimeoutError) else "fault")
+        pool.submit(ns_info.dev_path, _probe_nvme_ns, shared, ns_info.dev_path, ns_info.ns_id, ctrl_row,
+                    on_error=on_error, on_cancel=shared.release)
+
+
+def _nvme_ctrl_timeout(dev_path):
+    ## the controller can not be opened is skipped, but a hung one is reported
+    def on_error(error):
+        if isinstance(error, TimeoutError):
+            return {"kind": "nvme", "ctrl": dev_path, "node": dev_path, "status": "timeout", "sn": '-', "mn": '-', "fw": '-',
+                    "ns_id": '-', "usage": '-', "format": '-'}
+    return on_error
+
+
+def _probe_nvme_win(node):
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    with NVMe(init_device(node, open_t='nvme')) as d:
+        sn,mn,fw = nvme_ctrl_id_info(d.ctrl_identify_info)
+        cmd_id_ns = d.id_ns()
+    usage,_format = _nvme_ns_info(cmd_id_ns.data)
+    return {"kind": "nvme", "ctrl": node, "node": node, "status": "normal", "sn": sn, "mn": mn, "fw": fw,
+            "ns_id": '-', "usage": usage, "format": _format}
+
+
+def ata_id_info(id_info):
+    """
+    :param id_info: the IDENTIFY DEVICE data
+    :return: (SN, MN, FW, capacity, format)
+    """
+    invalid_symbol = b'\x00'.decode()
+    sn = bytearray2string(translocate_bytearray(id_info[20:40])).strip().strip(invalid_symbol)
+    fw = bytearray2string(translocate_bytearray(id_info[46:54]))
+    mn = bytearray2string(translocate_bytearray(id_info[54:94])).strip().strip(invalid_symbol)
+    logical_sector_num = int(binascii.hexlify(translocate_bytearray(id_info[200:208], 2)),16)
+    if id_info[213] & 0xC0 == 0x40: # word 106 valid
+        if id_info[213] & 0x10:
+            logical_sector_size = int(binascii.hexlify(translocate_bytearray(id_info[234:238], 2)),16) * 2
+        else:
+            logical_sector_size = 512
+        if id_info[213] & 0x20:
+            relationship = 2 ** (id_info[212] & 0x0F)
+        else:
+            relationship = 1
+        physical_sector_size = logical_sector_size * relationship
+        disk_format = "%s / %s" % (logical_sector_size, physical_sector_size)
+        cap = human_read_capacity(logical_sector_num*logical_sector_size)
+    else:
+        disk_format = "Unknown"
+        cap = "Unknown"
+    return sn,mn,fw,cap,disk_format
+
+
+def _probe_ata(node):
+    from pydiskcmdlib.pysata.sata import SATA
+    with SATA(init_device(node, open_t='ata'), 512) as d:
+        id_info = d.identify_raw
+    sn,mn,fw,cap,disk_format = ata_id_info(id_info)
+    return {"kind": "ata", "node": node, "sn": sn, "mn": mn, "fw": fw, "capacity": cap, "format": disk_format}
+
+
+def _probe_scsi(node):
+    from pydiskcmdlib.pyscsi.scsi import SCSI
+    from pydiskcmdlib.pysata.sata import SATA
+    from pyscsi.pyscsi import scsi_enum_inquiry as INQUIRY
+    ## one open handle for SCSI and the ATA check
+    dev = init_device(node, open_t='scsi')
+    try:
+        d = SCSI(dev, 512)
+        serial_info = d.inquiry(evpd=1, page_code=INQUIRY.VPD.UNIT_SERIAL_NUMBER).result
+        inq_info = d.inquiry().result
+        cap = d.readcapacity16().result
+        # device who can be here, will be scsi device
+        # Then check if ATA device
+        device_type = 'scsi'
+        try:
+            SATA(dev)
+        except Exception:
+            pass
+        else:
+            device_type = 'ata'
+    finally:
+        dev.close()
+    serial = strip_id_string(serial_info.get('unit_serial_number'))
+    model = strip_id_string(inq_info.get('product_identification'))
+    fw = decode_bytes(inq_info.get('product_revision_level'))
+    logical_sector_num = cap["returned_lba"]
+    logical_sector_size = cap["block_length"]
+    physical_sector_size = (2 ** cap["lbppbe"]) * logical_sector_size
+    return {"kind": "scsi",
+            "node": node,
+            "protocol": device_type,
+            "sn": serial if serial else 'Unknown',
+            "mn": model if model else 'Unknown',
+            "fw": fw,
+            "capacity": human_read_capacity(logical_sector_size * logical_sector_num),
+            "format": "%s / %s" % (logical_sector_size, physical_sector_size),}
+
+
+def get_disk_paths():
+    """
+    :return: the SATA/SAS disks(not NVMe) found in system
+    """
+    if os_type == 'Linux':
+        from pydiskcmdcli.system.lin_os_tool import get_block_devs
+        return [i for i in get_block_devs(exclude=("nvme",))]
+    elif os_type == 'Windows':
+        from pydiskcmdcli.system.win_os_tool import scan_all_physical_drive
+        return sorted([i for i in scan_all_physical_drive()])
+    raise RuntimeError("OS %s Not support device discovery" % os_type)
+
+
+def discover_devices(kind="nvme", dev_paths=None, max_workers=DefaultMaxWorkers, timeout=DefaultTimeout):
+    """
+    probe the devices concurrently, and yield the information as the devices respond.
+
+    The rows are dicts with key "node", "sn", "mn", "fw", and:
+      * nvme: "ctrl", "status"(normal, fault or timeout), "ns_id", "usage", "format",
+              one row per namespace, the namespaces of a controller share one open handle;
+      * ata:  "capacity", "format", only the ATA devices are yielded;
+      * scsi: "protocol"(scsi or ata), "capacity", "format".
+
+    :param kind: nvme, ata or scsi
+    :param dev_paths: the devices to probe, None means all the devices found in system
+                      (for nvme in Linux, a list of controller path, like /dev/nvme0)
+    :param max_workers: the max devices probed at the same time
+    :param timeout: the max seconds to wait for a device
+    :return: a generator of dict
+    """
+    pool = DiscoveryPool(max_workers=max_workers, timeout=timeout)
+    if kind == "nvme":
+        if os_type == 'Linux':
+            from pydiskcmdcli.system.lin_os_tool import scan_nvme_ctrls
+            ctrls = scan_nvme_ctrls()
+            for ctrl_name in sorted(ctrls.keys()):
+                ctrl_info = ctrls[ctrl_name]
+                if dev_paths is not None and ctrl_info.dev_path not in dev_paths:
+                    continue
+                pool.submit(ctrl_info.dev_path, _probe_nvme_ctrl, pool, ctrl_info, on_error=_nvme_ctrl_timeout(ctrl_info.dev_path))
+        elif os_type == 'Windows':
+            if dev_paths is None:
+                from pydiskcmdcli.system.win_os_tool import scan_all_physical_drive
+                dev_paths = sorted([i for i in scan_all_physical_drive()])
+            for node in dev_paths:
+                pool.submit(node, _probe_nvme_win, node)
+        else:
+            raise RuntimeError("OS %s Not support device discovery" % os_type)
+    elif kind in ("ata", "scsi"):
+        probe = _probe_ata if kind == "ata" else _probe_scsi
+        for node in (get_disk_paths() if dev_paths is None else dev_paths):
+            pool.submit(node, probe, node)
+    else:
+        raise NotImplementedError("No device discovery implemented for %s" % kind)
+    return pool.results()
@@ -0,0 +1,403 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import time
+import heapq
+import queue
+import socket
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer,BaseHTTPRequestHandler
+from pydiskcmdlib.utils import init_device
+from pydiskcmdlib.utils.converter import scsi_ba_to_int
+from pydiskcmdcli.system.discovery import strip_id_string,nvme_ctrl_id_info,ata_id_info,get_disk_paths
+from pydiskcmdcli.system.smart_history import nvme_smart_attributes,ata_smart_attributes,scsi_smart_attributes
+from pydiskcmdcli import os_type
+from pydiskcmdcli import log
+
+## The exporter keeps the devices open, and refreshes their pages in the
+#  background, every page at its TTL. A refresh renders the whole OpenMetrics
+#  body once, a scrape only returns it, so the scrape does not touch the
+#  devices and its latency does not depend on the number of drives.
+#
+#  The refresh runs in daemon worker threads, a device is refreshed by one
+#  worker at a time(the pages of a device share one handle), and at most
+#  max_workers devices are refreshed at the same time. A hung device only
+#  holds its worker, its pages get stale and are reported by
+#  pydiskcmd_page_up and pydiskcmd_page_refresh_timestamp_seconds.
+DefaultAddress = ("127.0.0.1", 9586)
+DefaultMaxWorkers = 4
+## the page name -> (the metric family, TTL in seconds)
+DefaultPages = {"nvme_smart": ("pydiskcmd_nvme_smart", 60),
+                "nvme_ocp_smart": ("pydiskcmd_nvme_ocp_smart", 300),
+                "ata_smart": ("pydiskcmd_ata_smart", 60),
+                "scsi_smart": ("pydiskcmd_scsi_smart", 300),
+                }
+ContentType = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+## the fields of OCP SMART / Health Information Extended(C0h) that are not counters
+_ocp_skip_fields = ("DSSD Spec Version", "Log Page Version", "Log Page GUID")
+
+
+def _ocp_smart_attributes(nvme):
+    from pydiskcmdcli.plugins.ocp.DSSD_spec import ocp_smart_extended_decode
+    cmd = nvme.get_log_page(0, 0xC0, 0, 0, 127, 0, 0, 0, 0, 0, 0, 0)
+    cmd.check_return_status(False, raise_if_fail=True)
+    return {k: scsi_ba_to_int(v, 'little') for k,v in ocp_smart_extended_decode(cmd.data).items()
+            if k not in _ocp_skip_fields}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**kwargs):
+    return ",".join('%s="%s"' % (k, _escape(v)) for k,v in kwargs.items())
+
+
+class ExporterDevice(object):
+    """
+    An open device and its pages
+    """
+    def __init__(self, kind, node, sn, mn, obj, pages):
+        """
+        :param kind: nvme, ata or scsi
+        :param node: the device node
+        :param sn: the serial number
+        :param mn: the model number
+        :param obj: the NVMe, SATA or SCSI object
+        :param pages: a dict of page name: the function to read the page, it returns a dict of attribute: value
+        """
+        self.kind = kind
+        self.node = node
+        self.sn = sn
+        self.mn = mn
+        self.obj = obj
+        self.pages = pages
+        ## page name -> (monotonic refresh time, wall refresh time, the rendered samples, None means failed)
+        self.results = {}
+
+    def close(self):
+        self.obj.device.close()
+
+
+def open_nvme(node):
+    """
+    :param node: the NVMe controller, like /dev/nvme0
+    :return: an ExporterDevice
+    """
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    d = NVMe(init_device(node, open_t='nvme'))
+    try:
+        sn,mn,_ = nvme_ctrl_id_info(d.ctrl_identify_info)
+        pages = {"nvme_smart": nvme_smart_attributes}
+        if d.ocp_support:
+            pages["nvme_ocp_smart"] = _ocp_smart_attributes
+    except Exception:
+        d.device.close()
+        raise
+    return ExporterDevice("nvme", node, sn, mn, d, pages)
+
+
+def open_disk(node):
+    """
+    :param node: the SATA or SAS disk, like /dev/sda
+    :return: an ExporterDevice
+    """
+    from pydiskcmdlib.pyscsi.scsi import SCSI
+    from pydiskcmdlib.pysata.sata import SATA
+    from pyscsi.pyscsi import scsi_enum_inquiry as INQUIRY
+    dev = init_device(node, open_t='scsi')
+    try:
+        try:
+            d = SATA(dev)
+        except Exception:
+            d = SCSI(dev, 512)
+            sn = strip_id_string(d.inquiry(evpd=1, page_code=INQUIRY.VPD.UNIT_SERIAL_NUMBER).result.get('unit_serial_number'))
+            mn = strip_id_string(d.inquiry().result.get('product_identification'))
+            return ExporterDevice("scsi", node, sn, mn, d, {"scsi_smart": scsi_smart_attributes})
+        sn,mn,_,_,_ = ata_id_info(d.identify_raw)
+        return ExporterDevice("ata", node, sn, mn, d, {"ata_smart": ata_smart_attributes})
+    except Exception:
+        dev.close()
+        raise
+
+
+def open_devices(nvme_paths=None, disk_paths=None):
+    """
+    :param nvme_paths: the NVMe controllers, None means all the controllers found in system
+    :param disk_paths: the SATA/SAS disks, None means all the disks found in system
+    :return: a list of ExporterDevice, the devices can not be opened are skipped
+    """
+    if nvme_paths is None:
+        nvme_paths = []
+        if os_type == 'Linux':
+            from pydiskcmdcli.system.lin_os_tool import scan_nvme_ctrls
+            nvme_paths = sorted(v.dev_path for v in scan_nvme_ctrls().values())
+    if disk_paths is None:
+        disk_paths = get_disk_paths()
+    devices = []
+    for open_func,paths in ((open_nvme, nvme_paths), (open_disk, disk_paths)):
+        for node in paths:
+            try:
+                devices.append(open_func(node))
+            except Exception as e:
+                log.debug("Open %s failed: %s" % (node, e))
+    return devices
+
+
+class MetricsExporter(object):
+    """
+    Refresh the pages of the devices in background, and render them in OpenMetrics text.
+
+    Usage:
+        exporter = MetricsExporter(open_devices())
+        exporter.start()
+        exporter.serve(("127.0.0.1", 9586))
+    """
+    def __init__(self, devices, max_workers=DefaultMaxWorkers, ttl=None):
+        """
+        :param devices: a list of ExporterDevice
+        :param max_workers: the max devices refreshed at the same time
+        :param ttl: a dict of page name: TTL in seconds, to override the default TTL
+        """
+        self.devices = devices
+        self.max_workers = max_workers
+        self.ttl = {k: v[1] for k,v in DefaultPages.items()}
+        if ttl:
+            self.ttl.update(ttl)
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        ## the devices queued or being refreshed
+        self._busy = set()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._body = self.render()
+
+    @property
+    def body(self):
+        """
+        the OpenMetrics text of the last refresh
+        """
+        return self._body
+
+    def refresh(self, device, now=None):
+        """
+        refresh the pages of a device that are due
+
+        :param device: an ExporterDevice
+        :param now: the current time, None means time.monotonic()
+        """
+        now = time.monotonic() if now is None else now
+        labels = _labels(device=device.node, kind=device.kind, sn=device.sn, model=device.mn)
+        for page,func in device.pages.items():
+            last = device.results.get(page)
+            if last is not None and now - last[0] < self.ttl[page]:
+                continue
+            try:
+                values = func(device.obj)
+            except Exception as e:
+                log.debug("Refresh %s of %s failed: %s" % (page, device.node, e))
+                samples = None
+            else:
+                samples = ['%s{%s,attribute="%s"} %d' % (DefaultPages[page][0], labels, _escape(k), v)
+                           for k,v in values.items()]
+            device.results[page] = (time.monotonic(), time.time(), samples)
+
+    def render(self):
+        """
+        render the OpenMetrics text of all the devices, the samples of a metric family
+        are grouped together
+
+        :return: the text in bytes
+        """
+        families = {}
+        up,stamp = [],[]
+        for device in self.devices:
+            for page in device.pages:
+                labels = _labels(device=device.node, page=page)
+                result = device.results.get(page)
+                if result is None:
+                    ## not refreshed yet(or the first refresh hangs)
+                    up.append('pydiskcmd_page_up{%s} 0' % labels)
+                    continue
+                _,wall,samples = result
+                up.append('pydiskcmd_page_up{%s} %d' % (labels, 0 if samples is None else 1))
+                stamp.append('pydiskcmd_page_refresh_timestamp_seconds{%s} %.3f' % (labels, wall))
+                if samples:
+                    families.setdefault(DefaultPages[page][0], []).extend(samples)
+        lines = []
+        for family in sorted(families.keys()):
+            lines.append("# TYPE %s gauge" % family)
+            lines.extend(families[family])
+        lines.append("# TYPE pydiskcmd_page_up gauge")
+        lines.extend(up)
+        lines.append("# TYPE pydiskcmd_page_refresh_timestamp_seconds gauge")
+        lines.extend(stamp)
+        lines.append("# EOF")
+        return ("\n".join(lines) + "\n").encode()
+
+    def _next_due(self, device):
+        due = []
+        for page in device.pages:
+            last = device.results.get(page)
+            due.append(0 if last is None else last[0] + self.ttl[page])
+        return min(due) if due else None
+
+    def _worker(self):
+        while True:
+            device = self._tasks.get()
+            if device is None:
+                return
+            if self._stop.is_set():
+                with self._lock:
+                    self._busy.discard(device)
+                return
+            try:
+                self.refresh(device)
+                with self._lock:
+                    self._body = self.render()
+            except Exception as e:
+                log.debug("Refresh %s failed: %s" % (device.node, e))
+            finally:
+                with self._lock:
+                    self._busy.discard(device)
+            self._wakeup.set()
+
+    def _scheduler(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            heap = []
+            with self._lock:
+                for i,device in enumerate(self.devices):
+                    if device in self._busy:
+                        continue
+                    due = self._next_due(device)
+                    if due is None:
+                        continue
+                    if due <= now:
+                        self._busy.add(device)
+                        self._tasks.put(device)
+                    else:
+                        heapq.heappush(heap, (due, i))
+            wait = (heap[0][0] - now) if heap else 1
+            self._wakeup.wait(timeout=max(0.01, min(wait, 1)))
+            self._wakeup.clear()
+
+    def start(self):
+        """
+        start the background refresh threads
+        """
+        for i in range(max(1, self.max_workers)):
+            t = threading.Thread(target=self._worker, name="pydiskcmd-exporter")
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._scheduler, name="pydiskcmd-exporter-scheduler")
+        t.daemon = True
+        t.start()
+        self._threads.append(t)
+
+    def stop(self, timeout=10):
+        """
+        stop the background refresh threads, and wait for them
+
+        :param timeout: the max seconds to wait for the threads
+        :return: True if all the threads stopped
+        """
+        self._stop.set()
+        self._wakeup.set()
+        for _ in range(max(1, self.max_workers)):
+            self._tasks.put(None)
+        end = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, end - time.monotonic()))
+        ## the devices queued but not taken by a worker
+        while True:
+            try:
+                device = self._tasks.get_nowait()
+            except queue.Empty:
+                break
+            if device is not None:
+                with self._lock:
+                    self._busy.discard(device)
+        self._threads = [t for t in self._threads if t.is_alive()]
+        return not self._threads
+
+    def close(self, timeout=10):
+        """
+        stop the background refresh threads, and close the devices. A device still
+        being refreshed after timeout(a hung ioctl) is not closed under its worker.
+
+        :param timeout: the max seconds to wait for the threads
+        """
+        self.stop(timeout=timeout)
+        with self._lock:
+            busy = set(self._busy)
+        for device in self.devices:
+            if device in busy:
+                log.debug("%s is still being refreshed, not closed" % device.node)
+                continue
+            try:
+                device.close()
+            except Exception:
+                pass
+
+    def make_server(self, address=DefaultAddress):
+        """
+        :param address: a (host, port) tuple for HTTP, or a path for the Unix socket
+        :return: a server, call its serve_forever()
+        """
+        exporter = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.body
+                self.send_response(200)
+                self.send_header("Content-Type", ContentType)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("exporter: " + (format % args))
+
+        if isinstance(address, str):
+            if not hasattr(socket, "AF_UNIX"):
+                raise NotImplementedError("Unix socket is not supported in OS %s" % os_type)
+            if os.path.exists(address):
+                os.unlink(address)
+            return _ThreadingUnixServer(address, Handler)
+        return _ThreadingHTTPServer(address, Handler)
+
+    def serve(self, address=DefaultAddress):
+        """
+        serve the metrics until interrupted
+
+        :param address: a (host, port) tuple for HTTP, or a path for the Unix socket
+        """
+        server = self.make_server(address)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+if hasattr(socket, "AF_UNIX"):
+    from socketserver import UnixStreamServer
+
+    class _ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            ## BaseHTTPRequestHandler takes the client address as a tuple
+            request,_ = self.socket.accept()
+            return request,("unix", 0)
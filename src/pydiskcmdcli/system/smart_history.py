@@ -0,0 +1,388 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import time
+import sqlite3
+from pydiskcmdlib.utils import init_device
+from pydiskcmdlib.utils.converter import scsi_ba_to_int
+from pydiskcmdcli.system.discovery import (
+    DiscoveryPool,
+    DefaultMaxWorkers,
+    DefaultTimeout,
+    strip_id_string,
+    nvme_ctrl_id_info,
+    ata_id_info,
+    get_disk_paths,
+)
+from pydiskcmdcli import os_type
+from pydiskcmdcli import log
+
+## The SMART history is a sqlite database of the SMART attributes of many drives.
+#  SMART attributes seldom change between two samples, so a value is stored only
+#  when it changes(delta encoded), the value of an attribute at time t is the
+#  last stored value before t. The samples table records when a drive is
+#  sampled, so a missing sample is not taken as an unchanged value.
+#
+#  The points table is keyed by (drive, attribute, time) without rowid, the
+#  history of one attribute of one drive is one range scan of the key.
+#
+#  Downsampling keeps the last point of every period(default a day) for the
+#  points older than the raw days, and retention drops the points older than
+#  the retention days, except the last one of every attribute.
+DefaultInterval = 3600
+DefaultRawDays = 30
+DefaultDownsamplePeriod = 86400
+DefaultRetentionDays = 730
+## sqlite INTEGER is signed 64 bits, the 128 bits NVMe counters are clamped
+_MaxValue = (1 << 63) - 1
+
+_schema = """
+CREATE TABLE IF NOT EXISTS drives (id INTEGER PRIMARY KEY, kind TEXT, sn TEXT, mn TEXT, node TEXT,
+                                   UNIQUE (kind, sn, mn));
+CREATE TABLE IF NOT EXISTS attributes (id INTEGER PRIMARY KEY, name TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS samples (drive_id INTEGER, ts INTEGER,
+                                    PRIMARY KEY (drive_id, ts)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS points (drive_id INTEGER, attr_id INTEGER, ts INTEGER, value INTEGER,
+                                   PRIMARY KEY (drive_id, attr_id, ts)) WITHOUT ROWID;
+"""
+
+
+def nvme_smart_attributes(nvme):
+    """
+    :param nvme: a NVMe object
+    :return: a dict of attribute name: value, of the SMART / Health Information log
+    """
+    from pydiskcmdcli.nvme_spec import nvme_smart_decode
+    cmd = nvme.smart_log()
+    cmd.check_return_status(False, raise_if_fail=True)
+    return {k: scsi_ba_to_int(v, 'little') for k,v in nvme_smart_decode(cmd.data).items()}
+
+
+def ata_smart_attributes(sata):
+    """
+    :param sata: a SATA object
+    :return: a dict of attribute name: value, every attribute ID has "ATA <ID> Value",
+             "ATA <ID> Worst", "ATA <ID> Raw" and "ATA <ID> Thresh"
+    """
+    from pydiskcmdcli.sata_spec import SMART_KEY,decode_smart_thresh
+    cmd_read_data = sata.smart_read_data(SMART_KEY)
+    cmd_read_data.check_return_status()
+    cmd_thresh = sata.smart_read_thresh()
+    cmd_thresh.check_return_status()
+    thresh = decode_smart_thresh(cmd_thresh.datain[2:362])
+    data = cmd_read_data.result['smartInfo']
+    result = {}
+    for i in range(0, 359, 12):
+        ID = data[i]
+        if ID:
+            result["ATA %d Value" % ID] = data[i+3]
+            result["ATA %d Worst" % ID] = data[i+4]
+            result["ATA %d Raw" % ID] = scsi_ba_to_int(data[i+5:i+11], 'little')
+            if ID in thresh:
+                result["ATA %d Thresh" % ID] = thresh[ID]
+    return result
+
+
+def scsi_smart_attributes(scsi):
+    """
+    :param scsi: a SCSI object
+    :return: a dict of attribute name: value, of the simulated SMART from log pages
+    """
+    from pydiskcmdcli.scsi_spec import get_smart_simulate
+    result = {}
+    for name,attr in get_smart_simulate(scsi).items():
+        if isinstance(attr.Value, int):
+            result[name] = attr.Value
+        if isinstance(attr.Threshold, int):
+            result["%s Threshold" % name] = attr.Threshold
+    return result
+
+
+def sample_nvme(node):
+    """
+    :param node: the NVMe controller, like /dev/nvme0
+    :return: a dict of "kind", "node", "sn", "mn" and "attributes"
+    """
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    with NVMe(init_device(node, open_t='nvme')) as d:
+        sn,mn,_ = nvme_ctrl_id_info(d.ctrl_identify_info)
+        attributes = nvme_smart_attributes(d)
+    return {"kind": "nvme", "node": node, "sn": sn, "mn": mn, "attributes": attributes}
+
+
+def sample_disk(node):
+    """
+    :param node: the SATA or SAS disk, like /dev/sda
+    :return: a dict of "kind"(ata or scsi), "node", "sn", "mn" and "attributes"
+    """
+    from pydiskcmdlib.pyscsi.scsi import SCSI
+    from pydiskcmdlib.pysata.sata import SATA
+    from pyscsi.pyscsi import scsi_enum_inquiry as INQUIRY
+    dev = init_device(node, open_t='scsi')
+    try:
+        try:
+            d = SATA(dev)
+        except Exception:
+            d = SCSI(dev, 512)
+            sn = strip_id_string(d.inquiry(evpd=1, page_code=INQUIRY.VPD.UNIT_SERIAL_NUMBER).result.get('unit_serial_number'))
+            mn = strip_id_string(d.inquiry().result.get('product_identification'))
+            return {"kind": "scsi", "node": node, "sn": sn, "mn": mn, "attributes": scsi_smart_attributes(d)}
+        sn,mn,_,_,_ = ata_id_info(d.identify_raw)
+        return {"kind": "ata", "node": node, "sn": sn, "mn": mn, "attributes": ata_smart_attributes(d)}
+    finally:
+        dev.close()
+
+
+class SMARTHistory(object):
+    """
+    The SMART history database.
+
+    Usage:
+        with SMARTHistory("smart.db") as h:
+            h.append(int(time.time()), [sample_nvme("/dev/nvme0")])
+            drive_id = h.drives()[0]["id"]
+            points = h.series(drive_id, "Percentage Used")
+    """
+    def __init__(self, path):
+        """
+        :param path: the database file
+        """
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(_schema)
+        self.__drive_ids = {}
+        self.__attr_ids = {row[1]: row[0] for row in self.conn.execute("SELECT id, name FROM attributes")}
+        ## the last stored value of every attribute, (drive id, attr id) -> value
+        self.__last = {(row[0], row[1]): row[2] for row in
+                       self.conn.execute("SELECT drive_id, attr_id, value, MAX(ts) FROM points GROUP BY drive_id, attr_id")}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _drive_id(self, kind, sn, mn, node):
+        key = (kind, sn, mn)
+        if key not in self.__drive_ids:
+            row = self.conn.execute("SELECT id, node FROM drives WHERE kind=? AND sn=? AND mn=?", key).fetchone()
+            if row is None:
+                cur = self.conn.execute("INSERT INTO drives (kind, sn, mn, node) VALUES (?, ?, ?, ?)", key + (node,))
+                self.__drive_ids[key] = cur.lastrowid
+            else:
+                if row[1] != node:
+                    self.conn.execute("UPDATE drives SET node=? WHERE id=?", (node, row[0]))
+                self.__drive_ids[key] = row[0]
+        return self.__drive_ids[key]
+
+    def _attr_id(self, name):
+        if name not in self.__attr_ids:
+            cur = self.conn.execute("INSERT INTO attributes (name) VALUES (?)", (name,))
+            self.__attr_ids[name] = cur.lastrowid
+        return self.__attr_ids[name]
+
+    def append(self, ts, samples):
+        """
+        store the samples of one round in one transaction, only the changed values are stored
+
+        :param ts: the sample time, seconds since epoch
+        :param samples: an iterable of dict, returned by sample_nvme or sample_disk
+        :return: the number of points stored
+        """
+        sample_rows,point_rows = [],[]
+        with self.conn:
+            for sample in samples:
+                drive_id = self._drive_id(sample["kind"], sample["sn"], sample["mn"], sample["node"])
+                sample_rows.append((drive_id, ts))
+                for name,value in sample["attributes"].items():
+                    key = (drive_id, self._attr_id(name))
+                    value = min(value, _MaxValue)
+                    if self.__last.get(key) != value:
+                        self.__last[key] = value
+                        point_rows.append(key + (ts, value))
+            self.conn.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?)", sample_rows)
+            self.conn.executemany("INSERT OR REPLACE INTO points VALUES (?, ?, ?, ?)", point_rows)
+        return len(point_rows)
+
+    def drives(self):
+        """
+        :return: a list of dict of "id", "kind", "sn", "mn", "node", "first" and "last"(the sample time)
+        """
+        rows = self.conn.execute("SELECT d.id, d.kind, d.sn, d.mn, d.node, MIN(s.ts), MAX(s.ts) FROM drives d "
+                                 "LEFT JOIN samples s ON s.drive_id = d.id GROUP BY d.id ORDER BY d.id")
+        return [dict(zip(("id", "kind", "sn", "mn", "node", "first", "last"), row)) for row in rows]
+
+    def find_drive(self, key):
+        """
+        :param key: the drive id, serial number or the last node
+        :return: the drive id, None means not found
+        """
+        for drive in self.drives():
+            if key in (str(drive["id"]), drive["sn"], drive["node"]):
+                return drive["id"]
+
+    def attributes(self, drive_id):
+        """
+        :param drive_id: the drive id
+        :return: a list of attribute names of the drive
+        """
+        rows = self.conn.execute("SELECT DISTINCT a.name FROM points p JOIN attributes a ON a.id = p.attr_id "
+                                 "WHERE p.drive_id=? ORDER BY a.name", (drive_id,))
+        return [row[0] for row in rows]
+
+    def series(self, drive_id, name, start=None, end=None):
+        """
+        the history of one attribute of one drive
+
+        :param drive_id: the drive id
+        :param name: the attribute name
+        :param start: the start time, None means the first one
+        :param end: the end time, None means the last one
+        :return: a list of (ts, value), the value changed at ts. The first one is the value at start.
+        """
+        attr_id = self.__attr_ids.get(name)
+        if attr_id is None:
+            return []
+        start = 0 if start is None else start
+        end = _MaxValue if end is None else end
+        result = []
+        if start > 0:
+            row = self.conn.execute("SELECT ts, value FROM points WHERE drive_id=? AND attr_id=? AND ts<? "
+                                    "ORDER BY ts DESC LIMIT 1", (drive_id, attr_id, start)).fetchone()
+            if row:
+                result.append((start, row[1]))
+        result.extend(self.conn.execute("SELECT ts, value FROM points WHERE drive_id=? AND attr_id=? AND ts>=? AND ts<=? "
+                                        "ORDER BY ts", (drive_id, attr_id, start, end)))
+        return result
+
+    def downsample(self, before, period=DefaultDownsamplePeriod):
+        """
+        keep the last point of every period for the points older than before
+
+        :param before: the time, seconds since epoch
+        :param period: the period in seconds
+        :return: the number of points deleted
+        """
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM points WHERE ts<:before AND EXISTS (SELECT 1 FROM points q "
+                                    "WHERE q.drive_id=points.drive_id AND q.attr_id=points.attr_id AND q.ts>points.ts "
+                                    "AND q.ts<:before AND q.ts/:period=points.ts/:period)",
+                                    {"before": before, "period": period})
+            self.conn.execute("DELETE FROM samples WHERE ts<:before AND EXISTS (SELECT 1 FROM samples q "
+                              "WHERE q.drive_id=samples.drive_id AND q.ts>samples.ts AND q.ts<:before "
+                              "AND q.ts/:period=samples.ts/:period)",
+                              {"before": before, "period": period})
+        return cur.rowcount
+
+    def expire(self, before):
+        """
+        drop the points older than before, but the last one of every attribute
+
+        :param before: the time, seconds since epoch
+        :return: the number of points deleted
+        """
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM points WHERE ts<:before AND EXISTS (SELECT 1 FROM points q "
+                                    "WHERE q.drive_id=points.drive_id AND q.attr_id=points.attr_id AND q.ts>points.ts "
+                                    "AND q.ts<=:before)", {"before": before})
+            self.conn.execute("DELETE FROM samples WHERE ts<?", (before,))
+        return cur.rowcount
+
+    def maintain(self, now=None, raw_days=DefaultRawDays, period=DefaultDownsamplePeriod, retention_days=DefaultRetentionDays):
+        """
+        downsample and expire the history
+
+        :param now: the current time, None means time.time()
+        :param raw_days: keep all the points of the days
+        :param period: the downsample period in seconds
+        :param retention_days: keep the history of the days
+        :return: the number of points deleted
+        """
+        now = int(time.time()) if now is None else now
+        deleted = self.expire(now - retention_days * 86400)
+        deleted += self.downsample(now - raw_days * 86400, period=period)
+        return deleted
+
+
+class SMARTCollector(object):
+    """
+    Sample the SMART of all the drives concurrently, and store them to a SMARTHistory.
+
+    Usage:
+        with SMARTHistory("smart.db") as h:
+            SMARTCollector(h).run(interval=3600)
+    """
+    def __init__(self, history, nvme_paths=None, disk_paths=None, max_workers=DefaultMaxWorkers, timeout=DefaultTimeout):
+        """
+        :param history: a SMARTHistory
+        :param nvme_paths: the NVMe controllers, None means all the controllers found in system
+        :param disk_paths: the SATA/SAS disks, None means all the disks found in system
+        :param max_workers: the max drives sampled at the same time
+        :param timeout: the max seconds to wait for a drive
+        """
+        self.history = history
+        self.nvme_paths = nvme_paths
+        self.disk_paths = disk_paths
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def _get_nvme_paths(self):
+        if self.nvme_paths is not None:
+            return self.nvme_paths
+        if os_type == 'Linux':
+            from pydiskcmdcli.system.lin_os_tool import scan_nvme_ctrls
+            return sorted(v.dev_path for v in scan_nvme_ctrls().values())
+        ## the NVMe disks are found as disks in Windows
+        return []
+
+    def collect(self, now=None):
+        """
+        sample all the drives once
+
+        :param now: the sample time, None means time.time()
+        :return: a dict of "drives"(the number of drives sampled), "failed"(the failed nodes) and "points"
+        """
+        now = int(time.time()) if now is None else now
+        pool = DiscoveryPool(max_workers=self.max_workers, timeout=self.timeout)
+        failed = []
+        def on_error(node):
+            def _on_error(error):
+                log.debug("Sample %s failed: %s" % (node, error))
+                failed.append(node)
+            return _on_error
+        for node in self._get_nvme_paths():
+            pool.submit(node, sample_nvme, node, on_error=on_error(node))
+        disk_paths = get_disk_paths() if self.disk_paths is None else self.disk_paths
+        for node in disk_paths:
+            pool.submit(node, sample_disk, node, on_error=on_error(node))
+        samples = list(pool.results())
+        points = self.history.append(now, samples)
+        return {"drives": len(samples), "failed": failed, "points": points}
+
+    def run(self, interval=DefaultInterval, rounds=0, maintain_interval=86400, callback=None, **kwargs):
+        """
+        sample all the drives every interval seconds, and maintain the history every maintain_interval seconds
+
+        :param interval: the sample interval in seconds
+        :param rounds: the rounds to sample, 0 means forever
+        :param maintain_interval: the maintain interval in seconds
+        :param callback: a callable(result) after every round, result is returned by collect
+        :param kwargs: passthrough to SMARTHistory.maintain
+        """
+        n = 0
+        next_maintain = 0
+        while True:
+            t0 = time.time()
+            result = self.collect(now=int(t0))
+            if callback:
+                callback(result)
+            if t0 >= next_maintain:
+                self.history.maintain(now=int(t0), **kwargs)
+                next_maintain = t0 + maintain_interval
+            n += 1
+            if rounds and n >= rounds:
+                break
+            ## the rounds keep the same pace, a slow round does not delay the next ones
+            time.sleep(max(0, interval - (time.time() - t0) % interval))
@@ -9,6 +9,7 @@ from pydiskcmdcli.nvme_spec import (
     nvme_error_log_decode,
     nvme_fw_slot_info_decode,
     persistent_event_log_header_decode,
+    persistent_event_log_event_decode,
     persistent_event_log_events_decode,
     self_test_log_decode,
     decode_commands_supported_and_effects,
@@ -42,7 +43,7 @@ def format_print_LBA_Status_Descriptor(raw_data, print_type='normal'):
                 print ("-"*30)
                 print ("Descriptor Starting LBA  : %d" % scsi_ba_to_int(v["DSLBA"], 'little'))
                 print ("Number of Logical Blocks : %d" % scsi_ba_to_int(v["NLB"], 'little'))
-                print ("Status                   : %#x" % scsi_ba_to_int(v["NLB"], 'little'))
+                print ("Status                   : %#x" % scsi_ba_to_int(v["Status"], 'little'))
     elif print_type == 'hex':
         format_dump_bytes(raw_data)
     elif print_type == 'json':
@@ -218,10 +219,20 @@ def format_print_fw_log(raw_data, dev='', print_type='normal'):
     else:
         raise NotImplementedError("Not Support type: %s" % print_type)
 
-def format_print_event_log(raw_data, dev='', print_type='normal', event_filter=[]):
+def _iter_event_log_events(raw_data, event_log_header, events):
+    if events is None:
+        return persistent_event_log_events_decode(raw_data[512:], scsi_ba_to_int(event_log_header.get("TNEV"), 'little')).items()
+    return ((i,persistent_event_log_event_decode(raw_event)) for i,raw_event in enumerate(events))
+
+def format_print_event_log(raw_data, dev='', print_type='normal', event_filter=[], events=None):
+    """
+    raw_data: the log data with header, or only the header if events is given
+    events: an iterable of raw event(event header included), the events are decoded 
+            and printed as they arrive
+    """
     if print_type == 'normal':
         event_log_header = persistent_event_log_header_decode(raw_data[0:512])
-        event_log_events = persistent_event_log_events_decode(raw_data[512:], scsi_ba_to_int(event_log_header.get("TNEV"), 'little'))
+        event_log_events = _iter_event_log_events(raw_data, event_log_header, events)
         print ("Persistent Event Log Header: ")
         for k,v in event_log_header.items():
             if k in ("LogID", "VID", "SSVID"):
@@ -236,10 +247,12 @@ def format_print_event_log(raw_data, dev='', print_type='normal', event_filter=[
                 print ("%-10s: %s" % (k,scsi_ba_to_int(v, 'little')))
         ##
         print ("="*60)
-        if event_log_events:
-            print ("Persistent Event Log Events: ")
-            print ('......................')
-        for k,v in event_log_events.items():
+        events_title = True
+        for k,v in event_log_events:
+            if events_title:
+                print ("Persistent Event Log Events: ")
+                print ('......................')
+                events_title = False
             if event_filter and (scsi_ba_to_int(v['event_log_event_header']['event_type'], 'little') not in event_filter):
                 continue
             print ('Entry[%s]' % k)
@@ -259,7 +272,7 @@ def format_print_event_log(raw_data, dev='', print_type='normal', event_filter=[
         print (raw_data)
     elif print_type == 'json':
         event_log_header = persistent_event_log_header_decode(raw_data[0:512])
-        event_log_events = persistent_event_log_events_decode(raw_data[512:], scsi_ba_to_int(event_log_header.get("TNEV"), 'little'))
+        event_log_events = _iter_event_log_events(raw_data, event_log_header, events)
         ##
         result = {"header": {}, "events": {}}
         for k,v in event_log_header.items():
@@ -271,7 +284,7 @@ def format_print_event_log(raw_data, dev='', print_type='normal', event_filter=[
                 result["header"][k] = v
             else:
                 result["header"][k] = scsi_ba_to_int(v, "")
-        for k,v in event_log_events.items():
+        for k,v in event_log_events:
             if event_filter and (scsi_ba_to_int(v['event_log_event_header']['event_type'], 'little') not in event_filter):
                 continue
             result["events"][k] = {}
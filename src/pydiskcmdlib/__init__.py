@@ -1,16 +1,45 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
-import platform
-os_type = platform.system()
 import sys
+## the same as platform.system(), without importing platform
+if sys.platform == "win32":
+    os_type = "Windows"
+else:
+    ## do not shadow the sub-package pydiskcmdlib.os
+    import os as _os
+    os_type = _os.uname().sysname
+    del _os
 local_byteorder = sys.byteorder
 ##
 from .log import Log
 log = Log("pydiskcmdlib")
 from .__version__ import version_format,version
-from .pyscsi import *
-from .pynvme import *
-from .pysata import *
-from .pypci import *
-from .utils import *
+## The sub-packages are imported when they are used(PEP 562), so importing 
+#  pydiskcmdlib does not load all the command sets.
+_lazy_packages = ("pyscsi", "pynvme", "pysata", "pypci")
+if sys.version_info < (3, 7):
+    from .pyscsi import *
+    from .pynvme import *
+    from .pysata import *
+    from .pypci import *
+    from .utils import *
+else:
+    import importlib
+
+    def __getattr__(name):
+        if name in _lazy_packages or name == "utils":
+            return importlib.import_module("." + name, __name__)
+        ## the names of "from .<package> import *"
+        value = None
+        for package in _lazy_packages:
+            module = importlib.import_module("." + package, __name__)
+            if name in module.__all__:
+                value = importlib.import_module("." + name, module.__name__)
+        if value is None and not name.startswith("_"):
+            module = importlib.import_module(".utils", __name__)
+            value = getattr(module, name, None)
+        if value is None:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        globals()[name] = value
+        return value
@@ -0,0 +1,299 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import re
+import asyncio
+import functools
+import threading
+from asyncio import events
+from concurrent.futures import ThreadPoolExecutor
+from pydiskcmdlib.exceptions import CommandNotSupport
+
+## the default executor is shared by all the devices, so that
+#  one event loop can poll hundreds of drives without one thread per drive.
+DefaultMaxWorkers = 32
+DefaultDeviceLimit = 4
+DefaultControllerLimit = 16
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+def get_default_executor():
+    """
+    get the executor shared by all the async command objects
+
+    :return: a ThreadPoolExecutor
+    """
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=DefaultMaxWorkers)
+    return _default_executor
+
+
+def get_controller_key(dev_path):
+    """
+    get the controller of a device path, the devices in one controller
+    share the controller concurrency limit.
+
+    :param dev_path: the device path, like /dev/nvme0n1, /dev/ng0n1, /dev/sda
+    :return: a string, like nvme0, host1, or the device path if unknown
+    """
+    name = os.path.basename(dev_path)
+    g = re.match(r"^(?:nvme|ng)(\d+)", name)
+    if g:
+        return "nvme%s" % g.group(1)
+    for sys_path in ("/sys/class/scsi_generic/%s/device" % name, "/sys/block/%s/device" % name):
+        if os.path.exists(sys_path):
+            g = re.search(r"/(host\d+)/", os.path.realpath(sys_path))
+            if g:
+                return g.group(1)
+    return dev_path
+
+
+class AsyncEngine(object):
+    """
+    The native asynchronous engine, drive the device asynchronous interface(io_uring, sg
+    write()/read()) by the event loop: the commands are submitted in the loop thread,
+    and the completions are reaped when the device file descriptor is readable.
+    """
+    def __init__(self, device, loop=None):
+        """
+        :param device: a device object with submit() and reap_results()/poll_results()
+        :param loop: the event loop, None means the running loop when the first command is sent
+        """
+        self._device = device
+        self._fd = device.async_fileno
+        if hasattr(device, "reap_results"):
+            self._results = device.reap_results
+        else:
+            self._results = device.poll_results
+        self._loop = loop
+        self._reader_added = False
+        ## id(cmd) -> future
+        self._futures = {}
+
+    @staticmethod
+    def is_supported(device):
+        """
+        check if the device support native asynchronous interface
+
+        :param device: a device object
+        :return: True or False
+        """
+        return getattr(device, "async_fileno", None) is not None
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def _drain(self):
+        for cmd,error in self._results(min_complete=0):
+            fut = self._futures.pop(id(cmd), None)
+            if fut is None or fut.done():
+                continue
+            if error:
+                fut.set_exception(error)
+            else:
+                fut.set_result(cmd)
+        if not self._futures and self._reader_added:
+            self._loop.remove_reader(self._fd)
+            self._reader_added = False
+
+    async def execute(self, cmd, **kwargs):
+        """
+        submit the command and wait for the completion without blocking the loop
+
+        :param cmd: a command object
+        :param kwargs: passthrough to device.submit
+        :return: the command object
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        fut = self._loop.create_future()
+        self._futures[id(cmd)] = fut
+        try:
+            self._device.submit(cmd, **kwargs)
+        except Exception:
+            self._futures.pop(id(cmd), None)
+            raise
+        if not self._reader_added:
+            self._loop.add_reader(self._fd, self._drain)
+            self._reader_added = True
+        ## flush the submission, and pick up the completions reaped by submit()
+        self._drain()
+        return await fut
+
+    def execute_threadsafe(self, cmd, **kwargs):
+        """
+        execute the command from a thread, the command is sent by the event loop thread.
+
+        :param cmd: a command object
+        :param kwargs: passthrough to device.submit
+        :return: the command object
+        """
+        loop = self._loop
+        if loop is None or not loop.is_running() or events._get_running_loop() is loop:
+            ## no loop to send it, or already in the loop thread
+            ret = self._device.execute(cmd, **kwargs)
+            if self._futures and loop is not None:
+                loop.call_soon(self._drain)
+            return ret
+        return asyncio.run_coroutine_threadsafe(self.execute(cmd, **kwargs), loop).result()
+
+
+class _AsyncDeviceProxy(object):
+    """
+    A device proxy used by the synchronous command object, the execute() is sent by the
+    AsyncEngine, the other attributes are passed to the real device.
+    """
+    def __init__(self, device, engine):
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_engine", engine)
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._device, name, value)
+
+    def execute(self, cmd, **kwargs):
+        try:
+            self._engine.execute_threadsafe(cmd, **kwargs)
+        except CommandNotSupport:
+            ## the command can not be sent asynchronously, like nvme reset
+            self._device.execute(cmd, **kwargs)
+        return cmd
+
+
+class AsyncCommandBase(object):
+    """
+    The base class of asyncio front-end, all the public methods of the synchronous
+    command class are mirrored as coroutines, which run in a bounded executor.
+    If the device supports native asynchronous interface, the commands are sent
+    by the AsyncEngine.
+
+    Concurrency is limited by device_limit per device, and controller_limit
+    per controller(shared by all the devices in the same controller).
+    """
+    _sync_class = None
+    ## controller key -> [limit, semaphore]
+    _controller_limits = {}
+    _controller_limits_lock = threading.Lock()
+
+    def __init__(self,
+                 dev,
+                 device_limit=DefaultDeviceLimit,
+                 controller=None,
+                 controller_limit=DefaultControllerLimit,
+                 executor=None,
+                 loop=None,
+                 **kwargs):
+        """
+        :param dev: the device object
+        :param device_limit: the max commands in flight of this device
+        :param controller: the controller key, None means auto detect from device path
+        :param controller_limit: the max commands in flight of the controller
+        :param executor: the executor to run the synchronous methods, None means the shared one
+        :param loop: the event loop
+        :param kwargs: passthrough to the synchronous command class
+        """
+        self._executor = executor or get_default_executor()
+        if AsyncEngine.is_supported(dev):
+            self._engine = AsyncEngine(dev, loop=loop)
+            device_limit = min(device_limit, dev.queue_depth)
+            self._sync = self._sync_class(_AsyncDeviceProxy(dev, self._engine), **kwargs)
+        else:
+            self._engine = None
+            self._sync = self._sync_class(dev, **kwargs)
+        self._device_limit = device_limit
+        self._device_sem = None
+        if controller is None:
+            controller = get_controller_key(getattr(dev, "_file_name", "") or repr(dev))
+        self._controller = controller
+        with AsyncCommandBase._controller_limits_lock:
+            if controller not in AsyncCommandBase._controller_limits:
+                AsyncCommandBase._controller_limits[controller] = [controller_limit, None]
+
+    @classmethod
+    async def open(cls, dev, **kwargs):
+        """
+        create the object in executor, the synchronous class sends commands
+        when initializing, which should not block the event loop.
+
+        :param dev: the device object
+        :param kwargs: passthrough to __init__
+        :return: a instance
+        """
+        loop = asyncio.get_event_loop()
+        kwargs.setdefault("loop", loop)
+        return await loop.run_in_executor(kwargs.get("executor") or get_default_executor(),
+                                          functools.partial(cls, dev, **kwargs))
+
+    @property
+    def sync(self):
+        """
+        the synchronous command object
+        """
+        return self._sync
+
+    @property
+    def device(self):
+        return self._sync.device
+
+    @property
+    def native(self):
+        """
+        if the commands are sent by native asynchronous engine
+        """
+        return self._engine is not None
+
+    @property
+    def controller(self):
+        return self._controller
+
+    def _get_sems(self):
+        if self._device_sem is None:
+            self._device_sem = asyncio.Semaphore(self._device_limit)
+        with AsyncCommandBase._controller_limits_lock:
+            ctrl = AsyncCommandBase._controller_limits[self._controller]
+            if ctrl[1] is None:
+                ctrl[1] = asyncio.Semaphore(ctrl[0])
+        return self._device_sem,ctrl[1]
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        run a synchronous function in executor within the concurrency limit
+        """
+        device_sem,ctrl_sem = self._get_sems()
+        async with ctrl_sem:
+            async with device_sem:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _execute_native(self, cmd, **kwargs):
+        """
+        send a command by the native engine within the concurrency limit
+        """
+        device_sem,ctrl_sem = self._get_sems()
+        async with ctrl_sem:
+            async with device_sem:
+                return await self._engine.execute(cmd, **kwargs)
+
+    def __getattr__(self, name):
+        if name == "_sync":
+            raise AttributeError(name)
+        attr = getattr(self._sync, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+        return method
+
+    def close(self):
+        """
+        close the device
+        """
+        self._sync.device.close()
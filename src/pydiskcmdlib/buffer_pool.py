@@ -0,0 +1,276 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import mmap
+import threading
+from collections import deque
+from itertools import count
+from ctypes import c_char,addressof,memset
+from pydiskcmdlib.exceptions import ParameterIncorrect
+
+## mmap is always page-aligned, so the kernel can map the user pages directly
+#  instead of bounce buffering the multi-MiB transfers.
+PAGE_SIZE = mmap.PAGESIZE
+DefaultMaxCachedBytes = 256 * 1024 * 1024
+## the smaller buffers are cheaper to allocate than to draw from pool,
+#  DataBuffer and SCSI commands only use pool when the length is not less than it.
+DefaultMinLength = 64 * 1024
+
+
+def _get_class_size(length):
+    """
+    get the size class of a length: a power of two, not less than one page.
+
+    :param length: the requested length in bytes
+    :return: the size class in bytes
+    """
+    if length <= PAGE_SIZE:
+        return PAGE_SIZE
+    return 1 << (length - 1).bit_length()
+
+
+class BufferPool(object):
+    """
+    A size-classed, page-aligned buffer pool backed by anonymous mmap.
+
+    A buffer returned by acquire()/acquire_ctypes() holds one block of the pool,
+    the block goes back to the free list when the buffer and all the views of it
+    are released(or garbage collected), and it is reused by the next acquire of
+    the same size class. The free blocks are trimmed in LRU order when they take
+    more than max_cached_bytes.
+
+    Do not keep any view of a released buffer, the memory will be reused.
+    """
+    def __init__(self, max_cached_bytes=DefaultMaxCachedBytes, min_length=DefaultMinLength):
+        """
+        :param max_cached_bytes: the max bytes of the free blocks kept by pool
+        :param min_length: the min buffer length that DataBuffer and SCSI commands draw from pool
+        """
+        self._max_cached_bytes = max_cached_bytes
+        self.min_length = min_length
+        self._lock = threading.Lock()
+        ## (size class, mmap) of the blocks given back by _Block.__del__. It may run
+        #  from gc in a thread that is holding the lock, so it only appends here
+        #  (deque.append is atomic), and the blocks are moved to the free lists
+        #  under the lock by _drain()
+        self._released = deque()
+        ## size class -> [(release sequence, mmap), ...] in release order,
+        #  the last released block is reused first, and the first one is trimmed first
+        self._free = {}
+        self._seq = count()
+        self._cached_bytes = 0
+        ## size class -> block type
+        self._block_types = {}
+        ## statistics
+        self._allocated = 0
+        self._reused = 0
+
+    @property
+    def cached_bytes(self):
+        """
+        the bytes of the free blocks kept by pool
+        """
+        with self._lock:
+            self._drain()
+            return self._cached_bytes
+
+    @property
+    def max_cached_bytes(self):
+        return self._max_cached_bytes
+
+    @max_cached_bytes.setter
+    def max_cached_bytes(self, value):
+        self._max_cached_bytes = value
+        self.trim(value)
+
+    @property
+    def stats(self):
+        """
+        :return: a dict of the pool statistics
+        """
+        with self._lock:
+            self._drain()
+            return {"allocated": self._allocated,
+                    "reused": self._reused,
+                    "free_blocks": sum(len(i) for i in self._free.values()),
+                    "cached_bytes": self._cached_bytes,}
+
+    def _get_block_type(self, size):
+        block_type = self._block_types.get(size)
+        if block_type is None:
+            pool = self
+            class _Block(c_char * size):
+                __slots__ = ("_mm",)
+                def __del__(self):
+                    ## the last view of the block is gone, give it back, never lock here
+                    pool._released.append((size, self._mm))
+            block_type = self._block_types[size] = _Block
+        return block_type
+
+    def _get(self, length, zero):
+        size = _get_class_size(length)
+        mm = None
+        with self._lock:
+            self._drain()
+            free = self._free.get(size)
+            if free:
+                mm = free.pop()[1]
+                self._cached_bytes -= size
+                self._reused += 1
+            else:
+                self._allocated += 1
+        if mm is None:
+            mm = mmap.mmap(-1, size)
+            zero = False    # anonymous mapping is zero filled
+        block = self._get_block_type(size).from_buffer(mm)
+        block._mm = mm
+        if zero:
+            memset(addressof(block), 0, length)
+        return block
+
+    def _drain(self):
+        """
+        move the released blocks to the free lists, the lock should be held
+        """
+        released = self._released
+        while released:
+            size,mm = released.popleft()
+            if size > self._max_cached_bytes:
+                continue
+            free = self._free.get(size)
+            if free is None:
+                free = self._free[size] = []
+            free.append((next(self._seq), mm))
+            self._cached_bytes += size
+        if self._cached_bytes > self._max_cached_bytes:
+            self._trim(self._max_cached_bytes)
+
+    def acquire(self, length, zero=True):
+        """
+        get a buffer from pool
+
+        :param length: the length of buffer in bytes
+        :param zero: fill the buffer with 0 if it is reused
+        :return: a writable memoryview(format 'B') of length bytes
+        """
+        return memoryview(self._get(length, zero)).cast('B')[:length]
+
+    def acquire_ctypes(self, length, zero=True):
+        """
+        get a ctypes buffer from pool, which is the same type with
+        ctypes.create_string_buffer(length)
+
+        :param length: the length of buffer in bytes
+        :param zero: fill the buffer with 0 if it is reused
+        :return: a ctypes array of c_char
+        """
+        return (c_char * length).from_buffer(self._get(length, zero))
+
+    @staticmethod
+    def release(buf):
+        """
+        release a memoryview returned by acquire(). The block goes back to pool once
+        no other view of it exists. The ctypes buffer is released by dropping the
+        reference of it.
+
+        :param buf: a memoryview returned by acquire()
+        """
+        try:
+            buf.release()
+        except (AttributeError, BufferError):
+            pass
+
+    def trim(self, max_bytes=0):
+        """
+        free the least recently released blocks
+
+        :param max_bytes: the max bytes of the free blocks kept after trimming
+        :return: the bytes freed
+        """
+        with self._lock:
+            self._drain()
+            return self._trim(max_bytes)
+
+    def _trim(self, max_bytes):
+        freed = 0
+        while self._cached_bytes > max_bytes:
+            ## the least recently released block is the head of one list
+            size = min((free[0][0],size) for size,free in self._free.items() if free)[1]
+            mm = self._free[size].pop(0)[1]
+            self._cached_bytes -= size
+            freed += size
+            try:
+                mm.close()
+            except BufferError:
+                ## still exported by the dying block, gc will free it
+                pass
+        return freed
+
+
+_default_pool = None
+
+def get_default_pool():
+    """
+    get the default pool used by DataBuffer and SCSI commands
+
+    :return: a BufferPool, or None if pool is not enabled
+    """
+    return _default_pool
+
+
+def set_default_pool(pool=True):
+    """
+    enable or disable the default pool. With it, every DataBuffer(NVMe command data) and
+    every SCSI/SATA command datain not less than pool.min_length draws from the pool,
+    instead of allocating a new buffer for each command.
+
+    Note the pooled SCSI datain is a memoryview rather than a bytearray.
+
+    :param pool: a BufferPool, True means a new BufferPool, None or False to disable
+    :return: the default pool
+    """
+    global _default_pool
+    from pyscsi.pyscsi.scsi_command import SCSICommand
+    if pool is True:
+        pool = BufferPool()
+    elif not pool:
+        pool = None
+    _default_pool = pool
+    if pool is None:
+        SCSICommand.datain_allocator = None
+    else:
+        def datain_allocator(length):
+            if length < pool.min_length:
+                return bytearray(length)
+            return pool.acquire(length)
+        SCSICommand.datain_allocator = staticmethod(datain_allocator)
+    return pool
+
+
+def new_command_with_buffer(cmd_class, buffer, *args, **kwargs):
+    """
+    create a SCSI command(or ATA pass through command) whose datain/dataout is
+    the caller supplied buffer, instead of a new bytearray. The device DMA straight
+    into or out of it.
+
+    :param cmd_class: a subclass of SCSICommand
+    :param buffer: a writable buffer(bytearray, mmap, memoryview), not smaller than the transfer length
+    :param args: passthrough to cmd_class
+    :param kwargs: passthrough to cmd_class
+    :return: the command, datain/dataout is a memoryview of buffer
+    """
+    view = memoryview(buffer).cast('B')
+    if view.readonly:
+        raise ParameterIncorrect("Need a writable buffer")
+    def allocator(length):
+        if length > len(view):
+            raise ParameterIncorrect("The buffer is too small, need %d bytes but got %d bytes" % (length, len(view)))
+        return view[0:length]
+    cmd = cmd_class.__new__(cmd_class)
+    ## the instance attribute overrides the class hook in SCSICommand.__init__
+    cmd.datain_allocator = allocator
+    cmd.dataout_allocator = allocator
+    cmd.__init__(*args, **kwargs)
+    del cmd.datain_allocator
+    del cmd.dataout_allocator
+    return cmd
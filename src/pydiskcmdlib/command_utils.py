@@ -6,13 +6,15 @@ from typing import Optional
 from abc import ABCMeta, abstractmethod
 from pydiskcmdlib import os_type
 from pydiskcmdlib.data_buffer import DataBuffer
-from pydiskcmdlib.utils.converter import encode_dict,decode_bits,CheckDict,scsi_int_to_ba,scsi_ba_to_int,ba_to_ascii_string
-from pydiskcmdlib.device.win_device import BytesReturnedStruc
+from pydiskcmdlib.utils.converter import encode_dict,decode_bits,CheckDict
+from pydiskcmdlib.utils.converter import get_codec,CheckDictTypeError
 from pydiskcmdlib.exceptions import *
-from pydiskcmdlib.os.win_ioctl_structures import (
+from ctypes import (
     Structure,
     sizeof,
 )
+if os_type == "Windows":
+    from pydiskcmdlib.device.win_device import BytesReturnedStruc
 
 
 class BitStrucInfo():
@@ -384,48 +386,10 @@ def encode_dict_pro(data_dict,
     :param check_dict: a dict mapping field-names to notation tuples.
     :param result: a buffer containing the bits encoded
     """
-    for key in data_dict.keys():
-        if key not in check_dict:
-            continue
-        value = data_dict[key]
-        if value is None:
-            continue
-
-        val = check_dict[key]
-        if isinstance(value, dict) and isinstance(val, dict):
-            encode_dict_pro(value, val, result, byteorder=byteorder)
-        elif isinstance(value, dict) or isinstance(val, dict):
-            raise CommandDataStrucError("The data_dict of %s is dict, but the check_dict is not dict" % key)
-        else:
-            if len(val) == 2:
-                bitmask, bytepos = val
-
-                _num = 1
-                _bm = bitmask
-                while _bm > 0xff:
-                    _bm >>= 8
-                    _num += 1
-
-                _bm = bitmask
-                while not _bm & 0x01:
-                    _bm >>= 1
-                    value <<= 1
-
-                v = scsi_int_to_ba(value, _num, byteorder=byteorder)
-                for i in range(len(v)):
-                    result[bytepos + i] ^= v[i]
-            elif val[0] == 'b' and val[2] > 0:
-                offset, length = val[1:]
-                fixed_length = min(length, len(value))
-                if isinstance(value, str):
-                    value = value.encode()
-                result[offset:offset + fixed_length] = value[0:fixed_length]
-            elif val[0] == 'w' and val[2] > 0:
-                offset, length = val[1:]
-                result[offset:offset + length * 2] = value
-            elif val[0] == 'dw' and val[2] > 0:
-                offset, length = val[1:]
-                result[offset:offset + length * 4] = value
+    try:
+        get_codec(check_dict, byteorder).encode(data_dict, result)
+    except CheckDictTypeError as e:
+        raise CommandDataStrucError(str(e))
 
 def decode_bits_pro(data,
                     check_dict,
@@ -444,62 +408,7 @@ def decode_bits_pro(data,
     :param check_dict: a dict mapping field-names to notation tuples.
     :param result_dict: a dict mapping field-names to notation tuples.
     """
-    for key in check_dict.keys():
-        # Notation format:
-        #
-        # If the length is 2 we have the legacy notation [bitmask, offset]
-        # Example: 'sync': [0x10, 7],
-        #
-        # >2-tuples is the new style of notation.
-        # These tuples always consist of at least three elements, where the
-        # first element is a string that describes the type of value.
-        #
-        # 'b': Byte array blobs
-        # ----------------
-        # ('b', offset, length)
-        # Example: 't10_vendor_identification': ('b', 8, 8),
-        #
-
-        val = check_dict[key]
-        if isinstance(val, dict):
-            result_dict[key] = {}
-            decode_bits_pro(data, val, result_dict[key], byteorder=byteorder)
-        else:
-            if len(val) == 2:
-                bitmask, byte_pos = val
-                _num = 1
-                _bm = bitmask
-                while _bm > 0xff:
-                    _bm >>= 8
-                    _num += 1
-                value = scsi_ba_to_int(data[byte_pos:byte_pos + _num],byteorder=byteorder)
-                while not bitmask & 0x01:
-                    bitmask >>= 1
-                    value >>= 1
-                value &= bitmask
-            elif val[0] == 'b':
-                offset, length = val[1:3]
-                value = data[offset:offset + length]
-            elif val[0] == 'bb':
-                bit_offset, bit_length = val[1:3]
-                if isinstance(data, bytes):
-                    _tmp = scsi_ba_to_int(data, 'little')
-                value = (_tmp >> bit_offset) & (2**bit_length-1)
-            elif val[0] == 'w':
-                offset, length = val[1:3]
-                value = data[offset:offset + length * 2]
-            elif val[0] == 'dw':
-                offset, length = val[1:3]
-                value = data[offset:offset + length * 4]
-            ##
-            if len(val) > 3:
-                if val[3] == 'int_l':
-                    value = scsi_ba_to_int(value, 'little')
-                elif val[3] == 'int_b':
-                    value = scsi_ba_to_int(value, 'big')
-                elif val[3] == 'str_ascii':
-                    value = ba_to_ascii_string(value)
-            result_dict.update({key: value})
+    get_codec(check_dict, byteorder).decode(data, result_dict)
 
 
 class CommandWrapperPro(CommandWrapper):
@@ -1,22 +1,75 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
-from ctypes import create_string_buffer,addressof,c_uint64
+from ctypes import create_string_buffer,addressof,c_uint64,c_char
 from pydiskcmdlib.utils.converter import scsi_int_to_ba
+from pydiskcmdlib.buffer_pool import get_default_pool
+from pydiskcmdlib.exceptions import ParameterIncorrect
 
 class DataBuffer(object):
-    def __init__(self, length):
+    def __init__(self, length, pool=None):
         """
         Initializes a new instance of the Format class.
 
         Parameters:
             length (int): The length of the data buffer to be created.
+            pool (BufferPool): The pool to draw the data buffer from(if length >= pool.min_length), None means
+                               the default pool(pydiskcmdlib.buffer_pool.set_default_pool), if it is enabled.
         """
         self.__len = length
         ## init
-        self._data_buf = create_string_buffer(length)
+        if pool is None:
+            pool = get_default_pool()
+        if pool is not None and length >= pool.min_length and length > 0:
+            self._data_buf = pool.acquire_ctypes(length)
+        else:
+            self._data_buf = create_string_buffer(length)
         # self.addr = c_uint64(addressof(self._data_buf))
 
+    @classmethod
+    def from_buffer(cls, buffer, length=None):
+        """
+        Create a DataBuffer over a caller supplied writable buffer, no data is copied,
+        the command DMA straight into or out of it.
+
+        Parameters:
+            buffer: A writable buffer, like bytearray, mmap, memoryview or ctypes array.
+            length (int): The length of the data buffer, None means the whole buffer.
+
+        Returns:
+            DataBuffer: The data buffer which shares the memory with buffer.
+        """
+        view = memoryview(buffer).cast('B')
+        if view.readonly:
+            raise ParameterIncorrect("Need a writable buffer")
+        if length is None:
+            length = len(view)
+        elif length > len(view):
+            raise ParameterIncorrect("The buffer is too small, need %d bytes but got %d bytes" % (length, len(view)))
+        data_buffer = cls(0)
+        data_buffer.__len = length
+        if length > 0:
+            data_buffer._data_buf = (c_char * length).from_buffer(view)
+        return data_buffer
+
+    @property
+    def view(self):
+        """
+        Get a memoryview(format 'B') of the data buffer, without copying the data.
+
+        Returns:
+            memoryview: The memoryview of the data buffer.
+        """
+        return memoryview(self._data_buf).cast('B')
+
+    def release(self):
+        """
+        Release the data buffer, a pooled buffer goes back to the pool.
+        The data buffer should not be used after release.
+        """
+        self._data_buf = None
+        self.__len = 0
+
     @property
     def data_buffer(self):
         """ 
@@ -68,7 +121,14 @@ class DataBuffer(object):
         Returns:
             None
         """
-        self._data_buf.value = bytes(value)
+        try:
+            value = memoryview(value).cast('B')
+        except TypeError:
+            value = bytes(value)
+        if len(value) > self.__len:
+            raise ValueError("byte string too long")
+        ## copy once into the buffer
+        memoryview(self._data_buf).cast('B')[0:len(value)] = value
 
     def get_data_buffer(self):
         """
@@ -1,21 +1,153 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
+import os
 from pydiskcmdlib.device.device import DeviceBase
 from pyscsi.pyscsi import scsi_device
 from pyscsi.pyscsi.scsi_device import SCSIDevice,get_inode
 from pydiskcmdlib import log
+from pydiskcmdlib.trace import DEBUG,HexBytes
+from pydiskcmdlib.sgio.linux import AsyncSGIO,is_sg_device
+from pydiskcmdlib.sgio.errors import CheckConditionError
+from pydiskcmdlib.sgio.constants import SG_MAX_QUEUE
+
+
+class _LinSGIOAsyncMixin(object):
+    """
+    The submit/poll API of LinSGIODevice, commands are queued by the asynchronous 
+    sg v3 write()/read() interface if the device is a scsi generic device(/dev/sgX), 
+    or executed synchronously by SG_IO for the others(like /dev/sdX).
+    """
+    def _init_async(self, queue_depth):
+        self._queue_depth = queue_depth
+        ## None means not initialized, False means not supported
+        self._async = None
+        ## completed, but not polled
+        self._completed = []
+
+    @property
+    def queue_depth(self):
+        engine = self._get_async()
+        return engine.queue_depth if engine else 1
+
+    @property
+    def inflight(self):
+        return (self._async.inflight if self._async else 0) + len(self._completed)
+
+    def _get_async(self):
+        if self._async is None:
+            self._async = False
+            if is_sg_device(self._file_name):
+                try:
+                    self._async = AsyncSGIO(self._file_name, queue_depth=self._queue_depth)
+                except OSError as e:
+                    log.debug("SGIO: asynchronous interface is not available for %s: %s" % (self._file_name, e))
+        return self._async
+
+    def _close_async(self):
+        if self._async:
+            self._async.close()
+        self._async = None
+
+    @property
+    def async_fileno(self):
+        """
+        the file descriptor of asynchronous interface, it is readable when there are 
+        completions to poll. None if the asynchronous interface is not supported.
+        """
+        engine = self._get_async()
+        return engine.fileno() if engine else None
+
+    def _complete(self, completions):
+        for (cmd,en_raw_sense),resid,sense,e in completions:
+            error = None
+            if e is not None:
+                try:
+                    if isinstance(e, CheckConditionError):
+                        self.CheckCondition(e.sense)
+                    else:
+                        raise e
+                except Exception as ex:
+                    error = ex
+            if en_raw_sense:
+                cmd.raw_sense_data = sense
+            self._completed.append((cmd, error))
+
+    def submit(self, cmd, en_raw_sense=False):
+        """
+        submit a scsi command without waiting for the completion, the command 
+        should not be changed until it is polled.
+
+        :param cmd: a SCSICommand
+        :param en_raw_sense: save the raw sense data to cmd.raw_sense_data
+        :return: a SCSICommand
+        """
+        engine = self._get_async()
+        if not engine:
+            self.execute(cmd, en_raw_sense=en_raw_sense)
+            self._completed.append((cmd, None))
+            return cmd
+        if engine.inflight == 0 and self._detect_replugged and self._is_replugged():
+            try:
+                self.close()
+            finally:
+                self.open()
+            engine = self._get_async()
+        if log.isEnabledFor(DEBUG):
+            log.debug("Submitting SCSi Command: %s", HexBytes(cmd.cdb))
+        while engine.inflight >= engine.queue_depth:
+            self._complete(engine.receive(min_complete=1))
+        engine.submit(cmd.cdb, cmd.dataout, cmd.datain, usr_obj=(cmd,en_raw_sense))
+        return cmd
+
+    def poll_results(self, min_complete=1, timeout=None):
+        """
+        poll the completed commands
+
+        :param min_complete: wait at least min_complete commands to complete
+        :param timeout: the max time(milliseconds) to wait, None means no limit
+        :return: a list of (cmd, error), error is None or the exception execute() would raise
+        """
+        if self._async:
+            self._complete(self._async.receive(min_complete=max(0, min_complete-len(self._completed)),
+                                               timeout=timeout))
+        done = self._completed
+        self._completed = []
+        return done
+
+    def poll(self, min_complete=1, timeout=None):
+        """
+        poll the completed commands. If a command fails, its error is raised, and 
+        the other completed commands are kept for the next poll().
+
+        :param min_complete: wait at least min_complete commands to complete
+        :param timeout: the max time(milliseconds) to wait, None means no limit
+        :return: a list of completed SCSICommand
+        """
+        done = self.poll_results(min_complete=min_complete, timeout=timeout)
+        for i,(_,error) in enumerate(done):
+            if error:
+                self._completed = done[:i] + done[i+1:]
+                raise error
+        return [cmd for cmd,_ in done]
+
+    def close(self):
+        self._close_async()
+        super(_LinSGIOAsyncMixin, self).close()
+
+
 # cython-sgio is not the only choise, if it is not installed,
 # and then python-sgio will be imported(locate in pydiskcmdlib)
 # The Source Code is from https://github.com/goodes/python-sgio
 # Thanks to the author: goodes
 if scsi_device._has_sgio:
-    class LinSGIODevice(SCSIDevice):
+    class LinSGIODevice(_LinSGIOAsyncMixin, SCSIDevice):
         """
         The scsi SGIO device class for Linux.
         See pyscsi.pyscsi.scsi_device for more detail.
         """
-        def __init__(self, *args, **kwargs):
+        def __init__(self, *args, queue_depth=SG_MAX_QUEUE, **kwargs):
+            self._init_async(queue_depth)
             SCSIDevice.__init__(self, *args, **kwargs)
 
         @property
@@ -29,7 +161,7 @@ else:
     except ImportError as e:
         scsi_device._has_sgio = False
     ##
-    class LinSGIODevice(SCSIDevice):
+    class LinSGIODevice(_LinSGIOAsyncMixin, SCSIDevice):
         """
         The scsi SGIO device class for Linux.
         See pyscsi.pyscsi.scsi_device for more detail.
@@ -37,10 +169,11 @@ else:
         If cython-sgio is not installed, the local sgio will be imported:
         Import the sgio from cython-sgio OR python-sgio
         """
-        def __init__(self, *args, **kwargs):
+        def __init__(self, *args, queue_depth=SG_MAX_QUEUE, **kwargs):
             log.debug("Opening SCSi device %s, read write flag is %s, detect replugged is %s" % (args[0], 
                                                                                                  kwargs.get("readwrite"), 
                                                                                                  kwargs.get("detect_replugged")))
+            self._init_async(queue_depth)
             SCSIDevice.__init__(self, *args, **kwargs)
 
         @property
@@ -58,7 +191,8 @@ else:
                     self.close()
                 finally:
                     self.open()
-            log.debug("Sending SCSi Command: %s" % " ".join(["%X" % i for i in cmd.cdb]))
+            if log.isEnabledFor(DEBUG):
+                log.debug("Sending SCSi Command: %s", HexBytes(cmd.cdb))
             try:
                 result = sgio.execute(self._file, cmd.cdb, cmd.dataout, cmd.datain, return_sense_buffer=en_raw_sense)
             except sgio.CheckConditionError as error:
@@ -74,7 +208,8 @@ else:
                     resid,cmd.raw_sense_data = result
                 else:
                     resid = result
-            log.debug("Sense Data: %s" % (" ".join(["%X" % i for i in cmd.raw_sense_data]) if cmd.raw_sense_data else 'NA'))
+            if log.isEnabledFor(DEBUG):
+                log.debug("Sense Data: %s", HexBytes(cmd.raw_sense_data))
             return resid
 
 
@@ -169,3 +304,137 @@ class LinIOCTLDevice(DeviceBase):
                              op, 
                              cdb if cdb else 0)
         return result
+
+
+class LinIOUringDevice(LinIOCTLDevice):
+    """
+    The io_uring device class for Linux, commands are sent by IORING_OP_URING_CMD.
+    A basic workflow for using a device would be:
+        - try to open the device passed by the device arg, and setup the io_uring;
+        - submit() the commands, up to queue_depth commands can be in flight;
+        - reap() the completions, wait at least min_complete commands to complete;
+        - close the device after all the commands.
+    """
+    def __init__(self, 
+                 device,
+                 readwrite=True,
+                 detect_replugged=True,
+                 queue_depth=32):
+        """
+        initialize a new instance of a LinIOUringDevice
+        :param device: the file descriptor
+        :param readwrite: access type
+        :param detect_replugged: detects device unplugged and plugged events and ensure executions will not fail
+        silently due to replugged events
+        :param queue_depth: the submission queue depth of io_uring
+        """
+        from pydiskcmdlib.os.lin_io_uring import IOUring
+        self._ring = IOUring(queue_depth)
+        ## tag -> in-flight object, keep the reference(and the buffers) alive
+        self._inflight = {}
+        ## tag -> (object, res, result), completed but not reaped
+        self._done = {}
+        self._next_tag = 1
+        super(LinIOUringDevice, self).__init__(device, readwrite, detect_replugged)
+
+    @property
+    def queue_depth(self):
+        return self._ring.entries
+
+    @property
+    def async_fileno(self):
+        """
+        the io_uring file descriptor, it is readable when there are completions to reap
+        """
+        return self._ring.fd
+
+    @property
+    def inflight(self):
+        """
+        the number of commands submitted but not reaped
+        """
+        return len(self._inflight) + len(self._done)
+
+    def close(self):
+        """
+        close the device if the device is opened, the in-flight commands will be dropped.
+
+        :return: None
+        """
+        if getattr(self, "_inflight", None):
+            self._ring.submit(wait_nr=len(self._inflight))
+            self._complete(self._ring.reap())
+            self._inflight.clear()
+        LinIOCTLDevice.close(self)
+
+    def _complete(self, completions):
+        for tag,res,result in completions:
+            if tag in self._inflight:
+                self._done[tag] = (self._inflight.pop(tag), res, result)
+
+    def _wait(self, wait_nr):
+        self._ring.submit(wait_nr=wait_nr)
+        self._complete(self._ring.reap())
+
+    def submit(self, op: int, cdb, obj=None):
+        """
+        submit a command without waiting for the completion
+
+        :param op: the uring command operation code, NVME_URING_CMD_IO or NVME_URING_CMD_ADMIN
+        :param cdb: the command structure(like CmdStructure), or bytes-like object
+        :param obj: the object returned by reap() when the command completes
+        :return: the tag of the command
+        """
+        if self._detect_replugged and not self._inflight and self._is_replugged():
+            try:
+                self.close()
+            finally:
+                self.open()
+        ## the queue is full, make room for it
+        while len(self._inflight) >= self._ring.entries:
+            self._wait(1)
+        tag = self._next_tag
+        self._next_tag = ((self._next_tag + 1) & 0xFFFFFFFFFFFFFFFF) or 1
+        while not self._ring.prep_uring_cmd(self._file.fileno(), op, cdb, tag):
+            self._ring.submit()
+        self._inflight[tag] = obj
+        return tag
+
+    def reap(self, min_complete=1):
+        """
+        flush the submitted commands to kernel and reap the completed ones
+
+        :param min_complete: wait at least min_complete commands to complete
+        :return: a list of (obj, res, result), res is the return value(same as ioctl), 
+                 and result is the command specific result(cq dword 0)
+        """
+        min_complete = min(min_complete, len(self._inflight) + len(self._done))
+        self._wait(0)
+        while len(self._done) < min_complete:
+            self._wait(min_complete - len(self._done))
+        done = list(self._done.values())
+        self._done.clear()
+        return done
+
+    def execute(self, op: int, cdb):
+        """
+        execute a command (admin, IO) and wait for the completion, 
+        the other in-flight commands are left to reap().
+
+        :param op: the uring command operation code
+        :param cdb: the command structure(like CmdStructure), or bytes-like object
+        :return: a tuple of (res, result)
+        """
+        ## not self.submit(), the subclasses override it with their own signature
+        tag = LinIOUringDevice.submit(self, op, cdb, obj=cdb)
+        while tag not in self._done:
+            self._wait(1)
+        _,res,result = self._done.pop(tag)
+        if res < 0:
+            raise OSError(-res, os.strerror(-res))
+        return res,result
+
+    def __del__(self):
+        self.close()
+        if getattr(self, "_ring", None):
+            self._ring.close()
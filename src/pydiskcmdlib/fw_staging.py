@@ -0,0 +1,219 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import mmap
+import time
+from pydiskcmdlib.trace import clock_ns
+from pydiskcmdlib.exceptions import ParameterIncorrect
+
+## The firmware staging engine of NVMe(Firmware Image Download) and ATA
+#  (DOWNLOAD MICROCODE). The image is memory-mapped, every chunk is copied
+#  once into a single page-aligned buffer and sent from it, with the largest
+#  chunk the device allows.
+DefaultMaxChunk = 1024 * 1024
+## NVMe FWUG is in 4KiB units, 0h means no information(align to 4KiB)
+NVMeFWUGUnit = 4096
+## ATA DOWNLOAD MICROCODE block, and the block count limit of 16-bit count field
+ATABlockSize = 512
+ATAMaxBlocks = 0xFFFF
+## used if IDENTIFY DEVICE does not report the maximum segment(word 235)
+ATADefaultBlocks = 0x200
+
+
+class FirmwareImage(object):
+    """
+    A read-only memory map of a firmware image file.
+    """
+    def __init__(self, fw_path):
+        self._file = open(fw_path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size == 0:
+            self._file.close()
+            raise ParameterIncorrect("Empty firmware file: %s" % fw_path)
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def copy_into(self, buffer, offset, length):
+        """
+        copy the image data into buffer, the bytes beyond the image are filled with 0
+
+        :param buffer: a writable memoryview(format 'B')
+        :param offset: the offset of image in bytes
+        :param length: the bytes to copy
+        """
+        n = max(0, min(length, self.size - offset))
+        if n > 0:
+            with memoryview(self._mm) as image_view:
+                buffer[0:n] = image_view[offset:offset+n]
+        if n < length:
+            buffer[n:length] = bytes(length - n)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            self._file.close()
+
+
+def get_nvme_fw_chunk_size(ctrl_identify_info, max_chunk=DefaultMaxChunk):
+    """
+    get the largest chunk of Firmware Image Download by FWUG and MDTS
+
+    :param ctrl_identify_info: the identify controller data
+    :param max_chunk: the upper limit in bytes
+    :return: (chunk size, granularity) in bytes
+    """
+    from pydiskcmdlib.pynvme.nvme import get_max_xfer_len
+    fwug = ctrl_identify_info[319]
+    if fwug == 0xFF:
+        ## no restriction, the data shall be dword aligned
+        granularity = 4
+    elif fwug == 0:
+        granularity = NVMeFWUGUnit
+    else:
+        granularity = fwug * NVMeFWUGUnit
+    limit = max_chunk
+    mdts_bytes = get_max_xfer_len(ctrl_identify_info)
+    if mdts_bytes:
+        limit = min(limit, mdts_bytes)
+    chunk = limit - (limit % granularity)
+    return max(chunk, granularity),granularity
+
+
+def get_ata_fw_chunk_size(identify, max_chunk=DefaultMaxChunk):
+    """
+    get the largest segment of DOWNLOAD MICROCODE(mode 03h/0Eh) by IDENTIFY DEVICE
+    word 234(minimum blocks) and word 235(maximum blocks)
+
+    :param identify: the identify device data
+    :param max_chunk: the upper limit in bytes, 0 means DefaultMaxChunk
+    :return: (chunk size, granularity) in bytes
+    """
+    min_blocks = identify[468] + (identify[469] << 8)
+    max_blocks = identify[470] + (identify[471] << 8)
+    if min_blocks in (0, 0xFFFF):
+        min_blocks = 1
+    if max_blocks in (0, 0xFFFF):
+        max_blocks = ATADefaultBlocks
+    ## word 235 may allow 32MiB in one command, more than most HBAs and SG_IO accept
+    max_blocks = min(max_blocks, ATAMaxBlocks, int((max_chunk or DefaultMaxChunk) / ATABlockSize))
+    blocks = max(max_blocks - (max_blocks % min_blocks), min_blocks)
+    return blocks * ATABlockSize,min_blocks * ATABlockSize
+
+
+def _release_buffer(obj):
+    ## a failed send may still export the buffer(like the command in the traceback),
+    #  then it is freed with the command, do not hide the error of send
+    try:
+        if isinstance(obj, memoryview):
+            obj.release()
+        else:
+            obj.close()
+    except BufferError:
+        pass
+
+
+def stage_image(fw_path, chunk_size, send, alignment=4, start=0, progress=None):
+    """
+    send the firmware image chunk by chunk
+
+    :param fw_path: the firmware file path
+    :param chunk_size: the chunk size in bytes
+    :param send: a function send(chunk, offset), chunk is a memoryview of the staging buffer,
+                 offset is in bytes, it should raise an exception if failed
+    :param alignment: the image is padded with 0 to a multiple of it
+    :param start: the offset in bytes to start from
+    :param progress: a function called after every chunk, progress(done_bytes, total_bytes, latency_ns)
+    :return: a dict of "bytes", "chunks", "chunk_size", "seconds", "throughput"(bytes/s),
+             "latency_ns"(a list, per chunk), "min_latency_ns", "avg_latency_ns" and "max_latency_ns"
+    """
+    if chunk_size <= 0 or chunk_size % alignment:
+        raise ParameterIncorrect("chunk size should be a multiple of %d" % alignment)
+    latency = []
+    t0 = time.perf_counter()
+    with FirmwareImage(fw_path) as image:
+        total = image.size + ((alignment - image.size % alignment) % alignment)
+        if start >= total:
+            raise ParameterIncorrect("offset %d is beyond the firmware image" % start)
+        ## the anonymous map is page aligned
+        buf = mmap.mmap(-1, min(chunk_size, total - start))
+        view = memoryview(buf)
+        try:
+            offset = start
+            while offset < total:
+                length = min(chunk_size, total - offset)
+                chunk = view[0:length]
+                try:
+                    image.copy_into(chunk, offset, length)
+                    t = clock_ns()
+                    send(chunk, offset)
+                    latency.append(clock_ns() - t)
+                finally:
+                    _release_buffer(chunk)
+                offset += length
+                if progress:
+                    progress(offset - start, total - start, latency[-1])
+        finally:
+            _release_buffer(view)
+            _release_buffer(buf)
+    seconds = time.perf_counter() - t0
+    return {"bytes": total - start,
+            "chunks": len(latency),
+            "chunk_size": chunk_size,
+            "seconds": seconds,
+            "throughput": (total - start) / seconds if seconds > 0 else 0,
+            "latency_ns": latency,
+            "min_latency_ns": min(latency),
+            "avg_latency_ns": int(sum(latency) / len(latency)),
+            "max_latency_ns": max(latency),}
+
+
+def stage_nvme_fw(nvme, fw_path, offset=0, xfer=0, progress=None):
+    """
+    download a firmware image to a NVMe controller
+
+    :param nvme: a NVMe object
+    :param fw_path: the firmware file path
+    :param offset: the offset to start from in dwords
+    :param xfer: the chunk size in bytes, 0 means the largest by FWUG and MDTS
+    :param progress: see stage_image
+    :return: see stage_image
+    """
+    from pydiskcmdlib.data_buffer import DataBuffer
+    chunk_size,granularity = get_nvme_fw_chunk_size(nvme.ctrl_identify_info, max_chunk=xfer or DefaultMaxChunk)
+    def send(chunk, offset_b):
+        cmd = nvme.nvme_fw_download(None, int(offset_b / 4), data_buffer=DataBuffer.from_buffer(chunk))
+        cmd.check_return_status(raise_if_fail=True)
+    return stage_image(fw_path, chunk_size, send, alignment=4, start=offset * 4, progress=progress)
+
+
+def stage_ata_fw(sata, fw_path, feature=0x03, xfer=0, progress=None):
+    """
+    download a firmware image to an ATA device by DOWNLOAD MICROCODE, with mode 03h or 0Eh
+
+    :param sata: a SATA object
+    :param fw_path: the firmware file path
+    :param feature: the subcommand, 0x03(download with offsets and save) or 0x0E(download with offsets and defer)
+    :param xfer: the chunk size in bytes, 0 means the largest by IDENTIFY DEVICE(up to DefaultMaxChunk)
+    :param progress: see stage_image
+    :return: see stage_image
+    """
+    from pydiskcmdlib.exceptions import CommandReturnStatusError,SenseDataCheckErr
+    if feature not in (0x03, 0x0E):
+        raise ParameterIncorrect("Only subcommand 0x03 and 0x0E download with offsets")
+    chunk_size,granularity = get_ata_fw_chunk_size(sata.identify_raw, max_chunk=xfer or DefaultMaxChunk)
+    def send(chunk, offset_b):
+        cmd = sata.download_microcode(feature, int(offset_b / ATABlockSize), int(len(chunk) / ATABlockSize), chunk)
+        return_descriptor = cmd.ata_status_return_descriptor
+        if return_descriptor:
+            if return_descriptor.get("error") != 0:
+                raise CommandReturnStatusError("offset %d, error: %s, status: %s" % (offset_b, return_descriptor.get("error"), return_descriptor.get("status")))
+        elif cmd.ata_sense_data_condition:
+            raise SenseDataCheckErr("offset %d, %s" % (offset_b, cmd.ata_sense_data_condition._describe_ascq()))
+    return stage_image(fw_path, chunk_size, send, alignment=ATABlockSize, progress=progress)
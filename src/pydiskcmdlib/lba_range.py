@@ -0,0 +1,41 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+## The LBA ranges of TRIM(ATA DATA SET MANAGEMENT, NVMe Dataset Management)
+#  and the others, a range is a tuple of (start lba, number of logical blocks).
+
+
+def coalesce_ranges(ranges):
+    """
+    sort the ranges and merge the overlapped or adjacent ones
+
+    :param ranges: an iterable of (slba, nlb), nlb is the number of logical blocks(1's based)
+    :return: a list of (slba, nlb)
+    """
+    merged = []
+    for slba,nlb in sorted(ranges):
+        if nlb <= 0:
+            continue
+        if merged and slba <= merged[-1][0] + merged[-1][1]:
+            last_slba,last_nlb = merged[-1]
+            merged[-1] = (last_slba, max(last_nlb, slba + nlb - last_slba))
+        else:
+            merged.append((slba, nlb))
+    return merged
+
+
+def split_ranges(ranges, max_range_length):
+    """
+    split the ranges longer than max_range_length
+
+    :param ranges: an iterable of (slba, nlb)
+    :param max_range_length: the max logical blocks of a range
+    :return: a generator of (slba, nlb)
+    """
+    for slba,nlb in ranges:
+        while nlb > 0:
+            n = min(nlb, max_range_length)
+            yield slba,n
+            slba += n
+            nlb -= n
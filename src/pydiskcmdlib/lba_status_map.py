@@ -0,0 +1,350 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+import struct
+from array import array
+from bisect import bisect_right
+from pydiskcmdlib.data_buffer import DataBuffer
+from pydiskcmdlib.exceptions import ParameterIncorrect,CommandNotSupport
+
+## The LBA status map is a run-length map of the LBA space: a run starts at
+#  starts[i], ends at starts[i+1](or the end of the map), and all the LBAs of
+#  the run are in states[i]. Only the state changes take memory, a namespace
+#  with a few unrecoverable ranges is a few runs, whatever its capacity.
+#
+#  The states:
+#    Mapped/Deallocated/Anchored   the provisioning status of SCSI GET LBA STATUS
+#    Unrecoverable                 the potentially unrecoverable LBAs of NVMe Get LBA Status
+#    Checked                       examined by NVMe Get LBA Status, not reported unrecoverable
+#    Unknown                       not examined, or the device does not know
+LBAStateMapped = 0
+LBAStateDeallocated = 1
+LBAStateAnchored = 2
+LBAStateUnrecoverable = 3
+LBAStateChecked = 4
+LBAStateUnknown = 0xFF
+LBAStateNames = {LBAStateMapped: "Mapped",
+                 LBAStateDeallocated: "Deallocated",
+                 LBAStateAnchored: "Anchored",
+                 LBAStateUnrecoverable: "Unrecoverable",
+                 LBAStateChecked: "Checked",
+                 LBAStateUnknown: "Unknown",
+                 }
+
+## The serialized map, little endian:
+#    bytes 0-3   magic "LBSM"
+#    bytes 4-5   version
+#    bytes 6-7   reserved
+#    bytes 8-15  total LBAs
+#    bytes 16-23 number of runs(N)
+#    then N 8 bytes run starts, and N 1 byte run states
+_header_struct = struct.Struct("<4sHHQQ")
+_magic = b"LBSM"
+_version = 1
+
+## NVMe Get LBA Status
+#  Action Type
+NVMeATypeUntracked = 0x10
+NVMeATypeTracked = 0x11
+#  the LBA Status Descriptor List is a 8 bytes header and 16 bytes descriptors
+NVMeLBAStatusBufferSize = 4096
+NVMeMaxRangeLength = 0xFFFF
+_nvme_header_struct = struct.Struct("<IB")
+_nvme_descriptor_struct = struct.Struct("<QI")
+
+## SCSI GET LBA STATUS provisioning status
+_scsi_p_status = {0: LBAStateMapped,        # mapped or unknown
+                  1: LBAStateDeallocated,
+                  2: LBAStateAnchored,
+                  3: LBAStateMapped,        # mapped or unknown, with additional status
+                  4: LBAStateUnknown,
+                  }
+
+
+def _to_le(a):
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+class LBAStatusMap(object):
+    """
+    A run-length map of the LBA states, backed by two arrays.
+
+    Usage:
+        m = LBAStatusMap(total_lbas)
+        m.set_range(0, 8, LBAStateUnrecoverable)
+        for slba,nlb in m.ranges_of(LBAStateUnrecoverable):
+            ...
+    """
+    def __init__(self, total_lbas, state=LBAStateUnknown):
+        """
+        :param total_lbas: the number of LBAs of the map
+        :param state: the initial state of all the LBAs
+        """
+        if total_lbas <= 0:
+            raise ParameterIncorrect("Empty LBA map")
+        self.total_lbas = total_lbas
+        self.starts = array('Q', [0])
+        self.states = array('B', [state])
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __eq__(self, other):
+        return (isinstance(other, LBAStatusMap) and self.total_lbas == other.total_lbas and
+                self.starts == other.starts and self.states == other.states)
+
+    def _run_end(self, i):
+        return self.starts[i+1] if i + 1 < len(self.starts) else self.total_lbas
+
+    def state_at(self, lba):
+        """
+        :param lba: the lba
+        :return: the state of the lba
+        """
+        if not (0 <= lba < self.total_lbas):
+            raise ParameterIncorrect("LBA %d is out of the map(%d LBAs)" % (lba, self.total_lbas))
+        return self.states[bisect_right(self.starts, lba) - 1]
+
+    def set_range(self, slba, nlb, state):
+        """
+        set the state of a LBA range, the part beyond the map is ignored
+
+        :param slba: the first lba
+        :param nlb: the number of LBAs
+        :param state: the state(0-255)
+        """
+        end = min(slba + nlb, self.total_lbas)
+        slba = max(slba, 0)
+        if slba >= end:
+            return
+        ## the runs first..last are replaced
+        first = bisect_right(self.starts, slba) - 1
+        last = bisect_right(self.starts, end - 1) - 1
+        tail_state = self.states[last]
+        new_starts,new_states = [],[]
+        if self.starts[first] < slba:
+            new_starts.append(self.starts[first])
+            new_states.append(self.states[first])
+        new_starts.append(slba)
+        new_states.append(state)
+        if end < self._run_end(last):
+            new_starts.append(end)
+            new_states.append(tail_state)
+        ## merge with the neighbours in the same state
+        lo,hi = first,last + 1
+        if lo > 0 and self.states[lo-1] == new_states[0]:
+            lo -= 1
+            new_starts[0] = self.starts[lo]
+        if hi < len(self.starts) and self.states[hi] == new_states[-1]:
+            hi += 1
+        merged_starts,merged_states = [],[]
+        for s,v in zip(new_starts, new_states):
+            if merged_states and merged_states[-1] == v:
+                continue
+            merged_starts.append(s)
+            merged_states.append(v)
+        self.starts[lo:hi] = array('Q', merged_starts)
+        self.states[lo:hi] = array('B', merged_states)
+
+    def iter_runs(self, slba=0, nlb=0):
+        """
+        :param slba: the first lba
+        :param nlb: the number of LBAs, 0 means to the end of the map
+        :return: a generator of (slba, nlb, state), clipped to the range
+        """
+        end = self.total_lbas if nlb <= 0 else min(slba + nlb, self.total_lbas)
+        if slba >= end:
+            return
+        i = bisect_right(self.starts, slba) - 1
+        while i < len(self.starts) and self.starts[i] < end:
+            start = max(self.starts[i], slba)
+            yield start,min(self._run_end(i), end) - start,self.states[i]
+            i += 1
+
+    def ranges_of(self, state):
+        """
+        :param state: the state
+        :return: a generator of (slba, nlb) in the state
+        """
+        for i,v in enumerate(self.states):
+            if v == state:
+                yield self.starts[i],self._run_end(i) - self.starts[i]
+
+    def summary(self):
+        """
+        :return: a dict of state: (number of LBAs, number of ranges)
+        """
+        result = {}
+        for _,nlb,state in self.iter_runs():
+            lbas,ranges = result.get(state, (0, 0))
+            result[state] = (lbas + nlb, ranges + 1)
+        return result
+
+    def to_bytes(self):
+        """
+        :return: the serialized map
+        """
+        return (_header_struct.pack(_magic, _version, 0, self.total_lbas, len(self.starts)) +
+                _to_le(self.starts) + self.states.tobytes())
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        :param data: the serialized map
+        :return: a LBAStatusMap
+        """
+        data = memoryview(data).cast('B')
+        if len(data) < _header_struct.size:
+            raise ParameterIncorrect("LBA status map is too short")
+        magic,version,_,total_lbas,runs = _header_struct.unpack_from(data)
+        if magic != _magic or version != _version:
+            raise ParameterIncorrect("Not a LBA status map(version %d)" % _version)
+        offset = _header_struct.size
+        if runs == 0 or len(data) < offset + runs * 9:
+            raise ParameterIncorrect("LBA status map is truncated")
+        m = cls(total_lbas)
+        m.starts = array('Q')
+        m.starts.frombytes(data[offset:offset+runs*8].tobytes())
+        if sys.byteorder != "little":
+            m.starts.byteswap()
+        m.states = array('B', data[offset+runs*8:offset+runs*9])
+        if m.starts[0] != 0 or any(m.starts[i] >= m.starts[i+1] for i in range(runs - 1)) or m.starts[-1] >= total_lbas:
+            raise ParameterIncorrect("LBA status map is corrupted")
+        return m
+
+    def to_dict(self):
+        """
+        :return: a dict, for json
+        """
+        return {"total_lbas": self.total_lbas,
+                "runs": [{"slba": slba, "nlb": nlb, "state": LBAStateNames.get(state, state)} for slba,nlb,state in self.iter_runs()],
+                }
+
+
+def _check_walk_range(total_lbas, slba, nlb):
+    end = total_lbas if nlb <= 0 else slba + nlb
+    if not (0 <= slba < end <= total_lbas):
+        raise ParameterIncorrect("LBA range %d-%d is beyond the device(%d blocks)" % (slba, end - 1, total_lbas))
+    return end
+
+
+def walk_nvme_lba_status(nvme,
+                         ns_id,
+                         atype=NVMeATypeUntracked,
+                         slba=0,
+                         nlb=0,
+                         rl=NVMeMaxRangeLength,
+                         timeout=60000,
+                         progress=None):
+    """
+    walk a namespace with Get LBA Status, the potentially unrecoverable LBAs are Unrecoverable,
+    the others examined are Checked.
+
+    :param nvme: a NVMe object
+    :param ns_id: the namespace id
+    :param atype: the Action Type, 0x10 untracked LBAs(the controller scans), 0x11 tracked LBAs
+    :param slba: the first lba to walk
+    :param nlb: the number of LBAs to walk, 0 means to the end of the namespace
+    :param rl: the Range Length of a command, 1-65535
+    :param timeout: the timeout of a command, in milliseconds
+    :param progress: a callable(done, total) after every command
+    :return: a LBAStatusMap of the namespace
+    """
+    if not (nvme.ctrl_identify_info[257] & 0x02):
+        raise CommandNotSupport("Get LBA Status is not supported(OACS bit 9)")
+    total_lbas = nvme.ns_format(ns_id)["nsze"]
+    end = _check_walk_range(total_lbas, slba, nlb)
+    rl = max(1, min(rl, NVMeMaxRangeLength))
+    m = LBAStatusMap(total_lbas)
+    buf = DataBuffer(NVMeLBAStatusBufferSize)
+    mndw = NVMeLBAStatusBufferSize // 4 - 1
+    max_descriptors = (NVMeLBAStatusBufferSize - 8) // 16
+    lba = slba
+    try:
+        while lba < end:
+            length = min(rl, end - lba)
+            cmd = nvme.get_lba_status(ns_id, lba, mndw, atype, length, timeout=timeout, data_buffer=buf)
+            cmd.check_return_status(False, raise_if_fail=True)
+            data = cmd.data_view
+            nlsd,cmpc = _nvme_header_struct.unpack_from(data)
+            nlsd = min(nlsd, max_descriptors)
+            ## CMPC 1h: the whole range is examined, 2h: the list is full,
+            #  the range is examined to the last descriptor
+            if cmpc == 2 and nlsd:
+                dslba,dnlb = _nvme_descriptor_struct.unpack_from(data, 8 + (nlsd - 1) * 16)
+                examined = min(max(dslba + dnlb, lba + 1), lba + length)
+            else:
+                examined = lba + length
+            m.set_range(lba, examined - lba, LBAStateChecked)
+            for i in range(nlsd):
+                dslba,dnlb = _nvme_descriptor_struct.unpack_from(data, 8 + i * 16)
+                m.set_range(dslba, dnlb, LBAStateUnrecoverable)
+            lba = examined
+            if progress:
+                progress(lba - slba, end - slba)
+    finally:
+        buf.release()
+    return m
+
+
+def walk_scsi_lba_status(scsi, slba=0, nlb=0, alloclen=16384, progress=None):
+    """
+    walk a logical unit with GET LBA STATUS, the LBAs get their provisioning status.
+
+    :param scsi: a SCSI object
+    :param slba: the first lba to walk
+    :param nlb: the number of LBAs to walk, 0 means to the end of the logical unit
+    :param alloclen: the allocation length of a command
+    :param progress: a callable(done, total) after every command
+    :return: a LBAStatusMap of the logical unit
+    """
+    r = scsi.readcapacity16().result
+    if not r["lbpme"]:
+        raise CommandNotSupport("The logical unit is fully provisioned")
+    total_lbas = r["returned_lba"] + 1
+    end = _check_walk_range(total_lbas, slba, nlb)
+    m = LBAStatusMap(total_lbas)
+    lba = slba
+    while lba < end:
+        cmd = scsi.getlbastatus(lba, alloclen=alloclen)
+        next_lba = lba
+        for desc in cmd.result["lbas"]:
+            m.set_range(desc["lba"], min(desc["num_blocks"], end - desc["lba"]),
+                        _scsi_p_status.get(desc["p_status"], LBAStateUnknown))
+            next_lba = max(next_lba, desc["lba"] + desc["num_blocks"])
+        ## the device reports nothing more
+        if next_lba <= lba:
+            break
+        lba = next_lba
+        if progress:
+            progress(min(lba, end) - slba, end - slba)
+    return m
+
+
+def format_lba_status_map(m, state=None, max_ranges=64):
+    """
+    :param m: a LBAStatusMap
+    :param state: print the ranges in this state, None means Unrecoverable and Deallocated
+    :param max_ranges: the max ranges to print of a state
+    :return: a list of lines
+    """
+    lines = ["Total LBAs: %d, %d runs(%d bytes serialized)" % (m.total_lbas, len(m), len(m.starts) * 9 + _header_struct.size)]
+    summary = m.summary()
+    for k in sorted(summary.keys()):
+        lbas,ranges = summary[k]
+        lines.append("  %-14s: %d LBAs(%.2f%%) in %d ranges" % (LBAStateNames.get(k, k), lbas, lbas * 100 / m.total_lbas, ranges))
+    for k in ((state,) if state is not None else (LBAStateUnrecoverable, LBAStateDeallocated)):
+        if k not in summary:
+            continue
+        lines.append("")
+        lines.append("%s ranges:" % LBAStateNames.get(k, k))
+        for i,(slba,nlb) in enumerate(m.ranges_of(k)):
+            if i >= max_ranges:
+                lines.append("  ... %d more" % (summary[k][1] - max_ranges))
+                break
+            lines.append("  LBA:%d-%d" % (slba, slba + nlb - 1))
+    return lines
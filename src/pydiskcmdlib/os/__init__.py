@@ -1,3 +1,15 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
+## the structures of the other OS are loaded only when they are used
+from pydiskcmdlib.utils.lazy_import import os_specific_getattr
+__getattr__ = os_specific_getattr(__name__, {
+    "lin_ioctl": "Linux",
+    "lin_ioctl_request": "Linux",
+    "lin_utils": "Linux",
+    "lin_io_uring": "Linux",
+    "win_ioctl_request": "Windows",
+    "win_ioctl_structures": "Windows",
+    "win_ioctl_utils": "Windows",
+    "win_utils": "Windows",
+})
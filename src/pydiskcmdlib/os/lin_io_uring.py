@@ -0,0 +1,313 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+#
+######################################
+# A minimal io_uring engine, used to send NVMe passthrough commands
+# (IORING_OP_URING_CMD) to the nvme generic char devices(/dev/ngXnY)
+# and the controller char devices(/dev/nvmeX).
+#
+# code is from include/uapi/linux/io_uring.h and include/uapi/linux/nvme_ioctl.h
+######################################
+import os
+import mmap
+import ctypes
+import struct
+from pydiskcmdlib.os.lin_ioctl import _IOWR
+
+## syscall numbers, the same in all the architectures(except alpha)
+NR_io_uring_setup = 425
+NR_io_uring_enter = 426
+## io_uring_setup flags
+IORING_SETUP_SQE128 = (1 << 10)
+IORING_SETUP_CQE32 = (1 << 11)
+## io_uring_params->features
+IORING_FEAT_SINGLE_MMAP = (1 << 0)
+## io_uring_enter flags
+IORING_ENTER_GETEVENTS = (1 << 0)
+## mmap offsets
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+## opcodes
+IORING_OP_NOP = 0
+IORING_OP_URING_CMD = 46
+##
+SQE128_SIZE = 128
+CQE32_SIZE = 32
+SQE_CMD_OFFSET = 48   # offset of sqe->cmd[] in the submission queue entry
+SQE_CMD_SIZE = 80     # 16 bytes in sqe + 64 bytes with IORING_SETUP_SQE128
+
+
+class NVMeUringCmd(ctypes.LittleEndianStructure):
+    '''
+    struct nvme_uring_cmd, the same layout as struct nvme_passthru_cmd,
+    except the last dword(result) is reserved.
+    '''
+    _fields_ = [
+        ("opcode", ctypes.c_uint8),
+        ("flags", ctypes.c_uint8),
+        ("rsvd1", ctypes.c_uint16),
+        ("nsid", ctypes.c_uint32),
+        ("cdw2", ctypes.c_uint32),
+        ("cdw3", ctypes.c_uint32),
+        ("metadata", ctypes.c_uint64),
+        ("addr", ctypes.c_uint64),
+        ("metadata_len", ctypes.c_uint32),
+        ("data_len", ctypes.c_uint32),
+        ("cdw10", ctypes.c_uint32),
+        ("cdw11", ctypes.c_uint32),
+        ("cdw12", ctypes.c_uint32),
+        ("cdw13", ctypes.c_uint32),
+        ("cdw14", ctypes.c_uint32),
+        ("cdw15", ctypes.c_uint32),
+        ("timeout_ms", ctypes.c_uint32),
+        ("rsvd2", ctypes.c_uint32),
+    ]
+    _pack_ = 1
+
+NVME_URING_CMD_IO = _IOWR('N', 0x80, NVMeUringCmd)
+NVME_URING_CMD_IO_VEC = _IOWR('N', 0x81, NVMeUringCmd)
+NVME_URING_CMD_ADMIN = _IOWR('N', 0x82, NVMeUringCmd)
+NVME_URING_CMD_ADMIN_VEC = _IOWR('N', 0x83, NVMeUringCmd)
+
+
+class IOSQRingOffsets(ctypes.Structure):
+    _fields_ = [
+        ("head", ctypes.c_uint32),
+        ("tail", ctypes.c_uint32),
+        ("ring_mask", ctypes.c_uint32),
+        ("ring_entries", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("dropped", ctypes.c_uint32),
+        ("array", ctypes.c_uint32),
+        ("resv1", ctypes.c_uint32),
+        ("user_addr", ctypes.c_uint64),
+    ]
+
+
+class IOCQRingOffsets(ctypes.Structure):
+    _fields_ = [
+        ("head", ctypes.c_uint32),
+        ("tail", ctypes.c_uint32),
+        ("ring_mask", ctypes.c_uint32),
+        ("ring_entries", ctypes.c_uint32),
+        ("overflow", ctypes.c_uint32),
+        ("cqes", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("resv1", ctypes.c_uint32),
+        ("user_addr", ctypes.c_uint64),
+    ]
+
+
+class IOUringParams(ctypes.Structure):
+    _fields_ = [
+        ("sq_entries", ctypes.c_uint32),
+        ("cq_entries", ctypes.c_uint32),
+        ("flags", ctypes.c_uint32),
+        ("sq_thread_cpu", ctypes.c_uint32),
+        ("sq_thread_idle", ctypes.c_uint32),
+        ("features", ctypes.c_uint32),
+        ("wq_fd", ctypes.c_uint32),
+        ("resv", ctypes.c_uint32 * 3),
+        ("sq_off", IOSQRingOffsets),
+        ("cq_off", IOCQRingOffsets),
+    ]
+
+# user_data(u64), opcode(u8), flags(u8), ioprio(u16), fd(s32), cmd_op(u32)
+_sqe_head = struct.Struct("<BBHiI")
+_sqe_user_data = struct.Struct("<Q")
+# user_data(u64), res(s32), flags(u32), big_cqe[0](u64)
+_cqe = struct.Struct("<QiIQ")
+_u32 = struct.Struct("<I")
+
+_libc = None
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(None, use_errno=True)
+        _libc.syscall.restype = ctypes.c_long
+    return _libc
+
+
+class IOUring(object):
+    '''
+    An io_uring instance with 128-byte SQEs and 32-byte CQEs, which is
+    required by IORING_OP_URING_CMD with NVMe passthrough.
+
+    A basic workflow:
+        - prep_uring_cmd() for every command, it returns False if SQ is full;
+        - submit() to notify the kernel, optionally wait some completions;
+        - reap() to get the completed (user_data, res, result) tuples.
+    '''
+    def __init__(self, entries=32):
+        """
+        :param entries: the submission queue depth
+        """
+        self.__entries = entries
+        self._fd = -1
+        self._sq_ring = None
+        self._cq_ring = None
+        self._sqes = None
+        ##
+        params = IOUringParams()
+        params.flags = IORING_SETUP_SQE128 | IORING_SETUP_CQE32
+        fd = _get_libc().syscall(NR_io_uring_setup, ctypes.c_uint(entries), ctypes.byref(params))
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "io_uring_setup: %s" % os.strerror(err))
+        self._fd = fd
+        ## map the rings
+        sq_off,cq_off = params.sq_off,params.cq_off
+        sq_ring_size = sq_off.array + params.sq_entries * 4
+        cq_ring_size = cq_off.cqes + params.cq_entries * CQE32_SIZE
+        try:
+            if params.features & IORING_FEAT_SINGLE_MMAP:
+                sq_ring_size = cq_ring_size = max(sq_ring_size, cq_ring_size)
+                self._sq_ring = self._mmap(sq_ring_size, IORING_OFF_SQ_RING)
+                self._cq_ring = self._sq_ring
+            else:
+                self._sq_ring = self._mmap(sq_ring_size, IORING_OFF_SQ_RING)
+                self._cq_ring = self._mmap(cq_ring_size, IORING_OFF_CQ_RING)
+            self._sqes = self._mmap(params.sq_entries * SQE128_SIZE, IORING_OFF_SQES)
+        except Exception:
+            self.close()
+            raise
+        ## ring layout
+        self._sq_head = sq_off.head
+        self._sq_tail = sq_off.tail
+        self._sq_mask = _u32.unpack_from(self._sq_ring, sq_off.ring_mask)[0]
+        self._sq_array = sq_off.array
+        self._sq_entries = params.sq_entries
+        self._cq_head = cq_off.head
+        self._cq_tail = cq_off.tail
+        self._cq_mask = _u32.unpack_from(self._cq_ring, cq_off.ring_mask)[0]
+        self._cqes = cq_off.cqes
+        ## local copy of sq tail, and the number of sqes not yet submitted
+        self._local_tail = _u32.unpack_from(self._sq_ring, self._sq_tail)[0]
+        self._to_submit = 0
+
+    def _mmap(self, length, offset):
+        return mmap.mmap(self._fd,
+                         length,
+                         flags=mmap.MAP_SHARED | getattr(mmap, "MAP_POPULATE", 0),
+                         prot=mmap.PROT_READ | mmap.PROT_WRITE,
+                         offset=offset)
+
+    @property
+    def fd(self):
+        return self._fd
+
+    @property
+    def entries(self):
+        return self._sq_entries
+
+    @property
+    def sq_space_left(self):
+        head = _u32.unpack_from(self._sq_ring, self._sq_head)[0]
+        return self._sq_entries - ((self._local_tail - head) & 0xFFFFFFFF)
+
+    def _get_sqe_index(self):
+        if self.sq_space_left <= 0:
+            return None
+        index = self._local_tail & self._sq_mask
+        ## clear the sqe before use
+        offset = index * SQE128_SIZE
+        self._sqes[offset:offset+SQE128_SIZE] = bytes(SQE128_SIZE)
+        return index
+
+    def _commit_sqe(self, index):
+        _u32.pack_into(self._sq_ring, self._sq_array + (self._local_tail & self._sq_mask) * 4, index)
+        self._local_tail = (self._local_tail + 1) & 0xFFFFFFFF
+        self._to_submit += 1
+
+    def prep_nop(self, user_data):
+        index = self._get_sqe_index()
+        if index is None:
+            return False
+        offset = index * SQE128_SIZE
+        _sqe_head.pack_into(self._sqes, offset, IORING_OP_NOP, 0, 0, -1, 0)
+        _sqe_user_data.pack_into(self._sqes, offset + 32, user_data)
+        self._commit_sqe(index)
+        return True
+
+    def prep_uring_cmd(self, fd, cmd_op, cmd, user_data):
+        '''
+        :param fd: the file descriptor of the nvme char device
+        :param cmd_op: NVME_URING_CMD_IO or NVME_URING_CMD_ADMIN
+        :param cmd: struct nvme_uring_cmd, a ctypes structure(like CmdStructure) or bytes-like object
+        :param user_data: a 64-bit integer to match the completion
+
+        :return: False if the submission queue is full
+        '''
+        if isinstance(cmd, (ctypes.Structure, ctypes.Union, ctypes.Array)):
+            cmd = ctypes.string_at(ctypes.addressof(cmd), ctypes.sizeof(cmd))
+        else:
+            cmd = bytes(cmd)
+        if len(cmd) > SQE_CMD_SIZE:
+            raise ValueError("uring command is %d bytes, more than %d" % (len(cmd), SQE_CMD_SIZE))
+        index = self._get_sqe_index()
+        if index is None:
+            return False
+        offset = index * SQE128_SIZE
+        _sqe_head.pack_into(self._sqes, offset, IORING_OP_URING_CMD, 0, 0, fd, cmd_op)
+        _sqe_user_data.pack_into(self._sqes, offset + 32, user_data)
+        self._sqes[offset+SQE_CMD_OFFSET:offset+SQE_CMD_OFFSET+len(cmd)] = cmd
+        self._commit_sqe(index)
+        return True
+
+    def submit(self, wait_nr=0):
+        '''
+        Publish the prepared sqes and notify the kernel.
+
+        :param wait_nr: the minimum number of completions to wait for
+        :return: the number of sqes consumed by the kernel
+        '''
+        ## make the new tail visible to the kernel
+        _u32.pack_into(self._sq_ring, self._sq_tail, self._local_tail)
+        to_submit = self._to_submit
+        flags = IORING_ENTER_GETEVENTS if wait_nr > 0 else 0
+        if to_submit == 0 and wait_nr == 0:
+            return 0
+        ret = _get_libc().syscall(NR_io_uring_enter,
+                                  ctypes.c_int(self._fd),
+                                  ctypes.c_uint(to_submit),
+                                  ctypes.c_uint(wait_nr),
+                                  ctypes.c_uint(flags),
+                                  None,
+                                  ctypes.c_size_t(0))
+        if ret < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "io_uring_enter: %s" % os.strerror(err))
+        self._to_submit -= min(ret, to_submit)
+        return ret
+
+    def reap(self, max_nr=0):
+        '''
+        Reap all(or at most max_nr) the completions in the completion queue.
+
+        :return: a list of (user_data, res, result), result is the big_cqe[0].
+        '''
+        head = _u32.unpack_from(self._cq_ring, self._cq_head)[0]
+        tail = _u32.unpack_from(self._cq_ring, self._cq_tail)[0]
+        completions = []
+        while head != tail:
+            user_data,res,_,result = _cqe.unpack_from(self._cq_ring, self._cqes + (head & self._cq_mask) * CQE32_SIZE)
+            completions.append((user_data, res, result))
+            head = (head + 1) & 0xFFFFFFFF
+            if max_nr and len(completions) >= max_nr:
+                break
+        _u32.pack_into(self._cq_ring, self._cq_head, head)
+        return completions
+
+    def close(self):
+        for ring in (self._sqes, self._cq_ring, self._sq_ring):
+            if ring is not None and not ring.closed:
+                ring.close()
+        self._sqes = self._cq_ring = self._sq_ring = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
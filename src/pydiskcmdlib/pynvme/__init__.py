@@ -8,3 +8,10 @@ __all__ = [
     "nvme_device",
     "nvme_command",
 ]
+
+## the structures of the other OS are loaded only when they are used
+from pydiskcmdlib.utils.lazy_import import os_specific_getattr
+__getattr__ = os_specific_getattr(__name__, {
+    "linux_nvme_command": "Linux",
+    "win_nvme_command": "Windows",
+})
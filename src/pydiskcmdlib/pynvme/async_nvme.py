@@ -0,0 +1,64 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from pydiskcmdlib.async_cmd import AsyncCommandBase
+from pydiskcmdlib.pynvme.nvme import NVMe
+from pydiskcmdlib.pynvme.cdb_identify import IDCtrl,IDNS
+from pydiskcmdlib.pynvme.cdb_get_log_page import SmartLog
+from pydiskcmdlib.pynvme.cdb_nvme_read import Read
+from pydiskcmdlib.pynvme.cdb_nvme_verify import Verify
+from pydiskcmdlib.pynvme.cdb_nvme_write import Write
+
+
+class AsyncNVMe(AsyncCommandBase):
+    """
+    The asyncio front-end of NVMe, all the NVMe methods can be awaited, like:
+        nvme = await AsyncNVMe.open(init_device("/dev/ng0n1", backend='io_uring'))
+        cmd = await nvme.smart_log()
+    See pydiskcmdlib.async_cmd.AsyncCommandBase for more detail.
+    """
+    _sync_class = NVMe
+
+    async def execute(self, cmd, check_return_status=False):
+        """
+        send a nvme command
+
+        :param cmd: a nvme CmdStructure object
+        :return: CommandDecoder type
+        """
+        if self._engine:
+            await self._execute_native(cmd)
+            if check_return_status:
+                cmd.check_return_status()
+            return cmd
+        return await self._run(self._sync.execute, cmd, check_return_status=check_return_status)
+
+    async def id_ctrl(self, uuid=0):
+        return await self.execute(IDCtrl(uuid=uuid))
+
+    async def id_ns(self, ns_id=1, uuid=0):
+        return await self.execute(IDNS(ns_id, uuid=uuid))
+
+    async def smart_log(self):
+        return await self.execute(SmartLog())
+
+    async def ns_format(self, ns_id):
+        """
+        get the format of a namespace, see NVMe.ns_format, only the first call sends Identify Namespace
+        """
+        ns_format = self._sync.ns_format(ns_id, cached_only=True)
+        if ns_format is None:
+            ns_format = await self._run(self._sync.ns_format, ns_id)
+        return ns_format
+
+    async def read(self, ns_id, slba, nlba, **kwargs):
+        data_len,metadata_len = NVMe._get_format_xfer_len(await self.ns_format(ns_id), nlba)
+        return await self.execute(Read(ns_id, slba, nlba, data_len=data_len, metadata_len=metadata_len, **kwargs))
+
+    async def verify(self, ns_id, slba, nlba):
+        return await self.execute(Verify(ns_id, slba, nlba))
+
+    async def write(self, ns_id, slba, nlba, raw_data, raw_metadata, fua=0, prinfo=0):
+        data_len,metadata_len = NVMe._get_format_xfer_len(await self.ns_format(ns_id), nlba)
+        return await self.execute(Write(ns_id, slba, nlba, raw_data=raw_data, raw_metadata=raw_metadata, fua=fua, prinfo=prinfo,
+                                        data_len=data_len, metadata_len=metadata_len if raw_metadata else 0))
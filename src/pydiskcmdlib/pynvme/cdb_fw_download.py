@@ -56,14 +56,23 @@ class FWImageDownload(NVMeCommand):
 
     def __init__(self, 
                  data, 
-                 offset):
+                 offset,
+                 data_buffer=None):
+        """
+        :param data: the firmware data, None if data_buffer is given
+        :param offset: the offset in dwords
+        :param data_buffer: a DataBuffer holding the firmware data, it is sent without copy
+        """
         super(FWImageDownload, self).__init__()
         #
-        data_len = len(data)
+        data_len = data_buffer.data_length if data_buffer is not None else len(data)
         if (data_len % 4):
             raise BuildNVMeCommandError("data length should be dword aligned")
-        dataout_buffer = self.init_data_buffer(data_length=data_len)
-        dataout_buffer.data_buffer = data
+        if data_buffer is not None:
+            dataout_buffer = self.init_data_buffer(data_buffer=data_buffer)
+        else:
+            dataout_buffer = self.init_data_buffer(data_length=data_len)
+            dataout_buffer.data_buffer = data
         if os_type == "Linux":
             self.build_command(opcode=CmdOPCode,
                                addr=dataout_buffer.addr,
@@ -75,5 +84,5 @@ class FWImageDownload(NVMeCommand):
             self.build_command(ControlCode=FWImageDownload.win_nvme_command.IOCTL_SCSI_MINIPORT_FIRMWARE,
                                Function=FWImageDownload.win_nvme_command.FIRMWARE_FUNCTION.DOWNLOAD.value,
                                fdOffset=offset,
-                               fdBufferSize=len(data),
+                               fdBufferSize=data_len,
                                )
@@ -14,6 +14,8 @@ class CNSValue(Enum):
     ActiveNamespaceID                = 0x02
     NamespaceIdentificationDescriptor= 0x03
     NVMSetList                       = 0x04
+    IOCommandSetSpecificNamespace    = 0x05
+    IOCommandSetSpecificController   = 0x06
     AllocatedNamespaceID             = 0x10
     IdentifyNamespaceOfAllocated     = 0x11
     AttachedControllerList           = 0x12
@@ -41,6 +43,7 @@ class Identify(NVMeCommand):
                      "cntid": [0xFFFF, 42],
                      #"cdw11":[0xFFFFFFFF, 44],
                      "nvmsetid": [0xFFFF, 44],
+                     "csi": [0xFF, 47],
                      "cdw12":[0xFFFFFFFF, 48],
                      "cdw13":[0xFFFFFFFF, 52],
                      #"cdw14":[0xFFFFFFFF, 56],
@@ -76,6 +79,7 @@ class Identify(NVMeCommand):
                  uuid,
                  data_length=4096,
                  data_buffer=None,
+                 csi=0,
                  timeout=CommandTimeout.admin.value,
                  ):
         '''
@@ -96,6 +100,7 @@ class Identify(NVMeCommand):
                                cns=cns,
                                cntid=cntid,
                                nvmsetid=nvmsetid,
+                               csi=csi,
                                uuid=uuid,
                                timeout_ms=timeout)
         elif os_type == "Windows":
@@ -191,3 +196,16 @@ class UUIDList(Identify):
                           0,  # uuid
                           data_length=4096,
                           )
+
+
+class IDCtrlCSI(Identify):
+    def __init__(self, csi=0, uuid=0):
+        Identify.__init__(self,
+                          0,  # nsid
+                          CNSValue.IOCommandSetSpecificController.value,  # cns
+                          0,  # cntid
+                          0,  # nvmsetid
+                          uuid,  # uuid
+                          data_length=4096,
+                          csi=csi,
+                          )
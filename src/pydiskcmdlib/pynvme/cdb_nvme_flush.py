@@ -46,18 +46,13 @@ class Flush(NVMeCommand):
             self.build_command()
 
 
-from pydiskcmdlib.pyscsi.scsi_cdb_synchronizecache import SynchronizeCache16
-from pyscsi.pyscsi.scsi_enum_command import sbc
-#####
-SCSICmdOPCode = sbc.SYNCHRONIZE_CACHE_16
-#####
-class SCSI2NVMeFlush(SynchronizeCache16):
-    def __init__(self,
-                 nsid,   # ignored by command
-                 timeout=CommandTimeout.nvm.value, # ignored by command
-                 ):
-        SynchronizeCache16.__init__(self,
-                                    SCSICmdOPCode,
-                                    0,   # start fronm lba 0
-                                    0,   # all lbas that start form lba 0
-                                    )
+## SCSI2NVMeFlush is moved to scsi2nvme, which loads the SCSI command set
+import sys
+if sys.version_info < (3, 7):
+    from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMeFlush
+else:
+    def __getattr__(name):
+        if name in ("SCSI2NVMeFlush", "SCSICmdOPCode"):
+            from pydiskcmdlib.pynvme import scsi2nvme
+            return getattr(scsi2nvme, name)
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
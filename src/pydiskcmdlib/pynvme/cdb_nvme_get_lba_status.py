@@ -41,17 +41,24 @@ class GetLBAStatus(NVMeCommand):
                  mndw,
                  atype,
                  rl,
+                 data_buffer=None,
                  timeout=CommandTimeout.admin.value,
                  ):
         super(GetLBAStatus, self).__init__()
         if os_type == "Linux":
+            ## the LBA Status Descriptor List, mndw is 0's based
+            data_buffer = self.init_data_buffer(data_length=(mndw + 1) * 4, data_buffer=data_buffer)
+            ##
             self.build_command(opcode=CmdOPCode,
                                nsid=nsid,
+                               addr=data_buffer.addr,
+                               data_len=data_buffer.data_length,
                                slbal=(slba & 0xFFFFFFFF),
                                slbau=((slba >> 32) & 0xFFFFFFFF),
                                mndw=mndw,
                                rl=rl,
                                atype=atype,
+                               data_buffer=data_buffer,
                                timeout_ms=timeout)
         elif os_type == "Windows":
             self.build_command()
@@ -62,11 +62,13 @@ class Write(NVMeCommand):
                  lbat=0,
                  lbatm=0,
                  timeout=CommandTimeout.nvm.value,
+                 data_len=0,     ## the data buffer length, raw_data shorter than it is padded with 0
+                 metadata_len=0, ## the metadata buffer length, raw_metadata shorter than it is padded with 0
                  ):
         super(Write, self).__init__()
         if os_type == "Linux":
-            data_buffer = self.init_data_buffer(data_length=len(raw_data), data_out=raw_data, data_buffer=data_buffer)
-            metadata_buffer = self.init_metadata_buffer(data_length=len(raw_metadata), data_out=raw_metadata, data_buffer=metadata_buffer)
+            data_buffer = self.init_data_buffer(data_length=max(data_len, len(raw_data)), data_out=raw_data, data_buffer=data_buffer)
+            metadata_buffer = self.init_metadata_buffer(data_length=max(metadata_len, len(raw_metadata)), data_out=raw_metadata, data_buffer=metadata_buffer)
             self.build_command(opcode=CmdOPCode,
                                nsid=nsid,
                                metadata=metadata_buffer.addr,
@@ -0,0 +1,53 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import struct
+from pydiskcmdlib.exceptions import ParameterIncorrect
+
+## The range list of Dataset Management, every range is 16 bytes:
+#    bytes 0-3   Context Attributes
+#    bytes 4-7   Length in logical blocks
+#    bytes 8-15  Starting LBA
+#  A command carries 1-256 ranges(NR is 0's based), in a 4096 bytes buffer.
+DSMRangeSize = 16
+DSMMaxRanges = 256
+DSMMaxRangeLength = 0xFFFFFFFF
+_range_struct = struct.Struct("<IIQ")
+
+
+def get_dsm_limits(csi_ctrl_data):
+    """
+    get the deallocate limits from the I/O Command Set specific Identify Controller
+    data of NVM Command Set
+
+    :param csi_ctrl_data: the identify data(CNS 06h, CSI 0), None means not reported
+    :return: (max ranges per command, max logical blocks per range)
+    """
+    max_ranges,max_range_length = DSMMaxRanges,DSMMaxRangeLength
+    if csi_ctrl_data:
+        ## Dataset Management Ranges Limit(DMRL), 0 means no limit
+        if csi_ctrl_data[3]:
+            max_ranges = min(csi_ctrl_data[3], DSMMaxRanges)
+        ## Dataset Management Range Size Limit(DMRSL), 0 means no limit
+        dmrsl = int.from_bytes(bytes(csi_ctrl_data[4:8]), 'little')
+        if dmrsl:
+            max_range_length = dmrsl
+    return max_ranges,max_range_length
+
+
+def pack_ranges(ranges, context_attributes=0, buffer=None):
+    """
+    pack the ranges into the range list of Dataset Management
+
+    :param ranges: a sequence of (slba, nlb), 1 to 256 ranges
+    :param context_attributes: the context attributes of all the ranges
+    :param buffer: a writable buffer to pack into, None means a new 4096 bytes bytearray
+    :return: the buffer
+    """
+    if not (0 < len(ranges) <= DSMMaxRanges):
+        raise ParameterIncorrect("Dataset Management needs 1-%d ranges" % DSMMaxRanges)
+    if buffer is None:
+        buffer = bytearray(DSMRangeSize * DSMMaxRanges)
+    for i,(slba,nlb) in enumerate(ranges):
+        _range_struct.pack_into(buffer, i * DSMRangeSize, context_attributes, nlb, slba)
+    return buffer
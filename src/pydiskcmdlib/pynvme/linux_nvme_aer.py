@@ -2,6 +2,10 @@
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import os
+import re
+import time
+import errno
+import select
 ###
 KernelTraceEventPath = "/sys/kernel/debug/tracing/events"
 KernelNVMeAEREnable = "/sys/kernel/debug/tracing/events/nvme/nvme_async_event/enable"
@@ -9,6 +13,34 @@ KernelNVMeAERTraceFile = "/sys/kernel/debug/tracing/trace"
 KernelNVMeAERTracePIPEFile = "/sys/kernel/debug/tracing/trace_pipe"
 ###
 
+## a nvme_async_event record in trace(or trace_pipe), like:
+#    kworker/0:1H-120   [000] d..1.  1234.567890: nvme_async_event: nvme0: NVME_AEN=0x000002 [NVME_AER_NOTICE_NS_CHANGED]
+#  the irqs-off/need-resched/... settings column is absent in some kernels
+_aer_line_re = re.compile(r"^\s*(?P<task>.+?)\s+(?P<cpu>\[\d+\])\s+(?:(?P<setting>[^\s\d]\S*)\s+)?"
+                          r"(?P<timestamp>\d+\.\d+):\s+nvme_async_event:\s+(?P<dev>[^\s:]+):?\s+"
+                          r"NVME_AEN=(?P<aen>(?:0x)?[0-9a-fA-F]+)\s*(?P<type>.*?)\s*$")
+_aer_event_tag = b"nvme_async_event:"
+
+
+def decode_aer_line(line):
+    """
+    :param line: a line of trace or trace_pipe, str or bytes
+    :return: a dict of "TASK-PID", "CPU#", "setting", "TIMESTAMP", "DEV", "NVME_AEN" and "AER_TYPE",
+             None means it is not a nvme_async_event
+    """
+    if isinstance(line, bytes):
+        line = line.decode(errors="replace")
+    m = _aer_line_re.match(line)
+    if m is None:
+        return None
+    return {"TASK-PID": m.group("task"),
+            "CPU#": m.group("cpu"),
+            "setting": m.group("setting"),
+            "TIMESTAMP": float(m.group("timestamp")),
+            "DEV": m.group("dev"),
+            "NVME_AEN": int(m.group("aen"), base=16),
+            "AER_TYPE": m.group("type"),}
+
 def check_aer_support():
     return os.path.isfile(KernelNVMeAEREnable)
 
@@ -51,31 +83,10 @@ class NVMeAER(object):
         return int(status)
 
     def _decode_trace_by_line(self, content):
-        description = None
         ## skip annotation
-        if not content.startswith("#"):
-            ## check if nvme_async_event
-            if "nvme_async_event:" in content:
-                description = {}
-                ##
-                content = content.strip()
-                temp_list = content.split(' ')
-                ## remove "''"
-                while '' in temp_list:
-                    temp_list.remove('')
-                ## strip ":"
-                for i in range(len(temp_list)):
-                    if temp_list[i].endswith(":"):
-                        temp_list[i] = temp_list[i].rstrip(":")
-                ##
-                description["TASK-PID"] = temp_list[0]
-                description["CPU#"] = temp_list[1]
-                description["setting"] = temp_list[2]
-                description["TIMESTAMP"] = float(temp_list[3])
-                description["DEV"] = temp_list[5]
-                description["NVME_AEN"] = int(temp_list[6].strip("NVME_AEN="), base=16)
-                description["AER_TYPE"] = temp_list[7]
-        return description
+        if content.startswith("#"):
+            return None
+        return decode_aer_line(content)
 
     def check_trace_once(self):
         '''
@@ -98,3 +109,172 @@ class NVMeAER(object):
                 if description:
                     nvme_aer.append(description)
         return nvme_aer
+
+    def watch(self, callback, controllers=None, timeout=None):
+        """
+        deliver the nvme_async_event records to callback as they happen, see NVMeAERWatcher
+
+        :param callback: a callable(description)
+        :param controllers: the controllers to watch, like ["nvme0", "/dev/nvme1"], None means all
+        :param timeout: the seconds to watch, None means forever
+        """
+        with NVMeAERWatcher(controllers=controllers) as watcher:
+            watcher.watch(callback, timeout=timeout)
+
+
+class TracePipeReader(object):
+    """
+    Read the lines of trace_pipe as the kernel writes them(epoll, or select).
+    The lines are consumed, so they are not missed when the trace ring buffer
+    wraps. Only one reader should read trace_pipe at a time.
+    """
+    ReadSize = 65536
+
+    def __init__(self, trace_pipe=KernelNVMeAERTracePIPEFile):
+        """
+        :param trace_pipe: the trace_pipe file
+        """
+        self.__fd = os.open(trace_pipe, os.O_RDONLY | os.O_NONBLOCK)
+        self.__pending = b""
+        self._stop = False
+        if hasattr(select, "epoll"):
+            self.__poller = select.epoll()
+            self.__poller.register(self.__fd, select.EPOLLIN)
+        else:
+            self.__poller = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.__poller is not None:
+            self.__poller.close()
+            self.__poller = None
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def fileno(self):
+        return self.__fd
+
+    def stop(self):
+        """
+        stop the wait loop after the current wait
+        """
+        self._stop = True
+
+    def wait(self, timeout):
+        """
+        :param timeout: the max seconds to wait, None means forever
+        :return: True if trace_pipe is readable
+        """
+        if self.__poller is not None:
+            return bool(self.__poller.poll(-1 if timeout is None else timeout))
+        return bool(select.select([self.__fd], [], [], timeout)[0])
+
+    def read_lines(self):
+        """
+        read the complete lines available now, without waiting
+
+        :return: a list of lines in bytes, without the line feed
+        """
+        result = []
+        while True:
+            try:
+                data = os.read(self.__fd, self.ReadSize)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            lines = (self.__pending + data).split(b"\n")
+            self.__pending = lines.pop()
+            result.extend(lines)
+        return result
+
+    def wait_loop(self, timeout=None, interval=1.0):
+        """
+        :param timeout: the seconds to wait, None means until stop()
+        :param interval: the max seconds of one wait, stop() takes effect in it
+        :return: a generator, yield every time trace_pipe is readable
+        """
+        self._stop = False
+        end = None if timeout is None else time.monotonic() + timeout
+        while not self._stop:
+            wait = interval if end is None else min(interval, end - time.monotonic())
+            if wait < 0:
+                break
+            if self.wait(wait):
+                yield
+
+
+class NVMeAERWatcher(TracePipeReader):
+    """
+    Stream the nvme_async_event records from trace_pipe.
+
+    Usage:
+        with NVMeAERWatcher(controllers=["nvme0"]) as w:
+            for description in w.events(timeout=60):
+                print (description)
+    """
+    def __init__(self, controllers=None, trace_pipe=KernelNVMeAERTracePIPEFile):
+        """
+        :param controllers: the controllers to watch, like ["nvme0", "/dev/nvme1"], None means all
+        :param trace_pipe: the trace_pipe file
+        """
+        self.controllers = set(os.path.basename(c) for c in controllers) if controllers else None
+        super(NVMeAERWatcher, self).__init__(trace_pipe=trace_pipe)
+
+    def read_events(self):
+        """
+        read the records available now, without waiting
+
+        :return: a list of description, see decode_aer_line
+        """
+        result = []
+        for line in self.read_lines():
+            if _aer_event_tag not in line:
+                continue
+            description = decode_aer_line(line)
+            if description and (self.controllers is None or description["DEV"] in self.controllers):
+                result.append(description)
+        return result
+
+    def events(self, timeout=None, interval=1.0):
+        """
+        :param timeout: the seconds to watch, None means until stop()
+        :param interval: the max seconds of one wait, stop() takes effect in it
+        :return: a generator of description, see decode_aer_line
+        """
+        for _ in self.wait_loop(timeout=timeout, interval=interval):
+            for description in self.read_events():
+                yield description
+
+    def watch(self, callback, timeout=None):
+        """
+        :param callback: a callable(description), for every record
+        :param timeout: the seconds to watch, None means until stop()
+        """
+        for description in self.events(timeout=timeout):
+            callback(description)
+
+    def __aiter__(self):
+        return self._aiter_events()
+
+    async def _aiter_events(self):
+        import asyncio
+        loop = asyncio.get_event_loop()
+        ready = asyncio.Event()
+        loop.add_reader(self.fileno(), ready.set)
+        try:
+            while not self._stop:
+                await ready.wait()
+                ready.clear()
+                for description in self.read_events():
+                    yield description
+        finally:
+            loop.remove_reader(self.fileno())
@@ -0,0 +1,209 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import re
+from array import array
+from pydiskcmdlib.surface_scan import LatencyBuckets,get_latency_bucket,get_bucket_bound_us
+from .linux_nvme_aer import KernelTraceEventPath,KernelNVMeAERTracePIPEFile,TracePipeReader
+
+## The kernel nvme driver traces every request it sends to the controller:
+#    nvme_setup_cmd: when the command is built, just before it is written to the SQ
+#    nvme_complete_rq: when the completion is handled
+#  like(the disk field is only in the I/O commands):
+#    fio-1234    [002] ..... 100.000001: nvme_setup_cmd: nvme0: disk=nvme0n1, qid=3, cmdid=17, nsid=1, flags=0x0, meta=0x0, cmd=(nvme_cmd_read slba=0, len=7, ctrl=0x0, dsmgmt=0, reftag=0)
+#    <idle>-0    [002] d.h1. 100.000090: nvme_complete_rq: nvme0: disk=nvme0n1, qid=3, cmdid=17, res=0x0, retries=0, flags=0x0, status=0x0
+#  A command is (controller, qid, cmdid) until it completes, so the two events
+#  are paired by it, and the time between is the service time of the command,
+#  for all the host I/O, not only the commands of pydiskcmd.
+NVMeTraceEvents = ("nvme_setup_cmd", "nvme_complete_rq")
+_setup_tag = b"nvme_setup_cmd:"
+_complete_tag = b"nvme_complete_rq:"
+_setup_re = re.compile(rb"\s(\d+)\.(\d+): nvme_setup_cmd: (nvme\d+): (?:disk=\S+, )?qid=(\d+), cmdid=(\d+),.*?cmd=\(([\w]+)")
+_complete_re = re.compile(rb"\s(\d+)\.(\d+): nvme_complete_rq: (nvme\d+): (?:disk=\S+, )?qid=(\d+), cmdid=(\d+),.*?status=(0x[0-9a-fA-F]+|\d+)")
+## the commands not completed, more than this means the completions are lost
+#  (trace buffer overrun, or events disabled by others)
+MaxPendingCommands = 65536
+
+
+def _timestamp_ns(sec, frac):
+    return int(sec) * 1000000000 + int(frac.ljust(9, b"0")[:9])
+
+
+class LatencyHistogram(object):
+    """
+    The latency histogram of a kind of command, the buckets see pydiskcmdlib.surface_scan
+    """
+    def __init__(self):
+        self.histogram = array('Q', [0]) * LatencyBuckets
+        self.count = 0
+        self.errors = 0
+        self.sum_ns = 0
+        self.max_ns = 0
+
+    def add(self, latency_ns, error=False):
+        self.histogram[get_latency_bucket(latency_ns)] += 1
+        self.count += 1
+        self.sum_ns += latency_ns
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+        if error:
+            self.errors += 1
+
+    def get_percentile_us(self, percent):
+        """
+        :param percent: 0-100
+        :return: the upper bound(microseconds) of the bucket of the percentile, 0 if no command
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * percent / 100
+        acc = 0
+        for bucket,v in enumerate(self.histogram):
+            acc += v
+            if acc >= target:
+                return get_bucket_bound_us(bucket)
+        return get_bucket_bound_us(LatencyBuckets - 1)
+
+    def to_dict(self):
+        return {"count": self.count,
+                "errors": self.errors,
+                "avg_us": (self.sum_ns / self.count / 1000) if self.count else 0,
+                "max_us": self.max_ns / 1000,
+                "p50_us": self.get_percentile_us(50),
+                "p99_us": self.get_percentile_us(99),
+                "p999_us": self.get_percentile_us(99.9),
+                "histogram": self.histogram.tolist(),}
+
+
+class NVMeLatencyProfiler(TracePipeReader):
+    """
+    Profile the service time of the commands of the nvme controllers, by the
+    nvme_setup_cmd and nvme_complete_rq events from trace_pipe.
+
+    Usage:
+        with NVMeLatencyProfiler(controllers=["nvme0"]) as p:
+            p.run(timeout=60)
+            print (p.to_dict())
+    """
+    def __init__(self, controllers=None, enable_events=True, trace_pipe=KernelNVMeAERTracePIPEFile):
+        """
+        :param controllers: the controllers to profile, like ["nvme0", "/dev/nvme1"], None means all
+        :param enable_events: enable the trace events, and restore them when close
+        :param trace_pipe: the trace_pipe file
+        """
+        self.controllers = set(os.path.basename(c).encode() for c in controllers) if controllers else None
+        ## {(ctrl, opcode): LatencyHistogram}
+        self.histograms = {}
+        ## {(ctrl, qid, cmdid): (timestamp_ns, opcode)}
+        self.pending = {}
+        self.lost = 0
+        self.__events_restore = {}
+        if enable_events:
+            for event in NVMeTraceEvents:
+                self.__enable_event(event)
+        try:
+            super(NVMeLatencyProfiler, self).__init__(trace_pipe=trace_pipe)
+        except Exception:
+            self.__restore_events()
+            raise
+
+    def __enable_event(self, event):
+        path = os.path.join(KernelTraceEventPath, "nvme", event, "enable")
+        with open(path, "r") as f:
+            status = f.read().strip()
+        if status != "1":
+            with open(path, "w") as f:
+                f.write("1")
+            self.__events_restore[path] = status
+
+    def __restore_events(self):
+        for path,status in self.__events_restore.items():
+            with open(path, "w") as f:
+                f.write(status)
+        self.__events_restore = {}
+
+    def close(self):
+        super(NVMeLatencyProfiler, self).close()
+        self.__restore_events()
+
+    def process_line(self, line):
+        """
+        :param line: a line of trace_pipe, in bytes
+        """
+        if _setup_tag in line:
+            m = _setup_re.search(line)
+            if m is None:
+                return
+            sec,frac,ctrl,qid,cmdid,opcode = m.groups()
+            if self.controllers is not None and ctrl not in self.controllers:
+                return
+            pending = self.pending
+            if len(pending) >= MaxPendingCommands:
+                self.lost += len(pending)
+                pending.clear()
+            pending[(ctrl, qid, cmdid)] = (_timestamp_ns(sec, frac), opcode)
+        elif _complete_tag in line:
+            m = _complete_re.search(line)
+            if m is None:
+                return
+            sec,frac,ctrl,qid,cmdid,status = m.groups()
+            setup = self.pending.pop((ctrl, qid, cmdid), None)
+            if setup is None:
+                return
+            start_ns,opcode = setup
+            key = (ctrl, opcode)
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(max(_timestamp_ns(sec, frac) - start_ns, 0), error=int(status, 0) != 0)
+
+    def process(self):
+        """
+        process the lines available now, without waiting
+        """
+        process_line = self.process_line
+        for line in self.read_lines():
+            process_line(line)
+
+    def run(self, timeout=None, interval=1.0, callback=None):
+        """
+        :param timeout: the seconds to profile, None means until stop()
+        :param interval: the max seconds of one wait, stop() takes effect in it
+        :param callback: a callable(profiler), after every read of trace_pipe
+        """
+        for _ in self.wait_loop(timeout=timeout, interval=interval):
+            self.process()
+            if callback:
+                callback(self)
+
+    def reset(self):
+        """
+        clear the histograms, keep the commands not completed
+        """
+        self.histograms = {}
+        self.lost = 0
+
+    def to_dict(self):
+        """
+        :return: {controller: {opcode: histogram dict}}, see LatencyHistogram.to_dict
+        """
+        result = {}
+        for (ctrl,opcode),histogram in sorted(self.histograms.items()):
+            result.setdefault(ctrl.decode(), {})[opcode.decode()] = histogram.to_dict()
+        return result
+
+
+def format_latency_profile(profile):
+    """
+    :param profile: the result of NVMeLatencyProfiler.to_dict
+    :return: a list of lines
+    """
+    print_format = "%-8s %-32s %10s %8s %10s %10s %10s %10s %10s"
+    lines = [print_format % ("Ctrl", "Opcode", "Count", "Errors", "Avg(us)", "Max(us)", "P50(us)", "P99(us)", "P99.9(us)"),
+             print_format % ("-"*8, "-"*32, "-"*10, "-"*8, "-"*10, "-"*10, "-"*10, "-"*10, "-"*10)]
+    for ctrl,opcodes in profile.items():
+        for opcode,h in opcodes.items():
+            lines.append(print_format % (ctrl, opcode, h["count"], h["errors"], "%.1f" % h["avg_us"], "%.1f" % h["max_us"],
+                                         "<%d" % h["p50_us"], "<%d" % h["p99_us"], "<%d" % h["p999_us"]))
+    return lines
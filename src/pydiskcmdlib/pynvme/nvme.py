@@ -1,9 +1,11 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
-
+import sys
+import time
 from pydiskcmdlib.pynvme.cdb_identify import (
     IDCtrl,
+    IDCtrlCSI,
     IDNS,
     IDActiveNS,
     IDAllocatedNS,
@@ -41,6 +43,8 @@ from pydiskcmdlib.pynvme.cdb_nvme_compare import Compare
 from pydiskcmdlib.pynvme.cdb_nvme_write_unc import WriteUncorrectable
 from pydiskcmdlib.pynvme.cdb_nvme_write_zeroes import WriteZeroes
 from pydiskcmdlib.pynvme.cdb_nvme_dataset_management import DatasetManagement
+from pydiskcmdlib.pynvme.dsm_range import get_dsm_limits,pack_ranges
+from pydiskcmdlib.lba_range import coalesce_ranges,split_ranges
 from pydiskcmdlib.pynvme.cdb_nvme_get_lba_status import GetLBAStatus
 from pydiskcmdlib.pynvme.cdb_nvme_reset import Reset
 from pydiskcmdlib.pynvme.cdb_nvme_subsys_reset import SubsysReset
@@ -49,16 +53,94 @@ from pydiskcmdlib.pynvme.cdb_nvme_passthru import AdminPassthru, NVMPassthru, NV
 from pydiskcmdlib.exceptions import *
 from pydiskcmdlib.pynvme.data_buffer import DataBuffer
 from pydiskcmdlib import log
+from pydiskcmdlib.trace import DEBUG,HexBytes,KindNVMe,get_trace_ring
+from pydiskcmdlib.session_cache import CacheNVMe,get_session_cache,get_device_path,invalidate_device
+
+## the transfer size limit of a log page chunk, to bound the memory
+DefaultMaxChunk = 1024 * 1024
+## CAP.MPSMIN, the MDTS unit. It is 4KiB in almost all the controllers.
+DefaultMinPageSize = 4096
+## NUMD is 12 bits if the controller does not support extended data for Get Log Page
+NoExtendedMaxChunk = 4096 * 4
+
+
+def get_max_xfer_len(ctrl_identify_info, min_page_size=DefaultMinPageSize):
+    """
+    get the max data transfer size from identify controller data
+
+    :param ctrl_identify_info: the identify controller data
+    :param min_page_size: the CAP.MPSMIN in bytes
+    :return: the max data transfer size in bytes, 0 means no limit
+    """
+    mdts = ctrl_identify_info[77]
+    if mdts == 0:
+        return 0
+    return (2 ** mdts) * min_page_size
+
+
+def get_chunk_size(ctrl_identify_info, max_chunk=DefaultMaxChunk, min_page_size=DefaultMinPageSize):
+    """
+    get the largest legal transfer size of Get Log Page
+
+    :param ctrl_identify_info: the identify controller data
+    :param max_chunk: the upper limit in bytes
+    :param min_page_size: the CAP.MPSMIN in bytes
+    :return: the chunk size in bytes, a multiple of 512
+    """
+    chunk = max_chunk
+    mdts_bytes = get_max_xfer_len(ctrl_identify_info, min_page_size=min_page_size)
+    if mdts_bytes:
+        chunk = min(chunk, mdts_bytes)
+    ## LPA bit 2, extended data(NUMDU and the 64-bit offset) for Get Log Page
+    if not (ctrl_identify_info[261] & 0x04):
+        chunk = min(chunk, NoExtendedMaxChunk)
+    chunk -= chunk % 512
+    return max(chunk, 512)
+
+
+def get_ns_format(ns_data):
+    """
+    get the format of a namespace from identify namespace data
+
+    :param ns_data: the identify namespace data
+    :return: a dict of "nsze", "flbas", "lbaf"(the format index), "lbads"(the LBA data size in bytes),
+             "ms"(the metadata size per LBA), "extended"(the metadata is transferred at the end of LBA data),
+             "dps"(End-to-end Data Protection Type Settings) and "pi_type"
+    """
+    flbas = ns_data[26]
+    ## FLBAS bits 3:0, and bits 6:5 are the most significant 2 bits of the format index
+    lbaf = (flbas & 0x0F) + (((flbas >> 5) & 0x03) << 4 if ns_data[25] > 15 else 0)
+    start_labf_des = 128 + lbaf * 4
+    return {"nsze": int.from_bytes(bytes(ns_data[0:8]), 'little'),
+            "flbas": flbas,
+            "lbaf": lbaf,
+            "lbads": 2 ** ns_data[start_labf_des+2],
+            "ms": ns_data[start_labf_des] + (ns_data[start_labf_des+1] << 8),
+            "extended": bool(flbas & 0x10),
+            "dps": ns_data[29],
+            "pi_type": ns_data[29] & 0x07,}
+
 
 class NVMe(object):
     def __init__(self, dev):
         self.device = dev
-        ## the identify information
-        ret = self.id_ctrl()
-        if max(ret.check_return_status(fail_hint=False)) > 0:
-            raise ExecuteCmdErr("Identify Command failed!")
-        self.__ctrl_identify_info = ret.data
-        # self.__id_ns_info = {}
+        ## the identify information, from session cache if it is enabled
+        self.__ctrl_identify_info = None
+        cache = get_session_cache()
+        dev_path = get_device_path(dev) if cache is not None else None
+        if dev_path:
+            info = cache.get(dev_path, CacheNVMe)
+            if info:
+                self.__ctrl_identify_info = info["id_ctrl"]
+        if self.__ctrl_identify_info is None:
+            ret = self.id_ctrl()
+            if max(ret.check_return_status(fail_hint=False)) > 0:
+                raise ExecuteCmdErr("Identify Command failed!")
+            self.__ctrl_identify_info = ret.data
+            if dev_path:
+                cache.put(dev_path, CacheNVMe, {"id_ctrl": ret.data}, serial=self.serial)
+        ## the namespace format, ns_id -> get_ns_format() result, filled when it is used
+        self.__ns_format = {}
         ## OCP info here
         self.__ocp_support = None
         self.__ocp_version = []
@@ -71,6 +153,7 @@ class NVMe(object):
         :param dev: a NVMeDevice object
         """
         self.device = dev
+        self.__ns_format.clear()
 
     def __enter__(self):
         return self
@@ -85,6 +168,48 @@ class NVMe(object):
     def ctrl_identify_info(self):
         return self.__ctrl_identify_info
 
+    @property
+    def serial(self):
+        """
+        the controller serial number in identify controller data
+        """
+        return bytes(self.__ctrl_identify_info[4:24])
+
+    def _invalidate_session(self):
+        """
+        drop the session cache of this controller, the identify data may be changed
+        """
+        self.__ns_format.clear()
+        invalidate_device(self.device, serial=self.serial)
+
+    def ns_format(self, ns_id, cached_only=False):
+        """
+        get the format of a namespace, it is cached until the namespace may be changed
+        (format, sanitize, namespace management and attachment, firmware commit)
+
+        :param ns_id: the namespace id
+        :param cached_only: do not send Identify Namespace, return None if it is not cached
+        :return: see get_ns_format
+        """
+        ns_format = self.__ns_format.get(ns_id)
+        if ns_format is None and not cached_only:
+            cmd = self.id_ns(ns_id=ns_id)
+            cmd.check_return_status(fail_hint=False, raise_if_fail=True)
+            ns_format = get_ns_format(cmd.data)
+            self.__ns_format[ns_id] = ns_format
+        return ns_format
+
+    def invalidate_ns_format(self, ns_id=None):
+        """
+        drop the cached namespace format
+
+        :param ns_id: the namespace id, None means all
+        """
+        if ns_id is None:
+            self.__ns_format.clear()
+        else:
+            self.__ns_format.pop(ns_id, None)
+
     def _ocp_info_check(self):
         cmd = self.get_log_page(0, 0xC0, 0, 0, 127, 0, 0, 0, 0, 0, 0, 0)
         smart_extend = bytes(cmd.data)
@@ -127,19 +252,51 @@ class NVMe(object):
         :param cmd: a nvme CmdStructure object
         :return: CommandDecoder type
         """
+        ring = get_trace_ring()
+        debug = log.isEnabledFor(DEBUG)
         try:
-            log.debug("Sending NVMe %s: %s" % ("command" if cmd.cdb_struc else "Request",
-                                               " ".join([("%X" % i).zfill(2) for i in cmd.cdb_struc]) if cmd.cdb_struc else cmd.req_id,
-                                              ))
-            self.device.execute(cmd)
-            if (cmd.cq_status is not None) and (cmd.cq_cmd_spec is not None):
-                log.debug("Completion Queue Status: %X, Command Specific Data: %X" % (cmd.cq_status, cmd.cq_cmd_spec))
+            if debug:
+                if cmd.cdb_struc:
+                    log.debug("Sending NVMe command: %s", HexBytes(cmd.cdb_struc))
+                else:
+                    log.debug("Sending NVMe Request: %s", cmd.req_id)
+            if ring is None:
+                self.device.execute(cmd)
+            else:
+                ring.trace(KindNVMe, self.device.execute, cmd)
+            if debug and (cmd.cq_status is not None) and (cmd.cq_cmd_spec is not None):
+                log.debug("Completion Queue Status: %X, Command Specific Data: %X", cmd.cq_status, cmd.cq_cmd_spec)
             if check_return_status:
                 cmd.check_return_status()
         except Exception as e:
+            if ring is not None:
+                ring.on_error(e)
             raise e
         return cmd
 
+    def submit(self, cmd):
+        """
+        wrapper method to call the NVMeDevice.submit method, the command is 
+        queued to device without waiting for the completion if the backend 
+        is asynchronous(io_uring), use reap() to get the completed commands.
+
+        :param cmd: a nvme CmdStructure object
+        :return: CommandDecoder type
+        """
+        if log.isEnabledFor(DEBUG):
+            log.debug("Submitting NVMe command: %s", HexBytes(cmd.cdb_struc))
+        self.device.submit(cmd)
+        return cmd
+
+    def reap(self, min_complete=1):
+        """
+        wrapper method to call the NVMeDevice.reap method
+
+        :param min_complete: wait at least min_complete commands to complete
+        :return: a list of completed commands
+        """
+        return self.device.reap(min_complete=min_complete)
+
     def reset_ctrl(self):
         cmd = Reset()
         self.execute(cmd, check_return_status=False)
@@ -209,6 +366,11 @@ class NVMe(object):
         self.execute(cmd)
         return cmd
 
+    def id_ctrl_csi(self, csi=0, uuid=0):
+        cmd = IDCtrlCSI(csi=csi, uuid=uuid)
+        self.execute(cmd)
+        return cmd
+
     def id_ns(self, ns_id=1, uuid=0):
         cmd = IDNS(ns_id, uuid=uuid)
         self.execute(cmd)
@@ -254,6 +416,69 @@ class NVMe(object):
         self.execute(cmd)
         return cmd
 
+    def iter_log_page(self, lid, total_len, nsid=0, lsp=0, rae=0, lsi=0, lpo=0, uuid=0, ot=0, csi=0, chunk=None, buffer=None):
+        """
+        Read a log page of any size in chunks, the numdl/numdu/lpol/lpou of every
+        chunk is handled here, and the status of every chunk is checked.
+
+        :param lid: the log page identifier
+        :param total_len: the bytes to read, a multiple of 4
+        :param lpo: the log page offset in bytes to start from, a multiple of 4
+        :param chunk: the transfer size of a command in bytes, None means the largest legal 
+                      size by MDTS and the Log Page Attributes
+        :param buffer: a writable buffer not smaller than total_len, the chunks are read into it. 
+                       None means one internal buffer reused by all the chunks
+        :return: a generator of memoryview chunks, a chunk of the internal buffer is only valid 
+                 before the next chunk is read
+        """
+        if total_len % 4 or lpo % 4:
+            raise ParameterIncorrect("Log Page Offset and length shall be Dword aligned")
+        max_chunk = get_chunk_size(self.__ctrl_identify_info)
+        if chunk is None or chunk > max_chunk:
+            chunk = max_chunk
+        chunk -= chunk % 4
+        if chunk <= 0:
+            raise ParameterIncorrect("chunk should not be less than 4 bytes")
+        ## LPA bit 2, the offset is not supported
+        if not (self.__ctrl_identify_info[261] & 0x04) and (lpo > 0 or total_len > chunk):
+            raise CommandNotSupport("Device Not support Log Page Offset, can only read %d bytes from offset 0" % chunk)
+        if buffer is not None:
+            view = memoryview(buffer).cast('B')
+            if len(view) < total_len:
+                raise ParameterIncorrect("The buffer is too small, need %d bytes but got %d bytes" % (total_len, len(view)))
+            internal = None
+        else:
+            internal = DataBuffer(min(chunk, total_len)) if total_len > 0 else None
+            view = internal.view if internal else None
+        try:
+            pos = 0
+            while pos < total_len:
+                length = min(chunk, total_len - pos)
+                offset = lpo + pos
+                numd = int(length / 4) - 1
+                data_buffer = DataBuffer.from_buffer(view[pos:pos+length] if internal is None else view, length)
+                cmd = GetLogPage(nsid,
+                                 lid,
+                                 lsp,
+                                 rae,
+                                 numd & 0xFFFF,
+                                 (numd >> 16) & 0xFFFF,
+                                 lsi,
+                                 offset & 0xFFFFFFFF,
+                                 (offset >> 32) & 0xFFFFFFFF,
+                                 uuid,
+                                 ot,
+                                 csi,
+                                 data_buffer=data_buffer,)
+                self.execute(cmd)
+                cmd.check_return_status(raise_if_fail=True)
+                ## the cmd keeps the data alive until the next chunk
+                yield cmd.data_view[0:length]
+                pos += length
+        finally:
+            if internal is not None:
+                internal.release()
+
     def fw_slot_info(self):
         cmd = FWSlotInfo()
         self.execute(cmd)
@@ -302,35 +527,38 @@ class NVMe(object):
         self.execute(cmd)
         return cmd
 
-    def telemetry_host_log(self, numdl, create_telemetry=0, lpol=0, lpou=0, uuid=0):
-        cmd = TelemetryHostInitiatedLog(create_telemetry, numdl, lpol=lpol, lpou=lpou, uuid=uuid)
+    def telemetry_host_log(self, numdl, create_telemetry=0, lpol=0, lpou=0, uuid=0, numdu=0, data_buffer=None):
+        cmd = TelemetryHostInitiatedLog(create_telemetry, numdl, numdu=numdu, lpol=lpol, lpou=lpou, uuid=uuid, data_buffer=data_buffer)
         self.execute(cmd)
         return cmd
 
-    def telemetry_ctrl_log(self, numdl, lpol=0, lpou=0, uuid=0):
-        cmd = TelemetryControllerInitiatedLog(numdl, lpol=lpol, lpou=lpou, uuid=uuid)
+    def telemetry_ctrl_log(self, numdl, lpol=0, lpou=0, uuid=0, numdu=0, data_buffer=None):
+        cmd = TelemetryControllerInitiatedLog(numdl, numdu=numdu, lpol=lpol, lpou=lpou, uuid=uuid, data_buffer=data_buffer)
         self.execute(cmd)
         return cmd
 
-    def nvme_fw_download(self, fw_data, offset):
-        cmd = FWImageDownload(fw_data, offset)
+    def nvme_fw_download(self, fw_data, offset, data_buffer=None):
+        cmd = FWImageDownload(fw_data, offset, data_buffer=data_buffer)
         self.execute(cmd)
         return cmd     
 
     def nvme_fw_commit(self, fw_slot, action, bpid=0):
         cmd = FWCommit(fw_slot, action, bpid)
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
     def nvme_format(self, lbaf, nsid=0xFFFFFFFF, mset=0, pi=0, pil=0, ses=0, timeout=600000):
         ###
         cmd = Format(lbaf, nsid=nsid, mset=mset, pi=pi, pil=pil, ses=ses, timeout=timeout)
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
     def sanitize(self, action, ause, owpass, oipbp, no_deallocate, ovrpat=0, timeout=CommandTimeout.admin.value):
         cmd = Sanitize(action, ause, owpass, oipbp, no_deallocate, ovrpat=ovrpat, timeout=timeout)
         self.execute(cmd)
+        self.__ns_format.clear()
         return cmd
 
     def sanitize_log(self, numdl, lpol=0):
@@ -346,16 +574,19 @@ class NVMe(object):
     def ns_create(self, ns_size, ns_cap, flbas, dps, nmic, anagrp_id, nvmeset_id, csi=0, vendor_spec_data=b''):
         cmd = NSCreate(ns_size=ns_size, ns_cap=ns_cap, flbas=flbas, dps=dps, nmic=nmic, anagrp_id=anagrp_id, nvmeset_id=nvmeset_id, csi=csi, vendor_spec_data=vendor_spec_data)
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
     def ns_delete(self, ns_id):
         cmd = NSDelete(ns_id)
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
     def ns_attachment(self, ns_id, sel, ctrl_id_list):
         cmd = NSAttachment(ns_id, sel, ctrl_id_list)
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
     def nvme_mi_send(self, opcode, nmd0, nmd1, data=None):
@@ -373,69 +604,146 @@ class NVMe(object):
         self.execute(cmd)
         return cmd
 
-    def read(self, ns_id, slba, nlba, **kwargs):
-        ## first get the lbaf
-        cmd = self.id_ns(ns_id=ns_id)
-        # 
-        flbaf = cmd.data[26] & 0x0F
-        start_labf_des = 128 + flbaf * 4
-        lbaf_ms = cmd.data[start_labf_des] + (cmd.data[start_labf_des+1] << 8)
-        lbaf_lbads = 2 ** (cmd.data[start_labf_des+2])
-        # get the data length
-        data_len = (nlba + 1) * lbaf_lbads
-        metadata_len = (nlba + 1) * lbaf_ms
-        if lbaf_ms > 0:
-            if (cmd.data[27] & 0x01): # extended data LBA
-                data_len += metadata_len
-                metadata_len = 0
-            elif (cmd.data[27] & 0x02):
-                pass
-            else:
-                metadata_len = 0
-        else:
+    @staticmethod
+    def _get_xfer_len(ns_data, nlba):
+        """
+        get the data and metadata transfer length of nlba(0's based) blocks
+
+        :param ns_data: the identify namespace data
+        :param nlba: number of logical blocks, 0's based
+        :return: a tuple, (data_len, metadata_len)
+        """
+        return NVMe._get_format_xfer_len(get_ns_format(ns_data), nlba)
+
+    @staticmethod
+    def _get_format_xfer_len(ns_format, nlba):
+        """
+        get the data and metadata transfer length of nlba(0's based) blocks
+
+        :param ns_format: the namespace format, see get_ns_format
+        :param nlba: number of logical blocks, 0's based
+        :return: a tuple, (data_len, metadata_len)
+        """
+        data_len = (nlba + 1) * ns_format["lbads"]
+        metadata_len = (nlba + 1) * ns_format["ms"]
+        if ns_format["extended"]: # extended data LBA
+            data_len += metadata_len
             metadata_len = 0
-        ##
+        return data_len,metadata_len
+
+    def _check_lba_range(self, ns_format, slba, nlba):
+        if slba + nlba >= ns_format["nsze"]:
+            raise ParameterIncorrect("LBA range %d-%d is beyond the namespace size %d" % (slba, slba+nlba, ns_format["nsze"]))
+
+    def read(self, ns_id, slba, nlba, nowait=False, **kwargs):
+        data_len,metadata_len = self._get_format_xfer_len(self.ns_format(ns_id), nlba)
         cmd = Read(ns_id, slba, nlba, data_len=data_len, metadata_len=metadata_len, **kwargs)
-        self.execute(cmd)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
         return cmd
 
-    def verify(self, ns_id, slba, nlba):
+    def verify(self, ns_id, slba, nlba, nowait=False):
+        self._check_lba_range(self.ns_format(ns_id), slba, nlba)
         cmd = Verify(ns_id, slba, nlba)
-        self.execute(cmd)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
         return cmd
 
-    def write(self, ns_id, slba, nlba, raw_data, raw_metadata, fua=0, prinfo=0):
-        cmd = Write(ns_id, slba, nlba, raw_data=raw_data, raw_metadata=raw_metadata, fua=fua, prinfo=prinfo)
-        self.execute(cmd)
+    def write(self, ns_id, slba, nlba, raw_data, raw_metadata, fua=0, prinfo=0, nowait=False):
+        ns_format = self.ns_format(ns_id)
+        self._check_lba_range(ns_format, slba, nlba)
+        ## the device transfers the whole blocks, the short data is padded with 0 in the
+        #  command buffer when it is copied there
+        data_len,metadata_len = self._get_format_xfer_len(ns_format, nlba)
+        cmd = Write(ns_id, slba, nlba, raw_data=raw_data, raw_metadata=raw_metadata, fua=fua, prinfo=prinfo,
+                    data_len=data_len, metadata_len=metadata_len if raw_metadata else 0)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
+        return cmd
+
+    def read_into(self, ns_id, slba, nlba, buffer, metadata_buffer=None, nowait=False, **kwargs):
+        """
+        Read the data into a caller supplied buffer, the device DMA straight into it,
+        no data is copied.
+
+        :param ns_id: the namespace id
+        :param slba: the start lba
+        :param nlba: number of logical blocks, 0's based
+        :param buffer: a writable buffer(bytearray, mmap, memoryview), not smaller than the data length
+        :param metadata_buffer: a writable buffer for the separate metadata, None means allocate one if needed
+        :param nowait: submit the command and return, reap it later
+        :param kwargs: passthrough to Read
+        :return: the command, cmd.data_view/cmd.metadata_view is the memoryview of the buffers
+        """
+        data_len,metadata_len = self._get_format_xfer_len(self.ns_format(ns_id), nlba)
+        data_buffer = DataBuffer.from_buffer(buffer, data_len)
+        if metadata_len > 0 and metadata_buffer is not None:
+            metadata_buffer = DataBuffer.from_buffer(metadata_buffer, metadata_len)
+        else:
+            metadata_buffer = None
+        cmd = Read(ns_id, 
+                   slba, 
+                   nlba, 
+                   data_buffer=data_buffer, 
+                   metadata_buffer=metadata_buffer, 
+                   metadata_len=metadata_len, 
+                   **kwargs)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
+        return cmd
+
+    def write_from(self, ns_id, slba, nlba, buffer, metadata_buffer=None, fua=0, prinfo=0, nowait=False):
+        """
+        Write the data from a caller supplied buffer, the device DMA straight out of 
+        a writable buffer(bytearray, mmap, memoryview), a read-only buffer(bytes) is copied once.
+
+        :param ns_id: the namespace id
+        :param slba: the start lba
+        :param nlba: number of logical blocks, 0's based
+        :param buffer: the buffer of data to write, not smaller than the data length
+        :param metadata_buffer: the buffer of the separate metadata, not smaller than the metadata length
+        :param nowait: submit the command and return, reap it later
+        :return: the command
+        """
+        data_len,metadata_len = self._get_format_xfer_len(self.ns_format(ns_id), nlba)
+        ## the device reads the whole blocks, a short buffer makes it DMA past the end
+        view = memoryview(buffer).cast('B')
+        if view.nbytes < data_len:
+            raise ValueError("The buffer is too small, need %d bytes but got %d bytes" % (data_len, view.nbytes))
+        if view.readonly:
+            buffer = bytearray(view[0:data_len])
+        data_buffer = DataBuffer.from_buffer(buffer, data_len)
+        if metadata_buffer is not None and metadata_len > 0:
+            view = memoryview(metadata_buffer).cast('B')
+            if view.nbytes < metadata_len:
+                raise ValueError("The metadata buffer is too small, need %d bytes but got %d bytes" % (metadata_len, view.nbytes))
+            if view.readonly:
+                metadata_buffer = bytearray(view[0:metadata_len])
+            metadata_buffer = DataBuffer.from_buffer(metadata_buffer, metadata_len)
+        else:
+            metadata_buffer = None
+        cmd = Write(ns_id, slba, nlba, data_buffer=data_buffer, metadata_buffer=metadata_buffer, fua=fua, prinfo=prinfo)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
         return cmd
 
-    def get_lba_status(self, ns_id, slba, mndw, atype, rl, timeout=60000):
-        cmd = GetLBAStatus(ns_id, slba, mndw, atype, rl, timeout=60000)
+    def get_lba_status(self, ns_id, slba, mndw, atype, rl, timeout=60000, data_buffer=None):
+        cmd = GetLBAStatus(ns_id, slba, mndw, atype, rl, data_buffer=data_buffer, timeout=timeout)
         self.execute(cmd)
         return cmd
 
     def compare(self, ns_id, slba, nlba, data, metadata=None, **kwargs):
-        ## first get the lbaf
-        cmd = self.id_ns(ns_id=ns_id)
-        # 
-        flbaf = cmd.data[26] & 0x0F
-        start_labf_des = 128 + flbaf * 4
-        lbaf_ms = cmd.data[start_labf_des] + (cmd.data[start_labf_des+1] << 8)
-        lbaf_lbads = 2 ** (cmd.data[start_labf_des+2])
-        # get the data length
-        data_len = (nlba + 1) * lbaf_lbads
-        metadata_len = (nlba + 1) * lbaf_ms
-        if lbaf_ms > 0:
-            if (cmd.data[27] & 0x01): # extended data LBA
-                data_len += metadata_len
-                metadata_len = 0
-            elif (cmd.data[27] & 0x02):
-                pass
-            else:
-                metadata_len = 0
-        else:
-            metadata_len = 0
-        ##
+        data_len,metadata_len = self._get_format_xfer_len(self.ns_format(ns_id), nlba)
         cmd = Compare(ns_id, 
                       slba, 
                       nlba, 
@@ -452,152 +760,94 @@ class NVMe(object):
         self.execute(cmd)
         return cmd
 
-    def write_zeroes(self, nsid, slba, nlba, **kwargs):
+    def write_zeroes(self, nsid, slba, nlba, nowait=False, **kwargs):
         cmd = WriteZeroes(nsid, slba, nlba, **kwargs)
-        self.execute(cmd)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
         return cmd
 
-    def dataset_management(self, nsid, nr, idr, idw, ad, data):
+    def dataset_management(self, nsid, nr, idr, idw, ad, data, nowait=False):
         cmd = DatasetManagement(nsid, nr, idr, idw, ad, data)
-        self.execute(cmd)
+        if nowait:
+            self.submit(cmd)
+        else:
+            self.execute(cmd)
         return cmd
 
-
-from pydiskcmdlib.pyscsi.scsi import SCSI
-from pyscsi.pyscsi.scsi_command import SCSICommand
-from pydiskcmdlib import os_type
-from pyscsi.pyscsi.scsi_sense import SCSICheckCondition
-from pydiskcmdlib.pynvme.nvme_status_code import get_nvme_status_code_without_status_code,StatusCodeDescription
-
-def _check_nvme_return_status(self: SCSICommand, success_hint: bool=False, fail_hint: bool = True, raise_if_fail: bool=True) -> bool:
-    """
-    Check the return status of the NVMe command.
-
-    Until Now, IOCTL status code cannot be obtained by the library, so only check sense key, acs,ascq.
-    """
-    _status  = False
-    _fail_hint = ''
-    sense_data = None
-    if self.sense:
-        sense_data = self.sense
-    elif self.raw_sense_data:
-        sense_data = self.raw_sense_data
-    else:
-        _status = True
-    ##
-    if sense_data:
-        sense = SCSICheckCondition(sense_data)
-        if sense.valid:
-            if sense.data:
-                if sense.data["sense_key"] == 0 and sense._ascq == 0:
-                    _status = True   
-                else:
-                    _fail_hint = str(sense)
-                    if fail_hint:
-                        status_code = get_nvme_status_code_without_status_code(sense.data["sense_key"], sense.asc, sense.ascq)
-                        _hint = """Command failed, and details bellow.
-- SCSI Status:
-  %-12s%-19s%s
-  %-12s%-19s%s
-- Mapping to Possible NVMe Status Code:
-  %-20s%-18s%s""" % ("Sense Key", "ASC", "ASCQ", 
-                     "0x%X" % sense.data.get("sense_key"), "0x%X" % sense.asc, "0x%X" % sense.ascq,
-                     "Status Code Type", "Status Code", "Status Code Description",
-                    )
-                        print (_hint)
-                        if status_code:
-                            for i in status_code.values():
-                                for code in i:
-                                    print ("  %-20s%-18s%s" % ("0x%X" % code[0], "0x%X" % code[1], StatusCodeDescription.get(code)))
-                        else:
-                            print ("  %-20s%-18s%s" % ("Unknown", "Unknown", "Unknown"))
-            else:
-                _fail_hint = "Invalid sense data format"
-        else:
-            _fail_hint = "Invalid sense data"
-    if _status:
-        if success_hint:
-            print ("Command Success")
-            print ('')
-    else:
-        if fail_hint:
-            print (_fail_hint)
-        if raise_if_fail:
-            raise CommandReturnStatusError(_fail_hint)
-    return _status
-
-class SCSI2NVMe(SCSI):
-    if os_type == "Windows":
-        # From StorNVMe SCSI Translation Support
-        support_commands = (
-            0x48,   # SANITIZE
-            0x12,   # Inquiry
-            0x4D,   # Log Sense
-            0x55,   # Mode Select 10
-            0x5A,   # Mode Sense 10
-            0x28,   # Read10
-            0x88,   # Read16
-            0x25,   # Read Capacity 10
-            0x10,   # Read Capacity 16
-            # Read Data Buffer 16
-            0xA0,   # Report Luns
-            0xA2,   # Security Protocal in
-            0xB5,   # Security Protocol out
-            0x1D,   # Send Diagnostic
-            0x1B,   # Start Stop Unit
-            0x35,   # SYNCHRONIZE_CACHE_10
-            0x00,   # Test Unit Ready
-            0x42,   # Unmap
-            0x2F,   # Verify10
-            0x8F,   # Verify16
-            0x2A,   # Write10
-            0x8A,   # Write16
-            0x3B,   # Write Buffer
-            0x9E,   # internal used by pyscsi, user should not use it
-        )
-        SCSICommand.check_nvme_return_status = _check_nvme_return_status
-    else:
-        # Support by 'NVM-Express-SCSI-Translation-Reference-1_1-Gold'
-        support_commands = (
-            0x12,   # Inquiry
-            0x4D,   # Log Sense
-            0x15,   # Mode Select 6
-            0x55,   # Mode Select 10
-            0x1A,   # Mode Sense 6
-            0x5A,   # Mode Sense 10
-            0xA0,   # Report Luns
-            0x03,   # Request Sense
-            0xA2,   # Security Protocal in
-            0xB5,   # Security Protocol out
-            0x1B,   # Start Stop Unit
-            0x00,   # Test Unit Ready
-            0x3B,   # Write Buffer
-            0x89,   # Compare And Write
-            0x04,   # Format Unit
-            0x08,   # Read6
-            0x28,   # Read10
-            0xA8,   # Read12
-            0x88,   # Read16
-            0x25,   # Read Capacity 10
-            0x10,   # Read Capacity 16
-            0x35,   # SYNCHRONIZE_CACHE_10
-            0x91,   # SYNCHRONIZE_CACHE_16
-            0x42,   # Unmap
-            0x0A,   # Write6
-            0x2A,   # Write10
-            0xAA,   # Write12
-            0x8A,   # Write16
-            0x3F,   # Write Long 10
-            0x9F,   # Write Long 16
-            0x9E,   # internal used by pyscsi, user should not use it
-        )
-    def __init__(self, 
-                 dev,
-                 blocksize=0):
-        super(SCSI2NVMe, self).__init__(dev, blocksize=blocksize)
-
-    def execute(self, cmd: SCSICommand, en_raw_sense=False):
-        if cmd.opcode.value in SCSI2NVMe.support_commands:
-            return SCSI.execute(self, cmd, en_raw_sense=en_raw_sense)
-        else:
-            raise CommandNotSupport("SCSI Translation to NVMe Do Not Support OPCode: 0x%x" % cmd.opcode.value)
+    def deallocate(self, nsid, ranges="all", progress=None):
+        """
+        Deallocate(TRIM) the ranges of a namespace by Dataset Management. The ranges are
+        coalesced, split by the range size limit(DMRSL), and packed up to the ranges
+        limit(DMRL, 256 at most) per command. Up to the device queue depth commands are
+        in flight.
+
+        :param nsid: the namespace id
+        :param ranges: an iterable of (slba, nlb), nlb is the number of logical blocks(1's based),
+                       or "all" for the whole namespace
+        :param progress: a function called after every completed command, progress(done_lbas, total_lbas)
+        :return: a dict of "lbas", "ranges", "commands", "seconds" and "throughput"(bytes/s)
+        """
+        ## ONCS bit 2, Dataset Management command
+        if not (self.__ctrl_identify_info[520] & 0x04):
+            raise CommandNotSupport("Device Not support Dataset Management.")
+        ns_format = self.ns_format(nsid)
+        if ranges == "all":
+            ranges = [(0, ns_format["nsze"])]
+        ranges = coalesce_ranges(ranges)
+        if not ranges:
+            raise ParameterIncorrect("No range to deallocate")
+        if ranges[-1][0] + ranges[-1][1] > ns_format["nsze"]:
+            raise ParameterIncorrect("LBA range is beyond the namespace size %d" % ns_format["nsze"])
+        ## the limits are optional, not all the controllers support CNS 06h
+        cmd = self.id_ctrl_csi()
+        SC,SCT = cmd.check_return_status(fail_hint=False)
+        max_ranges,max_range_length = get_dsm_limits(cmd.data if (SC == 0 and SCT == 0) else None)
+        ##
+        t0 = time.perf_counter()
+        total = sum(nlb for _,nlb in ranges)
+        queue_depth = getattr(self.device, "queue_depth", 1)
+        pieces = split_ranges(ranges, max_range_length)
+        done,commands,range_count = 0,0,0
+        ## cmd -> the lbas of the command
+        inflight = {}
+        while True:
+            while len(inflight) < queue_depth:
+                group = []
+                for piece in pieces:
+                    group.append(piece)
+                    if len(group) >= max_ranges:
+                        break
+                if not group:
+                    break
+                cmd = self.dataset_management(nsid, len(group) - 1, 0, 0, 1, pack_ranges(group), nowait=True)
+                inflight[cmd] = sum(nlb for _,nlb in group)
+                range_count += len(group)
+                commands += 1
+            if not inflight:
+                break
+            for cmd in self.reap(min_complete=1):
+                cmd.check_return_status(fail_hint=False, raise_if_fail=True)
+                done += inflight.pop(cmd)
+                if progress:
+                    progress(done, total)
+        seconds = time.perf_counter() - t0
+        return {"lbas": done,
+                "ranges": range_count,
+                "commands": commands,
+                "seconds": seconds,
+                "throughput": done * ns_format["lbads"] / seconds if seconds > 0 else 0,}
+
+
+## SCSI2NVMe loads the whole SCSI command set, it is imported when it is used.
+if sys.version_info < (3, 7):
+    from pydiskcmdlib.pynvme.scsi2nvme import SCSI2NVMe
+else:
+    def __getattr__(name):
+        if name in ("SCSI2NVMe", "SCSI", "SCSICommand", "SCSICheckCondition"):
+            from pydiskcmdlib.pynvme import scsi2nvme
+            value = getattr(scsi2nvme, name)
+            globals()[name] = value
+            return value
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import sys
 from enum import Enum
+from ctypes import sizeof
 from pydiskcmdlib import os_type
 from pydiskcmdlib.exceptions import *
 from pydiskcmdlib.utils.converter import (
@@ -14,11 +15,9 @@ from pydiskcmdlib.utils.converter import (
 from pydiskcmdlib.pynvme import linux_nvme_command
 from pydiskcmdlib.pynvme import win_nvme_command
 from pydiskcmdlib.pynvme.data_buffer import DataBuffer
-from pydiskcmdlib.os.win_ioctl_utils import StorageProtocolStatus
+from pydiskcmdlib.os import win_ioctl_utils
 from pydiskcmdlib.utils.common_lib import enum_find
 from .nvme_status_code import StatusCodeDescription
-#
-sizeof = win_nvme_command.sizeof
 ##
 class AdminCommandOpcode(Enum):
     DeleteIOSQ               = 0x00
@@ -208,30 +207,48 @@ class NVMeCommand(object):
         return result
 
     @staticmethod
-    def _init_data_buffer(data_length=0, data_out=None):
+    def _init_data_buffer(data_length=0, data_out=None, pool=None):
         data_buffer = None
         if data_out:
             _data_len = data_length if data_length > 0 else len(data_out)
-            data_buffer = DataBuffer(_data_len)
+            data_buffer = DataBuffer(_data_len, pool=pool)
             data_buffer.data_buffer = data_out
         else:
-            data_buffer = DataBuffer(data_length)
+            data_buffer = DataBuffer(data_length, pool=pool)
         return data_buffer
 
-    def init_data_buffer(self, data_length=0, data_out=None, data_buffer=None):
+    def init_data_buffer(self, data_length=0, data_out=None, data_buffer=None, pool=None):
+        """
+        :param pool: the BufferPool to draw the data buffer from, None means the default pool if enabled
+        """
         if isinstance(data_buffer, DataBuffer):
             self.__data_buffer = data_buffer
         else:
-            self.__data_buffer = self._init_data_buffer(data_length=data_length, data_out=data_out)
+            self.__data_buffer = self._init_data_buffer(data_length=data_length, data_out=data_out, pool=pool)
         return self.__data_buffer
 
-    def init_metadata_buffer(self, data_length=0, data_out=None, data_buffer=None):
+    def init_metadata_buffer(self, data_length=0, data_out=None, data_buffer=None, pool=None):
         if isinstance(data_buffer, DataBuffer):
             self.__metadata_buffer = data_buffer
         else:
-            self.__metadata_buffer = self._init_data_buffer(data_length=data_length, data_out=data_out)
+            self.__metadata_buffer = self._init_data_buffer(data_length=data_length, data_out=data_out, pool=pool)
         return self.__metadata_buffer
 
+    def release_buffer(self):
+        """
+        release the data and metadata buffer, the pooled buffers go back to pool
+        for the next command. Do not use the command data after release.
+        """
+        for data_buffer in (self.__data_buffer, self.__metadata_buffer):
+            if data_buffer is not None:
+                data_buffer.release()
+        self.__data_buffer = None
+        self.__metadata_buffer = None
+        if os_type == "Linux" and isinstance(self._cdb, linux_nvme_command.CmdStructure):
+            ## the cdb only keeps the address, make cdb.data_buf/metadata_buf None
+            self._cdb._data_buf = None
+            self._cdb._metadata_buf = None
+
     def build_command(self, **kwargs):
         """
         We suppose the command is consist of command-descriptor,in-data or out-data.
@@ -538,6 +555,22 @@ class NVMeCommand(object):
         if self.cdb and self.cdb.metadata_buf:
             return bytes(self.cdb.metadata_buf)
 
+    @property
+    def data_view(self):
+        """
+        the data as a memoryview(format 'B'), without copying it like data does
+        """
+        if self.cdb and self.cdb.data_buf:
+            return memoryview(self.cdb.data_buf).cast('B')
+
+    @property
+    def metadata_view(self):
+        """
+        the metadata as a memoryview(format 'B'), without copying it like metadata does
+        """
+        if self.cdb and self.cdb.metadata_buf:
+            return memoryview(self.cdb.metadata_buf).cast('B')
+
     def _win_execute_check(self):
         SCT,SC =  0,0
         hint = ''
@@ -554,10 +587,10 @@ class NVMeCommand(object):
                     hint = 'DeviceNVMeQueryProtocolData: ProtocolData Offset/Length not valid.'
         elif self._req_id == win_nvme_command.IOCTLRequest.IOCTL_STORAGE_PROTOCOL_COMMAND.value:
             _cdb = win_nvme_command.STORAGE_PROTOCOL_COMMAND.from_buffer_copy(bytearray(self.cdb_struc)) # cdb_struc
-            if _cdb.ReturnStatus not in (StorageProtocolStatus.STORAGE_PROTOCOL_STATUS_SUCCESS.value, StorageProtocolStatus.STORAGE_PROTOCOL_STATUS_PENDING.value):
+            if _cdb.ReturnStatus not in (win_ioctl_utils.StorageProtocolStatus.STORAGE_PROTOCOL_STATUS_SUCCESS.value, win_ioctl_utils.StorageProtocolStatus.STORAGE_PROTOCOL_STATUS_PENDING.value):
                 SCT,SC = 16,3
                 hint = "Unkown Storage Protocol Status"
-                status = enum_find(StorageProtocolStatus, value=_cdb.ReturnStatus)
+                status = enum_find(win_ioctl_utils.StorageProtocolStatus, value=_cdb.ReturnStatus)
                 if status:
                     hint = status.name
         elif self._req_id == win_nvme_command.IOCTLRequest.IOCTL_SCSI_MINIPORT.value:
@@ -11,7 +11,12 @@ from pydiskcmdlib import log
 ## This is cmd type
 
 if os_type == "Linux":
-    from pydiskcmdlib.device.Lin_device import LinIOCTLDevice
+    import os
+    from pydiskcmdlib.device.Lin_device import LinIOCTLDevice,LinIOUringDevice
+    from pydiskcmdlib.os.lin_ioctl_request import IOCTLRequest
+    from pydiskcmdlib.os.lin_io_uring import NVME_URING_CMD_ADMIN,NVME_URING_CMD_IO
+    _uring_cmd_op = {IOCTLRequest.NVME_IOCTL_ADMIN_CMD.value: NVME_URING_CMD_ADMIN,
+                     IOCTLRequest.NVME_IOCTL_IO_CMD.value: NVME_URING_CMD_IO,}
     ## Linux device
     class NVMeDevice(LinIOCTLDevice):
         def __init__(self, 
@@ -19,6 +24,8 @@ if os_type == "Linux":
                      readwrite=False,
                      detect_replugged=True):
             log.debug("Opening NVMe device %s, read write flag %s, detect replugged %s" % (device, readwrite, detect_replugged))
+            ## completed by submit(), but not reaped
+            self._completed = []
             super(NVMeDevice, self).__init__(device, readwrite, detect_replugged)
 
         def execute(self, cmd):
@@ -32,6 +39,121 @@ if os_type == "Linux":
             cmd.result = cmd.cq_status
             return cmd
 
+        def submit(self, cmd):
+            """
+            ioctl is synchronous, the command completes before submit returns,
+            and it will be returned by the next reap().
+
+            :param cmd: a NVMe LinCommand Object
+            :return: a NVMe LinCommand Object
+            """
+            self.execute(cmd)
+            self._completed.append(cmd)
+            return cmd
+
+        def reap(self, min_complete=1):
+            """
+            :return: a list of completed NVMe LinCommand Object
+            """
+            done = list(self._completed)
+            self._completed.clear()
+            return done
+
+    class NVMeIOUringDevice(LinIOUringDevice):
+        """
+        NVMe device with io_uring backend, the commands are sent by IORING_OP_URING_CMD.
+        IO commands need the nvme generic char device(/dev/ngXnY), while admin commands 
+        can be sent to both the controller(/dev/nvmeX) and the generic char device.
+        """
+        def __init__(self, 
+                     device,
+                     readwrite=False,
+                     detect_replugged=True,
+                     queue_depth=32):
+            log.debug("Opening NVMe device %s with io_uring, read write flag %s, detect replugged %s, queue depth %d" % (device, readwrite, detect_replugged, queue_depth))
+            ## (cmd, error) reaped from the ring, but not returned by reap()
+            self._completed = []
+            super(NVMeIOUringDevice, self).__init__(device, readwrite, detect_replugged, queue_depth=queue_depth)
+
+        @property
+        def inflight(self):
+            """
+            the number of commands submitted but not reaped
+            """
+            return LinIOUringDevice.inflight.fget(self) + len(self._completed)
+
+        @staticmethod
+        def _get_uring_cmd_op(cmd):
+            return _uring_cmd_op.get(cmd.req_id)
+
+        def submit(self, cmd):
+            """
+            submit a nvme command (admin, IO) without waiting for the completion,
+            the command object should be kept alive until it is reaped.
+
+            :param cmd: a NVMe LinCommand Object
+            :return: a NVMe LinCommand Object
+            """
+            op = self._get_uring_cmd_op(cmd)
+            if op is None:
+                raise CommandNotSupport("io_uring Do Not Support Request %#x" % cmd.req_id)
+            LinIOUringDevice.submit(self, op, cmd.cdb, obj=cmd)
+            return cmd
+
+        def reap_results(self, min_complete=1):
+            """
+            reap the completed commands, the completion status is set to the commands
+
+            :param min_complete: wait at least min_complete commands to complete
+            :return: a list of (cmd, error), error is None or the OSError of the command
+            """
+            done = self._completed
+            self._completed = []
+            for cmd,res,result in LinIOUringDevice.reap(self, min_complete=max(0, min_complete-len(done))):
+                if res < 0:
+                    cmd.result = res
+                    done.append((cmd, OSError(-res, os.strerror(-res))))
+                else:
+                    cmd.cq_status = res
+                    cmd.result = res
+                    cmd.cdb.result = result
+                    done.append((cmd, None))
+            return done
+
+        def reap(self, min_complete=1):
+            """
+            reap the completed commands, the completion status is set to the commands.
+            If a command fails, its error is raised, and the other completed commands 
+            are kept for the next reap().
+
+            :param min_complete: wait at least min_complete commands to complete
+            :return: a list of completed NVMe LinCommand Object
+            """
+            done = self.reap_results(min_complete=min_complete)
+            for i,(_,error) in enumerate(done):
+                if error:
+                    self._completed = done[:i] + done[i+1:]
+                    raise error
+            return [cmd for cmd,_ in done]
+
+        def execute(self, cmd):
+            """
+            execute a nvme command (admin, IO)
+
+            :param cmd: a NVMe LinCommand Object
+            :return: a NVMe LinCommand Object
+            """
+            op = self._get_uring_cmd_op(cmd)
+            if op is None:
+                ## Reset and subsystem reset, no uring command for them
+                cmd.cq_status = LinIOCTLDevice.execute(self, cmd.req_id, cmd.cdb)
+                cmd.result = cmd.cq_status
+            else:
+                cmd.cq_status,result = LinIOUringDevice.execute(self, op, cmd.cdb)
+                cmd.result = cmd.cq_status
+                cmd.cdb.result = result
+            return cmd
+
 elif os_type == "Windows":
     from pydiskcmdlib.device.win_device import WinIOCTLDevice,BytesReturnedStruc
     class NVMeDevice(WinIOCTLDevice):
@@ -40,6 +162,8 @@ elif os_type == "Windows":
                      readwrite=True,
                      detect_replugged=True):
             log.debug("Opening NVMe device %s, read write flag is %s, detect replugged is %s" % (device, readwrite, detect_replugged))
+            ## completed by submit(), but not reaped
+            self._completed = []
             super(NVMeDevice, self).__init__(device, readwrite, detect_replugged)
 
         def execute(self, cmd):
@@ -62,5 +186,25 @@ elif os_type == "Windows":
             # Usually 0 if it goes into here.
             cmd.cq_status = 0
             return cmd
+
+        def submit(self, cmd):
+            """
+            IOCTL is synchronous, the command completes before submit returns,
+            and it will be returned by the next reap().
+
+            :param cmd: a NVMe WinCommand Object
+            :return: a NVMe WinCommand Object
+            """
+            self.execute(cmd)
+            self._completed.append(cmd)
+            return cmd
+
+        def reap(self, min_complete=1):
+            """
+            :return: a list of completed NVMe WinCommand Object
+            """
+            done = list(self._completed)
+            self._completed.clear()
+            return done
 else:
     raise NotImplementedError("%s not support" % os_type)
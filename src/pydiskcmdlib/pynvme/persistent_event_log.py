@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import zlib
+from pydiskcmdlib.data_buffer import DataBuffer
+from pydiskcmdlib.pynvme.nvme import DefaultMaxChunk,get_chunk_size
+from pydiskcmdlib.exceptions import CommandNotSupport,CommandSequenceError,ParameterIncorrect
+
+## The persistent event log is read in chunks into one reused buffer, and the
+#  events are split out of the chunks as they arrive, so the log is never
+#  concatenated in memory.
+#
+#  The events have no sequence number, so a reader keeps a state of the last
+#  event it returned(the offset, length and crc32 of it, and its timestamp).
+#  If the event is still at the same offset of the log in next run, only the
+#  data after it is read. Otherwise(the log wrapped or the context changed),
+#  the whole log is read and the events not newer than the timestamp are
+#  skipped.
+LogHeaderSize = 512
+EventHeaderSize = 24
+## the action of Get Log Page
+ActionRead = 0
+ActionEstablish = 1
+ActionRelease = 2
+## Command Sequence Error, the context is not established or already established
+SCCommandSequenceError = 0x0C
+
+
+def get_event_length(event_header):
+    """
+    :param event_header: the 24 bytes event header
+    :return: the bytes of the whole event, header included
+    """
+    ## Event Header Length(EHL) is the bytes after byte 2, Event Length(EL) is the bytes after header
+    return event_header[2] + 3 + event_header[22] + (event_header[23] << 8)
+
+
+def get_event_timestamp(event_header):
+    """
+    :param event_header: the 24 bytes event header
+    :return: the event timestamp in milliseconds
+    """
+    return int.from_bytes(bytes(event_header[6:12]), 'little')
+
+
+class PersistentEventLogReader(object):
+    """
+    Read the persistent event log incrementally.
+
+    Usage:
+        reader = PersistentEventLogReader(d)
+        header = reader.establish()
+        try:
+            for offset,event in reader.read_new_events(state):
+                ...
+        finally:
+            reader.release()
+        state = reader.state  # save it for next run
+    """
+    def __init__(self, nvme, uuid=0, max_chunk=DefaultMaxChunk):
+        """
+        :param nvme: a NVMe object
+        :param uuid: the UUID index
+        :param max_chunk: the upper limit of a transfer in bytes
+        """
+        ## LPA bit 4, Persistent Event log
+        if not (nvme.ctrl_identify_info[261] & 0x10):
+            raise CommandNotSupport("Device Not support Persistent Event log.")
+        self.nvme = nvme
+        self.uuid = uuid
+        self.chunk_size = get_chunk_size(nvme.ctrl_identify_info, max_chunk=max_chunk)
+        self.header = None
+        self.state = None
+
+    @property
+    def total_events(self):
+        return int.from_bytes(self.header[4:8], 'little')
+
+    @property
+    def total_log_length(self):
+        return int.from_bytes(self.header[8:16], 'little')
+
+    def _read_header(self, action):
+        cmd = self.nvme.get_persistent_event_log(action, 127, 0, uuid=self.uuid)
+        SC,SCT = cmd.check_return_status(False, False)
+        if SCT == 0 and SC == SCCommandSequenceError:
+            if action == ActionEstablish:
+                raise CommandSequenceError("Context is already established by others")
+            raise CommandSequenceError("Command Sequence Error, may need establish the context")
+        cmd.check_return_status(False, True, raise_if_fail=True)
+        self.header = cmd.data[0:LogHeaderSize]
+        return self.header
+
+    def establish(self):
+        """
+        establish the reporting context and read the log header
+
+        :return: the 512 bytes header
+        """
+        return self._read_header(ActionEstablish)
+
+    def read_header(self):
+        """
+        read the log header, the context should be established
+
+        :return: the 512 bytes header
+        """
+        return self._read_header(ActionRead)
+
+    def release(self):
+        """
+        release the reporting context
+        """
+        cmd = self.nvme.get_persistent_event_log(ActionRelease, 0, 0, uuid=self.uuid)
+        cmd.check_return_status(False, True, raise_if_fail=True)
+
+    def _get_log(self, lpo, data_buffer):
+        cmd = self.nvme.get_persistent_event_log(ActionRead,
+                                                 int(data_buffer.data_length / 4) - 1,
+                                                 lpo,
+                                                 data_buffer=data_buffer,
+                                                 uuid=self.uuid)
+        cmd.check_return_status(False, True, raise_if_fail=True)
+        return cmd
+
+    def read_into(self, buffer, lpo=0):
+        """
+        read the log data into a caller supplied buffer, no data is copied
+
+        :param buffer: a writable buffer, its length should be a multiple of 4
+        :param lpo: the log page offset in bytes, a multiple of 4
+        :return: the bytes read
+        """
+        view = memoryview(buffer).cast('B')
+        if lpo % 4 or len(view) % 4:
+            raise ParameterIncorrect("Log Page Offset and length shall be Dword aligned")
+        pos = 0
+        while pos < len(view):
+            length = min(self.chunk_size, len(view) - pos)
+            self._get_log(lpo + pos, DataBuffer.from_buffer(view[pos:pos+length]))
+            pos += length
+        return pos
+
+    def iter_chunks(self, start, end):
+        """
+        read the log data chunk by chunk, the chunk is a memoryview of a reused buffer,
+        it is only valid before the next chunk is read.
+
+        :param start: the start offset in bytes
+        :param end: the end offset in bytes
+        :return: a generator of (offset, chunk)
+        """
+        ## Log Page Offset shall be Dword aligned
+        aligned = start - (start % 4)
+        if aligned >= end:
+            return
+        buf = DataBuffer(min(self.chunk_size, end - aligned + 3))
+        try:
+            offset = aligned
+            while offset < end:
+                length = min(self.chunk_size, end - offset)
+                xfer = length + ((4 - length % 4) % 4)
+                cmd = self._get_log(offset, DataBuffer.from_buffer(buf.view, xfer))
+                chunk = cmd.data_view[0:length]
+                if offset < start:
+                    yield start,chunk[start-offset:]
+                else:
+                    yield offset,chunk
+                offset += length
+        finally:
+            buf.release()
+
+    def iter_events(self, start=LogHeaderSize, end=None):
+        """
+        read the events as they arrive
+
+        :param start: the offset of the first event
+        :param end: the end offset, None means the Total Log Length
+        :return: a generator of (offset, event bytes), the event bytes includes the event header
+        """
+        if self.header is None:
+            raise CommandSequenceError("Need read the log header first")
+        if end is None:
+            end = self.total_log_length
+        ## the bytes of a event which is not complete in the chunk
+        carry = bytearray()
+        carry_offset = start
+        for offset,chunk in self.iter_chunks(start, end):
+            if carry:
+                carry += chunk
+                data = memoryview(carry)
+                base = carry_offset
+            else:
+                data = chunk
+                base = offset
+            pos = 0
+            while len(data) - pos >= EventHeaderSize:
+                event_len = get_event_length(data[pos:pos+EventHeaderSize])
+                if len(data) - pos < event_len:
+                    break
+                yield base+pos,bytes(data[pos:pos+event_len])
+                pos += event_len
+            rest = bytes(data[pos:])
+            data = None
+            carry = bytearray(rest)
+            carry_offset = base + pos
+
+    def _check_state(self, state):
+        """
+        :return: (the offset to read from, the timestamp to skip the events not newer than it)
+        """
+        if not state or state.get("sn") != self.header[56:76].hex():
+            return LogHeaderSize,None
+        last_offset,last_length,last_crc = state["last_event"]
+        if last_offset + last_length <= self.total_log_length:
+            aligned = last_offset - (last_offset % 4)
+            buf = bytearray((last_offset + last_length - aligned + 3) & ~3)
+            self.read_into(buf, lpo=aligned)
+            if zlib.crc32(buf[last_offset-aligned:last_offset-aligned+last_length]) == last_crc:
+                return last_offset + last_length,None
+        return LogHeaderSize,state["timestamp"]
+
+    def read_new_events(self, state=None):
+        """
+        read the events newer than the state, and update self.state
+
+        :param state: the state(reader.state) of last run, None means read all the events
+        :return: a generator of (offset, event bytes)
+        """
+        if self.header is None:
+            raise CommandSequenceError("Need read the log header first")
+        self.state = dict(state) if state else None
+        start,timestamp = self._check_state(state)
+        sn = self.header[56:76].hex()
+        for offset,event in self.iter_events(start=start):
+            event_timestamp = get_event_timestamp(event)
+            if timestamp is not None and event_timestamp <= timestamp:
+                continue
+            self.state = {"sn": sn,
+                          "last_event": [offset, len(event), zlib.crc32(event)],
+                          "timestamp": event_timestamp,}
+            yield offset,event
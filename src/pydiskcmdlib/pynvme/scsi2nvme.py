@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from pydiskcmdlib.exceptions import *
+from pydiskcmdlib.pynvme.nvme_command import CommandTimeout
+from pydiskcmdlib.pyscsi.scsi import SCSI
+from pyscsi.pyscsi.scsi_command import SCSICommand
+from pydiskcmdlib import os_type
+from pyscsi.pyscsi.scsi_sense import SCSICheckCondition
+from pydiskcmdlib.pynvme.nvme_status_code import get_nvme_status_code_without_status_code,StatusCodeDescription
+from pydiskcmdlib.pyscsi.scsi_cdb_synchronizecache import SynchronizeCache16
+from pyscsi.pyscsi.scsi_enum_command import sbc
+#####
+SCSICmdOPCode = sbc.SYNCHRONIZE_CACHE_16
+#####
+class SCSI2NVMeFlush(SynchronizeCache16):
+    def __init__(self,
+                 nsid,   # ignored by command
+                 timeout=CommandTimeout.nvm.value, # ignored by command
+                 ):
+        SynchronizeCache16.__init__(self,
+                                    SCSICmdOPCode,
+                                    0,   # start fronm lba 0
+                                    0,   # all lbas that start form lba 0
+                                    )
+
+
+def _check_nvme_return_status(self: SCSICommand, success_hint: bool=False, fail_hint: bool = True, raise_if_fail: bool=True) -> bool:
+    """
+    Check the return status of the NVMe command.
+
+    Until Now, IOCTL status code cannot be obtained by the library, so only check sense key, acs,ascq.
+    """
+    _status  = False
+    _fail_hint = ''
+    sense_data = None
+    if self.sense:
+        sense_data = self.sense
+    elif self.raw_sense_data:
+        sense_data = self.raw_sense_data
+    else:
+        _status = True
+    ##
+    if sense_data:
+        sense = SCSICheckCondition(sense_data)
+        if sense.valid:
+            if sense.data:
+                if sense.data["sense_key"] == 0 and sense._ascq == 0:
+                    _status = True   
+                else:
+                    _fail_hint = str(sense)
+                    if fail_hint:
+                        status_code = get_nvme_status_code_without_status_code(sense.data["sense_key"], sense.asc, sense.ascq)
+                        _hint = """Command failed, and details bellow.
+- SCSI Status:
+  %-12s%-19s%s
+  %-12s%-19s%s
+- Mapping to Possible NVMe Status Code:
+  %-20s%-18s%s""" % ("Sense Key", "ASC", "ASCQ", 
+                     "0x%X" % sense.data.get("sense_key"), "0x%X" % sense.asc, "0x%X" % sense.ascq,
+                     "Status Code Type", "Status Code", "Status Code Description",
+                    )
+                        print (_hint)
+                        if status_code:
+                            for i in status_code.values():
+                                for code in i:
+                                    print ("  %-20s%-18s%s" % ("0x%X" % code[0], "0x%X" % code[1], StatusCodeDescription.get(code)))
+                        else:
+                            print ("  %-20s%-18s%s" % ("Unknown", "Unknown", "Unknown"))
+            else:
+                _fail_hint = "Invalid sense data format"
+        else:
+            _fail_hint = "Invalid sense data"
+    if _status:
+        if success_hint:
+            print ("Command Success")
+            print ('')
+    else:
+        if fail_hint:
+            print (_fail_hint)
+        if raise_if_fail:
+            raise CommandReturnStatusError(_fail_hint)
+    return _status
+
+class SCSI2NVMe(SCSI):
+    if os_type == "Windows":
+        # From StorNVMe SCSI Translation Support
+        support_commands = (
+            0x48,   # SANITIZE
+            0x12,   # Inquiry
+            0x4D,   # Log Sense
+            0x55,   # Mode Select 10
+            0x5A,   # Mode Sense 10
+            0x28,   # Read10
+            0x88,   # Read16
+            0x25,   # Read Capacity 10
+            0x10,   # Read Capacity 16
+            # Read Data Buffer 16
+            0xA0,   # Report Luns
+            0xA2,   # Security Protocal in
+            0xB5,   # Security Protocol out
+            0x1D,   # Send Diagnostic
+            0x1B,   # Start Stop Unit
+            0x35,   # SYNCHRONIZE_CACHE_10
+            0x00,   # Test Unit Ready
+            0x42,   # Unmap
+            0x2F,   # Verify10
+            0x8F,   # Verify16
+            0x2A,   # Write10
+            0x8A,   # Write16
+            0x3B,   # Write Buffer
+            0x9E,   # internal used by pyscsi, user should not use it
+        )
+        SCSICommand.check_nvme_return_status = _check_nvme_return_status
+    else:
+        # Support by 'NVM-Express-SCSI-Translation-Reference-1_1-Gold'
+        support_commands = (
+            0x12,   # Inquiry
+            0x4D,   # Log Sense
+            0x15,   # Mode Select 6
+            0x55,   # Mode Select 10
+            0x1A,   # Mode Sense 6
+            0x5A,   # Mode Sense 10
+            0xA0,   # Report Luns
+            0x03,   # Request Sense
+            0xA2,   # Security Protocal in
+            0xB5,   # Security Protocol out
+            0x1B,   # Start Stop Unit
+            0x00,   # Test Unit Ready
+            0x3B,   # Write Buffer
+            0x89,   # Compare And Write
+            0x04,   # Format Unit
+            0x08,   # Read6
+            0x28,   # Read10
+            0xA8,   # Read12
+            0x88,   # Read16
+            0x25,   # Read Capacity 10
+            0x10,   # Read Capacity 16
+            0x35,   # SYNCHRONIZE_CACHE_10
+            0x91,   # SYNCHRONIZE_CACHE_16
+            0x42,   # Unmap
+            0x0A,   # Write6
+            0x2A,   # Write10
+            0xAA,   # Write12
+            0x8A,   # Write16
+            0x3F,   # Write Long 10
+            0x9F,   # Write Long 16
+            0x9E,   # internal used by pyscsi, user should not use it
+        )
+    def __init__(self, 
+                 dev,
+                 blocksize=0):
+        super(SCSI2NVMe, self).__init__(dev, blocksize=blocksize)
+
+    def execute(self, cmd: SCSICommand, en_raw_sense=False):
+        if cmd.opcode.value in SCSI2NVMe.support_commands:
+            return SCSI.execute(self, cmd, en_raw_sense=en_raw_sense)
+        else:
+            raise CommandNotSupport("SCSI Translation to NVMe Do Not Support OPCode: 0x%x" % cmd.opcode.value)
@@ -0,0 +1,213 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import time
+from pydiskcmdlib import log
+from pydiskcmdlib.data_buffer import DataBuffer
+from pydiskcmdlib.pynvme.nvme import DefaultMaxChunk,DefaultMinPageSize,get_chunk_size
+from pydiskcmdlib.exceptions import CommandNotSupport,ParameterIncorrect
+
+## The telemetry log is read in blocks of 512 bytes, the header is block 0.
+#  Every Get Log Page here transfers as many blocks as the controller allows
+#  (MDTS, and NUMDU/offset by LPA), into one buffer reused by all the chunks,
+#  and the chunk is written to output before the next one is read.
+TelemetryBlockSize = 512
+## the compression of output
+CompressMethods = ("gzip", "bz2", "xz")
+
+
+def get_data_area_last_block(header, data_area):
+    """
+    get the last block of a data area from telemetry log header
+
+    :param header: the first 512 bytes of telemetry log
+    :param data_area: 1, 2, 3 or 4
+    :return: the last block number(0's based, the header is block 0)
+    """
+    if data_area == 1:
+        return header[8] + (header[9] << 8)
+    elif data_area == 2:
+        return header[10] + (header[11] << 8)
+    elif data_area == 3:
+        return header[12] + (header[13] << 8)
+    elif data_area == 4:
+        ## data area 4 covers data area 1-3
+        return max(header[16] + (header[17] << 8) + (header[18] << 16) + (header[19] << 24),
+                   header[12] + (header[13] << 8))
+    raise ParameterIncorrect("data area should be 1|2|3|4")
+
+
+def _open_compress(fileobj, method):
+    if method == "gzip":
+        import gzip
+        return gzip.GzipFile(fileobj=fileobj, mode="wb")
+    elif method == "bz2":
+        import bz2
+        return bz2.BZ2File(fileobj, mode="wb")
+    elif method == "xz":
+        import lzma
+        return lzma.LZMAFile(fileobj, mode="wb")
+    raise ParameterIncorrect("compress should be one of %s" % ",".join(CompressMethods))
+
+
+class TelemetryCollector(object):
+    """
+    Stream the host-initiated or controller-initiated telemetry log to a file.
+
+    Usage:
+        with NVMe(init_device("/dev/nvme0", open_t='nvme')) as d:
+            result = TelemetryCollector(d, data_area=3).collect("telemetry.bin")
+    """
+    def __init__(self,
+                 nvme,
+                 host_initiated=True,
+                 data_area=3,
+                 create_telemetry=0,
+                 uuid=0,
+                 max_chunk=DefaultMaxChunk,
+                 min_page_size=DefaultMinPageSize):
+        """
+        :param nvme: a NVMe object
+        :param host_initiated: True for host-initiated telemetry log, False for controller-initiated
+        :param data_area: read data area 1 to data_area, 1|2|3|4
+        :param create_telemetry: 1 means the controller creates a new host-initiated telemetry data
+        :param uuid: the UUID index
+        :param max_chunk: the upper limit of a transfer in bytes
+        :param min_page_size: the CAP.MPSMIN in bytes
+        """
+        if data_area not in (1, 2, 3, 4):
+            raise ParameterIncorrect("data area should be 1|2|3|4")
+        ctrl_identify_info = nvme.ctrl_identify_info
+        ## LPA bit 3, Telemetry Host-Initiated and Telemetry Controller-Initiated log pages
+        if not (ctrl_identify_info[261] & 0x08):
+            raise CommandNotSupport("Device Not support Telemetry log.")
+        ## LPA bit 6, Telemetry Log Data Area 4
+        if data_area == 4 and not (ctrl_identify_info[261] & 0x40):
+            raise CommandNotSupport("Device Not support Telemetry data area 4.")
+        self.nvme = nvme
+        self.host_initiated = host_initiated
+        self.data_area = data_area
+        self.create_telemetry = create_telemetry
+        self.uuid = uuid
+        self.chunk_size = get_chunk_size(ctrl_identify_info, max_chunk=max_chunk, min_page_size=min_page_size)
+        ## the command count of last collect
+        self._commands = 0
+
+    def _get_log(self, offset, length, data_buffer, create_telemetry=0):
+        numd = int(length / 4) - 1
+        kwargs = {"lpol": offset & 0xFFFFFFFF,
+                  "lpou": (offset >> 32) & 0xFFFFFFFF,
+                  "uuid": self.uuid,
+                  "numdu": (numd >> 16) & 0xFFFF,
+                  "data_buffer": data_buffer,}
+        if self.host_initiated:
+            cmd = self.nvme.telemetry_host_log(numd & 0xFFFF, create_telemetry=create_telemetry, **kwargs)
+        else:
+            cmd = self.nvme.telemetry_ctrl_log(numd & 0xFFFF, **kwargs)
+        self._commands += 1
+        cmd.check_return_status(raise_if_fail=True)
+        return cmd
+
+    def read_header(self, create_telemetry=0):
+        """
+        read the telemetry log header
+
+        :param create_telemetry: 1 means the controller creates a new host-initiated telemetry data
+        :return: the 512 bytes header
+        """
+        cmd = self._get_log(0, TelemetryBlockSize, None, create_telemetry=create_telemetry)
+        return cmd.data[0:TelemetryBlockSize]
+
+    def get_total_length(self, header):
+        """
+        :param header: the telemetry log header
+        :return: the bytes of the log to collect, header included
+        """
+        return (get_data_area_last_block(header, self.data_area) + 1) * TelemetryBlockSize
+
+    def iter_chunks(self, start=0, header=None):
+        """
+        read the telemetry log chunk by chunk, the chunk is a memoryview of a reused buffer,
+        it is only valid before the next chunk is read.
+
+        :param start: the start offset in bytes, a multiple of 512
+        :param header: the header read by read_header(), None means read it here
+        :return: a generator of (offset, chunk)
+        """
+        if start % TelemetryBlockSize:
+            raise ParameterIncorrect("start offset should be a multiple of %d" % TelemetryBlockSize)
+        if header is None:
+            header = self.read_header(create_telemetry=self.create_telemetry)
+        total = self.get_total_length(header)
+        if start == 0:
+            yield 0,memoryview(header)
+            start = TelemetryBlockSize
+        if start >= total:
+            return
+        buf = DataBuffer(min(self.chunk_size, total - start))
+        try:
+            offset = start
+            while offset < total:
+                length = min(self.chunk_size, total - offset)
+                data_buffer = DataBuffer.from_buffer(buf.view, length)
+                ## the cmd keeps the data alive until the next chunk
+                cmd = self._get_log(offset, length, data_buffer)
+                yield offset,cmd.data_view[0:length]
+                offset += length
+        finally:
+            buf.release()
+
+    def collect(self, output, resume=False, compress=None, progress=None):
+        """
+        collect the telemetry log to output
+
+        :param output: a file path, or a writable file object
+        :param resume: continue a partial dump of file path, if the header of it matches the device
+        :param compress: None, or one of CompressMethods
+        :param progress: a function called after every chunk, progress(done_bytes, total_bytes)
+        :return: a dict of "bytes", "total", "resumed", "commands", "seconds" and "throughput"(bytes/s)
+        """
+        if compress is not None and compress not in CompressMethods:
+            raise ParameterIncorrect("compress should be one of %s" % ",".join(CompressMethods))
+        if resume and (compress is not None or not isinstance(output, str)):
+            raise ParameterIncorrect("Only an uncompressed file path can be resumed")
+        self._commands = 0
+        t0 = time.perf_counter()
+        start = 0
+        header = self.read_header(create_telemetry=0 if resume else self.create_telemetry)
+        total = self.get_total_length(header)
+        if resume and os.path.isfile(output):
+            f = open(output, 'r+b')
+            exist_header = f.read(TelemetryBlockSize)
+            if exist_header == header:
+                start = min(os.path.getsize(output), total)
+                start -= start % TelemetryBlockSize
+            else:
+                log.warning("The telemetry header of %s does not match the device, collect from start" % output)
+            f.seek(start)
+            f.truncate()
+        elif isinstance(output, str):
+            f = open(output, 'wb')
+        else:
+            f = output
+        out = _open_compress(f, compress) if compress else f
+        done = start
+        try:
+            for offset,chunk in self.iter_chunks(start=start, header=header):
+                out.write(chunk)
+                done = offset + len(chunk)
+                if progress:
+                    progress(done, total)
+        finally:
+            if out is not f:
+                out.close()
+            if f is not output:
+                f.close()
+        seconds = time.perf_counter() - t0
+        return {"bytes": done - start,
+                "total": total,
+                "resumed": start,
+                "commands": self._commands,
+                "seconds": seconds,
+                "throughput": (done - start) / seconds if seconds > 0 else 0,}
@@ -0,0 +1,328 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import time
+import struct
+from pydiskcmdlib.exceptions import ParameterIncorrect,CommandNotSupport,ExecuteCmdErr
+from pydiskcmdlib.pynvme.nvme import get_ns_format
+
+## The wipe planner erases all the namespaces of a controller. It finds the
+#  wipe methods the controller supports, estimates their time, and runs the
+#  fastest one of the wanted level.
+#
+#  The levels, a method of a higher level also meets the lower levels:
+#    deallocate   the LBAs are deallocated, Dataset Management is advisory, the
+#                 controller may keep some of the data
+#    clear        the user data reads back as zeroes
+#    purge        the user data is erased from the media(Sanitize, or Format NVM
+#                 with Secure Erase)
+WipeLevelDeallocate = 0
+WipeLevelClear = 1
+WipeLevelPurge = 2
+WipeLevelNames = {"deallocate": WipeLevelDeallocate,
+                  "clear": WipeLevelClear,
+                  "purge": WipeLevelPurge,
+                  }
+
+## the methods in preferred order, when the estimated time is the same
+WipeMethods = ("sanitize-crypto",
+               "format-crypto",
+               "sanitize-block",
+               "format-erase",
+               "sanitize-overwrite",
+               "write-zeroes",
+               "deallocate",
+               )
+
+## Sanitize Action
+SanitizeBlockErase = 2
+SanitizeOverwrite = 3
+SanitizeCryptoErase = 4
+## Sanitize Status(SSTAT bits 2:0)
+SanitizeStatusNever = 0
+SanitizeStatusSuccess = 1
+SanitizeStatusInProgress = 2
+SanitizeStatusFailed = 3
+SanitizeStatusSuccessNoDeallocate = 4
+## the estimated time in the sanitize log is not reported
+NoEstimate = 0xFFFFFFFF
+
+## When the controller does not report the time, the guessed time, they are
+#  rough but keep the crypto erase ahead of the media erase, and the media
+#  erase ahead of writing the whole capacity.
+GuessedCryptoEraseSeconds = 10
+GuessedBlockEraseSeconds = 120
+GuessedWriteBandwidth = 1024 * 1024 * 1024
+GuessedCommandSeconds = 0.001
+
+_sanitize_log_struct = struct.Struct("<HHIIII")
+
+
+def decode_sanitize_estimates(log_data):
+    """
+    :param log_data: the sanitize status log page
+    :return: a dict of sanitize action: the estimated seconds, None means not reported
+    """
+    _,_,_,overwrite,block_erase,crypto_erase = _sanitize_log_struct.unpack_from(log_data)
+    return {action: (None if t == NoEstimate else t) for action,t in ((SanitizeOverwrite, overwrite),
+                                                                      (SanitizeBlockErase, block_erase),
+                                                                      (SanitizeCryptoErase, crypto_erase))}
+
+
+def wait_sanitize(nvme, estimate=None, progress=None, min_interval=0.1, max_interval=10.0, timeout=None):
+    """
+    poll the sanitize log until the sanitize operation completes. The poll interval
+    follows the progress rate, and backs off(x2) while the progress does not move.
+
+    :param nvme: a NVMe object
+    :param estimate: the estimated seconds of the sanitize, None means unknown
+    :param progress: a callable(done, total), done is SPROG, total is 65536
+    :param min_interval: the min poll interval in seconds
+    :param max_interval: the max poll interval in seconds
+    :param timeout: the max seconds to wait, None means no limit
+    :return: the Sanitize Status
+    """
+    t0 = time.monotonic()
+    interval = min(max(estimate / 20, min_interval), max_interval) if estimate else min_interval
+    last_sprog,last_time = None,t0
+    while True:
+        cmd = nvme.sanitize_log(127)
+        cmd.check_return_status(False, raise_if_fail=True)
+        sprog,sstat = _sanitize_log_struct.unpack_from(cmd.data)[0:2]
+        sstat &= 0x07
+        now = time.monotonic()
+        if sstat in (SanitizeStatusSuccess, SanitizeStatusSuccessNoDeallocate):
+            if progress:
+                progress(65536, 65536)
+            return sstat
+        if sstat == SanitizeStatusFailed:
+            raise ExecuteCmdErr("Sanitize failed")
+        if sstat == SanitizeStatusInProgress:
+            if progress:
+                progress(sprog, 65536)
+            if last_sprog is not None and sprog > last_sprog:
+                ## poll about 4 times in the remaining time
+                remaining = (65536 - sprog) * (now - last_time) / (sprog - last_sprog)
+                interval = min(max(remaining / 4, min_interval), max_interval)
+            else:
+                interval = min(interval * 2, max_interval)
+            if last_sprog is None or sprog != last_sprog:
+                last_sprog,last_time = sprog,now
+        else:
+            ## the sanitize operation is not started yet
+            interval = min(interval * 2, max_interval)
+        if timeout is not None and now - t0 + interval > timeout:
+            raise ExecuteCmdErr("Sanitize is not completed in %d seconds" % timeout)
+        time.sleep(interval)
+
+
+class WipePlanner(object):
+    """
+    Plan and run the fastest wipe of all the namespaces of a controller.
+
+    Usage:
+        with NVMe(init_device("/dev/nvme0")) as d:
+            planner = WipePlanner(d)
+            result = planner.wipe("purge")
+    """
+    def __init__(self, nvme):
+        """
+        :param nvme: a NVMe object
+        """
+        self.nvme = nvme
+        id_ctrl = nvme.ctrl_identify_info
+        self.oacs = int.from_bytes(bytes(id_ctrl[256:258]), 'little')
+        self.sanicap = int.from_bytes(bytes(id_ctrl[328:332]), 'little')
+        self.oncs = int.from_bytes(bytes(id_ctrl[520:522]), 'little')
+        self.fna = id_ctrl[524]
+        ## the active namespaces, and their format and DLFEAT
+        self.namespaces = {}
+        cmd = nvme.active_ns_ids()
+        cmd.check_return_status(False, raise_if_fail=True)
+        data = cmd.data
+        for i in range(0, len(data), 4):
+            ns_id = int.from_bytes(data[i:i+4], 'little')
+            if ns_id == 0:
+                break
+            cmd = nvme.id_ns(ns_id)
+            cmd.check_return_status(False, raise_if_fail=True)
+            info = get_ns_format(cmd.data)
+            info["dlfeat"] = cmd.data[33]
+            self.namespaces[ns_id] = info
+        if not self.namespaces:
+            raise CommandNotSupport("No active namespace")
+        ## the estimated time of sanitize
+        self.sanitize_estimates = {}
+        if self.sanicap & 0x07:
+            cmd = nvme.sanitize_log(127)
+            SC,SCT = cmd.check_return_status(False, fail_hint=False)
+            if SC == 0 and SCT == 0:
+                self.sanitize_estimates = decode_sanitize_estimates(cmd.data)
+
+    @property
+    def total_bytes(self):
+        return sum(v["nsze"] * v["lbads"] for v in self.namespaces.values())
+
+    def _format_nsid(self):
+        """
+        :return: the nsid of Format NVM, 0xFFFFFFFF means all the namespaces, None means
+                 to format every namespace
+        """
+        ## FNA bit 0 format, bit 1 secure erase applies to all namespaces
+        if self.fna & 0x03:
+            formats = set((v["lbaf"], v["extended"], v["dps"]) for v in self.namespaces.values())
+            if len(formats) > 1:
+                raise CommandNotSupport("Format NVM applies to all namespaces, but they are in different formats")
+            return 0xFFFFFFFF
+        return None
+
+    def _candidate(self, method, level, seconds, reported):
+        return {"method": method,
+                "level": level,
+                "seconds": seconds,
+                "reported": reported,
+                "order": WipeMethods.index(method),}
+
+    def candidates(self, level="purge"):
+        """
+        the wipe methods of the level or higher, the controller supports
+
+        :param level: deallocate|clear|purge
+        :return: a list of dict, the fastest first, the dict keys:
+                 "method", "level", "seconds"(the estimated time), "reported"(the time is reported by the controller)
+        """
+        if level not in WipeLevelNames:
+            raise ParameterIncorrect("level should be %s" % "|".join(WipeLevelNames.keys()))
+        level = WipeLevelNames[level]
+        total_lbas = sum(v["nsze"] for v in self.namespaces.values())
+        result = []
+        ## Sanitize, SANICAP bit 0 crypto erase, bit 1 block erase, bit 2 overwrite
+        for action,method,bit,guess in ((SanitizeCryptoErase, "sanitize-crypto", 0x01, GuessedCryptoEraseSeconds),
+                                        (SanitizeBlockErase, "sanitize-block", 0x02, GuessedBlockEraseSeconds),
+                                        (SanitizeOverwrite, "sanitize-overwrite", 0x04, self.total_bytes / GuessedWriteBandwidth)):
+            if self.sanicap & bit:
+                t = self.sanitize_estimates.get(action)
+                result.append(self._candidate(method, WipeLevelPurge, guess if t is None else t, t is not None))
+        ## Format NVM(OACS bit 1), with user data erase, or crypto erase(FNA bit 2). The
+        #  controller does not report the time, the sanitize time is the closest one.
+        if self.oacs & 0x02:
+            try:
+                self._format_nsid()
+            except CommandNotSupport:
+                pass
+            else:
+                for action,method,supported,guess in ((SanitizeCryptoErase, "format-crypto", self.fna & 0x04, GuessedCryptoEraseSeconds),
+                                                      (SanitizeBlockErase, "format-erase", True, GuessedBlockEraseSeconds)):
+                    if supported:
+                        t = self.sanitize_estimates.get(action)
+                        result.append(self._candidate(method, WipeLevelPurge, guess if t is None else t, False))
+        ## Write Zeroes(ONCS bit 3), deallocate the LBAs if all the namespaces support DEAC(DLFEAT bit 3)
+        #  and read the deallocated LBAs as zeroes(DLFEAT bits 2:0 001b)
+        if level <= WipeLevelClear and self.oncs & 0x08:
+            if self.write_zeroes_deallocate:
+                seconds = total_lbas / 0x10000 * GuessedCommandSeconds
+            else:
+                seconds = self.total_bytes / GuessedWriteBandwidth
+            result.append(self._candidate("write-zeroes", WipeLevelClear, seconds, False))
+        ## Dataset Management(ONCS bit 2)
+        if level <= WipeLevelDeallocate and self.oncs & 0x04:
+            ## 256 ranges of 4G blocks at most per command
+            seconds = max(1, total_lbas / (256 * 0xFFFFFFFF)) * GuessedCommandSeconds
+            result.append(self._candidate("deallocate", WipeLevelDeallocate, seconds, False))
+        result.sort(key=lambda x: (x["seconds"], x["order"]))
+        return result
+
+    @property
+    def write_zeroes_deallocate(self):
+        return all((v["dlfeat"] & 0x0F) == 0x09 for v in self.namespaces.values())
+
+    def _write_zeroes(self, progress=None):
+        deac = 1 if self.write_zeroes_deallocate else 0
+        ## the Write Zeroes Size Limit(WZSL), in units of the min memory page size,
+        #  which is 4KiB at least
+        max_nlb = 0x10000
+        cmd = self.nvme.id_ctrl_csi()
+        SC,SCT = cmd.check_return_status(False, fail_hint=False)
+        wzsl = cmd.data[1] if (SC == 0 and SCT == 0) else 0
+        queue_depth = getattr(self.nvme.device, "queue_depth", 1)
+        total = sum(v["nsze"] for v in self.namespaces.values())
+        done = 0
+        for ns_id,info in self.namespaces.items():
+            nlb = max_nlb
+            if wzsl:
+                mpsmin = 4096
+                nlb = max(1, min(max_nlb, ((1 << wzsl) * mpsmin) // info["lbads"]))
+            lba,inflight = 0,{}
+            while lba < info["nsze"] or inflight:
+                while lba < info["nsze"] and len(inflight) < queue_depth:
+                    n = min(nlb, info["nsze"] - lba)
+                    cmd = self.nvme.write_zeroes(ns_id, lba, n - 1, deac=deac, nowait=True)
+                    inflight[cmd] = n
+                    lba += n
+                for cmd in self.nvme.reap(min_complete=1):
+                    cmd.check_return_status(False, raise_if_fail=True)
+                    done += inflight.pop(cmd)
+                    if progress:
+                        progress(done, total)
+
+    def _format(self, ses):
+        nsid = self._format_nsid()
+        for ns_id,info in self.namespaces.items():
+            dps = info["dps"]
+            cmd = self.nvme.nvme_format(info["lbaf"],
+                                        nsid=ns_id if nsid is None else nsid,
+                                        mset=1 if info["extended"] else 0,
+                                        pi=dps & 0x07,
+                                        pil=(dps >> 3) & 0x01,
+                                        ses=ses)
+            cmd.check_return_status(False, raise_if_fail=True)
+            if nsid is not None:
+                break
+
+    def run(self, method, progress=None, timeout=None):
+        """
+        run a wipe method
+
+        :param method: one of WipeMethods
+        :param progress: a callable(done, total)
+        :param timeout: the max seconds to wait the sanitize, None means no limit
+        :return: the seconds
+        """
+        if method not in WipeMethods:
+            raise ParameterIncorrect("method should be %s" % "|".join(WipeMethods))
+        t0 = time.monotonic()
+        if method.startswith("sanitize-"):
+            action = {"sanitize-crypto": SanitizeCryptoErase,
+                      "sanitize-block": SanitizeBlockErase,
+                      "sanitize-overwrite": SanitizeOverwrite}[method]
+            cmd = self.nvme.sanitize(action, 0, 1, 0, 0)
+            cmd.check_return_status(False, raise_if_fail=True)
+            wait_sanitize(self.nvme, estimate=self.sanitize_estimates.get(action), progress=progress, timeout=timeout)
+        elif method == "format-crypto":
+            self._format(2)
+        elif method == "format-erase":
+            self._format(1)
+        elif method == "write-zeroes":
+            self._write_zeroes(progress=progress)
+        else:
+            for ns_id in self.namespaces:
+                self.nvme.deallocate(ns_id, progress=progress)
+        self.nvme.invalidate_ns_format()
+        return time.monotonic() - t0
+
+    def wipe(self, level="purge", progress=None, timeout=None):
+        """
+        run the fastest wipe method of the level
+
+        :param level: deallocate|clear|purge
+        :param progress: a callable(done, total)
+        :param timeout: the max seconds to wait the sanitize, None means no limit
+        :return: a dict of "method", "estimated"(seconds), "seconds"
+        """
+        candidates = self.candidates(level)
+        if not candidates:
+            raise CommandNotSupport("No wipe method of level %s" % level)
+        method = candidates[0]
+        return {"method": method["method"],
+                "estimated": method["seconds"],
+                "seconds": self.run(method["method"], progress=progress, timeout=timeout),}
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from pydiskcmdlib.async_cmd import AsyncCommandBase
+from pydiskcmdlib.pysata.sata import SATA
+from pydiskcmdlib.pysata.ata_cdb_identify import Identify16 as Identify
+from pydiskcmdlib.pysata.ata_cdb_smart import SmartReadData16 as SmartReadData
+from pydiskcmdlib.pysata.ata_cdb_readDMAEXT16 import ReadDMAEXT16
+from pydiskcmdlib.pysata.ata_cdb_writeDMAEXT16 import WriteDMAEXT16
+
+
+class AsyncSATA(AsyncCommandBase):
+    """
+    The asyncio front-end of SATA, all the SATA methods can be awaited, like:
+        sata = await AsyncSATA.open(init_device("/dev/sg1"))
+        cmd = await sata.smart_read_data()
+    See pydiskcmdlib.async_cmd.AsyncCommandBase for more detail.
+    """
+    _sync_class = SATA
+
+    async def execute(self, cmd, check_return_status=True):
+        """
+        send a ata command
+
+        :param cmd: a SCSICommand object
+        """
+        if self._engine:
+            await self._execute_native(cmd, en_raw_sense=True)
+            if check_return_status:
+                cmd.ata_status_return_descriptor
+            return cmd
+        await self._run(self._sync.execute, cmd, check_return_status=check_return_status)
+        return cmd
+
+    async def identify(self):
+        cmd = await self.execute(Identify())
+        cmd.unmarshall()
+        return cmd
+
+    async def smart_read_data(self, smart_key=None):
+        cmd = await self.execute(SmartReadData(smart_key))
+        cmd.unmarshall()
+        return cmd
+
+    async def read_DMAEXT16(self, lba, tl):
+        return await self.execute(ReadDMAEXT16(lba, tl, self._sync.blocksize))
+
+    async def write_DMAEXT16(self, lba, tl, data):
+        return await self.execute(WriteDMAEXT16(lba, tl, data, self._sync.blocksize))
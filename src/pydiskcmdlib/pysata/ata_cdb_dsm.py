@@ -14,8 +14,36 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program; if not, see <http://www.gnu.org/licenses/>.
+import struct
 from pydiskcmdlib.pysata.ata_command import ATACommand16
 
+## A LBA Range Entry is 8 bytes, LBA in bits 47:0 and Range Length in bits 63:48,
+#  64 entries in a 512 bytes block, the entry of Range Length 0 is ignored.
+DSMEntrySize = 8
+DSMEntriesPerBlock = 64
+DSMMaxRangeLength = 0xFFFF
+DSMBlockSize = 512
+_entry_struct = struct.Struct("<Q")
+
+
+def pack_dsm_entries(ranges, buffer):
+    """
+    pack the LBA ranges into the LBA Range Entries, the rest of buffer is cleared
+
+    :param ranges: a sequence of (lba, length), length is 1-65535
+    :param buffer: a writable buffer, a multiple of 512 bytes
+    :return: the number of 512 bytes blocks used
+    """
+    view = memoryview(buffer).cast('B')
+    n = len(ranges)
+    if n * DSMEntrySize > len(view):
+        raise ValueError("Too many LBA ranges for the buffer")
+    for i,(lba,length) in enumerate(ranges):
+        _entry_struct.pack_into(view, i * DSMEntrySize, (lba & 0xFFFFFFFFFFFF) | (length << 48))
+    blocks = max(1, -(-n // DSMEntriesPerBlock))
+    view[n*DSMEntrySize:blocks*DSMBlockSize] = bytes(blocks*DSMBlockSize - n*DSMEntrySize)
+    return blocks
+
 
 class DSM(ATACommand16):
     """
@@ -23,10 +51,11 @@ class DSM(ATACommand16):
     """
     def __init__(self,
                  feature,
-                 data):
+                 data,
+                 count=1):
         ATACommand16.__init__(self,
                               feature,   # fetures
-                              1,         # count
+                              count,     # count
                               0,         # lba
                               0,         # device
                               0x06,      # command
@@ -1,7 +1,6 @@
 # SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
-import platform
 from pydiskcmdlib.utils.enum import Enum
 from pydiskcmdlib.utils.converter import scsi_int_to_ba
 from pydiskcmdlib.exceptions import ExecuteCmdErr,SenseDataCheckErr
@@ -29,6 +28,7 @@ def GetLinuxKernelVer():
                the system is not Linux or the version string does not contain enough parts.
     """
     if os_type == 'Linux':
+        import platform
         kernel_ver = platform.release().split(".")
         if len(kernel_ver) > 2:
             return int(kernel_ver[0]), int(kernel_ver[1])
@@ -6,6 +6,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 ###
 import os
+import time
 import binascii
 from pydiskcmdlib.utils.converter import translocate_bytearray
 from pyscsi.pyscsi.scsi_enum_command import spc, sbc, smc, ssc, mmc
@@ -23,7 +24,7 @@ from pydiskcmdlib.pysata.ata_cdb_downloadmicrocode import ActivateMicrocode16 as
 #
 from pydiskcmdlib.pysata.ata_cdb_smart import SmartReturnStatus
 from pydiskcmdlib.pysata.ata_cdb_AccessibleMaxAddress import AccessibleMaxAddressCfg
-from pydiskcmdlib.pysata.ata_cdb_dsm import DSM
+from pydiskcmdlib.pysata.ata_cdb_dsm import DSM,DSMEntriesPerBlock,DSMMaxRangeLength,DSMBlockSize,pack_dsm_entries
 from pydiskcmdlib.pysata.ata_cdb_flush import Flush
 from pydiskcmdlib.pysata.ata_cdb_hardreset import Hardreset
 from pydiskcmdlib.pysata.ata_cdb_readDMAEXT16 import ReadDMAEXT16
@@ -34,11 +35,16 @@ from pydiskcmdlib.pysata.ata_cdb_smart import SmartReadLog16
 from pydiskcmdlib.pysata.ata_cdb_softreset import SoftReset
 from pydiskcmdlib.pysata.ata_cdb_TrustedReceive import TrustedReceiveDMA
 from pydiskcmdlib.pysata.ata_cdb_writeDMAEXT16 import WriteDMAEXT16
+from pydiskcmdlib.buffer_pool import new_command_with_buffer
 from pydiskcmdlib.pysata.ata_cdb_read_verify_sectors import ReadVerifySectorEXT
 from pydiskcmdlib.pysata.ata_cdb_read_sectors_ext import ReadSectorsEXT16
 from pydiskcmdlib.pysata.ata_cdb_writelog import WriteLogExt
 from pydiskcmdlib.pysata.ata_cdb_write_uncorrectable import WriteUncorrectableEXT
+from pydiskcmdlib.exceptions import ParameterIncorrect,CommandReturnStatusError,SenseDataCheckErr
 from pydiskcmdlib import log
+from pydiskcmdlib.trace import DEBUG,KindATA,get_trace_ring
+from pydiskcmdlib.session_cache import CacheATA,get_session_cache,get_device_path,invalidate_device
+from pydiskcmdlib.lba_range import coalesce_ranges,split_ranges
 ##
 
 class SATA(object):
@@ -56,6 +62,18 @@ class SATA(object):
         """
         self.device = dev
         self._blocksize = blocksize
+        ## the information from session cache if it is enabled
+        cache = get_session_cache()
+        dev_path = get_device_path(dev) if cache is not None else None
+        info = cache.get(dev_path, CacheATA) if dev_path else None
+        if info:
+            self.device.devicetype = info["devicetype"]
+            if info["opcodes"] is not None:
+                self.device.opcodes = info["opcodes"]
+            self.__identify = bytearray(info["identify"])
+            if self._blocksize == 0:
+                self._blocksize = info["blocksize"]
+            return
         self.__init_opcode()
         ## check if SATA Device, raise error if not SATA Device
         cmd = self.identify()
@@ -63,11 +81,45 @@ class SATA(object):
         self.__identify = cmd.datain
         # auto detect blocksize
         # set blocksize if blocksize=0
-        if self._blocksize == 0 and self.__identify[213] & 0xC0 == 0x40: # word 106 valid
-            if self.__identify[213] & 0x10:
-                self._blocksize = int(binascii.hexlify(translocate_bytearray(self.__identify[234:238], 2)),16) * 2
+        detected_blocksize = self._detect_blocksize(self.__identify)
+        if self._blocksize == 0:
+            self._blocksize = detected_blocksize
+        if dev_path:
+            cache.put(dev_path,
+                      CacheATA,
+                      {"devicetype": self.device.devicetype,
+                       "opcodes": getattr(self.device, "opcodes", None),
+                       "identify": bytes(self.__identify),
+                       "blocksize": detected_blocksize,},
+                      serial=self.serial)
+
+    @staticmethod
+    def _detect_blocksize(identify):
+        """
+        get the logical sector size from identify data
+
+        :param identify: the identify device data
+        :return: the blocksize in bytes, 0 if word 106 is not valid
+        """
+        if identify[213] & 0xC0 == 0x40: # word 106 valid
+            if identify[213] & 0x10:
+                return int(binascii.hexlify(translocate_bytearray(identify[234:238], 2)),16) * 2
             else:
-                self._blocksize = 512
+                return 512
+        return 0
+
+    @property
+    def serial(self):
+        """
+        the serial number in identify device data(word 10-19)
+        """
+        return bytes(self.__identify[20:40])
+
+    def _invalidate_session(self):
+        """
+        drop the session cache of this device, the identify data may be changed
+        """
+        invalidate_device(self.device, serial=self.serial)
 
     def __call__(self,
                  dev):
@@ -125,23 +177,59 @@ class SATA(object):
 
         :param cmd: a SCSICommand object
         """
+        ring = get_trace_ring()
+        debug = log.isEnabledFor(DEBUG)
         try:
-            _cdb = cmd.unmarshall_cdb(cmd.cdb)
-            log.debug("Sending ATA Command: Command %Xh, Device %Xh, LBA %Xh, Count %Xh, Feature %Xh" % (_cdb.get("command"),
-                                                                                                         _cdb.get("device"),
-                                                                                                         _cdb.get("lba"),
-                                                                                                         _cdb.get("count"),
-                                                                                                         _cdb.get("fetures")))
-            self._execute(cmd)
-            ata_status_return = cmd.get_ata_status_return()
-            if ata_status_return:
-                log.debug('''Return Status: 
+            if debug:
+                _cdb = cmd.unmarshall_cdb(cmd.cdb)
+                log.debug("Sending ATA Command: Command %Xh, Device %Xh, LBA %Xh, Count %Xh, Feature %Xh",
+                          _cdb.get("command"),
+                          _cdb.get("device"),
+                          _cdb.get("lba"),
+                          _cdb.get("count"),
+                          _cdb.get("fetures"))
+            if ring is None:
+                self._execute(cmd)
+            else:
+                ring.trace(KindATA, self._execute, cmd)
+            if debug:
+                ata_status_return = cmd.get_ata_status_return()
+                if ata_status_return:
+                    log.debug('''Return Status:
 %s''' % os.linesep.join(['    %s: %s' % (k,v) for k,v in ata_status_return.items()]))
             if check_return_status:
                 cmd.ata_status_return_descriptor
         except Exception as e:
+            if ring is not None:
+                ring.on_error(e)
             raise e
 
+    def submit(self, cmd):
+        """
+        wrapper method to call the SCSIDevice.submit method, the command is queued 
+        without waiting for the completion if the device supports asynchronous 
+        interface(/dev/sgX in Linux), use poll() to get the completed commands.
+
+        :param cmd: a SCSICommand object
+        """
+        self.device.submit(cmd, en_raw_sense=True)
+        return cmd
+
+    def poll(self, min_complete=1, timeout=None, check_return_status=True):
+        """
+        wrapper method to call the SCSIDevice.poll method
+
+        :param min_complete: wait at least min_complete commands to complete
+        :param timeout: the max time(milliseconds) to wait, None means no limit
+        :param check_return_status: check the ata return status of the completed commands
+        :return: a list of completed SCSICommand
+        """
+        done = self.device.poll(min_complete=min_complete, timeout=timeout)
+        if check_return_status:
+            for cmd in done:
+                cmd.ata_status_return_descriptor
+        return done
+
     @property
     def identify_raw(self):
         return self.__identify
@@ -250,6 +338,36 @@ class SATA(object):
         self.execute(cmd)
         return cmd
 
+    def read_DMAEXT16_pipeline(self,
+                               lba,
+                               nlb,
+                               tl=256,
+                               check_return_status=True):
+        """
+        Read nlb blocks from lba with ReadDMAEXT16 commands, keep up to the device 
+        queue depth commands in flight.
+
+        :param lba: the start Logical Block Address
+        :param nlb: the number of blocks to read
+        :param tl: Transfer Length of each command, 1-65535
+        :param check_return_status: check the ata return status of the completed commands
+        :return: a generator of completed ReadDMAEXT16 instances, not ordered by lba
+        """
+        if tl < 1 or tl > 65535:
+            raise ParameterIncorrect("Transfer Length should be 1-65535")
+        queue_depth = self.device.queue_depth
+        end = lba + nlb
+        inflight = 0
+        while lba < end or inflight:
+            while lba < end and inflight < queue_depth:
+                n = min(tl, end - lba)
+                self.submit(ReadDMAEXT16(lba, n, self.blocksize))
+                lba += n
+                inflight += 1
+            for cmd in self.poll(min_complete=1, check_return_status=check_return_status):
+                inflight -= 1
+                yield cmd
+
     def read_sectors_ext(self, lba, tl):
         """
         Returns a Read16 Instance
@@ -271,95 +389,140 @@ class SATA(object):
         self.execute(cmd)
         return cmd
 
+    def read_DMAEXT16_into(self, lba, tl, buffer):
+        """
+        Read tl blocks into a caller supplied buffer, the device DMA straight into it.
+
+        :param lba: Logical Block Address to read from
+        :param tl: Transfer Length in blocks
+        :param buffer: a writable buffer(bytearray, mmap, memoryview), not smaller than tl blocks
+        :return: a ReadDMAEXT16 instance, cmd.datain is a memoryview of buffer
+        """
+        cmd = new_command_with_buffer(ReadDMAEXT16, buffer, lba, tl, self.blocksize)
+        self.execute(cmd)
+        return cmd
+
+    def write_DMAEXT16_from(self, lba, tl, buffer):
+        """
+        Write tl blocks from a caller supplied buffer, the device DMA straight out of 
+        a writable buffer(bytearray, mmap, memoryview), a read-only buffer(bytes) is copied once.
+
+        :param lba: Logical Block Address to write to
+        :param tl: Transfer Length in blocks
+        :param buffer: the buffer of data to write, not smaller than tl blocks
+        :return: a WriteDMAEXT16 instance
+        """
+        if memoryview(buffer).readonly:
+            buffer = bytearray(buffer)
+        data = memoryview(buffer).cast('B')[0:self.blocksize * (tl if tl else 65536)]
+        cmd = new_command_with_buffer(WriteDMAEXT16, data, lba, tl, data, self.blocksize)
+        self.execute(cmd)
+        return cmd
+
     def write_log(self, log_page_count, log_address, page_number, data=None):
         cmd = WriteLogExt(log_page_count, log_address, page_number, data=data)
         self.execute(cmd)
         return cmd
 
+    @property
+    def dsm_max_blocks(self):
+        """
+        the max 512 bytes blocks of LBA Range Entries in a DATA SET MANAGEMENT command,
+        IDENTIFY DEVICE word 105, 1 if not reported
+        """
+        blocks = self.__identify[210] + (self.__identify[211] << 8)
+        return blocks if blocks not in (0, 0xFFFF) else 1
+
     def dsm(self,
             lba_description,
             fetures=1):
         '''
-        lba_description = [[lba_start0,lba_length0], [lba_start1,lba_length1], ..., [lba_start63,lba_length63]]
-            lba_description length more than 0 and less than 65
+        lba_description = [[lba_start0,lba_length0], [lba_start1,lba_length1], ...]
+            64 ranges in a block, up to dsm_max_blocks blocks, lba_length is 1-65535
         '''
         ## check lba_description
-        if 0 < len(lba_description) < 65:
-            pass
-        else:
-            raise RuntimeError("lba_description format error!")
-        ##
-        data = bytearray(512)
-        data_index = 0
-        for lba_group in lba_description:
-            lba_start,lba_length = lba_group
-            #
-            data[data_index] = (lba_start & 0xFF)
-            data_index += 1
-            data[data_index] = (lba_start & 0xFF00) >> 8
-            data_index += 1
-            data[data_index] = (lba_start & 0xFF0000) >> 16
-            data_index += 1
-            data[data_index] = (lba_start & 0xFF000000) >> 24
-            data_index += 1
-            data[data_index] = (lba_start & 0xFF00000000) >> 32
-            data_index += 1
-            data[data_index] = (lba_start & 0xFF00000000) >> 40
-            data_index += 1
-            data[data_index] = (lba_length & 0xFF)
-            data_index += 1
-            data[data_index] = (lba_length & 0xFF00) >> 8
-            data_index += 1
+        max_ranges = DSMEntriesPerBlock * self.dsm_max_blocks
+        if not (0 < len(lba_description) <= max_ranges):
+            raise ParameterIncorrect("lba_description should have 1-%d ranges" % max_ranges)
+        for lba_start,lba_length in lba_description:
+            if not (0 < lba_length <= DSMMaxRangeLength):
+                raise ParameterIncorrect("lba_length should be 1-%d" % DSMMaxRangeLength)
         ##
-        cmd = DSM(fetures, data)
+        data = bytearray(DSMBlockSize * (-(-len(lba_description) // DSMEntriesPerBlock)))
+        blocks = pack_dsm_entries(lba_description, data)
+        cmd = DSM(fetures, data, count=blocks)
         self.execute(cmd)
         return cmd
 
     def trim(self, *args, **kwargs):
         return self.dsm(*args, **kwargs)
 
-    def trimall(self, LBAS, fetures=1):
-        single_cmd_num = 64
-        single_cmd_unit_lbas = 4624
-        LBAS = int(LBAS)
-        single_cmd_lbas = single_cmd_num * single_cmd_unit_lbas
-        #
-        data = bytearray(512)
-        for i in range(0,LBAS,single_cmd_lbas):
-            lba_description = []
-            for k in range(64):
-                start_lba = i+k*single_cmd_unit_lbas
-                if (start_lba+single_cmd_unit_lbas) <= LBAS:
-                    lba_description.append((start_lba, single_cmd_unit_lbas))
-                else:
-                    lba_description.append((start_lba, LBAS-start_lba))
+    def iter_trim(self, ranges, fetures=1):
+        """
+        TRIM the LBA ranges, the ranges are coalesced, split to 65535 blocks, and packed
+        into as many blocks as IDENTIFY DEVICE word 105 allows in every command.
+
+        :param ranges: an iterable of (lba, length), length is the number of logical blocks
+        :param fetures: the feature field, 1 is TRIM
+        :return: a generator of (the executed command, the logical blocks of it)
+        """
+        entries = split_ranges(coalesce_ranges(ranges), DSMMaxRangeLength)
+        max_ranges = DSMEntriesPerBlock * self.dsm_max_blocks
+        ## one payload buffer reused by all the commands
+        data = bytearray(DSMBlockSize * self.dsm_max_blocks)
+        view = memoryview(data)
+        while True:
+            group = []
+            for entry in entries:
+                group.append(entry)
+                if len(group) >= max_ranges:
                     break
-            #
-            data_index = 0
-            for lba_group in lba_description:
-                lba_start,lba_length = lba_group
-                data[data_index] = (lba_start & 0xFF)
-                data_index += 1
-                data[data_index] = (lba_start & 0xFF00) >> 8
-                data_index += 1
-                data[data_index] = (lba_start & 0xFF0000) >> 16
-                data_index += 1
-                data[data_index] = (lba_start & 0xFF000000) >> 24
-                data_index += 1
-                data[data_index] = (lba_start & 0xFF00000000) >> 32
-                data_index += 1
-                data[data_index] = (lba_start & 0xFF00000000) >> 40
-                data_index += 1
-                data[data_index] = (lba_length & 0xFF)
-                data_index += 1
-                data[data_index] = (lba_length & 0xFF00) >> 8
-                data_index += 1
-            # the rest data should be cleared 0 in the last value set
-            for i in (data_index,512):
-                data[i] = 0
-            #
-            cmd = DSM(fetures, data)
+            if not group:
+                break
+            blocks = pack_dsm_entries(group, data)
+            cmd = DSM(fetures, view[0:blocks*DSMBlockSize], count=blocks)
             self.execute(cmd)
+            yield cmd,sum(length for _,length in group)
+
+    def trim_ranges(self, ranges, fetures=1, progress=None):
+        """
+        TRIM the LBA ranges, see iter_trim
+
+        :param ranges: an iterable of (lba, length)
+        :param fetures: the feature field, 1 is TRIM
+        :param progress: a function called after every command, progress(done_lbas, total_lbas)
+        :return: a dict of "lbas", "commands", "seconds" and "throughput"(bytes/s)
+        """
+        ranges = coalesce_ranges(ranges)
+        total = sum(length for _,length in ranges)
+        t0 = time.perf_counter()
+        done,commands = 0,0
+        for cmd,lbas in self.iter_trim(ranges, fetures=fetures):
+            return_descriptor = cmd.ata_status_return_descriptor
+            if return_descriptor:
+                if return_descriptor.get("error") != 0:
+                    raise CommandReturnStatusError("lba %d, error: %s, status: %s" % (done, return_descriptor.get("error"), return_descriptor.get("status")))
+            elif cmd.ata_sense_data_condition:
+                raise SenseDataCheckErr("%s" % cmd.ata_sense_data_condition._describe_ascq())
+            done += lbas
+            commands += 1
+            if progress:
+                progress(done, total)
+        seconds = time.perf_counter() - t0
+        return {"lbas": done,
+                "commands": commands,
+                "seconds": seconds,
+                "throughput": done * self.blocksize / seconds if seconds > 0 else 0,}
+
+    def trimall(self, LBAS, fetures=1):
+        """
+        TRIM LBA 0 to LBAS-1
+
+        :return: the last command
+        """
+        cmd = None
+        for cmd,_ in self.iter_trim([(0, int(LBAS))], fetures=fetures):
+            pass
         return cmd
 
     def identify(self):
@@ -434,62 +597,40 @@ class SATA(object):
         ##
         cmd = DownloadMicrocode(lba_pass, count_l, data, feature=feature)
         self.execute(cmd)
+        if feature in (0x03, 0x07, 0x0F):
+            ## the new microcode is activated
+            self._invalidate_session()
         return cmd
 
     def active_delayed_microcode(self):
         cmd = ActivateMicrocode()
         self.execute(cmd)
+        self._invalidate_session()
         return cmd
 
-    def download_fw(self, fw_path, transfer_size=0x200, feature=0x03):
+    def download_fw(self, fw_path, transfer_size=0, feature=0x03, progress=None):
         '''
         transfer_data_size = (transfer_size * 512), in every transfer, <transfer_data_size> blocks to transfer.
+        transfer_size=0 means the largest segment reported by IDENTIFY DEVICE.
+        progress: see pydiskcmdlib.fw_staging.stage_image
         '''
-        ## read fw data
-        with open(fw_path, 'rb') as fp:
-            data = fp.read()
-        data = bytearray(data)
-        ## check fw if multiple of 512
-        res = len(data) % 512
-        if res != 0:
-            data += (b'\x00'*(512-res)) # need to be multiple of 512 Bytes, otherwise refill it.
-        #dataview = memoryview(data)
-        lba = 0
-        length = len(data) / 512  # length=how many sectors(512 Bytes) of data
-        ##
         if feature == 0x03 or feature == 0x0E:
-            quotients = int(length / transfer_size) # 
-            remainders = int(length % transfer_size)
-            ##
-            data_size = 512*transfer_size
-            ##
-            for i in range(0, quotients):
-                cmd = self.download_microcode(feature, lba, transfer_size, data[i*data_size:(i+1)*data_size])
-                ## first check sense data
-                return_descriptor = cmd.ata_status_return_descriptor
-                if return_descriptor:
-                    if return_descriptor.get("error") != 0:
-                        print ("Cycle: %s,Error: %s, status: %s" % (i, return_descriptor.get("error"), return_descriptor.get("status")))
-                        return 1
-                elif cmd.ata_sense_data_condition:  # something may be wrong here, check!
-                    print ("Cycle: %s, Descrption: %s" % (i, cmd.ata_sense_data_condition._describe_ascq()))
-                    print ('')
-                    print (cmd.ata_sense_data_condition.data)
-                    return 2
-                lba += transfer_size
-            if remainders != 0:
-                cmd = self.download_microcode(feature, lba, remainders, data[quotients*data_size:])
-                ##
-                ## first check sense data
-                return_descriptor = cmd.ata_status_return_descriptor
-                if return_descriptor:
-                    if return_descriptor.get("error") != 0:
-                        print ("Cycle: %s, Error: %s, status: %s" % (i+1, return_descriptor.get("error"), return_descriptor.get("status")))
-                elif cmd.ata_sense_data_condition:  # something may be wrong here, check!
-                    print ("Cycle: %s, Descrption: %s" % (i+1, cmd.ata_sense_data_condition._describe_ascq()))
-                    print ('')
-                    print (cmd.ata_sense_data_condition.data)
+            from pydiskcmdlib.fw_staging import stage_ata_fw
+            try:
+                stage_ata_fw(self, fw_path, feature=feature, xfer=transfer_size*512, progress=progress)
+            except CommandReturnStatusError as e:
+                print ("Error: %s" % e)
+                return 1
+            except SenseDataCheckErr as e:
+                print ("Descrption: %s" % e)
+                return 2
         elif feature == 0x07:
+            ## read fw data, need to be multiple of 512 Bytes, otherwise refill it.
+            with open(fw_path, 'rb') as fp:
+                size = os.fstat(fp.fileno()).st_size
+                data = bytearray(size + ((512 - size % 512) % 512))
+                fp.readinto(data)
+            lba = 0
             length = 0
             cmd = self.download_microcode(feature, lba, length, data)
             ## first check sense data
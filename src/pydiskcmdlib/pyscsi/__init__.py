@@ -8,3 +8,10 @@ __all__ = [
     "scsi_device",
     "scsi_command",
 ]
+
+## the structures of the other OS are loaded only when they are used
+from pydiskcmdlib.utils.lazy_import import os_specific_getattr
+__getattr__ = os_specific_getattr(__name__, {
+    "lin_scsi_structures": "Linux",
+    "win_scsi_structures": "Windows",
+})
@@ -0,0 +1,36 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+from pydiskcmdlib.async_cmd import AsyncCommandBase
+from pydiskcmdlib.pyscsi.scsi import SCSI
+from pyscsi.pyscsi.scsi_cdb_read16 import Read16
+from pyscsi.pyscsi.scsi_cdb_write16 import Write16
+
+
+class AsyncSCSI(AsyncCommandBase):
+    """
+    The asyncio front-end of SCSI, all the SCSI methods can be awaited, like:
+        scsi = await AsyncSCSI.open(init_device("/dev/sg1"))
+        cmd = await scsi.logsense(0x2F)
+    See pydiskcmdlib.async_cmd.AsyncCommandBase for more detail.
+    """
+    _sync_class = SCSI
+
+    async def execute(self, cmd, en_raw_sense=False):
+        """
+        send a scsi command
+
+        :param cmd: a SCSICommand object
+        """
+        if self._engine:
+            return await self._execute_native(cmd, en_raw_sense=en_raw_sense)
+        await self._run(self._sync.execute, cmd, en_raw_sense=en_raw_sense)
+        return cmd
+
+    async def read16(self, lba, tl, **kwargs):
+        cmd = Read16(self._sync.device.opcodes.READ_16, self._sync.blocksize, lba, tl, **kwargs)
+        return await self.execute(cmd)
+
+    async def write16(self, lba, tl, data, **kwargs):
+        cmd = Write16(self._sync.device.opcodes.WRITE_16, self._sync.blocksize, lba, tl, data, **kwargs)
+        return await self.execute(cmd)
@@ -10,20 +10,49 @@ from pydiskcmdlib.pyscsi.scsi_cdb_receivediagnosticresults import ReceiveDiagnos
 from pydiskcmdlib.pyscsi.scsi_cdb_writebuffer import WriteBuffer
 from pydiskcmdlib.pyscsi.scsi_cdb_sanitize import Sanitize
 from pydiskcmdlib.exceptions import ProtocolSettingError, ParameterIncorrect
-from pyscsi.utils.converter import encode_dict
+from pydiskcmdlib.utils.converter import encode_dict
+from pyscsi.pyscsi.scsi_cdb_read16 import Read16
+from pyscsi.pyscsi.scsi_cdb_write16 import Write16
+from pydiskcmdlib.buffer_pool import new_command_with_buffer
+from pydiskcmdlib.trace import KindSCSI,get_trace_ring
+from pydiskcmdlib.session_cache import CacheSCSI,get_session_cache,get_device_path,invalidate_device
 
 
 class SCSI(_SCSI):
     def __init__(self, 
                  dev,
                  blocksize=0):
-        super(SCSI, self).__init__(dev, blocksize=blocksize)
+        ## the information from session cache if it is enabled
+        cache = get_session_cache()
+        dev_path = get_device_path(dev) if cache is not None else None
+        info = cache.get(dev_path, CacheSCSI) if dev_path else None
+        if info:
+            ## the same as _SCSI.__init__, without sending inquiry
+            self.device = dev
+            self._blocksize = blocksize
+            self.device.devicetype = info["devicetype"]
+            if info["opcodes"] is not None:
+                self.device.opcodes = info["opcodes"]
+        else:
+            super(SCSI, self).__init__(dev, blocksize=blocksize)
         # auto detect blocksize
         self._max_lba = 0
+        cap = None
         if self._blocksize == 0:
-            cap = self.readcapacity16().result
-            self._blocksize = cap["block_length"]
-            self._max_lba = cap["returned_lba"]
+            if info and info["blocksize"]:
+                self._blocksize = info["blocksize"]
+                self._max_lba = info["max_lba"]
+            else:
+                cap = self.readcapacity16().result
+                self._blocksize = cap["block_length"]
+                self._max_lba = cap["returned_lba"]
+        if dev_path and (info is None or cap is not None):
+            cache.put(dev_path,
+                      CacheSCSI,
+                      {"devicetype": self.device.devicetype,
+                       "opcodes": getattr(self.device, "opcodes", None),
+                       "blocksize": cap["block_length"] if cap else 0,
+                       "max_lba": cap["returned_lba"] if cap else 0,})
 
     def __del__(self):
         if self.device:
@@ -33,6 +62,102 @@ class SCSI(_SCSI):
     def device_max_lba(self):
         return self._max_lba
 
+    def execute(self, cmd, en_raw_sense=False):
+        """
+        wrapper method to call the SCSIDevice.execute method, the command is
+        recorded to the trace ring if it is enabled.
+
+        :param cmd: a SCSICommand object
+        """
+        ring = get_trace_ring()
+        if ring is None:
+            return self.device.execute(cmd, en_raw_sense=en_raw_sense)
+        try:
+            return ring.trace(KindSCSI, self.device.execute, cmd, en_raw_sense=en_raw_sense)
+        except Exception as e:
+            ring.on_error(e)
+            raise e
+
+    def submit(self, cmd, en_raw_sense=False):
+        """
+        wrapper method to call the SCSIDevice.submit method, the command is queued 
+        without waiting for the completion if the device supports asynchronous 
+        interface(/dev/sgX in Linux), use poll() to get the completed commands.
+
+        :param cmd: a SCSICommand object
+        """
+        self.device.submit(cmd, en_raw_sense=en_raw_sense)
+        return cmd
+
+    def poll(self, min_complete=1, timeout=None):
+        """
+        wrapper method to call the SCSIDevice.poll method
+
+        :param min_complete: wait at least min_complete commands to complete
+        :param timeout: the max time(milliseconds) to wait, None means no limit
+        :return: a list of completed SCSICommand
+        """
+        return self.device.poll(min_complete=min_complete, timeout=timeout)
+
+    def read16_pipeline(self, lba, nlb, tl, **kwargs):
+        """
+        Read nlb blocks from lba with Read16 commands, keep up to the device queue 
+        depth commands in flight.
+
+        :param lba: the start Logical Block Address
+        :param nlb: the number of blocks to read
+        :param tl: Transfer Length of each Read16 command
+        :param kwargs: passthrough to Read16
+        :return: a generator of completed Read16 instances, not ordered by lba
+        """
+        opcode = self.device.opcodes.READ_16
+        queue_depth = self.device.queue_depth
+        end = lba + nlb
+        inflight = 0
+        while lba < end or inflight:
+            while lba < end and inflight < queue_depth:
+                n = min(tl, end - lba)
+                self.submit(Read16(opcode, self.blocksize, lba, n, **kwargs))
+                lba += n
+                inflight += 1
+            for cmd in self.poll(min_complete=1):
+                inflight -= 1
+                yield cmd
+
+    def read16_into(self, lba, tl, buffer, **kwargs):
+        """
+        Read tl blocks into a caller supplied buffer, the device DMA straight into it.
+
+        :param lba: Logical Block Address
+        :param tl: Transfer Length
+        :param buffer: a writable buffer(bytearray, mmap, memoryview), not smaller than tl blocks
+        :param kwargs: passthrough to Read16
+        :return: a Read16 instance, cmd.datain is a memoryview of buffer
+        """
+        opcode = self.device.opcodes.READ_16
+        cmd = new_command_with_buffer(Read16, buffer, opcode, self.blocksize, lba, tl, **kwargs)
+        self.execute(cmd)
+        return cmd
+
+    def write16_from(self, lba, tl, buffer, **kwargs):
+        """
+        Write tl blocks from a caller supplied buffer, the device DMA straight out of 
+        a writable buffer(bytearray, mmap, memoryview), a read-only buffer(bytes) is copied once.
+
+        :param lba: Logical Block Address to write to
+        :param tl: Transfer Length in blocks
+        :param buffer: the buffer of data to write, not smaller than tl blocks
+        :param kwargs: passthrough to Write16
+        :return: a Write16 instance
+        """
+        if memoryview(buffer).readonly:
+            buffer = bytearray(buffer)
+        opcode = self.device.opcodes.WRITE_16
+        data = memoryview(buffer).cast('B')[0:self.blocksize * tl]
+        cmd = new_command_with_buffer(Write16, data, opcode, self.blocksize, lba, tl, data, **kwargs)
+        self.execute(cmd)
+        return cmd
+
     def cdb_passthru(self, raw_cdb, dataout=b'', datain_alloclen=0):
         """
         Returns a CDBPassthru Instance
@@ -115,6 +240,9 @@ class SCSI(_SCSI):
         opcode = self.device.opcodes.WRITE_BUFFER
         cmd = WriteBuffer(opcode, mode, mode_spec, buffer_id, buffer_offset, para_list_length, data=data, control=control)
         self.execute(cmd)
+        if mode in (0x05, 0x07, 0x0F):
+            ## the new microcode is activated
+            invalidate_device(self.device)
         return cmd
 
     def sanitize(self, service_action: int, ause: int, znr: int, immed: int, control: int = 0, **kwargs):
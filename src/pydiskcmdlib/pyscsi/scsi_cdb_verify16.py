@@ -0,0 +1,52 @@
+# coding: utf-8
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+
+from pyscsi.pyscsi.scsi_command import SCSICommand
+#
+# SCSI Verify16 command and definitions
+#
+
+class Verify16(SCSICommand):
+    """
+    A class to hold information from a Verify16 command to a scsi device,
+    the medium is verified without data transfer(BYTCHK=0)
+    """
+
+    _cdb_bits = {
+        "opcode": [0xFF, 0],
+        "vrprotect": [0xE0, 1],
+        "dpo": [0x10, 1],
+        "bytchk": [0x06, 1],
+        "lba": [0xFFFFFFFFFFFFFFFF, 2],
+        "vl": [0xFFFFFFFF, 10],
+        "group_number": [0x1F, 14],
+        "control": [0xFF, 15],
+    }
+
+    def __init__(
+        self, opcode, lba, vl, vrprotect=0, dpo=0, group_number=0, control=0
+    ):
+        """
+        initialize a new instance
+
+        :param opcode: a OpCode instance
+        :param lba: the LOGICAL BLOCK ADDRESS field
+        :param vl: the VERIFICATION LENGTH field, in logical blocks
+        :param vrprotect: the VRPROTECT field
+        :param dpo: Disable Page Out
+        :param group_number: the group into which attributes associated with the command should be collected
+        :param control: The CONTROL byte is defined in SAM-5
+        """
+        SCSICommand.__init__(self, opcode, 0, 0)
+        self.cdb = self.build_cdb(
+            opcode=self.opcode.value,
+            lba=lba,
+            vl=vl,
+            vrprotect=vrprotect,
+            dpo=dpo,
+            bytchk=0,
+            group_number=group_number,
+            control=control,
+        )
@@ -3,9 +3,9 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later 
 from pydiskcmdlib import os_type
 from pyscsi.pyscsi.scsi_command import SCSICommand as _SCSICommand
+import ctypes
 from pydiskcmdlib.os import lin_ioctl_request,win_ioctl_request
-from pydiskcmdlib.device.win_device import ctypes
-from pydiskcmdlib.pyscsi.win_scsi_structures import SCSIPassThroughDirect,SCSIPassThroughDirectWithBuffer
+from pydiskcmdlib.pyscsi import win_scsi_structures
 from pydiskcmdlib.exceptions import *
 from pyscsi.pyscsi.scsi_sense import SCSICheckCondition
 
@@ -104,8 +104,8 @@ class SCSICommand(_SCSICommand):
                 data_buffer = ctypes.create_string_buffer(b'', 0)
             timeout = 18000
             ## create SCSIPassThroughDirect
-            header_sptd = SCSIPassThroughDirect(
-                length=ctypes.sizeof(SCSIPassThroughDirect),
+            header_sptd = win_scsi_structures.SCSIPassThroughDirect(
+                length=ctypes.sizeof(win_scsi_structures.SCSIPassThroughDirect),
                 data_in=direction,
                 data_transfer_length=data_transfer_length,
                 data_buffer=ctypes.addressof(data_buffer),
@@ -113,14 +113,14 @@ class SCSICommand(_SCSICommand):
                 cdb=cdb,
                 timeout_value=timeout,
                 sense_info_length=(
-                    SCSIPassThroughDirectWithBuffer.sense.size
+                    win_scsi_structures.SCSIPassThroughDirectWithBuffer.sense.size
                 ),
                 sense_info_offset=(
-                    SCSIPassThroughDirectWithBuffer.sense.offset
+                    win_scsi_structures.SCSIPassThroughDirectWithBuffer.sense.offset
                 )
             )
             # create SCSIPassThroughDirectWithBuffer
-            raw_cdb = SCSIPassThroughDirectWithBuffer(sptd=header_sptd)
+            raw_cdb = win_scsi_structures.SCSIPassThroughDirectWithBuffer(sptd=header_sptd)
         elif os_type == 'Linux':
             pass
         else:
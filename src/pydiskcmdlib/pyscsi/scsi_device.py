@@ -3,6 +3,7 @@
 # SPDX-License-Identifier: LGPL-2.1-or-later
 from pydiskcmdlib import os_type
 from pydiskcmdlib import log
+from pydiskcmdlib.trace import DEBUG,HexBytes
 
 if os_type == "Windows":
     ########################################
@@ -23,6 +24,8 @@ if os_type == "Windows":
                      detect_replugged=True):
             log.debug("Opening SCSi device %s, read write flag is %s, detect replugged is %s" % (device, readwrite, detect_replugged))
             self._opcodes = scsi_enum_command.spc
+            ## completed by submit(), but not polled
+            self._completed = []
             super(SCSIDevice, self).__init__(device, readwrite, detect_replugged)
 
         def execute(self, cmd, en_raw_sense=False):
@@ -32,17 +35,24 @@ if os_type == "Windows":
             :param cmd: a Command Structure
             :param en_raw_sense: Set it will return raw sense data even if no sense data is available
             """
-            log.debug("Sending SCSi Command: %s" % " ".join(["%X" % i for i in cmd.cdb]))
+            if log.isEnabledFor(DEBUG):
+                log.debug("Sending SCSi Command: %s", HexBytes(cmd.cdb))
             ## create SCSIPassThroughDirect Or SCSIPassThroughDirectWithBuffer
             # will transfer SCSICommand to windows mode command
             cdb = (ctypes.c_ubyte * 16).from_buffer_copy(
                 cmd.cdb.ljust(16, b'\x00')  # noqa
             )
 
+            datain_copy = False
             if cmd.datain:
                 direction = 1     ## read from device
                 data_transfer_length = len(cmd.datain)
-                data_buffer = ctypes.create_string_buffer(data_transfer_length)
+                if isinstance(cmd.datain, (bytearray, memoryview)) and not memoryview(cmd.datain).readonly:
+                    ## read into datain directly(bytearray or pooled buffer)
+                    data_buffer = (ctypes.c_char * data_transfer_length).from_buffer(cmd.datain)
+                else:
+                    data_buffer = ctypes.create_string_buffer(data_transfer_length)
+                    datain_copy = True
             elif cmd.dataout:
                 direction = 0     ## write to device
                 data_transfer_length = len(cmd.dataout)
@@ -76,15 +86,40 @@ if os_type == "Windows":
                                             header_with_buffer,
                                             header_with_buffer)
             ## After execute. will transfer result to Command Structure
-            if cmd.datain: 
+            if datain_copy:
                 cmd.datain = bytearray(data_buffer)
             # SCSICheckCondition(bytearray(header_with_buffer.sense))
             if header_with_buffer.sptd.scsi_status == 2: # Sense Data valid
                 cmd.sense = bytearray(header_with_buffer.sense)
             if en_raw_sense:
                 cmd.raw_sense_data = bytearray(header_with_buffer.sense)
-            log.debug("Sense Data: %s" % (" ".join(["%X" % i for i in cmd.raw_sense_data]) if cmd.raw_sense_data else 'NA'))
+            if log.isEnabledFor(DEBUG):
+                log.debug("Sense Data: %s", HexBytes(cmd.raw_sense_data))
             return cmd
 
+        @property
+        def queue_depth(self):
+            return 1
+
+        def submit(self, cmd, en_raw_sense=False):
+            """
+            IOCTL is synchronous, the command completes before submit returns,
+            and it will be returned by the next poll().
+
+            :param cmd: a SCSICommand
+            :param en_raw_sense: save the raw sense data to cmd.raw_sense_data
+            """
+            self.execute(cmd, en_raw_sense=en_raw_sense)
+            self._completed.append(cmd)
+            return cmd
+
+        def poll(self, min_complete=1, timeout=None):
+            """
+            :return: a list of completed SCSICommand
+            """
+            done = self._completed
+            self._completed = []
+            return done
+
 elif os_type == "Linux":
     from pydiskcmdlib.device.Lin_device import LinSGIODevice as SCSIDevice
@@ -0,0 +1,151 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import threading
+
+## The session cache keeps the information that NVMe(), SATA() and SCSI() get
+#  from device when initializing(identify data, blocksize and opcode table),
+#  so opening the same device again in one process sends no command.
+#
+#  An entry is keyed by the device path and the device kind, and it is only
+#  valid while the device node is the same one(the same st_rdev and st_ino,
+#  which is also how replug is detected). The controller serial number is kept
+#  in the entry, so that all the nodes of a controller(like /dev/nvme0,
+#  /dev/nvme0n1 and /dev/ng0n1) are invalidated together after format,
+#  firmware commit or namespace management.
+CacheNVMe = "nvme"
+CacheATA = "ata"
+CacheSCSI = "scsi"
+
+
+def get_device_key(dev_path):
+    """
+    get the identity of the device node
+
+    :param dev_path: the device path
+    :return: a tuple of (st_rdev, st_ino), or None if the node can not be stat
+    """
+    try:
+        st = os.stat(dev_path)
+    except (OSError, ValueError):
+        return None
+    return st.st_rdev,st.st_ino
+
+
+class SessionCache(object):
+    """
+    A per-process cache of the device information
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        ## (device path, kind) -> (device key, serial, data dict)
+        self._entries = {}
+        self._hit = 0
+        self._miss = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        return {"entries": len(self._entries), "hit": self._hit, "miss": self._miss}
+
+    def get(self, dev_path, kind):
+        """
+        get the cached information of a device
+
+        :param dev_path: the device path
+        :param kind: CacheNVMe, CacheATA or CacheSCSI
+        :return: a dict, or None if not cached, or the device node changed(replugged)
+        """
+        device_key = get_device_key(dev_path)
+        with self._lock:
+            entry = self._entries.get((dev_path, kind))
+            if entry is not None and entry[0] != device_key:
+                del self._entries[(dev_path, kind)]
+                entry = None
+            if entry is None:
+                self._miss += 1
+                return None
+            self._hit += 1
+            return entry[2]
+
+    def put(self, dev_path, kind, data, serial=None):
+        """
+        cache the information of a device
+
+        :param dev_path: the device path
+        :param kind: CacheNVMe, CacheATA or CacheSCSI
+        :param data: a dict, it should not be changed after cached
+        :param serial: the controller(or device) serial number
+        """
+        device_key = get_device_key(dev_path)
+        with self._lock:
+            self._entries[(dev_path, kind)] = (device_key, serial, data)
+
+    def invalidate(self, dev_path=None, serial=None):
+        """
+        drop the entries of a device path, and the entries of a serial number
+
+        :param dev_path: the device path
+        :param serial: the controller(or device) serial number
+        :return: the number of entries dropped
+        """
+        with self._lock:
+            keys = [k for k,v in self._entries.items() if (dev_path is not None and k[0] == dev_path) or (serial is not None and v[1] == serial)]
+            for k in keys:
+                del self._entries[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_session_cache = None
+
+def enable_session_cache():
+    """
+    enable the session cache, NVMe(), SATA() and SCSI() use it from now on
+
+    :return: the SessionCache
+    """
+    global _session_cache
+    if _session_cache is None:
+        _session_cache = SessionCache()
+    return _session_cache
+
+
+def disable_session_cache():
+    global _session_cache
+    _session_cache = None
+
+
+def get_session_cache():
+    """
+    :return: the SessionCache, or None if not enabled
+    """
+    return _session_cache
+
+
+def get_device_path(dev):
+    """
+    get the path of a device object
+
+    :param dev: a device object
+    :return: the device path, or None if unknown
+    """
+    return getattr(dev, "_file_name", None)
+
+
+def invalidate_device(dev, serial=None):
+    """
+    drop the cached information of a device object, and all the nodes of the same serial number
+
+    :param dev: a device object
+    :param serial: the controller(or device) serial number
+    """
+    cache = _session_cache
+    if cache is not None:
+        cache.invalidate(dev_path=get_device_path(dev), serial=serial)
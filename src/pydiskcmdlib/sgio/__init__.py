@@ -1,3 +1,4 @@
 from .linux import execute
+from .linux import AsyncSGIO, is_sg_device
 from .errors import CheckConditionError
 from .errors import UnspecifiedError
\ No newline at end of file
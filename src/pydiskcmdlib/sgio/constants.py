@@ -31,4 +31,11 @@ SG_DXFER_TO_FROM_DEV = -4
 SG_DXFER_UNKNOWN = -5
 
 
-TIMEOUT = 1800000
\ No newline at end of file
+TIMEOUT = 1800000
+
+# /* the max commands queued in one sg file descriptor */
+# #define SG_MAX_QUEUE 16
+SG_MAX_QUEUE = 16
+
+# #define SCSI_GENERIC_MAJOR 21
+SCSI_GENERIC_MAJOR = 21
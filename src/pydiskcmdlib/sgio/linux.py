@@ -1,7 +1,11 @@
+import os
+import stat
+import select
 import ctypes
 import fcntl
 
 from pydiskcmdlib.sgio.constants import SG_INFO_OK_MASK, SG_INFO_OK, SG_IO, TIMEOUT
+from pydiskcmdlib.sgio.constants import SG_MAX_QUEUE, SCSI_GENERIC_MAJOR
 from pydiskcmdlib.sgio.constants import SG_DXFER_TO_DEV, SG_DXFER_FROM_DEV, SG_DXFER_NONE
 from pydiskcmdlib.sgio.errors import UnspecifiedError, CheckConditionError
 from pydiskcmdlib import log
@@ -9,30 +13,10 @@ from pydiskcmdlib import log
 # interface_id = ord('S')
 InterfaceID = 83
 
-class CheckConditionError(Exception):
-    """The target is reporting an error.
-
-    Send a Request Sense command to retrieve error information.
-
-    See https://en.wikipedia.org/wiki/SCSI_check_condition for details.
-    """
-
-    def __init__(self, sense):
-        super(CheckConditionError, self).__init__(
-            'SCSI Check Condition: %s' % sense.hex()
-        )
-        self.sense = sense
-
-
-class UnspecifiedError(Exception):
-    """Something went wrong."""
-
-
 class sgioHdr(ctypes.Structure):
     """
-    This structure descibed in scsi/sg.h
+    This structure descibed in scsi/sg.h, with natural alignment(88 bytes in 64 bit system)
     """
-    _pack_ = 1
     _fields_ = [
         ('interface_id', ctypes.c_int),
         ('dxfer_direction', ctypes.c_int),
@@ -58,6 +42,15 @@ class sgioHdr(ctypes.Structure):
         ('info', ctypes.c_uint)]
 
 
+def _is_writable(buf):
+    """
+    check if buf is a writable buffer, like bytearray or a writable memoryview(pooled buffer)
+    """
+    if isinstance(buf, bytearray):
+        return True
+    return isinstance(buf, memoryview) and not buf.readonly and buf.contiguous
+
+
 def execute(
     fid,
     cdb: bytearray,
@@ -71,13 +64,13 @@ def execute(
         raise NotImplemented('Indirect IO is not suported')
     elif data_out is not None and len(data_out):
         dxfer_direction = SG_DXFER_TO_DEV
-        # For check if not bytearray data
-        if not isinstance(data_out, bytearray):
+        # For check if not writable data
+        if not _is_writable(data_out):
             data_out = bytearray(data_out)
         data_buffer = data_out
     elif data_in is not None and len(data_in):
         dxfer_direction = SG_DXFER_FROM_DEV
-        if not isinstance(data_in, bytearray):
+        if not _is_writable(data_in):
             raise RuntimeError("Bytearray data_in is need")
         data_buffer = data_in
     else:
@@ -112,6 +105,15 @@ def execute(
     if result < 0:
         raise OSError('ioctl failed')
 
+    _check_io_hdr(io_hdr, sense_buffer)
+    # Return the actual transfer written and any sense we got.
+    if return_sense_buffer:
+        return io_hdr.resid, bytes(sense_buffer)
+    else:
+        return io_hdr.resid
+
+
+def _check_io_hdr(io_hdr, sense_buffer):
     if io_hdr.info & SG_INFO_OK_MASK != SG_INFO_OK:
         log.debug("SGIO: SG_INFO: %#x, sb_len_wr: %d, resid: %d" % ((io_hdr.info & SG_INFO_OK_MASK), io_hdr.sb_len_wr, io_hdr.resid))
         log.debug("SGIO: sense data: %s" % bytes(sense_buffer))
@@ -127,8 +129,161 @@ def execute(
                 pass
             else:
                 raise UnspecifiedError()
-    # Return the actual transfer written and any sense we got.
-    if return_sense_buffer:
-        return io_hdr.resid, bytes(sense_buffer)
-    else:
-        return io_hdr.resid
+
+
+def is_sg_device(path):
+    """
+    check if the path is a scsi generic char device(/dev/sgX), only the sg driver 
+    supports the asynchronous write()/read() interface.
+
+    :param path: the device path
+    :return: True or False
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISCHR(st.st_mode) and os.major(st.st_rdev) == SCSI_GENERIC_MAJOR
+
+
+class _SGRequest(object):
+    __slots__ = ('io_hdr', 'cdb_buffer', 'data_buffer', 'sense_buffer', 'usr_obj')
+
+
+class AsyncSGIO(object):
+    """
+    The asynchronous sg v3 interface, write() the sg_io_hdr to queue a command 
+    and read() it back when completed. The pack_id and usr_ptr are set to a tag, 
+    which is used to match the completion with the command.
+
+    A basic workflow:
+        - submit() up to queue_depth commands;
+        - receive() the completions, wait at least min_complete commands to complete;
+        - close() after all the commands are completed.
+    """
+    def __init__(self, path, queue_depth=SG_MAX_QUEUE, max_sense_data_length=32):
+        """
+        :param path: the scsi generic device path, like /dev/sg1
+        :param queue_depth: the max commands in flight, the sg driver limits it to SG_MAX_QUEUE
+        :param max_sense_data_length: the sense buffer length of each command
+        """
+        if not is_sg_device(path):
+            raise OSError("%s is not a scsi generic device" % path)
+        self._fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        self._queue_depth = max(1, min(queue_depth, SG_MAX_QUEUE))
+        self._max_sense_data_length = max_sense_data_length
+        self._pending = {}
+        self._next_tag = 0
+        self._poller = select.poll()
+        self._poller.register(self._fd, select.POLLIN)
+
+    @property
+    def queue_depth(self):
+        return self._queue_depth
+
+    @property
+    def inflight(self):
+        return len(self._pending)
+
+    def fileno(self):
+        return self._fd
+
+    def submit(self, cdb, data_out, data_in, usr_obj=None):
+        """
+        queue a scsi command, the buffers should not be resized until it is received.
+
+        :param cdb: the scsi cdb
+        :param data_out: the data send to device, or None
+        :param data_in: a bytearray(or writable memoryview) to receive the data from device, or None
+        :param usr_obj: a object returned with the completion
+        :return: the tag(pack_id) of this command
+        """
+        if len(self._pending) >= self._queue_depth:
+            raise OSError("SGIO: the queue is full, receive the completions first")
+        req = _SGRequest()
+        if data_out is not None and len(data_out) and data_in is not None and len(data_in):
+            raise NotImplementedError('Indirect IO is not suported')
+        elif data_out is not None and len(data_out):
+            dxfer_direction = SG_DXFER_TO_DEV
+            if _is_writable(data_out):
+                ## no copy, do not change it until it is received
+                req.data_buffer = (ctypes.c_char * len(data_out)).from_buffer(data_out)
+            else:
+                req.data_buffer = ctypes.create_string_buffer(bytes(data_out), len(data_out))
+            dxfer_len = len(data_out)
+        elif data_in is not None and len(data_in):
+            dxfer_direction = SG_DXFER_FROM_DEV
+            if not _is_writable(data_in):
+                raise RuntimeError("Bytearray data_in is need")
+            req.data_buffer = (ctypes.c_char * len(data_in)).from_buffer(data_in)
+            dxfer_len = len(data_in)
+        else:
+            dxfer_direction = SG_DXFER_NONE
+            req.data_buffer = None
+            dxfer_len = 0
+        req.cdb_buffer = ctypes.create_string_buffer(bytes(cdb), len(cdb))
+        req.sense_buffer = ctypes.create_string_buffer(self._max_sense_data_length)
+        req.usr_obj = usr_obj
+        ## pack_id is a signed int
+        tag = self._next_tag
+        self._next_tag = (tag + 1) & 0x7FFFFFFF
+        req.io_hdr = sgioHdr(interface_id=InterfaceID, dxfer_direction=dxfer_direction,
+                             cmd_len=len(cdb),
+                             mx_sb_len=self._max_sense_data_length, iovec_count=0,
+                             dxfer_len=dxfer_len,
+                             dxferp=ctypes.addressof(req.data_buffer) if req.data_buffer is not None else 0,
+                             cmdp=ctypes.addressof(req.cdb_buffer),
+                             sbp=ctypes.addressof(req.sense_buffer), timeout=TIMEOUT,
+                             flags=0, pack_id=tag, usr_ptr=tag)
+        os.write(self._fd, req.io_hdr)
+        self._pending[tag] = req
+        return tag
+
+    def receive(self, min_complete=1, timeout=None):
+        """
+        receive the completed commands.
+
+        :param min_complete: wait at least min_complete commands to complete
+        :param timeout: the max time(milliseconds) to wait, None means no limit
+        :return: a list of tuple (usr_obj, resid, sense, error), error is None or 
+                 the exception that execute() would raise
+        """
+        min_complete = min(min_complete, len(self._pending))
+        done = []
+        hdr_size = ctypes.sizeof(sgioHdr)
+        while self._pending:
+            try:
+                raw = os.read(self._fd, hdr_size)
+            except BlockingIOError:
+                if len(done) >= min_complete or not self._poller.poll(timeout):
+                    break
+                continue
+            io_hdr = sgioHdr.from_buffer_copy(raw)
+            req = self._pending.pop(io_hdr.pack_id, None)
+            if req is None or (io_hdr.usr_ptr or 0) != io_hdr.pack_id:
+                log.debug("SGIO: unexpected completion, pack_id %d" % io_hdr.pack_id)
+                continue
+            error = None
+            try:
+                _check_io_hdr(io_hdr, req.sense_buffer)
+            except (CheckConditionError, UnspecifiedError) as e:
+                error = e
+            done.append((req.usr_obj, io_hdr.resid, bytes(req.sense_buffer), error))
+        return done
+
+    def close(self):
+        """
+        wait for the commands in flight and close the device.
+        """
+        if self._fd is not None:
+            try:
+                while self._pending:
+                    self.receive(min_complete=len(self._pending))
+            finally:
+                self._poller.unregister(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+    def __del__(self):
+        if getattr(self, '_fd', None) is not None:
+            self.close()
@@ -0,0 +1,460 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import time
+from array import array
+from pydiskcmdlib.trace import clock_ns
+from pydiskcmdlib.exceptions import (
+    ParameterIncorrect,
+    CommandReturnStatusError,
+    SenseDataCheckErr,
+    ExecuteCmdErr,
+)
+from pydiskcmdlib.sgio.errors import CheckConditionError,UnspecifiedError
+from pyscsi.pyscsi.scsi_sense import SCSICheckCondition
+
+## The surface scan sweeps the LBA space with Verify(or Read) commands, and
+#  keeps up to the device queue depth commands in flight. Every completed
+#  command is recorded into a latency heatmap: the LBA space is divided into
+#  regions, and every region has a latency histogram in one flat array, so
+#  the memory does not grow with the number of commands.
+#
+#  The histogram buckets are power of 2 in microseconds, bucket 0 is less
+#  than 1us, bucket i is [2^(i-1), 2^i) us, the last bucket has all the
+#  latency not less than 2^(LatencyBuckets-2) us.
+LatencyBuckets = 26
+HeatmapChars = " .:-=+*#%@"
+HeatmapErrorChar = "X"
+DefaultRegions = 256
+DefaultSlowMs = 200
+DefaultChunkBytes = 1024 * 1024
+## the failures of a command reported by the device, they are recorded as a
+#  failed LBA range, all the other exceptions stop the scan
+CommandFailureErrors = (CommandReturnStatusError,
+                        SenseDataCheckErr,
+                        ExecuteCmdErr,
+                        CheckConditionError,
+                        UnspecifiedError,
+                        SCSICheckCondition)
+
+
+def get_latency_bucket(latency_ns):
+    """
+    :param latency_ns: the latency in nanoseconds
+    :return: the histogram bucket
+    """
+    return min(int(latency_ns // 1000).bit_length(), LatencyBuckets - 1)
+
+
+def get_bucket_bound_us(bucket):
+    """
+    :param bucket: the histogram bucket
+    :return: the upper bound of the bucket in microseconds
+    """
+    return 1 << bucket
+
+
+class LatencyHeatmap(object):
+    """
+    The per-region latency histogram of a LBA space
+    """
+    def __init__(self, start, end, regions=DefaultRegions):
+        """
+        :param start: the first lba
+        :param end: the lba after the last one
+        :param regions: the number of regions
+        """
+        if end <= start:
+            raise ParameterIncorrect("Empty LBA range")
+        self.start = start
+        self.end = end
+        regions = max(1, min(regions, end - start))
+        self.region_lbas = -(-(end - start) // regions)
+        self.regions = -(-(end - start) // self.region_lbas)
+        self.histogram = array('I', [0]) * (self.regions * LatencyBuckets)
+        self.count = array('I', [0]) * self.regions
+        self.errors = array('I', [0]) * self.regions
+        self.max_ns = array('Q', [0]) * self.regions
+        self.sum_ns = array('Q', [0]) * self.regions
+
+    def get_region(self, lba):
+        return min(max(lba - self.start, 0) // self.region_lbas, self.regions - 1)
+
+    def get_region_range(self, region):
+        """
+        :return: (the first lba, the number of lbas) of the region
+        """
+        lba = self.start + region * self.region_lbas
+        return lba,min(self.region_lbas, self.end - lba)
+
+    def add(self, lba, latency_ns, error=False):
+        """
+        record a command
+
+        :param lba: the start lba of the command
+        :param latency_ns: the latency in nanoseconds
+        :param error: the command failed
+        """
+        region = self.get_region(lba)
+        self.histogram[region * LatencyBuckets + get_latency_bucket(latency_ns)] += 1
+        self.count[region] += 1
+        self.sum_ns[region] += latency_ns
+        if latency_ns > self.max_ns[region]:
+            self.max_ns[region] = latency_ns
+        if error:
+            self.errors[region] += 1
+
+    def get_histogram(self, region=None):
+        """
+        :param region: the region, None means the whole LBA space
+        :return: a list of the count of every bucket
+        """
+        if region is not None:
+            return self.histogram[region*LatencyBuckets:(region+1)*LatencyBuckets].tolist()
+        total = [0] * LatencyBuckets
+        for i,v in enumerate(self.histogram):
+            total[i % LatencyBuckets] += v
+        return total
+
+    def get_percentile_us(self, percent, region=None):
+        """
+        :param percent: 0-100
+        :param region: the region, None means the whole LBA space
+        :return: the upper bound(microseconds) of the bucket of the percentile, 0 if no command
+        """
+        histogram = self.get_histogram(region)
+        total = sum(histogram)
+        if total == 0:
+            return 0
+        target = total * percent / 100
+        acc = 0
+        for bucket,v in enumerate(histogram):
+            acc += v
+            if acc >= target:
+                return get_bucket_bound_us(bucket)
+        return get_bucket_bound_us(LatencyBuckets - 1)
+
+    def render(self, width=64):
+        """
+        render the max latency of every region as characters, a region failed is HeatmapErrorChar
+
+        :param width: the regions per line
+        :return: a tuple of (lines, legend), legend is a list of (char, the upper bound in microseconds)
+        """
+        buckets = [get_latency_bucket(v) for i,v in enumerate(self.max_ns) if self.count[i]]
+        low = min(buckets) if buckets else 0
+        high = max(buckets) if buckets else 0
+        levels = len(HeatmapChars) - 1
+        def get_level(bucket):
+            if high == low:
+                return 1
+            return 1 + (bucket - low) * (levels - 1) // (high - low)
+        chars = []
+        for region in range(self.regions):
+            if self.errors[region]:
+                chars.append(HeatmapErrorChar)
+            elif self.count[region] == 0:
+                chars.append(HeatmapChars[0])
+            else:
+                chars.append(HeatmapChars[get_level(get_latency_bucket(self.max_ns[region]))])
+        lines = []
+        for i in range(0, self.regions, width):
+            lines.append("%#014x %s" % (self.get_region_range(i)[0], "".join(chars[i:i+width])))
+        legend = []
+        for bucket in range(low, high + 1):
+            c = HeatmapChars[get_level(bucket)]
+            if not legend or legend[-1][0] != c:
+                legend.append((c, get_bucket_bound_us(bucket)))
+            else:
+                legend[-1] = (c, get_bucket_bound_us(bucket))
+        return lines,legend
+
+
+def merge_extents(extents, same_value=False):
+    """
+    merge the adjacent extents
+
+    :param extents: a list of (lba, nlb, value), the value of merged extent is the max one
+    :param same_value: only merge the extents of the same value
+    :return: a list of (lba, nlb, value), sorted by lba
+    """
+    merged = []
+    for lba,nlb,value in sorted(extents, key=lambda x: x[0]):
+        if merged and merged[-1][0] + merged[-1][1] == lba and (not same_value or merged[-1][2] == value):
+            last = merged[-1]
+            merged[-1] = (last[0], last[1] + nlb, max(last[2], value))
+        else:
+            merged.append((lba, nlb, value))
+    return merged
+
+
+class ScanTarget(object):
+    """
+    The commands of a surface scan, subclass it for a device type.
+    """
+    ## the number of logical blocks, the logical block size in bytes
+    total_lbas = 0
+    blocksize = 512
+    ## the max commands in flight, and the max logical blocks of a command
+    queue_depth = 1
+    max_chunk = 65535
+
+    def issue(self, lba, nlb):
+        """
+        submit a command
+
+        :param lba: the start lba
+        :param nlb: the number of logical blocks, 1's based
+        :return: the command
+        """
+        raise NotImplementedError
+
+    def reap(self):
+        """
+        :return: a list of (cmd, error), error is None or the exception of the command
+        """
+        raise NotImplementedError
+
+    def check(self, cmd):
+        """
+        :return: None if the command success, or the description of the failure
+        """
+        return None
+
+
+class NVMeScanTarget(ScanTarget):
+    def __init__(self, nvme, ns_id, mode="verify"):
+        """
+        :param nvme: a NVMe object
+        :param ns_id: the namespace id
+        :param mode: "verify" or "read"
+        """
+        if mode not in ("verify", "read"):
+            raise ParameterIncorrect("mode should be verify|read")
+        from pydiskcmdlib.pynvme.nvme import get_max_xfer_len
+        self.nvme = nvme
+        self.ns_id = ns_id
+        self.mode = mode
+        ns_format = nvme.ns_format(ns_id)
+        self.total_lbas = ns_format["nsze"]
+        self.blocksize = ns_format["lbads"]
+        self.queue_depth = getattr(nvme.device, "queue_depth", 1)
+        ## NLB is 16 bits
+        self.max_chunk = 65536
+        if mode == "read":
+            mdts_bytes = get_max_xfer_len(nvme.ctrl_identify_info)
+            if mdts_bytes:
+                self.max_chunk = max(1, min(self.max_chunk, mdts_bytes // (ns_format["lbads"] + (ns_format["ms"] if ns_format["extended"] else 0))))
+
+    def issue(self, lba, nlb):
+        if self.mode == "verify":
+            return self.nvme.verify(self.ns_id, lba, nlb - 1, nowait=True)
+        return self.nvme.read(self.ns_id, lba, nlb - 1, nowait=True)
+
+    def reap(self):
+        reap_results = getattr(self.nvme.device, "reap_results", None)
+        if reap_results:
+            return reap_results(min_complete=1)
+        return [(cmd, None) for cmd in self.nvme.reap(min_complete=1)]
+
+    def check(self, cmd):
+        SC,SCT = cmd.check_return_status(False, False)
+        if SC or SCT:
+            return "SCT %#x, SC %#x" % (SCT, SC)
+
+
+class _SGTarget(ScanTarget):
+    def reap(self):
+        poll_results = getattr(self.device, "poll_results", None)
+        if poll_results:
+            return poll_results(min_complete=1)
+        return [(cmd, None) for cmd in self.device.poll(min_complete=1)]
+
+
+class ATAScanTarget(_SGTarget):
+    def __init__(self, sata):
+        """
+        :param sata: a SATA object, READ VERIFY SECTORS EXT is used
+        """
+        self.sata = sata
+        self.device = sata.device
+        identify = sata.identify_raw
+        ## IDENTIFY DEVICE words 100-103, the number of user addressable logical sectors
+        self.total_lbas = int.from_bytes(bytes(identify[200:208]), 'little')
+        self.blocksize = sata.blocksize
+        self.queue_depth = getattr(sata.device, "queue_depth", 1)
+        ## the count field is 16 bits
+        self.max_chunk = 65535
+
+    def issue(self, lba, nlb):
+        from pydiskcmdlib.pysata.ata_cdb_read_verify_sectors import ReadVerifySectorEXT
+        return self.sata.submit(ReadVerifySectorEXT(lba, nlb))
+
+    def check(self, cmd):
+        return_descriptor = cmd.ata_status_return_descriptor
+        if return_descriptor:
+            if return_descriptor.get("error") != 0:
+                return "error: %#x, status: %#x" % (return_descriptor.get("error"), return_descriptor.get("status"))
+        elif cmd.ata_sense_data_condition:
+            return cmd.ata_sense_data_condition._describe_ascq()
+
+
+class SCSIScanTarget(_SGTarget):
+    def __init__(self, scsi, mode="verify"):
+        """
+        :param scsi: a SCSI object
+        :param mode: "verify"(VERIFY(16)) or "read"(READ(16))
+        """
+        if mode not in ("verify", "read"):
+            raise ParameterIncorrect("mode should be verify|read")
+        self.scsi = scsi
+        self.device = scsi.device
+        self.mode = mode
+        max_lba = scsi.device_max_lba
+        if not max_lba:
+            max_lba = scsi.readcapacity16().result["returned_lba"]
+        self.total_lbas = max_lba + 1
+        self.blocksize = scsi.blocksize
+        self.queue_depth = getattr(scsi.device, "queue_depth", 1)
+        self.max_chunk = 65535
+
+    def issue(self, lba, nlb):
+        if self.mode == "verify":
+            from pydiskcmdlib.pyscsi.scsi_cdb_verify16 import Verify16
+            cmd = Verify16(self.device.opcodes.VERIFY_16, lba, nlb)
+        else:
+            from pyscsi.pyscsi.scsi_cdb_read16 import Read16
+            cmd = Read16(self.device.opcodes.READ_16, self.blocksize, lba, nlb)
+        return self.scsi.submit(cmd)
+
+
+class SurfaceScan(object):
+    """
+    Sweep a LBA range with up to queue depth commands in flight.
+
+    Usage:
+        with NVMe(init_device("/dev/ng0n1", backend='io_uring')) as d:
+            result = SurfaceScan(NVMeScanTarget(d, 1)).run()
+            lines,legend = result["heatmap"].render()
+    """
+    def __init__(self,
+                 target,
+                 start=0,
+                 count=0,
+                 chunk=0,
+                 regions=DefaultRegions,
+                 slow_ms=DefaultSlowMs,
+                 queue_depth=0):
+        """
+        :param target: a ScanTarget
+        :param start: the first lba
+        :param count: the number of logical blocks, 0 means to the end
+        :param chunk: the logical blocks per command, 0 means 1MiB(limited by target.max_chunk)
+        :param regions: the regions of heatmap
+        :param slow_ms: the command latency(milliseconds) to report as slow
+        :param queue_depth: the max commands in flight, limited by target.queue_depth, 0 means target.queue_depth
+        """
+        self.target = target
+        self.start = start
+        self.end = (start + count) if count else target.total_lbas
+        if not (0 <= start < self.end <= target.total_lbas):
+            raise ParameterIncorrect("LBA range %d-%d is beyond the device(%d blocks)" % (start, self.end - 1, target.total_lbas))
+        if chunk <= 0:
+            chunk = max(1, DefaultChunkBytes // target.blocksize)
+        self.chunk = min(chunk, target.max_chunk)
+        ## the synchronous backends complete the command in submit, more in flight is meaningless
+        self.queue_depth = max(1, min(queue_depth, target.queue_depth) if queue_depth else target.queue_depth)
+        self.slow_ns = int(slow_ms * 1000000)
+        self.heatmap = LatencyHeatmap(self.start, self.end, regions=regions)
+
+    def run(self, progress=None):
+        """
+        :param progress: a function called after every completed command, progress(done_lbas, total_lbas)
+        :return: a dict of "start", "end", "lbas", "commands", "seconds", "throughput"(bytes/s),
+                 "heatmap"(LatencyHeatmap), "slow"(a list of (lba, nlb, max latency ns)),
+                 "errors"(a list of (lba, nlb, description))
+        """
+        target = self.target
+        heatmap = self.heatmap
+        total = self.end - self.start
+        slow,errors = [],[]
+        ## cmd -> (lba, nlb, submit time)
+        inflight = {}
+        done,commands = 0,0
+        lba = self.start
+        t0 = time.perf_counter()
+        def complete(lba, nlb, latency, error):
+            heatmap.add(lba, latency, error=bool(error))
+            if error:
+                errors.append((lba, nlb, error))
+            elif latency >= self.slow_ns:
+                slow.append((lba, nlb, latency))
+        while lba < self.end or inflight:
+            while lba < self.end and len(inflight) < self.queue_depth:
+                nlb = min(self.chunk, self.end - lba)
+                t = clock_ns()
+                try:
+                    cmd = target.issue(lba, nlb)
+                except CommandFailureErrors as e:
+                    ## the synchronous backends raise the command failure when submitting
+                    complete(lba, nlb, clock_ns() - t, str(e) or e.__class__.__name__)
+                    done += nlb
+                    commands += 1
+                else:
+                    inflight[cmd] = (lba, nlb, t)
+                lba += nlb
+            if not inflight:
+                continue
+            for cmd,error in target.reap():
+                now = clock_ns()
+                cmd_lba,nlb,t = inflight.pop(cmd)
+                if error is not None:
+                    error = str(error) or error.__class__.__name__
+                else:
+                    error = target.check(cmd)
+                complete(cmd_lba, nlb, now - t, error)
+                done += nlb
+                commands += 1
+                if progress:
+                    progress(done, total)
+        seconds = time.perf_counter() - t0
+        return {"start": self.start,
+                "end": self.end,
+                "lbas": done,
+                "commands": commands,
+                "seconds": seconds,
+                "throughput": done * target.blocksize / seconds if seconds > 0 else 0,
+                "heatmap": heatmap,
+                "slow": merge_extents(slow),
+                "errors": merge_extents(errors, same_value=True),}
+
+
+def format_scan_report(result, width=64):
+    """
+    :param result: the result of SurfaceScan.run()
+    :param width: the regions per line of heatmap
+    :return: the report lines
+    """
+    heatmap = result["heatmap"]
+    lines = ["Scanned LBA %#x-%#x, %d blocks in %d commands, %.3fs" % (result["start"],
+                                                                       result["end"] - 1,
+                                                                       result["lbas"],
+                                                                       result["commands"],
+                                                                       result["seconds"]),
+             "Latency p50/p99/p99.9/max: <%dus/<%dus/<%dus/%.1fms" % (heatmap.get_percentile_us(50),
+                                                                      heatmap.get_percentile_us(99),
+                                                                      heatmap.get_percentile_us(99.9),
+                                                                      max(heatmap.max_ns) / 1000000),
+             "",
+             "Heatmap of max latency, %d blocks per region:" % heatmap.region_lbas,]
+    heatmap_lines,legend = heatmap.render(width=width)
+    lines.extend(heatmap_lines)
+    lines.append("Legend: %s, '%s' error" % (", ".join("'%s' <%dus" % (c, us) for c,us in legend), HeatmapErrorChar))
+    lines.append("")
+    lines.append("Slow ranges(%d):" % len(result["slow"]))
+    for lba,nlb,latency in result["slow"]:
+        lines.append("  %#x-%#x  %.1fms" % (lba, lba + nlb - 1, latency / 1000000))
+    lines.append("Failed ranges(%d):" % len(result["errors"]))
+    for lba,nlb,error in result["errors"]:
+        lines.append("  %#x-%#x  %s" % (lba, lba + nlb - 1, error))
+    return lines
@@ -0,0 +1,257 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import time
+import struct
+import logging
+from itertools import count
+from pydiskcmdlib import log
+
+## The command tracing of the hot path. Nothing is formatted unless debug
+#  logging is enabled, and the trace ring is only fed when it is enabled by
+#  enable_trace_ring(), so the cost is one check per command when disabled.
+DEBUG = logging.DEBUG
+
+KindNVMe = 1
+KindATA = 2
+KindSCSI = 3
+KindName = {KindNVMe: "NVMe", KindATA: "ATA", KindSCSI: "SCSI"}
+
+DefaultEntries = 256
+## bytes of command structure and sense data kept in a record
+CDBSize = 80
+SenseSize = 32
+## created time, duration(ns), kind, cdb length, sense length, flags, status, result, cdb, sense
+_Record = struct.Struct("<dQBBBBiI%ds%ds" % (CDBSize, SenseSize))
+_FlagError = 0x01
+
+if hasattr(time, "perf_counter_ns"):
+    clock_ns = time.perf_counter_ns
+else:
+    def clock_ns():
+        return int(time.perf_counter() * 1000000000)
+
+
+class HexBytes(object):
+    """
+    Format bytes as hex string only when it is printed, used as logging argument.
+    """
+    __slots__ = ("_data",)
+    def __init__(self, data):
+        self._data = data
+
+    def __str__(self):
+        if not self._data:
+            return 'NA'
+        return " ".join(["%02X" % i for i in memoryview(self._data).cast('B')])
+
+
+def _head_bytes(data, size):
+    if not data:
+        return b''
+    return memoryview(data).cast('B')[:size].tobytes()
+
+
+def _decode_ata_taskfile(cdb):
+    """
+    get the ATA taskfile from an ATA PASS-THROUGH(12 or 16) cdb
+
+    :return: (command, feature, count, lba, device), or None if not ATA PASS-THROUGH
+    """
+    if len(cdb) >= 16 and cdb[0] == 0x85:
+        return (cdb[14],
+                (cdb[3] << 8) + cdb[4],
+                (cdb[5] << 8) + cdb[6],
+                (cdb[11] << 40) + (cdb[9] << 32) + (cdb[7] << 24) + (cdb[12] << 16) + (cdb[10] << 8) + cdb[8],
+                cdb[13])
+    elif len(cdb) >= 12 and cdb[0] == 0xA1:
+        return (cdb[9], cdb[3], cdb[4], (cdb[7] << 16) + (cdb[6] << 8) + cdb[5], cdb[8])
+
+
+def _decode_ata_status(sense):
+    """
+    get the ATA status and error from sense data
+
+    :return: (status, error), or None if no ATA status in sense data
+    """
+    if len(sense) >= 22 and (sense[0] & 0x7F) == 0x72 and sense[8] == 0x09:
+        return sense[21],sense[11]
+    elif len(sense) >= 5 and (sense[0] & 0x7F) == 0x70:
+        return sense[4],sense[3]
+
+
+class TraceRing(object):
+    """
+    A binary ring buffer of the recent commands. Every record is packed into a
+    preallocated bytearray, and only decoded when the ring is dumped.
+    """
+    def __init__(self, entries=DefaultEntries, dump_on_error=True):
+        """
+        :param entries: the max records kept in ring
+        :param dump_on_error: dump the ring to log when a traced command raises error
+        """
+        self._entries = entries
+        self._buf = bytearray(_Record.size * entries)
+        self._counter = count()
+        self._total = 0
+        self.dump_on_error = dump_on_error
+
+    @property
+    def entries(self):
+        return self._entries
+
+    def __len__(self):
+        return min(self._total, self._entries)
+
+    def clear(self):
+        self._counter = count()
+        self._total = 0
+
+    def add(self, kind, cmd, start_ns, error=None):
+        """
+        add a record of a completed command
+
+        :param kind: KindNVMe, KindATA or KindSCSI
+        :param cmd: the command object
+        :param start_ns: the clock_ns() when the command is sent
+        :param error: the exception raised by the command
+        """
+        duration = clock_ns() - start_ns
+        if kind == KindNVMe:
+            cdb = _head_bytes(cmd.cdb_struc, CDBSize)
+            sense = b''
+            status = -1 if cmd.cq_status is None else cmd.cq_status
+            result = cmd.cq_cmd_spec or 0
+        else:
+            cdb = _head_bytes(cmd.cdb, CDBSize)
+            sense = _head_bytes(cmd.raw_sense_data or cmd.sense, SenseSize)
+            status = -1
+            result = 0
+        n = next(self._counter)
+        _Record.pack_into(self._buf,
+                          (n % self._entries) * _Record.size,
+                          time.time(),
+                          duration,
+                          kind,
+                          len(cdb),
+                          len(sense),
+                          _FlagError if error is not None else 0,
+                          status,
+                          result & 0xFFFFFFFF,
+                          cdb,
+                          sense)
+        self._total = n + 1
+
+    def trace(self, kind, func, cmd, *args, **kwargs):
+        """
+        call func(cmd, *args, **kwargs), and add the record of cmd
+
+        :return: the return of func
+        """
+        t0 = clock_ns()
+        try:
+            ret = func(cmd, *args, **kwargs)
+        except Exception as e:
+            self.add(kind, cmd, t0, error=e)
+            raise
+        self.add(kind, cmd, t0)
+        return ret
+
+    def records(self):
+        """
+        get the records, from the oldest to the newest
+
+        :return: a list of dict
+        """
+        total = self._total
+        ret = []
+        for n in range(max(0, total - self._entries), total):
+            created,duration,kind,cdb_len,sense_len,flags,status,result,cdb,sense = _Record.unpack_from(self._buf, (n % self._entries) * _Record.size)
+            ret.append({"index": n,
+                        "created": created,
+                        "duration": duration,
+                        "kind": kind,
+                        "error": bool(flags & _FlagError),
+                        "status": None if status < 0 else status,
+                        "result": result,
+                        "cdb": cdb[0:cdb_len],
+                        "sense": sense[0:sense_len],})
+        return ret
+
+    def format_records(self):
+        """
+        format the records to human readable lines
+
+        :return: a list of string
+        """
+        lines = []
+        for r in self.records():
+            cdb = r["cdb"]
+            line = "#%-6d [%f] %-4s %10.1fus " % (r["index"], r["created"], KindName.get(r["kind"], "?"), r["duration"] / 1000)
+            if r["kind"] == KindNVMe:
+                line += "opcode %02Xh status %s result %Xh" % (cdb[0] if cdb else 0,
+                                                              "NA" if r["status"] is None else "%Xh" % r["status"],
+                                                              r["result"])
+            else:
+                taskfile = _decode_ata_taskfile(cdb) if r["kind"] == KindATA else None
+                if taskfile:
+                    line += "command %02Xh feature %Xh count %Xh lba %Xh device %Xh" % taskfile
+                    ata_status = _decode_ata_status(r["sense"])
+                    if ata_status:
+                        line += " status %02Xh error %02Xh" % ata_status
+                else:
+                    line += "opcode %02Xh" % (cdb[0] if cdb else 0)
+            if r["error"]:
+                line += " ERROR"
+            lines.append(line)
+            lines.append("        cdb: %s" % HexBytes(cdb))
+            if r["sense"]:
+                lines.append("        sense: %s" % HexBytes(r["sense"]))
+        return lines
+
+    def dump(self, logger=None, level=logging.ERROR):
+        """
+        dump the records to logger
+
+        :param logger: the logger, None means pydiskcmdlib log
+        :param level: the logging level
+        """
+        logger = logger or log
+        logger.log(level, "Recent %d commands:", len(self))
+        for line in self.format_records():
+            logger.log(level, line)
+
+    def on_error(self, error):
+        """
+        called when a traced command raises error
+        """
+        if self.dump_on_error:
+            log.error("Command failed: %s", error)
+            self.dump()
+
+
+_ring = None
+
+def enable_trace_ring(entries=DefaultEntries, dump_on_error=True):
+    """
+    enable the trace ring, the NVMe, ATA and SCSI commands are recorded to it
+
+    :param entries: the max records kept in ring
+    :param dump_on_error: dump the ring to log when a command raises error
+    :return: the TraceRing
+    """
+    global _ring
+    _ring = TraceRing(entries=entries, dump_on_error=dump_on_error)
+    return _ring
+
+
+def disable_trace_ring():
+    global _ring
+    _ring = None
+
+
+def get_trace_ring():
+    """
+    :return: the TraceRing, or None if not enabled
+    """
+    return _ring
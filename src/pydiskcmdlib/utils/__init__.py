@@ -8,30 +8,46 @@ from pydiskcmdlib import os_type
 
 def init_device(dev, 
                 read_write=(False if os_type == "Linux" else True), 
-                open_t=None):
+                open_t=None,
+                backend=None,
+                queue_depth=32):
     '''
     initialize a device object
         :param dev: the device path
         :param readwrite: access type
         :param open_t: the open type of device, valid values is None, 'scsi', 'ata', 'nvme', 'vroc'
-        :param backends: backend io engine type, valid parameters: 
+        :param backend: backend io engine type, None means the default one, valid parameters: 
             * 'ioctl'                ioctl type, alias ioctl_fcntl
             * 'ioctl_fcntl'          ioctl type, Send sgio request with ioctl (python fcntl.ioctl)
             * 'ioctl_sgio'           ioctl type, alias ioctl_sgio_local
             * 'ioctl_sgio_pyscsi'    ioctl type, Send sgio request with cython-sgio (python cython-sgio)
             * 'ioctl_sgio_local'     ioctl type, Send sgio request with local code (pydiskcmdlib.sgio)
-            * 'io_uring'             under development
+            * 'io_uring'             Linux nvme only, send nvme passthrough commands with IORING_OP_URING_CMD,
+                                     IO commands need the generic char device, like /dev/ng0n1
+        :param queue_depth: the max number of commands in flight, used by the asynchronous backend 
+                            (nvme io_uring, and the scsi generic device /dev/sgX in Linux)
     '''
+    if backend not in (None, 'ioctl', 'ioctl_fcntl', 'ioctl_sgio', 'ioctl_sgio_pyscsi', 'ioctl_sgio_local', 'io_uring'):
+        raise NotImplementedError('No backend %s implemented' % backend)
+    if backend == 'io_uring' and (os_type != "Linux" or open_t not in (None, 'nvme')):
+        raise NotImplementedError('Backend io_uring only implemented for Linux NVMe device')
     if open_t == 'scsi' or open_t == 'ata':
         from pydiskcmdlib.pyscsi.scsi_device import SCSIDevice
         if os_type == "Windows" and dev.upper().startswith("PHYSICALDRIVE"): 
             dev = "\\\\.\\" + dev.upper()
-        device = SCSIDevice(dev, read_write)
+        if os_type == "Linux":
+            device = SCSIDevice(dev, read_write, queue_depth=queue_depth)
+        else:
+            device = SCSIDevice(dev, read_write)
     elif open_t == 'nvme':
-        from pydiskcmdlib.pynvme.nvme_device import NVMeDevice
         if os_type == "Windows" and dev.upper().startswith("PHYSICALDRIVE"):
             dev = "\\\\.\\" + dev.upper()
-        device = NVMeDevice(dev, read_write)
+        if backend == 'io_uring':
+            from pydiskcmdlib.pynvme.nvme_device import NVMeIOUringDevice
+            device = NVMeIOUringDevice(dev, read_write, queue_depth=queue_depth)
+        else:
+            from pydiskcmdlib.pynvme.nvme_device import NVMeDevice
+            device = NVMeDevice(dev, read_write)
     elif open_t == 'vroc':
         if os_type == "Windows":
             from pydiskcmdlib.vroc.vroc_device import VROCDevice
@@ -57,12 +73,16 @@ def init_device(dev,
         else:
             raise NotImplementedError('No backend implemented for %s' % dev)
     elif open_t == None and os_type == "Linux":
-        if dev[:5] == '/dev/' and "nvme" in dev[5:]:
-            from pydiskcmdlib.pynvme.nvme_device import NVMeDevice
-            device = NVMeDevice(dev, read_write)
+        if dev[:5] == '/dev/' and ("nvme" in dev[5:] or dev[5:7] == 'ng'):
+            if backend == 'io_uring':
+                from pydiskcmdlib.pynvme.nvme_device import NVMeIOUringDevice
+                device = NVMeIOUringDevice(dev, read_write, queue_depth=queue_depth)
+            else:
+                from pydiskcmdlib.pynvme.nvme_device import NVMeDevice
+                device = NVMeDevice(dev, read_write)
         elif dev[:5] == '/dev/':
             from pydiskcmdlib.pyscsi.scsi_device import SCSIDevice
-            device = SCSIDevice(dev, read_write)
+            device = SCSIDevice(dev, read_write, queue_depth=queue_depth)
         elif dev[:8] == 'iscsi://':
             from pyscsi.pyiscsi.iscsi_device import ISCSIDevice
             device = ISCSIDevice(dev)
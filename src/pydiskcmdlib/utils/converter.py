@@ -6,6 +6,7 @@
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
 import binascii
+from operator import itemgetter
 from typing import Mapping, Sequence, Tuple, Union
 
 CheckDict = Mapping[
@@ -34,10 +35,7 @@ def scsi_int_to_ba(to_convert=0,
     :param byteorder: a string defining BigEndian Or LittleEndian byte order
     :return: a byte array
     """
-    if byteorder == 'big':
-        return bytearray((to_convert >> i * 8) & 0xff for i in reversed(range(array_size)))
-    else:
-        return bytearray((to_convert >> i * 8) & 0xff for i in range(array_size))
+    return bytearray((to_convert & ((1 << (array_size * 8)) - 1)).to_bytes(array_size, byteorder))
 
 
 def scsi_ba_to_int(ba, byteorder='big'):
@@ -49,12 +47,20 @@ def scsi_ba_to_int(ba, byteorder='big'):
     :param byteorder: 'big'|'little'
     :return: an integer
     """
-    if byteorder == 'big':
-        return sum(ba[i] << ((len(ba) - 1 - i) * 8) for i in range(len(ba)))
-    else:
-        return sum(ba[i] << (i * 8) for i in range(len(ba)))
+    try:
+        return int.from_bytes(ba, byteorder)
+    except (TypeError, ValueError):
+        ## not a bytes-like object, like a list of integers
+        if byteorder == 'big':
+            return sum(ba[i] << ((len(ba) - 1 - i) * 8) for i in range(len(ba)))
+        else:
+            return sum(ba[i] << (i * 8) for i in range(len(ba)))
+
+_ascii_table = bytes((v if 31 < v < 127 else 0x2E) for v in range(256))
 
 def ba_to_ascii_string(ba, dummy_char="."):
+    if dummy_char == ".":
+        return bytes(ba).translate(_ascii_table).decode('ascii')
     ascii_string = ""
     for v in ba:
         if (31 < v < 127):
@@ -63,6 +69,195 @@ def ba_to_ascii_string(ba, dummy_char="."):
             ascii_string += dummy_char
     return ascii_string
 
+
+##########################################
+# The compiled codec of CheckDict, the notation tuples are
+# compiled to a plan once(precomputed byte range, shift and
+# mask), and cached by the CheckDict object.
+##########################################
+_FIELD_BITS = 0      # [bitmask, offset]
+_FIELD_SLICE = 1     # ('b'|'w'|'dw', offset, length)
+_FIELD_BB = 2        # ('bb', bit_offset, bit_length)
+_FIELD_DICT = 3      # nested CheckDict
+
+_CONV_NONE = 0
+_CONV_INT_L = 1
+_CONV_INT_B = 2
+_CONV_STR_ASCII = 3
+_conv_map = {'int_l': _CONV_INT_L, 'int_b': _CONV_INT_B, 'str_ascii': _CONV_STR_ASCII}
+
+
+class CheckDictTypeError(TypeError):
+    """The data_dict does not match the nested CheckDict."""
+
+
+_codec_cache = {}
+_CodecCacheSize = 1024
+
+
+class CheckDictCodec(object):
+    """
+    The compiled plan of a CheckDict:
+      * decode: all the byte ranges are sliced by one itemgetter, and only the
+        fields need to convert(bit fields, int/str, nested) are post-processed
+        with the precomputed shift and mask;
+      * encode: every field is compiled to a tuple (kind, start, end, shift, mask|notation).
+    """
+    __slots__ = ('check_dict', 'snapshot', 'byteorder', 'keys', 'getter', 'post', 'encode_fields', 'has_bb')
+
+    def __init__(self, check_dict, byteorder='big'):
+        self.check_dict = check_dict
+        self.snapshot = list(check_dict.values())
+        self.byteorder = byteorder
+        keys = []
+        slices = []
+        self.post = []
+        self.encode_fields = {}
+        self.has_bb = False
+        for key,val in check_dict.items():
+            index = len(keys)
+            if isinstance(val, dict):
+                sl = slice(0, 0)
+                self.post.append((index, _FIELD_DICT, 0, 0, val))
+                self.encode_fields[key] = (_FIELD_DICT, 0, 0, 0, val)
+            elif len(val) == 2:
+                bitmask, start = val
+                size = max(1, (bitmask.bit_length() + 7) // 8)
+                shift = (bitmask & -bitmask).bit_length() - 1 if bitmask > 0 else 0
+                sl = slice(start, start + size)
+                self.post.append((index, _FIELD_BITS, shift, bitmask >> shift, _CONV_NONE))
+                self.encode_fields[key] = (_FIELD_BITS, start, start + size, shift, (1 << (size * 8)) - 1)
+            elif val[0] == 'bb':
+                bit_offset, bit_length = val[1:3]
+                sl = slice(0, 0)
+                self.post.append((index, _FIELD_BB, bit_offset, (1 << bit_length) - 1, _CONV_NONE))
+                self.has_bb = True
+            elif val[0] in ('b', 'w', 'dw'):
+                offset, length = val[1:3]
+                end = offset + length * {'b': 1, 'w': 2, 'dw': 4}[val[0]]
+                sl = slice(offset, end)
+                conv = _conv_map.get(val[3], _CONV_NONE) if len(val) > 3 else _CONV_NONE
+                if conv != _CONV_NONE:
+                    self.post.append((index, _FIELD_SLICE, 0, 0, conv))
+                self.encode_fields[key] = (_FIELD_SLICE, offset, end, 0, val[0])
+            else:
+                ## unknown notation, skip it
+                continue
+            keys.append(key)
+            slices.append(sl)
+        self.keys = tuple(keys)
+        if len(slices) == 1:
+            sl = slices[0]
+            self.getter = lambda data: (data[sl],)
+        elif slices:
+            self.getter = itemgetter(*slices)
+        else:
+            self.getter = lambda data: ()
+        self.post = tuple(self.post)
+
+    def is_valid(self):
+        """
+        check the CheckDict is not changed since compiled
+        """
+        return self.snapshot == list(self.check_dict.values())
+
+    def decode(self, data, result_dict):
+        """
+        decode the data to result_dict, the same as decode_bits_iterative
+        """
+        values = list(self.getter(data))
+        if self.post:
+            byteorder = self.byteorder
+            from_bytes = int.from_bytes
+            bb_value = from_bytes(data, 'little') if self.has_bb else 0
+            for index,kind,shift,mask,conv in self.post:
+                if kind == _FIELD_BITS:
+                    value = values[index]
+                    if len(value) == 1:
+                        values[index] = (value[0] >> shift) & mask
+                    else:
+                        values[index] = (from_bytes(value, byteorder) >> shift) & mask
+                elif kind == _FIELD_SLICE:
+                    if conv == _CONV_INT_L:
+                        values[index] = from_bytes(values[index], 'little')
+                    elif conv == _CONV_INT_B:
+                        values[index] = from_bytes(values[index], 'big')
+                    else:
+                        values[index] = bytes(values[index]).translate(_ascii_table).decode('ascii')
+                elif kind == _FIELD_BB:
+                    values[index] = (bb_value >> shift) & mask
+                else:
+                    values[index] = get_codec(conv, byteorder).decode(data, {})
+        result_dict.update(zip(self.keys, values))
+        return result_dict
+
+    def encode(self, data_dict, result):
+        """
+        encode the data_dict to result, the same as encode_dict.
+        The bit fields are XORed to an integer of the whole buffer first, 
+        and then applied to result at once.
+        """
+        byteorder = self.byteorder
+        little = (byteorder == 'little')
+        encode_fields = self.encode_fields
+        length = len(result)
+        acc = 0
+        for key,value in data_dict.items():
+            if value is None:
+                continue
+            field = encode_fields.get(key)
+            if field is None:
+                continue
+            kind,start,end,shift,extra = field
+            if kind == _FIELD_BITS:
+                if isinstance(value, dict):
+                    raise CheckDictTypeError("The data_dict of %s is dict, but the check_dict is not dict" % key)
+                if end > length:
+                    raise IndexError("bytearray index out of range")
+                acc ^= ((value << shift) & extra) << ((start if little else length - end) << 3)
+            elif kind == _FIELD_DICT:
+                if not isinstance(value, dict):
+                    raise CheckDictTypeError("The check_dict of %s is dict, but the data_dict is not dict" % key)
+                if acc:
+                    result[:] = (int.from_bytes(result, byteorder) ^ acc).to_bytes(length, byteorder)
+                    acc = 0
+                get_codec(extra, byteorder).encode(value, result)
+            elif end > start:
+                ## keep the order of bit fields and byte fields
+                if acc:
+                    result[:] = (int.from_bytes(result, byteorder) ^ acc).to_bytes(length, byteorder)
+                    acc = 0
+                if extra == 'b':
+                    fixed_length = min(end - start, len(value))
+                    if isinstance(value, str):
+                        value = value.encode()
+                    result[start:start + fixed_length] = value[0:fixed_length]
+                else:
+                    result[start:end] = value
+                length = len(result)
+        if acc:
+            result[:] = (int.from_bytes(result, byteorder) ^ acc).to_bytes(length, byteorder)
+        return result
+
+
+def get_codec(check_dict, byteorder='big'):
+    """
+    get the compiled codec of a CheckDict, compile it if not cached or the CheckDict is changed.
+
+    :param check_dict: a dict mapping field-names to notation tuples.
+    :param byteorder: 'big'|'little'
+    :return: a CheckDictCodec object
+    """
+    cache_key = (id(check_dict), byteorder)
+    codec = _codec_cache.get(cache_key)
+    if codec is None or codec.check_dict is not check_dict or not codec.is_valid():
+        if len(_codec_cache) >= _CodecCacheSize:
+            _codec_cache.clear()
+        codec = CheckDictCodec(check_dict, byteorder)
+        _codec_cache[cache_key] = codec
+    return codec
+
+
 def decode_bits(data,
                 check_dict,
                 result_dict,
@@ -80,58 +275,7 @@ def decode_bits(data,
     :param check_dict: a dict mapping field-names to notation tuples.
     :param result_dict: a dict mapping field-names to notation tuples.
     """
-    for key in check_dict.keys():
-        # Notation format:
-        #
-        # If the length is 2 we have the legacy notation [bitmask, offset]
-        # Example: 'sync': [0x10, 7],
-        #
-        # >2-tuples is the new style of notation.
-        # These tuples always consist of at least three elements, where the
-        # first element is a string that describes the type of value.
-        #
-        # 'b': Byte array blobs
-        # ----------------
-        # ('b', offset, length)
-        # Example: 't10_vendor_identification': ('b', 8, 8),
-        #
-
-        val = check_dict[key]
-        if len(val) == 2:
-            bitmask, byte_pos = val
-            _num = 1
-            _bm = bitmask
-            while _bm > 0xff:
-                _bm >>= 8
-                _num += 1
-            value = scsi_ba_to_int(data[byte_pos:byte_pos + _num],byteorder=byteorder)
-            while not bitmask & 0x01:
-                bitmask >>= 1
-                value >>= 1
-            value &= bitmask
-        elif val[0] == 'b':
-            offset, length = val[1:3]
-            value = data[offset:offset + length]
-        elif val[0] == 'bb':
-            bit_offset, bit_length = val[1:3]
-            if isinstance(data, bytes):
-                _tmp = scsi_ba_to_int(data, 'little')
-            value = (_tmp >> bit_offset) & (2**bit_length-1)
-        elif val[0] == 'w':
-            offset, length = val[1:3]
-            value = data[offset:offset + length * 2]
-        elif val[0] == 'dw':
-            offset, length = val[1:3]
-            value = data[offset:offset + length * 4]
-        ##
-        if len(val) > 3:
-            if val[3] == 'int_l':
-                value = scsi_ba_to_int(value, 'little')
-            elif val[3] == 'int_b':
-                value = scsi_ba_to_int(value, 'big')
-            elif val[3] == 'str_ascii':
-                value = ba_to_ascii_string(value)
-        result_dict.update({key: value})
+    get_codec(check_dict, byteorder).decode(data, result_dict)
 
 def decode_bits_iterative(data,
                           check_dict,
@@ -145,63 +289,7 @@ def decode_bits_iterative(data,
     :param result_dict: A dict to store the decoded results.
     :param byteorder: A string specifying the byte order ('big' or 'little'), default is 'big'.
     """
-    for key in check_dict.keys():
-        # Notation format:
-        #
-        # If the length is 2 we have the legacy notation [bitmask, offset]
-        # Example: 'sync': [0x10, 7],
-        #
-        # >2-tuples is the new style of notation.
-        # These tuples always consist of at least three elements, where the
-        # first element is a string that describes the type of value.
-        #
-        # 'b': Byte array blobs
-        # ----------------
-        # ('b', offset, length)
-        # Example: 't10_vendor_identification': ('b', 8, 8),
-        #
-        val = check_dict[key]
-        if isinstance(val, (list, tuple)):
-            if len(val) == 2:
-                bitmask, byte_pos = val
-                _num = 1
-                _bm = bitmask
-                while _bm > 0xff:
-                    _bm >>= 8
-                    _num += 1
-                value = scsi_ba_to_int(data[byte_pos:byte_pos + _num],byteorder=byteorder)
-                while not bitmask & 0x01:
-                    bitmask >>= 1
-                    value >>= 1
-                value &= bitmask
-            elif val[0] == 'b':
-                offset, length = val[1:3]
-                value = data[offset:offset + length]
-            elif val[0] == 'bb':
-                bit_offset, bit_length = val[1:3]
-                if isinstance(data, bytes):
-                    _tmp = scsi_ba_to_int(data, 'little')
-                value = (_tmp >> bit_offset) & (2**bit_length-1)
-            elif val[0] == 'w':
-                offset, length = val[1:3]
-                value = data[offset:offset + length * 2]
-            elif val[0] == 'dw':
-                offset, length = val[1:3]
-                value = data[offset:offset + length * 4]
-            ##
-            if len(val) > 3:
-                if val[3] == 'int_l':
-                    value = scsi_ba_to_int(value, 'little')
-                elif val[3] == 'int_b':
-                    value = scsi_ba_to_int(value, 'big')
-                elif val[3] == 'str_ascii':
-                    value = ba_to_ascii_string(value)
-            result_dict.update({key: value})
-        elif isinstance(val, dict):
-            result_dict[key] = {}
-            decode_bits_iterative(data, val, result_dict[key], byteorder=byteorder)
-        else:
-            raise TypeError(f"Unknown type {type(val)}")
+    get_codec(check_dict, byteorder).decode(data, result_dict)
 
 
 def encode_dict(data_dict,
@@ -221,43 +309,7 @@ def encode_dict(data_dict,
     :param check_dict: a dict mapping field-names to notation tuples.
     :param result: a buffer containing the bits encoded
     """
-    for key in data_dict.keys():
-        if key not in check_dict:
-            continue
-        value = data_dict[key]
-        if value is None:
-            continue
-
-        val = check_dict[key]
-        if len(val) == 2:
-            bitmask, bytepos = val
-
-            _num = 1
-            _bm = bitmask
-            while _bm > 0xff:
-                _bm >>= 8
-                _num += 1
-
-            _bm = bitmask
-            while not _bm & 0x01:
-                _bm >>= 1
-                value <<= 1
-
-            v = scsi_int_to_ba(value, _num, byteorder=byteorder)
-            for i in range(len(v)):
-                result[bytepos + i] ^= v[i]
-        elif val[0] == 'b' and val[2] > 0:
-            offset, length = val[1:]
-            fixed_length = min(length, len(value))
-            if isinstance(value, str):
-                value = value.encode()
-            result[offset:offset + fixed_length] = value[0:fixed_length]
-        elif val[0] == 'w' and val[2] > 0:
-            offset, length = val[1:]
-            result[offset:offset + length * 2] = value
-        elif val[0] == 'dw' and val[2] > 0:
-            offset, length = val[1:]
-            result[offset:offset + length * 4] = value
+    get_codec(check_dict, byteorder).encode(data_dict, result)
 
 
 def get_check_dict_maxsize(check_dict) -> int:
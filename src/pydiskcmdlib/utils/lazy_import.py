@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+import importlib
+import importlib.util
+
+def lazy_import(name):
+    """
+    import a module lazily, the module is executed when one of its attributes
+    is accessed for the first time.
+
+    :param name: the absolute module name
+    :return: the module(maybe not executed yet)
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named %r" % name, name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+def os_specific_getattr(package, os_modules):
+    """
+    build a module __getattr__(PEP 562) for a package, which imports the OS
+    specific submodule lazily, so the structures of the other OS are not
+    loaded until they are used.
+
+    :param package: the package name
+    :param os_modules: a dict, submodule name -> the OS it is used, like {"win_nvme_command": "Windows"}
+    :return: a function used as the module __getattr__
+    """
+    from pydiskcmdlib import os_type
+    def __getattr__(name):
+        target = os_modules.get(name)
+        if target is None:
+            raise AttributeError("module %r has no attribute %r" % (package, name))
+        full_name = "%s.%s" % (package, name)
+        if target == os_type:
+            module = importlib.import_module(full_name)
+        else:
+            module = lazy_import(full_name)
+        setattr(sys.modules[package], name, module)
+        return module
+    return __getattr__
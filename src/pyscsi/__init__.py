@@ -2,5 +2,26 @@
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
-from .pyscsi import *
-from .utils import *
+import sys
+
+if sys.version_info < (3, 7):
+    from .pyscsi import *
+    from .utils import *
+else:
+    import importlib
+
+    # The submodules of pyscsi.pyscsi and the helpers of pyscsi.utils are
+    # imported on first access (PEP 562) instead of all at package import.
+    def __getattr__(name):
+        if name.startswith("__"):
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        pkg = importlib.import_module(".pyscsi", __name__)
+        if name in pkg.__all__:
+            value = importlib.import_module(f".pyscsi.{name}", __name__)
+        else:
+            utils = importlib.import_module(".utils", __name__)
+            if name.startswith("_") or not hasattr(utils, name):
+                raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+            value = getattr(utils, name)
+        globals()[name] = value
+        return value
@@ -24,6 +24,10 @@ class SCSICommand(metaclass=ExMETA):
     _result = None
     _page_code = None
     _opcode = None
+    # optional callable(length) returning a writable buffer for datain/dataout,
+    # None means a new bytearray for every command
+    datain_allocator = None
+    dataout_allocator = None
 
     def __init__(self, opcode, dataout_alloclen, datain_alloclen):
         """
@@ -37,8 +41,14 @@ class SCSICommand(metaclass=ExMETA):
         # on the class and not on the instance of the class. that might be wrong ...
         SCSICommand._cdb_bits = self._cdb_bits
         SCSICommand._cdb = SCSICommand.init_cdb(opcode)
-        self.dataout = bytearray(dataout_alloclen)
-        self.datain = bytearray(datain_alloclen)
+        if self.dataout_allocator is not None and dataout_alloclen > 0:
+            self.dataout = self.dataout_allocator(dataout_alloclen)
+        else:
+            self.dataout = bytearray(dataout_alloclen)
+        if self.datain_allocator is not None and datain_alloclen > 0:
+            self.datain = self.datain_allocator(datain_alloclen)
+        else:
+            self.datain = bytearray(datain_alloclen)
         self.result = {}
         self.page_code = None
         self.opcode = opcode
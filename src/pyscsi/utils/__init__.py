@@ -2,8 +2,6 @@
 #
 # SPDX-License-Identifier: LGPL-2.1-or-later
 
-import socket
-
 from .converter import *
 from .enum import *
 
@@ -11,15 +9,20 @@ from .enum import *
 def init_device(
     dev,
     read_write=False,
-    initiator_name=f"iqn.2018-01.org.pyscsi:{socket.gethostname()}",
+    initiator_name=None,
 ):
     if dev[:5] == "/dev/":
         from pyscsi.pyscsi.scsi_device import SCSIDevice
 
         device = SCSIDevice(dev, read_write)
     elif dev[:8] == "iscsi://":
+        import socket
+
         from pyscsi.pyiscsi.iscsi_device import ISCSIDevice
 
+        if initiator_name is None:
+            initiator_name = f"iqn.2018-01.org.pyscsi:{socket.gethostname()}"
+
         device = ISCSIDevice(dev, initiator_name)
     else:
         raise NotImplementedError("No backend implemented for %s" % dev)
@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import sys
+import ctypes
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="io_uring is Linux only")
+
+
+def _get_ring():
+    from pydiskcmdlib.os.lin_io_uring import IOUring
+    try:
+        return IOUring(entries=4)
+    except OSError as e:
+        pytest.skip("io_uring not available: %s" % e)
+
+
+def test_prep_uring_cmd_with_cmd_structure():
+    from pydiskcmdlib.os.lin_io_uring import SQE128_SIZE,SQE_CMD_OFFSET,NVME_URING_CMD_IO
+    from pydiskcmdlib.pynvme.linux_nvme_command import CmdStructure
+    ring = _get_ring()
+    try:
+        cmd = CmdStructure(opcode=0x02, nsid=1, cdw10=0x12345678, cdw12=7, data_len=4096)
+        cmd_bytes = ctypes.string_at(ctypes.addressof(cmd), ctypes.sizeof(cmd))
+        assert ring.prep_uring_cmd(0, NVME_URING_CMD_IO, cmd, 0xABCD)
+        ## the first sqe is used
+        sqe = bytes(ring._sqes[0:SQE128_SIZE])
+        assert sqe[SQE_CMD_OFFSET:SQE_CMD_OFFSET+len(cmd_bytes)] == cmd_bytes
+        assert sqe[SQE_CMD_OFFSET+len(cmd_bytes):] == bytes(SQE128_SIZE - SQE_CMD_OFFSET - len(cmd_bytes))
+    finally:
+        ring.close()
+
+
+def test_prep_uring_cmd_too_long():
+    from pydiskcmdlib.os.lin_io_uring import SQE_CMD_SIZE,NVME_URING_CMD_IO
+    ring = _get_ring()
+    try:
+        with pytest.raises(ValueError):
+            ring.prep_uring_cmd(0, NVME_URING_CMD_IO, bytes(SQE_CMD_SIZE + 1), 1)
+    finally:
+        ring.close()
+
+
+def _get_nvme_uring_device(tmp_path):
+    ## a regular file does not support uring commands, every command completes with an error
+    from pydiskcmdlib.pynvme.nvme_device import NVMeIOUringDevice
+    path = tmp_path / "ng0n1"
+    path.write_bytes(bytes(4096))
+    try:
+        return NVMeIOUringDevice(str(path), readwrite=True, queue_depth=4)
+    except OSError as e:
+        pytest.skip("io_uring not available: %s" % e)
+
+
+def test_nvme_uring_device_execute(tmp_path):
+    from pydiskcmdlib.pynvme.cdb_identify import IDCtrl
+    dev = _get_nvme_uring_device(tmp_path)
+    try:
+        ## the command goes through the ring, and the completion error is raised
+        with pytest.raises(OSError):
+            dev.execute(IDCtrl())
+        assert dev.inflight == 0
+    finally:
+        dev.close()
+
+
+def test_nvme_uring_device_reap_keeps_batch(tmp_path):
+    from pydiskcmdlib.pynvme.cdb_identify import IDCtrl
+    dev = _get_nvme_uring_device(tmp_path)
+    try:
+        cmds = [dev.submit(IDCtrl()) for _ in range(3)]
+        errors = 0
+        while dev.inflight:
+            try:
+                dev.reap(min_complete=3)
+            except OSError:
+                errors += 1
+        assert errors == len(cmds)
+        assert all(cmd.result < 0 for cmd in cmds)
+    finally:
+        dev.close()
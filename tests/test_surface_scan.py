@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import sys
+import optparse
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="io_uring is Linux only")
+
+
+def _get_nvme_uring_device(tmp_path):
+    ## a regular file does not support uring commands, every command completes with an error
+    from pydiskcmdlib.pynvme.nvme_device import NVMeIOUringDevice
+    path = tmp_path / "ng0n1"
+    path.write_bytes(bytes(4096))
+    try:
+        return NVMeIOUringDevice(str(path), readwrite=True, queue_depth=4)
+    except OSError as e:
+        pytest.skip("io_uring not available: %s" % e)
+
+
+def test_nvme_open_with_io_uring(tmp_path):
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    dev = _get_nvme_uring_device(tmp_path)
+    try:
+        ## Identify Controller is sent through the ring
+        with pytest.raises(OSError):
+            NVMe(dev)
+    finally:
+        dev.close()
+
+
+def test_nvme_surface_scan_with_io_uring(tmp_path):
+    from pydiskcmdlib.pynvme.nvme import NVMe
+    from pydiskcmdlib.surface_scan import NVMeScanTarget
+    from pydiskcmdcli.scripts._surface_scan_common import add_surface_scan_options,run_surface_scan
+    dev = _get_nvme_uring_device(tmp_path)
+    try:
+        d = NVMe.__new__(NVMe)
+        d.device = dev
+        d._NVMe__ns_format = {1: {"nsze": 64, "flbas": 0, "lbaf": 0, "lbads": 512, "ms": 0, "extended": False, "dps": 0, "pi_type": 0}}
+        parser = optparse.OptionParser()
+        add_surface_scan_options(parser)
+        (options, args) = parser.parse_args(["-b", "8", "-q", "4", "-r", "8"])
+        target = NVMeScanTarget(d, 1)
+        assert target.queue_depth == 4
+        ## every command fails in the ring, and is recorded as a failed range
+        assert run_surface_scan(target, options) == 1
+        assert dev.inflight == 0
+    finally:
+        dev.close()
@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import sys
+import timeit
+import argparse
+## run from the source tree without installing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+import pydiskcmdlib.pynvme.nvme_command as nvme_command
+import pydiskcmdcli.nvme_spec as nvme_spec
+from pydiskcmdlib.pynvme.cdb_nvme_read import Read
+from pydiskcmdlib.pynvme.cdb_get_log_page import SmartLog
+
+# This is a script to benchmark the compiled CheckDict codec(pydiskcmdlib.utils.converter)
+# against the legacy field walk, no device is needed. It measures:
+#   * build: the nvme command build time(NVMeCommand.marshall_cdb -> encode_dict)
+#   * smart: the smart log decode time(nvme_smart_decode -> decode_bits)
+#   * id-ctrl: the identify controller decode time(nvme_id_ctrl_decode -> decode_bits)
+#
+# example:
+#   python3 CodecBench.py -n 20000
+
+
+## The legacy implementation, copied from converter before the codec is compiled
+def _legacy_ba_to_int(ba, byteorder='big'):
+    if byteorder == 'big':
+        return sum(ba[i] << ((len(ba) - 1 - i) * 8) for i in range(len(ba)))
+    else:
+        return sum(ba[i] << (i * 8) for i in range(len(ba)))
+
+def _legacy_int_to_ba(to_convert=0, array_size=4, byteorder="big"):
+    if byteorder == 'big':
+        return bytearray((to_convert >> i * 8) & 0xff for i in reversed(range(array_size)))
+    else:
+        return bytearray((to_convert >> i * 8) & 0xff for i in range(array_size))
+
+def _legacy_ba_to_ascii_string(ba, dummy_char="."):
+    ascii_string = ""
+    for v in ba:
+        if (31 < v < 127):
+            ascii_string += chr(v)
+        else:
+            ascii_string += dummy_char
+    return ascii_string
+
+def legacy_decode_bits(data, check_dict, result_dict, byteorder='big'):
+    for key in check_dict.keys():
+        val = check_dict[key]
+        if len(val) == 2:
+            bitmask, byte_pos = val
+            _num = 1
+            _bm = bitmask
+            while _bm > 0xff:
+                _bm >>= 8
+                _num += 1
+            value = _legacy_ba_to_int(data[byte_pos:byte_pos + _num],byteorder=byteorder)
+            while not bitmask & 0x01:
+                bitmask >>= 1
+                value >>= 1
+            value &= bitmask
+        elif val[0] == 'b':
+            offset, length = val[1:3]
+            value = data[offset:offset + length]
+        elif val[0] == 'w':
+            offset, length = val[1:3]
+            value = data[offset:offset + length * 2]
+        elif val[0] == 'dw':
+            offset, length = val[1:3]
+            value = data[offset:offset + length * 4]
+        if len(val) > 3:
+            if val[3] == 'int_l':
+                value = _legacy_ba_to_int(value, 'little')
+            elif val[3] == 'int_b':
+                value = _legacy_ba_to_int(value, 'big')
+            elif val[3] == 'str_ascii':
+                value = _legacy_ba_to_ascii_string(value)
+        result_dict.update({key: value})
+
+def legacy_encode_dict(data_dict, check_dict, result, byteorder='big'):
+    for key in data_dict.keys():
+        if key not in check_dict:
+            continue
+        value = data_dict[key]
+        if value is None:
+            continue
+        val = check_dict[key]
+        if len(val) == 2:
+            bitmask, bytepos = val
+            _num = 1
+            _bm = bitmask
+            while _bm > 0xff:
+                _bm >>= 8
+                _num += 1
+            _bm = bitmask
+            while not _bm & 0x01:
+                _bm >>= 1
+                value <<= 1
+            v = _legacy_int_to_ba(value, _num, byteorder=byteorder)
+            for i in range(len(v)):
+                result[bytepos + i] ^= v[i]
+        elif val[0] == 'b' and val[2] > 0:
+            offset, length = val[1:]
+            fixed_length = min(length, len(value))
+            if isinstance(value, str):
+                value = value.encode()
+            result[offset:offset + fixed_length] = value[0:fixed_length]
+        elif val[0] == 'w' and val[2] > 0:
+            offset, length = val[1:]
+            result[offset:offset + length * 2] = value
+        elif val[0] == 'dw' and val[2] > 0:
+            offset, length = val[1:]
+            result[offset:offset + length * 4] = value
+
+
+def run_case(name, stmt, number, patches):
+    """
+    run a case with compiled codec and legacy codec
+
+    :param patches: a list of (module, function name, legacy function)
+    """
+    compiled = min(timeit.repeat(stmt, number=number, repeat=3)) / number
+    saved = [(m, n, getattr(m, n)) for m,n,_ in patches]
+    try:
+        for m,n,f in patches:
+            setattr(m, n, f)
+        legacy = min(timeit.repeat(stmt, number=number, repeat=3)) / number
+    finally:
+        for m,n,f in saved:
+            setattr(m, n, f)
+    print("%-10s legacy %9.2f us    compiled %9.2f us    speedup %5.1fx" % (name, legacy * 1e6, compiled * 1e6, legacy / compiled))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CheckDict codec")
+    parser.add_argument("-n", "--number", type=int, default=5000, help="loops of every case")
+    args = parser.parse_args()
+    ##
+    smart_data = os.urandom(512)
+    id_ctrl_data = os.urandom(4096)
+    encode_patch = [(nvme_command, "encode_dict", legacy_encode_dict)]
+    decode_patch = [(nvme_spec, "decode_bits", legacy_decode_bits)]
+    run_case("build", lambda: Read(1, 0, 7, data_len=4096), args.number, encode_patch)
+    run_case("build-log", lambda: SmartLog(), args.number, encode_patch)
+    run_case("smart", lambda: nvme_spec.nvme_smart_decode(smart_data), args.number, decode_patch)
+    run_case("id-ctrl", lambda: nvme_spec.nvme_id_ctrl_decode(id_ctrl_data), max(1, args.number // 10), decode_patch)
+
+
+if __name__ == "__main__":
+    main()
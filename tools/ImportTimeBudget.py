@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2022 The pydiskcmd Authors
+#
+# SPDX-License-Identifier: LGPL-2.1-or-later
+import os
+import sys
+import argparse
+import subprocess
+
+# This is a script to check the startup import time of the command line tools,
+# it runs "python -X importtime -c 'import pydiskcmdcli.scripts.<tool>'" several
+# times, takes the best cumulative time, and compares it with the budget. No
+# device is needed.
+#
+# example:
+#   python3 ImportTimeBudget.py
+#   python3 ImportTimeBudget.py -b 60 -r 10 pynvme
+#
+# exit code is 1 if any tool exceeds the budget.
+
+DefaultTools = ("pynvme", "pysata", "pyscsi")
+## run from the source tree without installing
+SourcePath = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+## milliseconds, measured with warm .pyc on a idle machine
+DefaultBudget = 100
+
+
+def measure(tool, repeat):
+    """
+    measure the import time of a tool
+
+    :param tool: the script name in pydiskcmdcli.scripts
+    :param repeat: how many times to run
+    :return: the best cumulative import time in milliseconds
+    """
+    module = "pydiskcmdcli.scripts.%s" % tool
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([SourcePath] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    best = None
+    for _ in range(repeat):
+        p = subprocess.run([sys.executable, "-X", "importtime", "-c", "import %s" % module],
+                           stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE,
+                           universal_newlines=True,
+                           env=env,
+                           )
+        if p.returncode != 0:
+            raise RuntimeError("import %s failed:\n%s" % (module, p.stderr))
+        for line in p.stderr.splitlines():
+            ## import time: self [us] | cumulative | imported package
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                cumulative = int(fields[1]) / 1000
+                if best is None or cumulative < best:
+                    best = cumulative
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time budget of pydiskcmd tools")
+    parser.add_argument("tools", nargs="*", default=DefaultTools, help="the tools to check, default %s" % ",".join(DefaultTools))
+    parser.add_argument("-b", "--budget", type=float, default=DefaultBudget, help="the budget in milliseconds")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="runs of every tool")
+    args = parser.parse_args()
+    ##
+    ret = 0
+    for tool in args.tools:
+        t = measure(tool, args.repeat)
+        status = "OK" if t <= args.budget else "OVER"
+        if t > args.budget:
+            ret = 1
+        print("%-10s %8.1f ms    budget %8.1f ms    %s" % (tool, t, args.budget, status))
+    return ret
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,43 +20,25 @@ from pydiskcmdlib.utils.converter import scsi_ba_to_int
 #   python3 WAFTool.py -i nvme -d /dev/nvme<X> -nw 240,16,8 -nl 4096 -nf 1000000000
 
 
+def read_log_page(d, log_id, log_length):
+    data = bytearray(log_length + ((4 - log_length % 4) % 4))
+    for chunk in d.iter_log_page(log_id, len(data), buffer=data):
+        pass
+    return data
+
 def get_nvme_write_factor(d, args):
     if args.host_write:
         host_write_log_id,host_write_offset,host_write_length = [int(i.strip()) for i in args.host_write.split(',')]
-        cmd = d.get_log_page(0,                    # ns_id
-                             host_write_log_id,    # log id
-                             0,                    # lsp
-                             0,
-                             (args.host_log_length & 0xFFFF),
-                             ((args.host_log_length >> 16) & 0xFFFF),
-                             0,
-                             0,
-                             0,
-                             0,
-                             0,
-                             0,
-                             )
-        host_write = scsi_ba_to_int(cmd.data[host_write_offset:host_write_offset+host_write_length], 'little') * args.host_factor
+        data = read_log_page(d, host_write_log_id, args.host_log_length)
+        host_write = scsi_ba_to_int(data[host_write_offset:host_write_offset+host_write_length], 'little') * args.host_factor
     else:
         cmd = d.smart_log()
         host_write = scsi_ba_to_int(cmd.data[48:64], 'little') * 512000
     ##
     if args.nand_write:
         nand_write_log_id,nand_write_offset,nand_write_length = [int(i.strip()) for i in args.nand_write.split(',')]
-        cmd = d.get_log_page(0,                    # ns_id
-                             nand_write_log_id,    # log id
-                             0,                    # lsp
-                             0,
-                             (args.nand_log_length & 0xFFFF),
-                             ((args.nand_log_length >> 16) & 0xFFFF),
-                             0,
-                             0,
-                             0,
-                             0,
-                             0,
-                             0,
-                             )
-        nand_write = scsi_ba_to_int(cmd.data[nand_write_offset:nand_write_offset+nand_write_length], 'little') * args.nand_factor
+        data = read_log_page(d, nand_write_log_id, args.nand_log_length)
+        nand_write = scsi_ba_to_int(data[nand_write_offset:nand_write_offset+nand_write_length], 'little') * args.nand_factor
     elif d.ocp_support:
         from pydiskcmdcli.plugins import ocp_plugin
         cmd = ocp_plugin["SmartExtendedLog"]()